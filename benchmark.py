@@ -0,0 +1,635 @@
+#!/usr/bin/env python
+# Copyright 2017 Bracket Computing, Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License").
+# You may not use this file except in compliance with the License.
+# A copy of the License is located at
+#
+# https://github.com/brkt/brkt-cli/blob/master/LICENSE
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Benchmark the encryption pipelines against the dummy cloud services that
+the unit tests use.
+
+The dummy services respond instantly.  The simulator wraps them, so that
+each API call takes a configurable amount of time, calls are throttled with
+a token bucket, and a resource that was just created is not visible to
+other calls until a delay has passed.  Time is virtual: time.time() and
+time.sleep() are replaced for the duration of the run, util.run_concurrently
+runs its functions one after another and advances the clock as though they
+ran in parallel, and the console tailer polls on the virtual clock instead
+of in a thread.  A run with the same seed and profile always reports the
+same times and call counts.
+
+Each INFO message that brkt-cli logs starts a new stage in the report.
+
+Usage: python benchmark.py [--seed N] [--profile FILE] [--json] [PIPELINE]
+"""
+
+import argparse
+import collections
+import json
+import logging
+import random
+import re
+import StringIO
+import sys
+import threading
+import time
+
+from brkt_cli import console_tailer, util
+from brkt_cli.aws import encrypt_ami, wrap_image
+from brkt_cli.aws.test_aws_service import build_aws_service
+from brkt_cli.aws.update_ami import update_ami
+from brkt_cli.esx import encrypt_vmdk
+from brkt_cli.gcp import encrypt_gcp_image
+from brkt_cli.instance_config import InstanceConfig
+from brkt_cli.test_encryptor_service import DummyEncryptorService
+from brkt_cli.util import CRYPTO_GCM
+
+log = logging.getLogger('benchmark')
+
+# The virtual clock starts at this time, so that timestamps look real.
+START_TIME = 1500000000.0
+
+# Methods on the dummy services that are not API calls.
+NOT_API_CALLS = ('retry', 'connect', 'get_session_id')
+
+# Methods whose result is a new resource, for eventual consistency.
+CREATE_PREFIXES = ('create_', 'run_', 'copy_', 'register_')
+
+
+class Fixed(object):
+    def __init__(self, seconds):
+        self.seconds = seconds
+
+    def sample(self, rng):
+        return self.seconds
+
+
+class Uniform(object):
+    def __init__(self, low, high):
+        self.low = low
+        self.high = high
+
+    def sample(self, rng):
+        return rng.uniform(self.low, self.high)
+
+
+class LogNormal(object):
+    """ A long-tailed distribution, with half of the samples below
+    median.
+    """
+    def __init__(self, median, sigma=0.5):
+        self.median = median
+        self.sigma = sigma
+
+    def sample(self, rng):
+        return self.median * rng.lognormvariate(0, self.sigma)
+
+
+def _distribution(value):
+    """ Convert a profile value to a distribution.  A number is a fixed
+    latency, [low, high] is uniform and {"median": m, "sigma": s} is
+    lognormal.
+    """
+    if isinstance(value, (int, float)):
+        return Fixed(value)
+    if isinstance(value, list):
+        return Uniform(*value)
+    if isinstance(value, dict):
+        return LogNormal(**value)
+    return value
+
+
+class TokenBucket(object):
+    """ Allows rate calls per second on average, and bursts of up to
+    burst calls.
+    """
+    def __init__(self, rate, burst):
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.tokens = self.burst
+        self.last = None
+
+    def take(self, now):
+        """ Take a token.
+
+        :return the number of seconds to wait before the call can be made
+        """
+        if self.last is not None:
+            elapsed = max(0.0, now - self.last)
+            self.tokens = min(self.burst, self.tokens + elapsed * self.rate)
+        self.last = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        wait = (1 - self.tokens) / self.rate
+        self.tokens = 0.0
+        self.last = now + wait
+        return wait
+
+
+class Profile(object):
+    """ Describes how the simulated cloud behaves.
+
+    Latencies and throttles are looked up by '<service>.<method>', then
+    by '<method>', then by '*'.
+    """
+    def __init__(self, latencies=None, throttles=None, consistency_delay=0.0,
+                 default_latency=0.1):
+        self.latencies = dict(
+            (k, _distribution(v)) for k, v in (latencies or {}).iteritems())
+        self.latencies.setdefault('*', _distribution(default_latency))
+        # Maps the key to a (rate, burst) tuple.
+        self.throttles = dict(throttles or {})
+        self.consistency_delay = consistency_delay
+
+    @classmethod
+    def from_dict(cls, d):
+        return cls(
+            latencies=d.get('latencies'),
+            throttles=dict(
+                (k, tuple(v)) for k, v in d.get('throttles', {}).iteritems()),
+            consistency_delay=d.get('consistency_delay', 0.0),
+            default_latency=d.get('default_latency', 0.1)
+        )
+
+    def lookup(self, table, service, method):
+        for key in ('%s.%s' % (service, method), method, '*'):
+            if key in table:
+                return key, table[key]
+        return None, None
+
+
+# Rough latencies of the slow calls in each cloud.  Everything else takes
+# 100 ms.
+DEFAULT_PROFILE = {
+    'latencies': {
+        'aws.run_instance': {'median': 5.0, 'sigma': 0.3},
+        'aws.create_image': {'median': 3.0, 'sigma': 0.3},
+        'aws.create_snapshot': [0.5, 1.5],
+        'aws.create_volume': [0.5, 1.0],
+        'aws.attach_volume': [1.0, 2.0],
+        'aws.detach_volume': [1.0, 2.0],
+        'aws.get_console_output': [0.2, 0.5],
+        'gcp.run_instance': {'median': 20.0, 'sigma': 0.3},
+        'gcp.create_disks': [5.0, 10.0],
+        'gcp.create_snapshot': [10.0, 20.0],
+        'gcp.create_gcp_image_from_disk': [30.0, 60.0],
+        'gcp.get_serial_port_output': [0.2, 0.5],
+        'esx.create_vm': [2.0, 4.0],
+        'esx.clone_vm': [10.0, 20.0],
+        'esx.power_on': [5.0, 10.0],
+        'encryptor.get_status': [0.01, 0.05],
+        'encryptor.is_encryptor_up': [0.01, 0.05],
+    },
+    'throttles': {
+        'aws.*': [20, 100],
+        'gcp.*': [20, 100],
+    },
+    'consistency_delay': 2.0,
+}
+
+
+class Stage(object):
+    def __init__(self, name):
+        self.name = name
+        self.seconds = 0.0
+        self.calls = collections.Counter()
+        self.throttled = 0
+        self.consistency_waits = 0
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'seconds': round(self.seconds, 3),
+            'calls': dict(self.calls),
+            'throttled': self.throttled,
+            'consistency_waits': self.consistency_waits,
+        }
+
+
+class Result(object):
+    def __init__(self, name):
+        self.name = name
+        self.seconds = 0.0
+        self.stages = []
+
+    def total_calls(self):
+        return sum(sum(s.calls.values()) for s in self.stages)
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'seconds': round(self.seconds, 3),
+            'calls': self.total_calls(),
+            'stages': [s.to_dict() for s in self.stages],
+        }
+
+
+def _stage_name(message):
+    """ Replace resource ids and session ids in a log message, so that
+    stage names are the same in every run.
+    """
+    message = re.sub(r'\b([a-z]+)-[0-9a-f]{6,}\b', r'\1-*', message)
+    message = re.sub(r'\b[0-9a-f]{6,}\b', '*', message)
+    return message.splitlines()[0][:72]
+
+
+class _StageHandler(logging.Handler):
+    def __init__(self, simulator):
+        logging.Handler.__init__(self, logging.INFO)
+        self.simulator = simulator
+
+    def emit(self, record):
+        if record.levelno == logging.INFO:
+            self.simulator.start_stage(_stage_name(record.getMessage()))
+
+
+class Simulator(object):
+
+    def __init__(self, profile=None, seed=0):
+        self.profile = profile or Profile.from_dict(DEFAULT_PROFILE)
+        self.rng = random.Random(seed)
+        self.now = START_TIME
+        self.buckets = {}
+        self.visible_at = {}
+        self.result = None
+        self.stage = None
+        self._owner = None
+        self._saved = []
+
+    # Virtual clock.
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        if threading.current_thread() is not self._owner:
+            # Only the thread that runs the pipeline moves the clock.
+            self._real_sleep(seconds)
+            return
+        self.advance(seconds)
+
+    def advance(self, seconds):
+        self.now += seconds
+        if self.stage:
+            self.stage.seconds += seconds
+
+    def start_stage(self, name):
+        if self.result is not None:
+            self.stage = Stage(name)
+            self.result.stages.append(self.stage)
+
+    # Services.
+
+    def wrap(self, service, name):
+        return SimulatedService(service, name, self)
+
+    def wrap_class(self, cls, name):
+        """ Return a factory that creates simulated instances of cls, for
+        use as enc_svc_cls.
+        """
+        def _create(*args, **kwargs):
+            return self.wrap(cls(*args, **kwargs), name)
+        return _create
+
+    def before_call(self, service, method, args):
+        stage = self.stage
+        if stage:
+            stage.calls['%s.%s' % (service, method)] += 1
+
+        key, throttle = self.profile.lookup(
+            self.profile.throttles, service, method)
+        if not throttle:
+            key, throttle = self.profile.lookup(
+                self.profile.throttles, service, '*')
+        if throttle:
+            if key not in self.buckets:
+                self.buckets[key] = TokenBucket(*throttle)
+            wait = self.buckets[key].take(self.now)
+            if wait:
+                if stage:
+                    stage.throttled += 1
+                self.advance(wait)
+
+        # A real service retries until a new resource is visible.
+        for arg in args:
+            if isinstance(arg, basestring) and arg in self.visible_at:
+                wait = self.visible_at[arg] - self.now
+                if wait > 0:
+                    if stage:
+                        stage.consistency_waits += 1
+                    self.advance(wait)
+
+    def after_call(self, service, method, result):
+        _, latency = self.profile.lookup(
+            self.profile.latencies, service, method)
+        self.advance(latency.sample(self.rng))
+
+        delay = self.profile.consistency_delay
+        if delay and method.startswith(CREATE_PREFIXES):
+            resource_id = getattr(result, 'id', result)
+            if isinstance(resource_id, basestring):
+                self.visible_at[resource_id] = self.now + delay
+
+    # Patching.
+
+    def _patch(self, obj, name, value):
+        self._saved.append((obj, name, getattr(obj, name)))
+        setattr(obj, name, value)
+
+    def _run_concurrently(self, functions, max_workers=None):
+        """ Run the functions one after another.  Each one starts at the
+        time when a worker would have been free, and the clock ends at the
+        time when the last one finishes.
+        """
+        start = self.now
+        workers = [start] * (max_workers or len(functions) or 1)
+        results = []
+        errors = []
+        for function in functions:
+            worker = workers.index(min(workers))
+            self.now = workers[worker]
+            try:
+                results.append(function())
+            except BaseException:
+                results.append(None)
+                errors.append(sys.exc_info())
+            workers[worker] = self.now
+        self.now = max(workers)
+        if errors:
+            exc_info = errors[0]
+            raise exc_info[0], exc_info[1], exc_info[2]
+        return results
+
+    def _tailer_start(self, tailer):
+        tailer._next_poll = self.now
+
+    def _tailer_stop(self, tailer):
+        pass
+
+    def _tailer_check(self, tailer, _check=console_tailer.ConsoleTailer.check):
+        if self.now >= getattr(tailer, '_next_poll', self.now):
+            try:
+                tailer.poll()
+            except Exception as e:
+                log.debug('Console poll failed: %s', e)
+            tailer._next_poll = self.now + tailer.interval
+        _check(tailer)
+
+    def __enter__(self):
+        self._owner = threading.current_thread()
+        self._real_sleep = time.sleep
+        self._patch(time, 'time', self.time)
+        self._patch(time, 'sleep', self.sleep)
+        self._patch(util, 'SLEEP_ENABLED', True)
+        for module in sys.modules.values():
+            if (module and module.__name__.startswith('brkt_cli') and
+                    getattr(module, 'run_concurrently', None) is
+                    util.run_concurrently):
+                self._patch(module, 'run_concurrently', self._run_concurrently)
+        tailer = console_tailer.ConsoleTailer
+        sim = self
+        self._patch(tailer, 'start', lambda t: sim._tailer_start(t))
+        self._patch(tailer, 'stop', lambda t: sim._tailer_stop(t))
+        self._patch(tailer, 'check', lambda t: sim._tailer_check(t))
+
+        self._handler = _StageHandler(self)
+        self._logger = logging.getLogger('brkt_cli')
+        self._patch(self._logger, 'level', logging.INFO)
+        self._logger.addHandler(self._handler)
+        return self
+
+    def __exit__(self, *args):
+        self._logger.removeHandler(self._handler)
+        while self._saved:
+            obj, name, value = self._saved.pop()
+            setattr(obj, name, value)
+        self._owner = None
+
+    def run(self, name, function):
+        """ Run the pipeline function and return its Result. """
+        self.result = Result(name)
+        self.start_stage('(start)')
+        start = self.now
+        # Some pipelines print their results.  Keep them out of the report.
+        stdout = sys.stdout
+        sys.stdout = StringIO.StringIO()
+        try:
+            function()
+        finally:
+            sys.stdout = stdout
+            self.result.seconds = self.now - start
+            result, self.result, self.stage = self.result, None, None
+        return result
+
+
+class SimulatedService(object):
+    """ Wraps a dummy service.  Calls to its public methods are counted,
+    throttled and delayed by the simulator.
+    """
+
+    def __init__(self, service, name, simulator):
+        self.__dict__['_service'] = service
+        self.__dict__['_name'] = name
+        self.__dict__['_simulator'] = simulator
+
+    def __getattr__(self, attr):
+        value = getattr(self._service, attr)
+        if (attr.startswith('_') or attr in NOT_API_CALLS or
+                not callable(value) or isinstance(value, type)):
+            return value
+        sim = self._simulator
+        name = self._name
+
+        def _call(*args, **kwargs):
+            sim.before_call(name, attr, args)
+            result = value(*args, **kwargs)
+            sim.after_call(name, attr, result)
+            return result
+        return _call
+
+    def __setattr__(self, attr, value):
+        setattr(self._service, attr, value)
+
+
+# Pipelines.  Each one takes the simulator and returns the function that
+# is measured.  Setup runs against the unwrapped service, and is not
+# measured.
+
+def aws_encrypt(sim):
+    aws_svc, encryptor_image, guest_image = build_aws_service()
+
+    def _run():
+        encrypt_ami.encrypt(
+            aws_svc=sim.wrap(aws_svc, 'aws'),
+            enc_svc_cls=sim.wrap_class(DummyEncryptorService, 'encryptor'),
+            image_id=guest_image.id,
+            encryptor_ami=encryptor_image.id,
+            crypto_policy=CRYPTO_GCM
+        )
+    return _run
+
+
+def aws_update(sim):
+    aws_svc, encryptor_image, guest_image = build_aws_service()
+    encrypted_ami_id = encrypt_ami.encrypt(
+        aws_svc=aws_svc,
+        enc_svc_cls=DummyEncryptorService,
+        image_id=guest_image.id,
+        encryptor_ami=encryptor_image.id,
+        crypto_policy=CRYPTO_GCM
+    )
+
+    def _run():
+        update_ami(
+            sim.wrap(aws_svc, 'aws'), encrypted_ami_id, encryptor_image.id,
+            'Benchmark updated AMI',
+            enc_svc_class=sim.wrap_class(DummyEncryptorService, 'encryptor')
+        )
+    return _run
+
+
+def aws_wrap(sim):
+    aws_svc, encryptor_image, guest_image = build_aws_service()
+
+    def _run():
+        wrap_image.launch_wrapped_image(
+            aws_svc=sim.wrap(aws_svc, 'aws'),
+            image_id=guest_image.id,
+            metavisor_ami=encryptor_image.id
+        )
+    return _run
+
+
+def gcp_encrypt(sim):
+    import test_gce
+    gcp_svc = test_gce.DummyGCPService()
+
+    def _run():
+        encrypt_gcp_image.encrypt(
+            gcp_svc=sim.wrap(gcp_svc, 'gcp'),
+            enc_svc_cls=sim.wrap_class(DummyEncryptorService, 'encryptor'),
+            image_id=test_gce.IGNORE_IMAGE,
+            encryptor_image='encryptor-image',
+            encrypted_image_name='benchmark-encrypted',
+            zone='us-central1-a',
+            crypto_policy=CRYPTO_GCM,
+            instance_config=InstanceConfig(
+                {'identity_token': test_gce.TOKEN})
+        )
+    return _run
+
+
+def esx_encrypt(sim):
+    import test_esx
+    vc_swc = test_esx.DummyVCenterService()
+    mv_vm = test_esx.DummyVM('mv_image', 1, 1024)
+    mv_vm.add_disk(test_esx.DummyDisk(12 * 1024 * 1024, None), 0)
+    mv_ovf = test_esx.DummyOVF(mv_vm, 'mv-ovf')
+    vc_swc.ovfs = [mv_ovf]
+    guest_vmdk = 'guest-vmdk'
+    vc_swc.disks[guest_vmdk] = test_esx.DummyDisk(
+        16 * 1024 * 1024, guest_vmdk)
+
+    def _run():
+        encrypt_vmdk.encrypt_from_s3(
+            sim.wrap(vc_swc, 'esx'),
+            sim.wrap_class(DummyEncryptorService, 'encryptor'),
+            guest_vmdk,
+            crypto_policy=CRYPTO_GCM,
+            vm_name='template-encrypted',
+            create_ovf=False, create_ova=False,
+            target_path=mv_ovf,
+            image_name=None,
+            ovftool_path=None,
+            ovf_name='mv-ovf',
+            download_file_list=[],
+            user_data_str=None
+        )
+    return _run
+
+
+PIPELINES = collections.OrderedDict([
+    ('aws-encrypt', aws_encrypt),
+    ('aws-update', aws_update),
+    ('aws-wrap', aws_wrap),
+    ('gcp-encrypt', gcp_encrypt),
+    ('esx-encrypt', esx_encrypt),
+])
+
+
+def run_benchmarks(names=None, profile=None, seed=0):
+    """ Run the given pipelines, each with a new simulator.
+
+    :return a list of Result objects
+    """
+    results = []
+    for name in names or PIPELINES.keys():
+        with Simulator(profile=profile, seed=seed) as sim:
+            function = PIPELINES[name](sim)
+            results.append(sim.run(name, function))
+    return results
+
+
+def format_results(results):
+    lines = []
+    for result in results:
+        lines.append('%s: %.1f s, %d API calls' % (
+            result.name, result.seconds, result.total_calls()))
+        for stage in result.stages:
+            extra = ''
+            if stage.throttled:
+                extra += ', %d throttled' % stage.throttled
+            if stage.consistency_waits:
+                extra += ', %d consistency waits' % stage.consistency_waits
+            lines.append('  %8.1f s %4d calls  %s%s' % (
+                stage.seconds, sum(stage.calls.values()), stage.name, extra))
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Benchmark brkt-cli pipelines against simulated clouds')
+    parser.add_argument(
+        'pipelines', metavar='PIPELINE', nargs='*',
+        help='Pipelines to run (%s).  Default: all' % ', '.join(PIPELINES))
+    parser.add_argument(
+        '--seed', type=int, default=0,
+        help='Seed for the latency distributions')
+    parser.add_argument(
+        '--profile', metavar='FILE',
+        help='JSON file with latencies, throttles and consistency_delay')
+    parser.add_argument(
+        '--json', action='store_true', help='Print the results as JSON')
+    values = parser.parse_args(argv)
+    for name in values.pipelines:
+        if name not in PIPELINES:
+            parser.error('Unknown pipeline: %s' % name)
+
+    # Keep brkt-cli messages off the console.  They are still used to
+    # split the report into stages.
+    logging.getLogger('brkt_cli').propagate = False
+
+    profile = None
+    if values.profile:
+        with open(values.profile) as f:
+            profile = Profile.from_dict(json.load(f))
+    results = run_benchmarks(values.pipelines, profile, values.seed)
+    if values.json:
+        print json.dumps([r.to_dict() for r in results], indent=2)
+    else:
+        print format_results(results)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -24,7 +24,7 @@ import sys
 import tempfile
 from operator import attrgetter
 
-from brkt_cli import brkt_jwt, util, version, crypto
+from brkt_cli import brkt_jwt, trace, util, version, crypto
 from brkt_cli.config import CLIConfig, CONFIG_PATH
 from brkt_cli.proxy import Proxy, generate_proxy_config, validate_proxy_config
 from brkt_cli.util import validate_dns_name_ip_address
@@ -329,6 +329,22 @@ def main():
         default=True,
         help="Don't check whether this version of brkt-cli is supported"
     )
+    parser.add_argument(
+        '--trace-file',
+        metavar='PATH',
+        dest='trace_file',
+        help='Write the time spent in each stage and API call to this file'
+    )
+    parser.add_argument(
+        '--trace-format',
+        dest='trace_format',
+        choices=trace.FORMATS,
+        default=trace.FORMAT_CHROME,
+        help=(
+            'Write the trace in the Chrome trace event format, which can be '
+            'loaded in chrome://tracing, or as JSON lines'
+        )
+    )
 
     # Batch up messages that are logged while loading modules.  We don't know
     # whether to log them yet, since we haven't parsed arguments.  argparse
@@ -459,11 +475,16 @@ def main():
 
     result = 1
 
+    tracer = None
+    if values.trace_file:
+        tracer = trace.enable()
+
     # Run the subcommand.
     allow_debug_log = True
     error_msg = None
     try:
-        result = subcommand.run(values)
+        with trace.span(subcommand.name()):
+            result = subcommand.run(values)
         if not isinstance(result, (int, long)):
             raise Exception(
                 '%s did not return an integer result' % subcommand.name())
@@ -479,6 +500,14 @@ def main():
         log.debug('', exc_info=1)
         log.error('Interrupted by user')
     finally:
+        if tracer:
+            trace.disable()
+            try:
+                tracer.write(values.trace_file, format=values.trace_format)
+                log.info('Trace written to %s', values.trace_file)
+            except IOError as e:
+                log.error(
+                    'Unable to write trace to %s: %s', values.trace_file, e)
         if debug_handler:
             logging.root.removeHandler(debug_handler)
             debug_handler.close()
@@ -21,12 +21,17 @@ import botocore
 from botocore.exceptions import ClientError
 
 import brkt_cli
-from brkt_cli import encryptor_service, util, mv_version
+from brkt_cli import aws_clients, encryptor_service, util, mv_version
 from brkt_cli import instance_config_args
 from brkt_cli.aws import (
     aws_service,
     encrypt_ami,
     encrypt_ami_args,
+    gc,
+    gc_args,
+    inventory,
+    inventory_args,
+    preflight,
     wrap_image,
     wrap_image_args,
     share_logs,
@@ -38,7 +43,7 @@ from brkt_cli.aws import (
 from brkt_cli.aws.aws_constants import (
     TAG_ENCRYPTOR, TAG_ENCRYPTOR_SESSION_ID, TAG_ENCRYPTOR_AMI
 )
-from brkt_cli.aws.update_ami import update_ami
+from brkt_cli.aws.update_ami import update_ami, update_amis
 from brkt_cli.instance_config import (
     INSTANCE_CREATOR_MODE,
     INSTANCE_UPDATER_MODE,
@@ -115,35 +120,156 @@ def run_share_logs(values):
         'Retry timeout=%.02f, initial sleep seconds=%.02f',
         aws_svc.retry_timeout, aws_svc.retry_initial_sleep_seconds)
 
-    if values.snapshot_id and values.instance_id:
+    instance_ids = values.instance_ids or []
+    snapshot_ids = values.snapshot_ids or []
+    if snapshot_ids and instance_ids:
         raise ValidationError("Only one of --instance-id or --snapshot-id "
                               "may be specified")
 
-    if not values.snapshot_id and not values.instance_id:
+    if not snapshot_ids and not instance_ids:
         raise ValidationError("--instance-id or --snapshot-id "
                               "must be specified")
 
     if values.validate:
         # Validate the region before connecting.
-        region_names = [r.name for r in aws_svc.get_regions()]
-        if values.region not in region_names:
-            raise ValidationError(
-                'Invalid region %s.  Supported regions: %s.' %
-                (values.region, ', '.join(region_names)))
+        _validate_region(
+            aws_svc, values.region, cache_path=preflight.REGION_CACHE_PATH)
 
     aws_svc.connect(values.region)
     logs_svc = share_logs.ShareLogsService()
 
+    if len(instance_ids) + len(snapshot_ids) > 1:
+        share_logs.share_batch(
+            aws_svc,
+            logs_svc,
+            instance_ids=instance_ids,
+            snapshot_ids=snapshot_ids,
+            region=values.region,
+            bucket=values.bucket,
+            path=values.path,
+            subnet_id=values.subnet_id,
+            direct=values.direct,
+            queue_url=values.queue_url
+        )
+        return 0
+
     share_logs.share(
         aws_svc,
         logs_svc,
-        instance_id=values.instance_id,
-        snapshot_id=values.snapshot_id,
+        instance_id=instance_ids[0] if instance_ids else None,
+        snapshot_id=snapshot_ids[0] if snapshot_ids else None,
         region=values.region,
         bucket=values.bucket,
         path=values.path,
-        subnet_id=values.subnet_id
+        subnet_id=values.subnet_id,
+        direct=values.direct,
+        queue_url=values.queue_url
+    )
+    return 0
+
+
+def _new_aws_svc_factory(values):
+    """ Return a function that takes a region name and returns an
+    AWSService that is connected to that region.
+    """
+    nonce = util.make_nonce()
+
+    def _new_aws_svc(region):
+        aws_svc = aws_service.AWSService(
+            nonce,
+            retry_timeout=values.retry_timeout,
+            retry_initial_sleep_seconds=values.retry_initial_sleep_seconds
+        )
+        aws_svc.connect(region)
+        return aws_svc
+    return _new_aws_svc
+
+
+def _scan_regions(new_aws_svc, regions=None):
+    """ Scan the given regions, or all regions, for resources that were
+    created by brkt-cli.  Errors for regions that couldn't be scanned are
+    logged.
+
+    :return a tuple of the InventoryItems and the dictionary of region
+        name to error
+    :raise ValidationError if a region is invalid
+    """
+    region_names = preflight.get_region_names(
+        new_aws_svc('us-east-1'), cache_path=preflight.REGION_CACHE_PATH)
+    if regions and not set(regions) <= set(region_names):
+        # The region may have been added since the cache was written.
+        region_names = preflight.get_region_names(
+            new_aws_svc('us-east-1'), cache_path=preflight.REGION_CACHE_PATH,
+            refresh=True)
+    regions = regions or region_names
+    for region in regions:
+        if region not in region_names:
+            raise ValidationError(
+                'Invalid region %s.  Supported regions: %s.' %
+                (region, ', '.join(region_names)))
+
+    items, errors = inventory.scan_regions(new_aws_svc, regions)
+    for region in sorted(errors):
+        log.error(inventory.get_error_message(region, errors[region]))
+    return items, errors
+
+
+@_handle_aws_errors
+def run_inventory(values):
+    new_aws_svc = _new_aws_svc_factory(values)
+    items, errors = _scan_regions(new_aws_svc, values.regions)
+
+    if values.json:
+        output = inventory.render_json(items)
+    else:
+        output = inventory.render_table(items)
+    if output:
+        print(output)
+    if errors:
+        return 1
+    return 0
+
+
+@_handle_aws_errors
+def run_gc(values):
+    min_age = util.parse_duration(values.min_age)
+    if values.max_parallel < 1:
+        raise ValidationError('--max-parallel must be at least 1')
+    if values.calls_per_second <= 0:
+        raise ValidationError('--rate must be greater than 0')
+    aws_clients.set_max_concurrency(values.max_parallel)
+
+    new_aws_svc = _new_aws_svc_factory(values)
+    items, errors = _scan_regions(new_aws_svc, values.regions)
+    actions = gc.make_plan(items, min_age)
+    if actions:
+        print(gc.render_plan(actions))
+
+    to_delete = [a for a in actions if a.delete]
+    if not values.delete:
+        log.info(
+            'Dry run.  Specify --delete to delete %d resources.',
+            len(to_delete))
+        return 1 if errors else 0
+    if not to_delete:
+        log.info('No resources to delete.')
+        return 1 if errors else 0
+
+    failures = gc.collect(
+        new_aws_svc,
+        actions,
+        max_parallel=values.max_parallel,
+        calls_per_second=values.calls_per_second
     )
+    for item, e in failures:
+        code, message = aws_service.get_code_and_message(e)
+        log.error('Unable to delete %s in %s: %s', item.id, item.region,
+                  message or code)
+    log.info(
+        'Deleted %d of %d resources.',
+        len(to_delete) - len(failures), len(to_delete))
+    if errors or failures:
+        return 1
     return 0
 
 
@@ -178,6 +304,13 @@ def run_wrap_image(values, config):
         if not aws_svc.iam_role_exists(values.iam):
             raise ValidationError('IAM role %s does not exist' % values.iam)
 
+    if values.count < 1:
+        raise ValidationError('--count must be at least 1')
+    subnet_ids = []
+    if values.subnet_id:
+        subnet_ids.append(values.subnet_id)
+    subnet_ids += values.fleet_subnet_ids or []
+
     metavisor_ami = values.encryptor_ami or _get_encryptor_ami(values.region,
                                                     values.metavisor_version)
     log.debug('Using Metavisor %s', metavisor_ami)
@@ -190,6 +323,13 @@ def run_wrap_image(values, config):
             subnet_id=values.subnet_id,
             security_group_ids=values.security_group_ids
         )
+        for subnet_id in values.fleet_subnet_ids or []:
+            try:
+                _validate_subnet_and_security_groups(
+                    aws_svc, subnet_id, values.security_group_ids)
+            except ClientError as e:
+                _, message = aws_service.get_code_and_message(e)
+                raise ValidationError(message)
 
         brkt_cli.validate_ntp_servers(values.ntp_servers)
 
@@ -201,20 +341,32 @@ def run_wrap_image(values, config):
         brkt_env=brkt_env,
         launch_token=lt)
 
-    instance = wrap_image.launch_wrapped_image(
+    def _new_aws_svc():
+        svc = aws_service.AWSService(
+            nonce,
+            retry_timeout=values.retry_timeout,
+            retry_initial_sleep_seconds=values.retry_initial_sleep_seconds
+        )
+        svc.connect(values.region, key_name=values.key_name)
+        return svc
+
+    instances = wrap_image.launch_wrapped_images(
         aws_svc=aws_svc,
         image_id=guest_image.id,
         metavisor_ami=metavisor_ami,
+        count=values.count,
         wrapped_instance_name=values.wrapped_instance_name,
-        subnet_id=values.subnet_id,
+        subnet_ids=subnet_ids,
         security_group_ids=values.security_group_ids,
         instance_type=values.instance_type,
         instance_config=instance_config,
-        iam=values.iam
+        iam=values.iam,
+        new_aws_svc=_new_aws_svc
     )
-    # Print the Instance ID to stdout, in case the caller wants to process
+    # Print the Instance IDs to stdout, in case the caller wants to process
     # the output. Log messages go to stderr
-    print instance.id
+    for instance in instances:
+        print instance.id
     return 0
 
 
@@ -326,40 +478,60 @@ def run_encrypt(values, config, verbose=False):
         'Retry timeout=%.02f, initial sleep seconds=%.02f',
         aws_svc.retry_timeout, aws_svc.retry_initial_sleep_seconds)
 
-    aws_svc.connect(values.region, key_name=values.key_name)
-
     if values.validate:
-        # Validate the region before connecting.
-        _validate_region(aws_svc, values.region)
+        # Validate the region before connecting, and before the other
+        # checks, which fail with connection errors when it's invalid.
+        _validate_region(
+            aws_svc, values.region, cache_path=preflight.REGION_CACHE_PATH)
 
-    # Keywords check
-    guest_ami_id = values.ami
-    if values.ami == 'ubuntu':
-        guest_ami_id = get_ubuntu_ami_id(values.stock_image_version, values.region)
-    elif values.ami == 'centos':
-        guest_ami_id = get_centos_ami_id(values.stock_image_version, aws_svc)
+    aws_svc.connect(values.region, key_name=values.key_name)
 
-    if values.validate:
-        guest_image = _validate_guest_ami(aws_svc, guest_ami_id)
-    else:
-        guest_image = _validate_ami(aws_svc, guest_ami_id)
-    encryptor_ami = values.encryptor_ami or _get_encryptor_ami(values.region,
-                                                    values.metavisor_version)
-    aws_tags = encrypt_ami.get_default_tags(session_id, encryptor_ami)
-    command_line_tags = brkt_cli.parse_tags(values.aws_tags)
-    aws_tags.update(command_line_tags)
-    aws_svc.default_tags = aws_tags
+    def _get_guest_image():
+        # Keywords check
+        guest_ami_id = values.ami
+        if values.ami == 'ubuntu':
+            guest_ami_id = get_ubuntu_ami_id(
+                values.stock_image_version, values.region)
+        elif values.ami == 'centos':
+            guest_ami_id = get_centos_ami_id(
+                values.stock_image_version, aws_svc)
+
+        if values.validate:
+            return _validate_guest_ami(aws_svc, guest_ami_id)
+        return _validate_ami(aws_svc, guest_ami_id)
+
+    def _get_encryptor():
+        encryptor_ami = values.encryptor_ami or _get_encryptor_ami(
+            values.region, values.metavisor_version)
+        if values.validate:
+            _validate_encryptor_ami(aws_svc, encryptor_ami)
+        return encryptor_ami
 
     if values.validate:
-        _validate(
+        # Run the independent checks concurrently, and report all of the
+        # failures at once.
+        checks = [
+            _get_guest_image,
+            _get_encryptor,
+            lambda: brkt_cli.validate_ntp_servers(values.ntp_servers)
+        ]
+        checks += _validation_checks(
             aws_svc,
-            encryptor_ami,
             encrypted_ami_name=values.encrypted_ami_name,
             key_name=values.key_name,
             subnet_id=values.subnet_id,
             security_group_ids=values.security_group_ids
         )
-        brkt_cli.validate_ntp_servers(values.ntp_servers)
+        results = preflight.run_checks(checks)
+        guest_image, encryptor_ami = results[:2]
+    else:
+        guest_image = _get_guest_image()
+        encryptor_ami = _get_encryptor()
+
+    aws_tags = encrypt_ami.get_default_tags(session_id, encryptor_ami)
+    command_line_tags = brkt_cli.parse_tags(values.aws_tags)
+    aws_tags.update(command_line_tags)
+    aws_svc.default_tags = aws_tags
 
     mv_image = aws_svc.get_image(encryptor_ami)
     if values.crypto is None:
@@ -435,48 +607,81 @@ def run_update(values, config, verbose=False):
         'Retry timeout=%.02f, initial sleep seconds=%.02f',
         aws_svc.retry_timeout, aws_svc.retry_initial_sleep_seconds)
 
+    if len(values.amis) > 1 and values.encrypted_ami_name:
+        raise ValidationError(
+            '--encrypted-ami-name cannot be specified when updating more '
+            'than one AMI')
+    if values.max_parallel < 1:
+        raise ValidationError('--max-parallel must be at least 1')
+    aws_clients.set_max_concurrency(values.max_parallel)
+
     if values.validate:
-        # Validate the region before connecting.
-        _validate_region(aws_svc, values.region)
+        # Validate the region before connecting, and before the other
+        # checks, which fail with connection errors when it's invalid.
+        _validate_region(
+            aws_svc, values.region, cache_path=preflight.REGION_CACHE_PATH)
 
     aws_svc.connect(values.region, key_name=values.key_name)
-    encrypted_image = _validate_ami(aws_svc, values.ami)
-    encryptor_ami = values.encryptor_ami or _get_encryptor_ami(values.region,
-                                                    values.metavisor_version)
-    aws_tags = encrypt_ami.get_default_tags(nonce, encryptor_ami)
-    command_line_tags = brkt_cli.parse_tags(values.aws_tags)
-    aws_tags.update(command_line_tags)
-    aws_svc.default_tags = aws_tags
+
+    def _get_encryptor():
+        encryptor_ami = values.encryptor_ami or _get_encryptor_ami(
+            values.region, values.metavisor_version)
+        if values.validate:
+            _validate_encryptor_ami(aws_svc, encryptor_ami)
+        return encryptor_ami
 
     if values.validate:
-        _validate_guest_encrypted_ami(
-            aws_svc, encrypted_image.id, encryptor_ami)
-        brkt_cli.validate_ntp_servers(values.ntp_servers)
-        _validate(
+        # Run the independent checks concurrently, and report all of the
+        # failures at once.
+        checks = [_get_encryptor]
+        checks += [
+            lambda ami=ami: _validate_guest_encrypted_ami(aws_svc, ami)
+            for ami in values.amis
+        ]
+        checks.append(
+            lambda: brkt_cli.validate_ntp_servers(values.ntp_servers))
+        checks += _validation_checks(
             aws_svc,
-            encryptor_ami,
             encrypted_ami_name=values.encrypted_ami_name,
             key_name=values.key_name,
             subnet_id=values.subnet_id,
             security_group_ids=values.security_group_ids
         )
-
-        _validate_guest_encrypted_ami(
-            aws_svc, encrypted_image.id, encryptor_ami)
+        results = preflight.run_checks(checks)
+        encryptor_ami = results[0]
+        encrypted_images = results[1:1 + len(values.amis)]
+
+        # This check depends on the encryptor AMI, but doesn't make any
+        # AWS calls.
+        preflight.run_checks([
+            lambda image=image: _validate_not_encrypted_with(
+                image, encryptor_ami)
+            for image in encrypted_images
+        ])
     else:
         log.info('Skipping AMI validation.')
+        encrypted_images = [
+            _validate_ami(aws_svc, ami) for ami in values.amis]
+        encryptor_ami = _get_encryptor()
+
+    aws_tags = encrypt_ami.get_default_tags(nonce, encryptor_ami)
+    command_line_tags = brkt_cli.parse_tags(values.aws_tags)
+    aws_tags.update(command_line_tags)
+    aws_svc.default_tags = aws_tags
 
     mv_image = aws_svc.get_image(encryptor_ami)
-    if (encrypted_image.virtualization_type != mv_image.virtualization_type):
-        log.error(
-            'Virtualization type mismatch.  %s is %s, but encryptor %s is '
-            '%s.',
-            encrypted_image.id,
-            encrypted_image.virtualization_type,
-            mv_image.id,
-            mv_image.virtualization_type
-        )
-        return 1
+    for encrypted_image in encrypted_images:
+        if (encrypted_image.virtualization_type !=
+                mv_image.virtualization_type):
+            log.error(
+                'Virtualization type mismatch.  %s is %s, but encryptor %s '
+                'is %s.',
+                encrypted_image.id,
+                encrypted_image.virtualization_type,
+                mv_image.id,
+                mv_image.virtualization_type
+            )
+            return 1
 
     encrypted_ami_name = values.encrypted_ami_name
     if encrypted_ami_name:
@@ -484,16 +689,24 @@ def run_update(values, config, verbose=False):
         if aws_svc.get_images(name=encrypted_ami_name, owner_alias='self'):
             raise ValidationError(
                 'You already own image named %s' % encrypted_ami_name)
+        encrypted_amis = [(encrypted_images[0].id, encrypted_ami_name)]
     else:
-        encrypted_ami_name = _get_updated_image_name(
-            encrypted_image.name, nonce)
-        log.debug('Image name: %s', encrypted_ami_name)
-        aws_service.validate_image_name(encrypted_ami_name)
+        encrypted_amis = []
+        for encrypted_image in encrypted_images:
+            # Use a separate nonce for each image in a batch, so that
+            # images with the same name get unique updated names.
+            name_nonce = nonce
+            if len(encrypted_images) > 1:
+                name_nonce = util.make_nonce()
+            name = _get_updated_image_name(encrypted_image.name, name_nonce)
+            log.debug('Image name: %s', name)
+            aws_service.validate_image_name(name)
+            encrypted_amis.append((encrypted_image.id, name))
 
     # Initial validation done
     log.info(
         'Updating %s with new metavisor %s',
-        encrypted_image.id, encryptor_ami
+        ', '.join(i.id for i in encrypted_images), encryptor_ami
     )
 
     brkt_env = brkt_cli.brkt_env_from_values(values, config)
@@ -512,16 +725,54 @@ def run_update(values, config, verbose=False):
             log.debug('Writing instance user data to %s', f.name)
             f.write(instance_config.make_userdata())
 
-    updated_ami_id = update_ami(
-        aws_svc, encrypted_image.id, encryptor_ami, encrypted_ami_name,
+    if len(encrypted_amis) == 1:
+        ((encrypted_ami_id, encrypted_ami_name),) = encrypted_amis
+        updated_ami_id = update_ami(
+            aws_svc, encrypted_ami_id, encryptor_ami, encrypted_ami_name,
+            subnet_id=values.subnet_id,
+            security_group_ids=values.security_group_ids,
+            guest_instance_type=values.guest_instance_type,
+            updater_instance_type=values.updater_instance_type,
+            instance_config=instance_config,
+            status_port=values.status_port,
+        )
+        print(updated_ami_id)
+        return 0
+
+    def _new_aws_svc():
+        svc = aws_service.AWSService(
+            nonce,
+            default_tags=aws_tags,
+            retry_timeout=values.retry_timeout,
+            retry_initial_sleep_seconds=values.retry_initial_sleep_seconds
+        )
+        svc.connect(values.region, key_name=values.key_name)
+        return svc
+
+    results = update_amis(
+        aws_svc, encrypted_amis, encryptor_ami,
         subnet_id=values.subnet_id,
         security_group_ids=values.security_group_ids,
         guest_instance_type=values.guest_instance_type,
         updater_instance_type=values.updater_instance_type,
         instance_config=instance_config,
         status_port=values.status_port,
+        new_aws_svc=_new_aws_svc,
+        max_parallel=values.max_parallel
     )
-    print(updated_ami_id)
+
+    # Print the original and updated AMI ids to stdout, one pair per line.
+    failed = [r for r in results if r.error]
+    for result in results:
+        if result.updated_ami:
+            print('%s %s' % (result.encrypted_ami, result.updated_ami))
+    if failed:
+        log.error(
+            'Unable to update %d of %d AMIs: %s',
+            len(failed), len(results),
+            ', '.join(r.encrypted_ami for r in failed)
+        )
+        return 1
     return 0
 
 
@@ -559,7 +810,7 @@ class AWSSubcommand(Subcommand):
         aws_subparsers = aws_parser.add_subparsers(
             dest='aws_subcommand',
             # Hardcode the list, so that we don't expose internal subcommands.
-            metavar='{encrypt,update,wrap-guest-image}'
+            metavar='{encrypt,gc,inventory,update,wrap-guest-image}'
         )
 
         encrypt_ami_parser = aws_subparsers.add_parser(
@@ -628,10 +879,38 @@ class AWSSubcommand(Subcommand):
         )
         wrap_instance_parser.set_defaults(aws_subcommand='wrap-instance')
 
+        inventory_parser = aws_subparsers.add_parser(
+            'inventory',
+            description=(
+                'List the images, snapshots, volumes, instances and security '
+                'groups that were created by brkt-cli, in all regions.'
+            ),
+            help='List resources created by brkt-cli',
+            formatter_class=brkt_cli.SortingHelpFormatter
+        )
+        inventory_args.setup_inventory_args(inventory_parser)
+        inventory_parser.set_defaults(aws_subcommand='inventory')
+
+        gc_parser = aws_subparsers.add_parser(
+            'gc',
+            description=(
+                'Delete the temporary instances, volumes, snapshots and '
+                'security groups that were left behind by brkt-cli.'
+            ),
+            help='Delete resources left behind by brkt-cli',
+            formatter_class=brkt_cli.SortingHelpFormatter
+        )
+        gc_args.setup_gc_args(gc_parser)
+        gc_parser.set_defaults(aws_subcommand='gc')
+
     def debug_log_to_temp_file(self, values):
         return values.aws_subcommand in ('encrypt', 'update')
 
     def run(self, values):
+        if values.aws_subcommand == 'inventory':
+            return run_inventory(values)
+        if values.aws_subcommand == 'gc':
+            return run_gc(values)
         if not values.region:
             raise ValidationError(
                 'Specify --region or set the aws.region config key')
@@ -754,10 +1033,12 @@ def _validate_guest_ami(aws_svc, ami_id):
     return image
 
 
-def _validate_guest_encrypted_ami(aws_svc, ami_id, encryptor_ami_id):
+def _validate_guest_encrypted_ami(aws_svc, ami_id, encryptor_ami_id=None):
     """ Validate that this image was encrypted by Bracket by checking
         tags.
 
+    :param encryptor_ami_id if specified, also validate that the image
+        was not encrypted with this encryptor AMI
     :raise: ValidationError if validation fails
     :return: the Image object
     """
@@ -773,7 +1054,18 @@ def _validate_guest_encrypted_ami(aws_svc, ami_id, encryptor_ami_id):
         raise ValidationError(
             '%s is missing tags: %s' % (ami.id, ', '.join(missing_tags)))
 
-    # See if this image was already encrypted by the given encryptor AMI.
+    if encryptor_ami_id:
+        _validate_not_encrypted_with(ami, encryptor_ami_id)
+    return ami
+
+
+def _validate_not_encrypted_with(ami, encryptor_ami_id):
+    """ Validate that the encrypted image was not encrypted with the given
+    encryptor AMI.
+
+    :raise: ValidationError if validation fails
+    """
+    tags = boto3_tag.tags_to_dict(ami.tags)
     original_encryptor_id = tags.get(TAG_ENCRYPTOR_AMI)
     if original_encryptor_id == encryptor_ami_id:
         msg = '%s was already encrypted with Bracket Encryptor %s' % (
@@ -782,8 +1074,6 @@ def _validate_guest_encrypted_ami(aws_svc, ami_id, encryptor_ami_id):
         )
         raise ValidationError(msg)
 
-    return ami
-
 
 def _validate_encryptor_ami(aws_svc, ami_id):
     """ Validate that the image exists and is a Bracket encryptor image.
@@ -798,25 +1088,16 @@ def _validate_encryptor_ami(aws_svc, ami_id):
     return None
 
 
-def _validate(aws_svc, encryptor_ami_id, encrypted_ami_name=None,
-              key_name=None, subnet_id=None, security_group_ids=None):
-    """ Validate command-line options
-
-    :param aws_svc: the BaseAWSService implementation
-    :param values: object that was generated by argparse
+def _validation_checks(aws_svc, encryptor_ami_id=None,
+                       encrypted_ami_name=None, key_name=None,
+                       subnet_id=None, security_group_ids=None):
+    """ Return the checks that validate the command-line options, as a
+    list of functions that can be passed to preflight.run_checks().
     """
+    checks = []
     if encrypted_ami_name:
-        aws_service.validate_image_name(encrypted_ami_name)
-
-    try:
-        if key_name:
-            aws_svc.get_key_pair(key_name)
-
-        _validate_subnet_and_security_groups(
-            aws_svc, subnet_id, security_group_ids)
-        _validate_encryptor_ami(aws_svc, encryptor_ami_id)
-
-        if encrypted_ami_name:
+        def _check_image_name():
+            aws_service.validate_image_name(encrypted_ami_name)
             images = aws_svc.get_images(
                 name=encrypted_ami_name,
                 owner_alias='self')
@@ -825,22 +1106,45 @@ def _validate(aws_svc, encryptor_ami_id, encrypted_ami_name=None,
                     'You already own an image named %s' %
                     encrypted_ami_name
                 )
-    except ClientError as e:
-        _, message = aws_service.get_code_and_message(e)
-        raise ValidationError(message)
+        checks.append(_check_image_name)
+    if key_name:
+        checks.append(lambda: aws_svc.get_key_pair(key_name))
+    checks.append(
+        lambda: _validate_subnet_and_security_groups(
+            aws_svc, subnet_id, security_group_ids)
+    )
+    if encryptor_ami_id:
+        checks.append(
+            lambda: _validate_encryptor_ami(aws_svc, encryptor_ami_id))
+    return checks
+
 
+def _validate(aws_svc, encryptor_ami_id, encrypted_ami_name=None,
+              key_name=None, subnet_id=None, security_group_ids=None):
+    """ Validate command-line options.  The checks run concurrently, and
+    all of the failures are reported in a single ValidationError.
 
-def _validate_region(aws_svc, region_name):
+    :param aws_svc: the BaseAWSService implementation
+    :param values: object that was generated by argparse
+    """
+    preflight.run_checks(_validation_checks(
+        aws_svc,
+        encryptor_ami_id=encryptor_ami_id,
+        encrypted_ami_name=encrypted_ami_name,
+        key_name=key_name,
+        subnet_id=subnet_id,
+        security_group_ids=security_group_ids
+    ))
+
+
+def _validate_region(aws_svc, region_name, cache_path=None):
     """ Check that the specified region is a valid AWS region.
 
+    :param cache_path the path to the region cache, or None to always
+        call DescribeRegions
     :raise ValidationError if the region is invalid
     """
-    region_names = [r.name for r in aws_svc.get_regions()]
-    if region_name not in region_names:
-        raise ValidationError(
-            '%s does not exist.  AWS regions are %s' %
-            (region_name, ', '.join(region_names))
-        )
+    preflight.validate_region(aws_svc, region_name, cache_path=cache_path)
 
 
 def _get_encryptor_ami(region_name, version):
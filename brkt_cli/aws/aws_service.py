@@ -18,13 +18,13 @@ import re
 import ssl
 import string
 import tempfile
+import threading
 import time
 from datetime import datetime
 
-import boto3
 from botocore.exceptions import ClientError
 
-from brkt_cli import util, encryptor_service
+from brkt_cli import aws_clients, encryptor_service, trace, util
 from brkt_cli.aws import boto3_device, boto3_tag
 from brkt_cli.aws.aws_constants import (
     NAME_ENCRYPTOR_SECURITY_GROUP,
@@ -56,6 +56,14 @@ EBS_OPTIMIZED_INSTANCES = ['c1.xlarge', 'c3.xlarge', 'c3.2xlarge',
                            'r4.2xlarge', 'r4.4xlarge', 'r4.8xlarge',
                            'r4.16xlarge', 'x1.16xlarge', 'x1.32xlarge']
 
+# The types of resources that brkt-cli creates, as passed to
+# AWSService.list_resources().
+RESOURCE_TYPES = ('image', 'snapshot', 'volume', 'instance', 'security-group')
+
+# The number of results requested per DescribeVolumes call.  500 is the
+# maximum that the API allows.
+DESCRIBE_VOLUMES_PAGE_SIZE = 500
+
 
 class BaseAWSService(object):
     __metaclass__ = abc.ABCMeta
@@ -86,10 +94,30 @@ class BaseAWSService(object):
                      description=None):
         pass
 
+    @abc.abstractmethod
+    def run_instances(self,
+                      image_id,
+                      count,
+                      security_group_ids=None,
+                      instance_type='c4.xlarge',
+                      placement=None,
+                      block_device_mappings=None,
+                      subnet_ids=None,
+                      user_data=None,
+                      ebs_optimized=True,
+                      instance_profile_name=None,
+                      name=None,
+                      description=None):
+        pass
+
     @abc.abstractmethod
     def get_instance(self, instance_id, retry=True):
         pass
 
+    @abc.abstractmethod
+    def get_instances(self, *instance_ids):
+        pass
+
     @abc.abstractmethod
     def create_tags(self, resource_id, name=None, description=None):
         pass
@@ -106,6 +134,10 @@ class BaseAWSService(object):
     def terminate_instance(self, instance_id):
         pass
 
+    @abc.abstractmethod
+    def terminate_instances(self, instance_ids):
+        pass
+
     @abc.abstractmethod
     def get_volume(self, volume_id):
         pass
@@ -122,6 +154,10 @@ class BaseAWSService(object):
     def get_snapshots(self, *snapshot_ids):
         pass
 
+    @abc.abstractmethod
+    def list_resources(self, resource_type, filters=None):
+        pass
+
     @abc.abstractmethod
     def get_snapshot(self, snapshot_id):
         pass
@@ -244,10 +280,10 @@ class BotoRetryExceptionChecker(util.RetryExceptionChecker):
 def retry_boto(function, error_code_regexp=None, timeout=10.0,
                initial_sleep_seconds=0.25):
     """ Retry an AWS API call.  Handle known intermittent errors and expected
-    error codes.
+    error codes.  Each attempt is recorded as a trace span.
     """
     return util.retry(
-        function,
+        trace.traced(category=trace.API)(function),
         exception_checker=BotoRetryExceptionChecker(error_code_regexp),
         timeout=timeout,
         initial_sleep_seconds=initial_sleep_seconds
@@ -261,20 +297,55 @@ class AWSService(BaseAWSService):
             encryptor_session_id,
             default_tags=None,
             retry_timeout=10.0,
-            retry_initial_sleep_seconds=0.25):
+            retry_initial_sleep_seconds=0.25,
+            client_factory=None):
         super(AWSService, self).__init__(encryptor_session_id)
 
         self.default_tags = default_tags or {}
         self.retry_timeout = retry_timeout
         self.retry_initial_sleep_seconds = retry_initial_sleep_seconds
+        self.client_factory = client_factory or aws_clients.get_factory()
 
         # These will be initialized by connect().
         self.key_name = None
         self.region = None
 
-        self.ec2 = None
-        # Hardcode us-east-1 for the purpose of getting the list of regions.
-        self.ec2client = boto3.client('ec2', region_name='us-east-1')
+        # The EC2 resource and client are created on first use.  boto3
+        # resources are not thread-safe, so each thread gets its own EC2
+        # resource, on top of the shared client.
+        self._ec2 = None
+        self._ec2client = None
+        self._local = threading.local()
+
+    @property
+    def ec2(self):
+        if self._ec2:
+            return self._ec2
+        cached = getattr(self._local, 'ec2', None)
+        if not cached or cached[0] != self.region:
+            cached = (
+                self.region,
+                self.client_factory.resource('ec2', region_name=self.region)
+            )
+            self._local.ec2 = cached
+        return cached[1]
+
+    @ec2.setter
+    def ec2(self, value):
+        self._ec2 = value
+
+    @property
+    def ec2client(self):
+        if not self._ec2client:
+            # Before connect() is called, the client is only used for
+            # getting the list of regions, so hardcode us-east-1.
+            self._ec2client = self.client_factory.client(
+                'ec2', region_name=self.region or 'us-east-1')
+        return self._ec2client
+
+    @ec2client.setter
+    def ec2client(self, value):
+        self._ec2client = value
 
     def get_regions(self):
         """ Return the available regions as a list of RegionInfo. """
@@ -287,8 +358,8 @@ class AWSService(BaseAWSService):
     def connect(self, region, key_name=None):
         self.region = region
         self.key_name = key_name
-        self.ec2 = boto3.resource('ec2', region_name=region)
-        self.ec2client = boto3.client('ec2', region_name=region)
+        self._ec2 = None
+        self._ec2client = None
 
     def retry(self, function, error_code_regexp=None, timeout=None):
         """ Call the retry_boto function with this object's timeout and
@@ -314,12 +385,46 @@ class AWSService(BaseAWSService):
                      instance_profile_name=None,
                      name=None,
                      description=None):
-        instance_id = None
+        instances = self.run_instances(
+            image_id,
+            1,
+            security_group_ids=security_group_ids,
+            instance_type=instance_type,
+            placement=placement,
+            block_device_mappings=block_device_mappings,
+            subnet_ids=[subnet_id] if subnet_id else None,
+            user_data=user_data,
+            ebs_optimized=ebs_optimized,
+            instance_profile_name=instance_profile_name,
+            name=name,
+            description=description
+        )
+        return instances[0]
+
+    def run_instances(self,
+                      image_id,
+                      count,
+                      security_group_ids=None,
+                      instance_type='c4.xlarge',
+                      placement=None,
+                      block_device_mappings=None,
+                      subnet_ids=None,
+                      user_data=None,
+                      ebs_optimized=True,
+                      instance_profile_name=None,
+                      name=None,
+                      description=None):
+        """ Launch count instances of the given image.  The instances are
+        spread evenly across the given subnets, with one RunInstances call
+        per subnet.  All of the instances are tagged with a single
+        CreateTags call.
+
+        :return a list of Instance objects
+        """
+        instance_ids = []
         try:
             kwargs = {
-                'ImageId': image_id,
-                'MaxCount': 1,
-                'MinCount': 1
+                'ImageId': image_id
             }
             if security_group_ids:
                 kwargs['SecurityGroupIds'] = security_group_ids
@@ -329,8 +434,6 @@ class AWSService(BaseAWSService):
                 kwargs['Placement'] = placement
             if block_device_mappings:
                 kwargs['BlockDeviceMappings'] = block_device_mappings
-            if subnet_id:
-                kwargs['SubnetId'] = subnet_id
             if user_data:
                 kwargs['UserData'] = user_data
             if ebs_optimized is not None:
@@ -340,25 +443,44 @@ class AWSService(BaseAWSService):
             if self.key_name:
                 kwargs['KeyName'] = self.key_name
 
-            if log.isEnabledFor(logging.DEBUG):
-                # User-data is long and can have binary content.
-                kwargs_for_log = dict(kwargs)
-                if user_data:
-                    kwargs_for_log['UserData'] = '(%d bytes)' % len(user_data)
-                j = pretty_print_json(kwargs_for_log)
-                log.debug('Running instance: %s', j)
-
             run_instances = self.retry(
                 self.ec2client.run_instances, )
-            response = run_instances(**kwargs)
-            instance_id = response['Instances'][0]['InstanceId']
-            log.info('Launched %s based on %s', instance_id, image_id)
-
-            self.create_tags(instance_id, name=name, description=description)
-            return self.get_instance(instance_id)
+            subnet_ids = subnet_ids or [None]
+            for i, subnet_id in enumerate(subnet_ids):
+                subnet_count = count / len(subnet_ids)
+                if i < count % len(subnet_ids):
+                    subnet_count += 1
+                if not subnet_count:
+                    continue
+
+                subnet_kwargs = dict(kwargs)
+                subnet_kwargs['MaxCount'] = subnet_count
+                subnet_kwargs['MinCount'] = subnet_count
+                if subnet_id:
+                    subnet_kwargs['SubnetId'] = subnet_id
+
+                if log.isEnabledFor(logging.DEBUG):
+                    # User-data is long and can have binary content.
+                    kwargs_for_log = dict(subnet_kwargs)
+                    if user_data:
+                        kwargs_for_log['UserData'] = \
+                            '(%d bytes)' % len(user_data)
+                    j = pretty_print_json(kwargs_for_log)
+                    log.debug('Running instances: %s', j)
+
+                response = run_instances(**subnet_kwargs)
+                for instance in response['Instances']:
+                    instance_ids.append(instance['InstanceId'])
+                    log.info(
+                        'Launched %s based on %s',
+                        instance['InstanceId'], image_id
+                    )
+
+            self.create_tags(instance_ids, name=name, description=description)
+            return self.get_instances(*instance_ids)
         except:
-            if instance_id:
-                clean_up(self, instance_ids=[instance_id])
+            if instance_ids:
+                clean_up(self, instance_ids=instance_ids)
             raise
 
     def get_instance(self, instance_id, retry=True):
@@ -370,7 +492,23 @@ class AWSService(BaseAWSService):
         load()
         return instance
 
+    def get_instances(self, *instance_ids):
+        """ Return the given instances, using a single DescribeInstances
+        call.
+        """
+        instances = self._list_collection(
+            self.ec2.instances.filter(InstanceIds=list(instance_ids)),
+            r'InvalidInstanceID\.NotFound'
+        )
+        instances = {i.id: i for i in instances}
+        return [instances[id] for id in instance_ids if id in instances]
+
     def create_tags(self, resource_id, name=None, description=None):
+        """ Tag the given resource with the default tags, name and
+        description.
+
+        :param resource_id a resource ID, or a list of resource IDs
+        """
         d = dict(self.default_tags)
         if name:
             d['Name'] = name
@@ -383,8 +521,12 @@ class AWSService(BaseAWSService):
         log.debug(
             'Tagging %s with %s', resource_id, pretty_print_json(d))
         create_tags = self.retry(self.ec2client.create_tags, r'.*\.NotFound')
+        if isinstance(resource_id, basestring):
+            resource_ids = [resource_id]
+        else:
+            resource_ids = list(resource_id)
         create_tags(
-            Resources=[resource_id],
+            Resources=resource_ids,
             Tags=boto3_tag.dict_to_tags(d)
         )
 
@@ -403,6 +545,14 @@ class AWSService(BaseAWSService):
         terminate_instances = self.retry(self.ec2client.terminate_instances)
         terminate_instances(InstanceIds=[instance_id])
 
+    def terminate_instances(self, instance_ids):
+        """ Terminate the given instances with a single TerminateInstances
+        call.
+        """
+        log.info('Terminating %s', ', '.join(instance_ids))
+        terminate_instances = self.retry(self.ec2client.terminate_instances)
+        terminate_instances(InstanceIds=list(instance_ids))
+
     def get_volume(self, volume_id):
         volume = self.ec2.Volume(volume_id)
         load = self.retry(
@@ -410,23 +560,32 @@ class AWSService(BaseAWSService):
         load()
         return volume
 
+    def _list_collection(self, collection, error_code_regexp=None):
+        """ Return the resources in the given boto3 collection as a list.
+        The collection pages through the Describe responses and populates
+        each resource from them, so the resources don't need to be
+        loaded individually.  The whole listing is retried, since the
+        collection doesn't call the API until it's iterated.
+        """
+        def _list_collection():
+            return list(collection)
+
+        return self.retry(_list_collection, error_code_regexp)()
+
     def get_volumes(self, tag_key=None, tag_value=None):
         filters = list()
         if tag_key and tag_value:
             filters = [{'Name': 'tag:%s' % tag_key, 'Values': [tag_value]}]
+        elif tag_key:
+            filters = [{'Name': 'tag-key', 'Values': [tag_key]}]
 
-        f = self.retry(
-            self.ec2.volumes.filter, r'InvalidVolume\.NotFound')
-        volumes = f(Filters=filters)
-
-        for volume in volumes:
-            load = self.retry(volume.load, r'InvalidVolume\.NotFound')
-            load()
-        return list(volumes)
+        volumes = self.ec2.volumes.filter(Filters=filters).page_size(
+            DESCRIBE_VOLUMES_PAGE_SIZE)
+        return self._list_collection(volumes, r'InvalidVolume\.NotFound')
 
     def iam_role_exists(self, role):
         try:
-            iam = boto3.resource('iam')
+            iam = self.client_factory.resource('iam')
             iamRole = iam.Role(role)
             iamRole.load()
         except ClientError as e:
@@ -437,13 +596,40 @@ class AWSService(BaseAWSService):
         return True
 
     def get_snapshots(self, *snapshot_ids):
-        f = self.retry(
-            self.ec2.snapshots.filter, r'InvalidSnapshot\.NotFound')
-        snapshots = f(SnapshotIds=snapshot_ids)
-        for snapshot in snapshots:
-            load = self.retry(snapshot.load, r'InvalidSnapshot\.NotFound')
-            load()
-        return list(snapshots)
+        if not snapshot_ids:
+            # An empty list of IDs would return every snapshot that we
+            # have access to, including public ones.
+            return []
+        snapshots = self.ec2.snapshots.filter(SnapshotIds=list(snapshot_ids))
+        return self._list_collection(
+            snapshots, r'InvalidSnapshot\.NotFound')
+
+    def list_resources(self, resource_type, filters=None):
+        """ Return the resources of the given type that match the given
+        Describe filters.  Images and snapshots are limited to the ones
+        that are owned by this account.
+
+        :param resource_type one of RESOURCE_TYPES
+        :param filters a list of filter dictionaries, as passed to the
+            Describe calls
+        """
+        filters = filters or []
+        if resource_type == 'image':
+            collection = self.ec2.images.filter(
+                Owners=['self'], Filters=filters)
+        elif resource_type == 'snapshot':
+            collection = self.ec2.snapshots.filter(
+                OwnerIds=['self'], Filters=filters)
+        elif resource_type == 'volume':
+            collection = self.ec2.volumes.filter(Filters=filters).page_size(
+                DESCRIBE_VOLUMES_PAGE_SIZE)
+        elif resource_type == 'instance':
+            collection = self.ec2.instances.filter(Filters=filters)
+        elif resource_type == 'security-group':
+            collection = self.ec2.security_groups.filter(Filters=filters)
+        else:
+            raise ValueError('Unknown resource type: %s' % resource_type)
+        return self._list_collection(collection)
 
     def get_snapshot(self, snapshot_id):
         snapshot = self.ec2.Snapshot(snapshot_id)
@@ -527,9 +713,7 @@ class AWSService(BaseAWSService):
             owners.append(owner_alias)
 
         images = self.ec2.images.filter(Owners=owners, Filters=filters)
-        for image in images:
-            image.load()
-        return list(images)
+        return self._list_collection(images)
 
     def get_image(self, image_id, retry=False):
         image = self.ec2.Image(image_id)
@@ -674,12 +858,12 @@ class AWSService(BaseAWSService):
         return self.get_volume(response['VolumeId'])
 
     def get_default_vpc(self):
-        filter = self.retry(self.ec2.vpcs.filter)
-        vpcs = filter(Filters=[{'Name': 'isDefault', 'Values': ['true']}])
+        vpcs = self._list_collection(
+            self.ec2.vpcs.filter(
+                Filters=[{'Name': 'isDefault', 'Values': ['true']}])
+        )
         if vpcs:
-            vpc = list(vpcs)[0]
-            vpc.load()
-            return vpc
+            return vpcs[0]
 
         return None
 
@@ -763,6 +947,7 @@ class VolumeError(BracketError):
     pass
 
 
+@trace.traced()
 def wait_for_volume(aws_svc, volume_id, timeout=600.0, state='available'):
     """ Wait for the volume to be in the specified state.
 
@@ -795,6 +980,7 @@ class InstanceError(BracketError):
     pass
 
 
+@trace.traced()
 def wait_for_instance(
         aws_svc, instance_id, timeout=600, state='running'):
     """ Wait for up to timeout seconds for an instance to be in the
@@ -831,6 +1017,46 @@ def wait_for_instance(
     )
 
 
+@trace.traced()
+def wait_for_instances(
+        aws_svc, instance_ids, timeout=600, state='running'):
+    """ Wait for up to timeout seconds for all of the given instances to
+    be in the given state.  The instances are described with a single call
+    every 2 seconds.
+
+    :return: a list of Instance objects
+    :raises InstanceError if a timeout occurs or an instance unexpectedly
+        goes into an error or terminated state
+    """
+    log.debug(
+        'Waiting for %s, timeout=%d, state=%s',
+        ', '.join(instance_ids), timeout, state)
+
+    deadline = Deadline(timeout)
+    while not deadline.is_expired():
+        instances = aws_svc.get_instances(*instance_ids)
+        log.debug('%s', {i.id: i.state['Name'] for i in instances})
+        for instance in instances:
+            if instance.state['Name'] == 'error':
+                raise InstanceError(
+                    'Instance %s is in an error state.  Cannot proceed.' %
+                    instance.id
+                )
+            if state != 'terminated' and \
+                    instance.state['Name'] == 'terminated':
+                raise InstanceError(
+                    'Instance %s was unexpectedly terminated.' % instance.id
+                )
+        if all(i.state['Name'] == state for i in instances):
+            return instances
+        sleep(2)
+    raise InstanceError(
+        'Timed out waiting for %s to be in the %s state' %
+        (', '.join(instance_ids), state)
+    )
+
+
+@trace.traced()
 def stop_and_wait(aws_svc, instance_id):
     """ Stop the given instance and wait for it to be in the stopped state.
     If an exception is thrown, log the error and return.
@@ -843,6 +1069,7 @@ def stop_and_wait(aws_svc, instance_id):
             'Error while waiting for instance %s to stop', instance_id)
 
 
+@trace.traced()
 def wait_for_image(aws_svc, image_id):
     log.debug('Waiting for %s to become available.', image_id)
     image = None
@@ -860,6 +1087,7 @@ def wait_for_image(aws_svc, image_id):
         'Image failed to become available (%s)' % image.state)
 
 
+@trace.traced()
 def create_encryptor_security_group(aws_svc, vpc_id=None, status_port=\
                                     encryptor_service.ENCRYPTOR_STATUS_PORT):
     sg_name = NAME_ENCRYPTOR_SECURITY_GROUP % {'nonce': make_nonce()}
@@ -880,6 +1108,7 @@ def create_encryptor_security_group(aws_svc, vpc_id=None, status_port=\
     return sg
 
 
+@trace.traced()
 def run_guest_instance(aws_svc, image_id, subnet_id=None,
                        instance_type='m4.large'):
     return aws_svc.run_instance(
@@ -892,6 +1121,7 @@ def run_guest_instance(aws_svc, image_id, subnet_id=None,
     )
 
 
+@trace.traced()
 def clean_up(aws_svc, instance_ids=None, volume_ids=None,
              snapshot_ids=None, security_group_ids=None):
     """ Clean up any resources that were created by the encryption process.
@@ -979,9 +1209,13 @@ def log_exception_console(aws_svc, e, id):
         )
 
 
-def snapshot_log_volume(aws_svc, instance_id):
+@trace.traced()
+def snapshot_log_volume(aws_svc, instance_id, wait=True):
     """ Snapshot the log volume of the given instance.
 
+    :param wait if False, return as soon as the snapshot is created.  The
+        snapshot completes in the background, even if the instance and
+        its volumes are deleted.
     :except SnapshotError if the snapshot goes into an error state
     """
 
@@ -1003,6 +1237,8 @@ def snapshot_log_volume(aws_svc, instance_id):
         'Creating snapshot %s of log volume for instance %s',
         snapshot.id, instance_id
     )
+    if not wait:
+        return snapshot
 
     try:
         wait_for_snapshots(aws_svc, snapshot.id)
@@ -1012,6 +1248,7 @@ def snapshot_log_volume(aws_svc, instance_id):
     return snapshot
 
 
+@trace.traced()
 def wait_for_volume_attached(aws_svc, instance_id, device):
     """ Wait until the device appears in the block device mapping of the
     given instance.
@@ -1063,6 +1300,7 @@ def _write_console_output(aws_svc, instance_id):
     return None
 
 
+@trace.traced()
 def wait_for_snapshots(aws_svc, *snapshot_ids):
 
     log.info(
@@ -1112,6 +1350,7 @@ def _get_snapshot_progress_text(snapshots):
     return ', '.join(elements)
 
 
+@trace.traced()
 def snapshot_root_volume(aws_svc, instance, image_id):
     """ Snapshot the root volume of the given AMI.
 
@@ -0,0 +1,253 @@
+# Copyright 2017 Bracket Computing, Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License").
+# You may not use this file except in compliance with the License.
+# A copy of the License is located at
+#
+# https://github.com/brkt/brkt-cli/blob/master/LICENSE
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Read the contents of an EBS snapshot with the EBS direct APIs.
+
+ListSnapshotBlocks returns the blocks that were written to the volume, and
+GetSnapshotBlock returns the contents of a single block.  Blocks that are
+not listed have never been written and read as zeros.  This allows the
+Metavisor logs to be copied out of a snapshot without creating a volume
+or launching an instance.
+"""
+
+import base64
+import collections
+import hashlib
+import logging
+import posixpath
+import struct
+import tarfile
+
+from brkt_cli import ufs, util
+from brkt_cli.util import BracketError
+
+log = logging.getLogger(__name__)
+
+GIB = 1024 * 1024 * 1024
+SECTOR_SIZE = 512
+
+# The maximum number of GetSnapshotBlock calls that run at the same time.
+DEFAULT_MAX_WORKERS = 16
+
+# The number of blocks that are kept in memory.  Snapshot blocks are
+# 512 KiB.
+DEFAULT_CACHE_BLOCKS = 64
+
+# The partition that holds the Metavisor logs, and the directories that
+# are copied from it.
+LOG_PARTITION = 4
+LOG_DIRECTORIES = ('log', 'crash')
+
+
+class SnapshotBlockReader(object):
+    """ A device that reads from an EBS snapshot. """
+
+    def __init__(self, ebs, snapshot_id, max_workers=DEFAULT_MAX_WORKERS,
+                 cache_blocks=DEFAULT_CACHE_BLOCKS):
+        """
+        :param ebs an EBS client, as returned by boto3.client('ebs')
+        """
+        self.ebs = ebs
+        self.snapshot_id = snapshot_id
+        self.max_workers = max_workers
+        self.cache_blocks = max(cache_blocks, max_workers)
+        self.block_size = None
+        self.volume_size = None
+        self.blocks_fetched = 0
+        self._tokens = None
+        self._cache = collections.OrderedDict()
+
+    def _list_blocks(self):
+        if self._tokens is not None:
+            return
+        tokens = {}
+        kwargs = {'SnapshotId': self.snapshot_id, 'MaxResults': 10000}
+        while True:
+            response = self.ebs.list_snapshot_blocks(**kwargs)
+            for block in response.get('Blocks', []):
+                tokens[block['BlockIndex']] = block['BlockToken']
+            self.block_size = response['BlockSize']
+            self.volume_size = response['VolumeSize'] * GIB
+            next_token = response.get('NextToken')
+            if not next_token:
+                break
+            kwargs['NextToken'] = next_token
+        log.debug(
+            'Snapshot %s has %d blocks of %d bytes', self.snapshot_id,
+            len(tokens), self.block_size)
+        self._tokens = tokens
+
+    def _fetch(self, index):
+        token = self._tokens.get(index)
+        if not token:
+            return '\0' * self.block_size
+        response = self.ebs.get_snapshot_block(
+            SnapshotId=self.snapshot_id,
+            BlockIndex=index,
+            BlockToken=token
+        )
+        data = response['BlockData'].read()
+        checksum = base64.b64encode(hashlib.sha256(data).digest())
+        if response.get('ChecksumAlgorithm') == 'SHA256' and \
+                response.get('Checksum') != checksum:
+            raise BracketError(
+                'Checksum mismatch in block %d of %s' %
+                (index, self.snapshot_id))
+        return data
+
+    def _indexes(self, offset, length):
+        first = offset // self.block_size
+        last = (offset + max(length, 1) - 1) // self.block_size
+        return range(first, last + 1)
+
+    def _load(self, indexes):
+        """ Fetch the blocks that are not in the cache, concurrently, and
+        return a dictionary of block index to data for all of the given
+        blocks.
+        """
+        self._list_blocks()
+        blocks = {}
+        missing = []
+        for index in indexes:
+            if index in self._cache:
+                blocks[index] = self._cache.pop(index)
+                self._cache[index] = blocks[index]
+            elif index not in blocks:
+                missing.append(index)
+        if missing:
+            results = util.run_concurrently(
+                [lambda i=i: self._fetch(i) for i in missing],
+                max_workers=self.max_workers
+            )
+            self.blocks_fetched += len(
+                [i for i in missing if i in self._tokens])
+            for index, data in zip(missing, results):
+                blocks[index] = data
+                self._cache[index] = data
+            while len(self._cache) > self.cache_blocks:
+                self._cache.popitem(last=False)
+        return blocks
+
+    def prefetch(self, extents):
+        """ Load the blocks for the given (offset, length) extents into
+        the cache.  No more than the cache size is loaded.
+        """
+        self._list_blocks()
+        indexes = []
+        for offset, length in extents:
+            for index in self._indexes(offset, length):
+                if index not in indexes:
+                    indexes.append(index)
+        self._load(indexes[:self.cache_blocks])
+
+    def read(self, offset, length):
+        self._list_blocks()
+        blocks = self._load(self._indexes(offset, length))
+        chunks = []
+        while length > 0:
+            index, skip = divmod(offset, self.block_size)
+            n = min(length, self.block_size - skip)
+            chunks.append(blocks[index][skip:skip + n])
+            offset += n
+            length -= n
+        return ''.join(chunks)
+
+
+def get_partition(device, number):
+    """ Return the offset and size in bytes of the given partition, from
+    the GPT or MBR partition table.  Partitions are numbered from 1.
+
+    :raise BracketError if the partition does not exist
+    """
+    mbr = device.read(0, SECTOR_SIZE)
+    if mbr[510:512] != '\x55\xaa':
+        raise BracketError('Partition table not found')
+    entries = [
+        struct.unpack_from('<4xB3xII', mbr, 446 + 16 * i) for i in range(4)
+    ]
+    if any(partition_type == 0xee for partition_type, _, _ in entries):
+        return _get_gpt_partition(device, number)
+    if not 1 <= number <= 4 or not entries[number - 1][0]:
+        raise BracketError('Partition %d not found' % number)
+    _, start, sectors = entries[number - 1]
+    return start * SECTOR_SIZE, sectors * SECTOR_SIZE
+
+
+def _get_gpt_partition(device, number):
+    header = device.read(SECTOR_SIZE, SECTOR_SIZE)
+    if header[:8] != 'EFI PART':
+        raise BracketError('Invalid GPT header')
+    entries_lba, count, entry_size = struct.unpack_from('<QII', header, 72)
+    if not 1 <= number <= count:
+        raise BracketError('Partition %d not found' % number)
+    entry = device.read(
+        entries_lba * SECTOR_SIZE + (number - 1) * entry_size, entry_size)
+    if entry[:16] == '\0' * 16:
+        raise BracketError('Partition %d not found' % number)
+    first, last = struct.unpack_from('<QQ', entry, 32)
+    return first * SECTOR_SIZE, (last - first + 1) * SECTOR_SIZE
+
+
+def add_logs(tar, device, prefix='.', partition=LOG_PARTITION,
+             directories=LOG_DIRECTORIES):
+    """ Add the log directories from the Metavisor disk to the tar file,
+    under the given prefix.  Directories that don't exist are skipped.
+
+    :param tar a TarFile that is open for writing
+    :param device the Metavisor disk, for example a SnapshotBlockReader
+    :return the number of files that were added
+    """
+    offset, _ = get_partition(device, partition)
+    fs = ufs.FileSystem(ufs.PartitionDevice(device, offset))
+    count = 0
+    for directory in directories:
+        try:
+            entries = list(fs.walk(directory))
+        except ufs.UFSError as e:
+            log.warn('Unable to read %s: %s', directory, e)
+            continue
+        for path, inode in entries:
+            info = tarfile.TarInfo(posixpath.join(prefix, path))
+            info.mtime = inode.mtime
+            info.mode = inode.mode & 07777
+            info.uid = inode.uid
+            info.gid = inode.gid
+            if inode.is_dir:
+                info.type = tarfile.DIRTYPE
+                tar.addfile(info)
+            elif inode.is_symlink:
+                info.type = tarfile.SYMTYPE
+                info.linkname = fs.readlink(inode)
+                tar.addfile(info)
+            elif inode.is_file:
+                info.size = inode.size
+                tar.addfile(info, fs.open(inode))
+                count += 1
+    return count
+
+
+def extract_logs(device, fileobj, partition=LOG_PARTITION,
+                 directories=LOG_DIRECTORIES):
+    """ Write the log directories from the Metavisor disk to fileobj, as
+    a gzipped tar file.
+
+    :return the number of files that were written
+    """
+    tar = tarfile.open(fileobj=fileobj, mode='w:gz')
+    try:
+        return add_logs(
+            tar, device, partition=partition, directories=directories)
+    finally:
+        tar.close()
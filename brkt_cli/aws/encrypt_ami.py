@@ -37,11 +37,10 @@ AWS_SECRET_ACCESS_KEY environment variables, like you would when
 running the AWS command line utility.
 """
 import logging
-import os
 
 from botocore.exceptions import ClientError
 
-from brkt_cli import encryptor_service, util
+from brkt_cli import encryptor_service, trace, util
 from brkt_cli.aws import aws_service, boto3_device
 from brkt_cli.aws.aws_constants import (
     NAME_ENCRYPTOR, DESCRIPTION_ENCRYPTOR,
@@ -57,6 +56,7 @@ from brkt_cli.aws.aws_service import (
     clean_up, log_exception_console, snapshot_log_volume,
     wait_for_volume_attached, wait_for_snapshots,
     snapshot_root_volume)
+from brkt_cli.console_tailer import ConsoleTailer, SnapshotDiffer
 from brkt_cli.instance_config import InstanceConfig
 from brkt_cli.user_data import gzip_user_data
 from brkt_cli.util import (
@@ -110,6 +110,7 @@ def _get_description_from_image(image):
     return description
 
 
+@trace.traced()
 def _run_encryptor_instance(
         aws_svc, encryptor_image_id, snapshot, root_size, guest_image_id,
         crypto_policy, security_group_ids=None, subnet_id=None, placement=None,
@@ -228,6 +229,29 @@ def _terminate_instance(aws_svc, id, name, terminated_instance_ids):
         log.warn('Could not terminate %s instance: %s', name, e)
 
 
+@trace.traced()
+def _save_encryptor_logs(aws_svc, e, instance_id):
+    """ Start a snapshot of the encryptor log volume and set
+    e.log_snapshot_id.  The snapshot is not waited for, so that the
+    encryption error is reported and cleanup starts right away.  The
+    snapshot completes in the background, and share-logs waits for it.
+    """
+    log.info('Saving logs from encryptor instance in snapshot')
+    try:
+        log_snapshot = snapshot_log_volume(aws_svc, instance_id, wait=False)
+    except Exception:
+        log.exception('Unable to snapshot the log volume of %s', instance_id)
+        return
+    e.log_snapshot_id = log_snapshot.id
+    log.info('Encryptor logs are being saved in snapshot %(snapshot_id)s. '
+             'Run `brkt aws share-logs --region %(region)s '
+             '--snapshot %(snapshot_id)s` '
+             'to share this snapshot with Bracket support' %
+             {'snapshot_id': log_snapshot.id,
+              'region': aws_svc.region})
+
+
+@trace.traced()
 def _snapshot_encrypted_instance(
         aws_svc, enc_svc_cls, encryptor_instance,
         image_id=None, vol_type=None, iops=None,
@@ -240,37 +264,33 @@ def _snapshot_encrypted_instance(
         host_ips.append(encryptor_instance.public_ip_address)
     if encryptor_instance.private_ip_address:
         host_ips.append(encryptor_instance.private_ip_address)
-        log.info('Adding %s to NO_PROXY environment variable' %
-                 encryptor_instance.private_ip_address)
-        if os.environ.get('NO_PROXY'):
-            os.environ['NO_PROXY'] += "," + \
-                encryptor_instance.private_ip_address
-        else:
-            os.environ['NO_PROXY'] = encryptor_instance.private_ip_address
 
     enc_svc = enc_svc_cls(host_ips, port=status_port)
 
+    # Watch the console in the background, so that we fail right away
+    # if Metavisor panics instead of waiting for the timeout.
+    tailer = ConsoleTailer(
+        SnapshotDiffer(
+            lambda: aws_svc.get_console_output(encryptor_instance.id)),
+        encryptor_instance.id
+    )
     try:
         log.info('Waiting for encryption service on %s (port %s on %s)',
                  encryptor_instance.id, enc_svc.port, ', '.join(host_ips))
-        encryptor_service.wait_for_encryptor_up(
-            enc_svc, Deadline(encryption_start_timeout))
-        log.info('Creating encrypted root drive.')
-        encryptor_service.wait_for_encryption(enc_svc)
+        with tailer:
+            encryptor_service.wait_for_encryptor_up(
+                enc_svc, Deadline(encryption_start_timeout),
+                check=tailer.check)
+            log.info('Creating encrypted root drive.')
+            encryptor_service.wait_for_encryption(
+                enc_svc, check=tailer.check)
     except encryptor_service.EncryptionError as e:
         # Stop the encryptor instance, to make the console log available.
         stop_and_wait(aws_svc, encryptor_instance.id)
 
         log_exception_console(aws_svc, e, encryptor_instance.id)
         if save_encryptor_logs:
-            log.info('Saving logs from encryptor instance in snapshot')
-            log_snapshot = snapshot_log_volume(aws_svc, encryptor_instance.id)
-            log.info('Encryptor logs saved in snapshot %(snapshot_id)s. '
-                     'Run `brkt share-logs --region %(region)s '
-                     '--snapshot-id %(snapshot_id)s` '
-                     'to share this snapshot with Bracket support' %
-                     {'snapshot_id': log_snapshot.id,
-                      'region': aws_svc.region})
+            _save_encryptor_logs(aws_svc, e, encryptor_instance.id)
         raise
 
     log.info('Encrypted root drive is ready.')
@@ -348,6 +368,7 @@ def _snapshot_encrypted_instance(
     return mv_root_id, new_bdm
 
 
+@trace.traced()
 def _register_ami(aws_svc, encryptor_instance, name,
                   description, mv_bdm=None, legacy=False, guest_instance=None,
                   mv_root_id=None):
@@ -441,6 +462,7 @@ def _print_bdm(context, resource):
     print context, util.pretty_print_json(resource.block_device_mappings)
 
 
+@trace.traced()
 def encrypt(aws_svc, enc_svc_cls, image_id, encryptor_ami, crypto_policy,
             encrypted_ami_name=None, subnet_id=None, security_group_ids=None,
             guest_instance_type='m4.large', instance_config=None,
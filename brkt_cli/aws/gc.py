@@ -0,0 +1,293 @@
+# Copyright 2017 Bracket Computing, Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License").
+# You may not use this file except in compliance with the License.
+# A copy of the License is located at
+#
+# https://github.com/brkt/brkt-cli/blob/master/LICENSE
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Delete the temporary resources that were left behind by brkt-cli.
+
+When brkt-cli is killed, or when cleanup fails, encryptor instances,
+volumes, snapshots and temporary security groups are left behind.  The
+resources are found with inventory.scan_regions().  An encryption session
+is considered abandoned when its most recent resource is older than the
+minimum age.  Encrypted images, the snapshots that they use and wrapped
+instances are never deleted.
+
+Instances are terminated first, in batches.  Once they have terminated,
+volumes, snapshots and security groups are deleted concurrently, at a
+limited rate.
+"""
+
+import datetime
+import logging
+
+import iso8601
+from botocore.exceptions import ClientError
+
+from brkt_cli import util
+from brkt_cli.aws import aws_service
+from brkt_cli.aws.inventory import (
+    ROLE_ENCRYPTOR,
+    ROLE_GUEST,
+    ROLE_SECURITY_GROUP,
+    ROLE_UPDATER
+)
+
+log = logging.getLogger(__name__)
+
+DEFAULT_MIN_AGE = '24h'
+MAX_PARALLEL_DELETES = 8
+DELETES_PER_SECOND = 5
+
+# The maximum number of instances that are terminated with a single
+# TerminateInstances call.
+TERMINATE_BATCH_SIZE = 100
+
+# Resources are deleted in this order, so that instances release their
+# volumes and security groups before those are deleted.
+DELETE_ORDER = ('instance', 'volume', 'snapshot', 'security-group', 'image')
+
+_TEMPORARY_INSTANCE_ROLES = (ROLE_ENCRYPTOR, ROLE_GUEST, ROLE_UPDATER)
+
+
+class GCAction(object):
+    """ Whether an inventory item will be deleted and, if not, why. """
+
+    def __init__(self, item, delete, reason=None):
+        self.item = item
+        self.delete = delete
+        self.reason = reason
+
+    def __repr__(self):
+        return '<GCAction %s %s>' % (
+            'delete' if self.delete else 'keep', self.item.id)
+
+
+def _newest_by_session(items):
+    """ Return a dictionary of session id to the creation time of the
+    session's most recent resource.
+    """
+    newest = {}
+    for item in items:
+        if not item.session_id or not item.created:
+            continue
+        current = newest.get(item.session_id)
+        if not current or item.created > current:
+            newest[item.session_id] = item.created
+    return newest
+
+
+def _format_timedelta(td):
+    hours = int(td.total_seconds() // 3600)
+    if hours and hours % 24 == 0:
+        return '%dd' % (hours // 24)
+    if hours:
+        return '%dh' % hours
+    return '%dm' % (td.total_seconds() // 60)
+
+
+def _keep_reason(item, created, cutoff, min_age, doomed_instance_ids):
+    """ Return the reason that the item must be kept, or None if it can
+    be deleted.
+    """
+    resource_type = item.resource_type
+    if resource_type == 'image':
+        return 'images are never deleted'
+    if resource_type == 'instance' and \
+            item.role not in _TEMPORARY_INSTANCE_ROLES:
+        return 'not a temporary instance'
+    if resource_type == 'security-group' and \
+            item.role != ROLE_SECURITY_GROUP:
+        return 'not a temporary security group'
+    if resource_type == 'snapshot':
+        if item.image_ids:
+            return 'used by %s' % ', '.join(item.image_ids)
+        if item.state != 'completed':
+            return 'snapshot is %s' % item.state
+    if resource_type == 'volume' and \
+            item.state not in ('available', 'in-use'):
+        return 'volume is %s' % item.state
+
+    if not created:
+        return 'unknown age'
+    if created > cutoff:
+        return 'newer than %s' % _format_timedelta(min_age)
+
+    if resource_type == 'volume':
+        attached = [
+            i for i in item.instance_ids if i not in doomed_instance_ids]
+        if attached:
+            return 'attached to %s' % ', '.join(attached)
+    return None
+
+
+def _sort_key(action):
+    item = action.item
+    return (
+        item.region,
+        DELETE_ORDER.index(item.resource_type),
+        item.session_id or '',
+        item.id
+    )
+
+
+def make_plan(items, min_age, now=None):
+    """ Decide which of the given inventory items to delete.  Resources
+    that belong to a session are as old as the session's most recent
+    resource, so that nothing is deleted while a session is still running.
+    Instances that are already terminated are left out of the plan.
+
+    :param items a list of InventoryItem
+    :param min_age a timedelta
+    :return a list of GCAction, sorted by region and deletion order
+    """
+    now = now or datetime.datetime.now(tz=iso8601.UTC)
+    cutoff = now - min_age
+    newest = _newest_by_session(items)
+
+    items = [
+        i for i in items
+        if not (i.resource_type == 'instance' and
+                i.state in ('shutting-down', 'terminated'))
+    ]
+
+    def _action(item, doomed_instance_ids=frozenset()):
+        created = item.created
+        if item.session_id:
+            created = newest.get(item.session_id)
+        reason = _keep_reason(
+            item, created, cutoff, min_age, doomed_instance_ids)
+        return GCAction(item, reason is None, reason)
+
+    # Volumes that are attached to instances that will be terminated can
+    # be deleted, so decide about the instances first.
+    actions = [_action(i) for i in items if i.resource_type == 'instance']
+    doomed_instance_ids = frozenset(a.item.id for a in actions if a.delete)
+    actions.extend(
+        _action(i, doomed_instance_ids) for i in items
+        if i.resource_type != 'instance'
+    )
+    return sorted(actions, key=_sort_key)
+
+
+def render_plan(actions):
+    """ Render the plan as a table. """
+    rows = [['ACTION', 'REGION', 'TYPE', 'ID', 'ROLE', 'SESSION', 'REASON']]
+    for action in actions:
+        item = action.item
+        rows.append([
+            'delete' if action.delete else 'keep',
+            item.region,
+            item.resource_type,
+            item.id,
+            item.role,
+            item.session_id or '-',
+            action.reason or '-'
+        ])
+    return util.render_table_rows(rows)
+
+
+def _terminate_instances(aws_svc, items, limiter):
+    """ Terminate the instances in batches and wait for them to
+    terminate.
+
+    :return a list of (InventoryItem, ClientError) for the instances that
+        could not be terminated
+    """
+    failures = []
+    terminated_ids = []
+    for start in range(0, len(items), TERMINATE_BATCH_SIZE):
+        batch = items[start:start + TERMINATE_BATCH_SIZE]
+        limiter.wait()
+        try:
+            aws_svc.terminate_instances([i.id for i in batch])
+            terminated_ids.extend(i.id for i in batch)
+        except ClientError as e:
+            log.debug('Unable to terminate instances', exc_info=1)
+            failures.extend((i, e) for i in batch)
+
+    if terminated_ids:
+        try:
+            aws_service.wait_for_instances(
+                aws_svc, terminated_ids, state='terminated')
+        except (ClientError, aws_service.InstanceError) as e:
+            # Deleting the volumes and security groups that the instances
+            # still use will fail, and those failures are reported.
+            log.warn('Error while waiting for instances to terminate: %s', e)
+    return failures
+
+
+def _collect_region(aws_svc, items, max_parallel, calls_per_second):
+    """ Delete the given resources in the region that aws_svc is
+    connected to.
+
+    :return a list of (InventoryItem, ClientError) for the resources that
+        could not be deleted
+    """
+    limiter = util.RateLimiter(calls_per_second)
+    instances = [i for i in items if i.resource_type == 'instance']
+    others = [i for i in items if i.resource_type != 'instance']
+
+    failures = []
+    if instances:
+        failures.extend(_terminate_instances(aws_svc, instances, limiter))
+
+    delete_functions = {
+        'volume': aws_svc.delete_volume,
+        'snapshot': aws_svc.delete_snapshot,
+        'security-group': aws_svc.delete_security_group
+    }
+
+    def _delete(item):
+        def _do_delete():
+            limiter.wait()
+            try:
+                delete_functions[item.resource_type](item.id)
+            except ClientError as e:
+                log.debug('Unable to delete %s', item.id, exc_info=1)
+                return e
+        return _do_delete
+
+    # Volumes, snapshots and security groups don't depend on each other,
+    # so they are deleted in a single concurrent pass.
+    errors = util.run_concurrently(
+        [_delete(item) for item in others], max_workers=max_parallel)
+    failures.extend((item, e) for item, e in zip(others, errors) if e)
+    return failures
+
+
+def collect(new_aws_svc, actions, max_parallel=MAX_PARALLEL_DELETES,
+            calls_per_second=DELETES_PER_SECOND):
+    """ Delete the resources that the plan marks for deletion.  Regions
+    are processed concurrently.  Within a region, no more than
+    max_parallel calls run at the same time, and no more than
+    calls_per_second calls are made.
+
+    :param new_aws_svc a function that takes a region name and returns a
+        BaseAWSService that is connected to that region
+    :param actions the plan returned by make_plan()
+    :return a list of (InventoryItem, ClientError) for the resources that
+        could not be deleted
+    """
+    by_region = {}
+    for action in actions:
+        if action.delete:
+            by_region.setdefault(action.item.region, []).append(action.item)
+    regions = sorted(by_region)
+
+    services = [new_aws_svc(region) for region in regions]
+    results = util.run_concurrently([
+        lambda svc=svc, region=region: _collect_region(
+            svc, by_region[region], max_parallel, calls_per_second)
+        for svc, region in zip(services, regions)
+    ])
+    return [failure for failures in results for failure in failures]
@@ -0,0 +1,73 @@
+# Copyright 2017 Bracket Computing, Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License").
+# You may not use this file except in compliance with the License.
+# A copy of the License is located at
+#
+# https://github.com/brkt/brkt-cli/blob/master/LICENSE
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and
+# limitations under the License.
+
+from brkt_cli.aws import aws_args, gc
+
+
+def setup_gc_args(parser):
+    parser.add_argument(
+        '--region',
+        metavar='NAME',
+        dest='regions',
+        action='append',
+        help=(
+            'Only collect resources in this region.  May be specified '
+            'multiple times.  By default, all regions are scanned.'
+        )
+    )
+    parser.add_argument(
+        '--min-age',
+        metavar='N[dhms]',
+        dest='min_age',
+        default=gc.DEFAULT_MIN_AGE,
+        help=(
+            'Only delete resources from encryption sessions that have not '
+            'created a resource in this amount of time (default: '
+            '%(default)s)'
+        )
+    )
+    parser.add_argument(
+        '--delete',
+        dest='delete',
+        action='store_true',
+        default=False,
+        help=(
+            'Delete the resources.  By default, the plan is printed and '
+            'nothing is deleted.'
+        )
+    )
+    parser.add_argument(
+        '--max-parallel',
+        metavar='N',
+        dest='max_parallel',
+        type=int,
+        default=gc.MAX_PARALLEL_DELETES,
+        help=(
+            'The maximum number of concurrent delete calls per region '
+            '(default: %(default)s)'
+        )
+    )
+    parser.add_argument(
+        '--rate',
+        metavar='N',
+        dest='calls_per_second',
+        type=float,
+        default=gc.DELETES_PER_SECOND,
+        help=(
+            'The maximum number of delete calls per second per region '
+            '(default: %(default)s)'
+        )
+    )
+    aws_args.add_retry_timeout(parser)
+    aws_args.add_retry_initial_sleep_seconds(parser)
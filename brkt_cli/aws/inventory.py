@@ -0,0 +1,364 @@
+# Copyright 2017 Bracket Computing, Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License").
+# You may not use this file except in compliance with the License.
+# A copy of the License is located at
+#
+# https://github.com/brkt/brkt-cli/blob/master/LICENSE
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+List the AWS resources that brkt-cli created, in all regions.
+
+A resource is considered to be created by brkt-cli if it has the
+TAG_ENCRYPTOR_SESSION_ID tag, or if its name matches one of the names
+that brkt-cli gives to temporary resources.  Each region is scanned in
+its own thread, and each resource type is listed with server-side
+filters, so that a scan only pages through the matching resources.
+"""
+
+import datetime
+import fnmatch
+import json
+import logging
+import re
+
+import iso8601
+from botocore.exceptions import ClientError
+
+from brkt_cli import util
+from brkt_cli.aws import aws_service
+from brkt_cli.aws.aws_constants import (
+    NAME_ENCRYPTED_ROOT_SNAPSHOT,
+    NAME_ENCRYPTED_ROOT_VOLUME,
+    NAME_ENCRYPTOR,
+    NAME_ENCRYPTOR_SECURITY_GROUP,
+    NAME_GUEST_CREATOR,
+    NAME_LOG_SNAPSHOT,
+    NAME_METAVISOR_ROOT_SNAPSHOT,
+    NAME_METAVISOR_ROOT_VOLUME,
+    NAME_METAVISOR_UPDATER,
+    NAME_ORIGINAL_SNAPSHOT,
+    NAME_ORIGINAL_VOLUME,
+    TAG_ENCRYPTOR_SESSION_ID
+)
+from brkt_cli.aws.aws_service import RESOURCE_TYPES
+from brkt_cli.aws.wrap_image import NAME_INSTANCE_SECURITY_GROUP
+
+log = logging.getLogger(__name__)
+
+# The maximum number of regions that are scanned at the same time.
+MAX_PARALLEL_REGIONS = 16
+
+ROLE_ENCRYPTED_IMAGE = 'encrypted-image'
+ROLE_ENCRYPTED_ROOT = 'encrypted-root'
+ROLE_ENCRYPTOR = 'encryptor'
+ROLE_GUEST = 'guest'
+ROLE_LOGS = 'logs'
+ROLE_METAVISOR_ROOT = 'metavisor-root'
+ROLE_ORIGINAL = 'original'
+ROLE_SECURITY_GROUP = 'security-group'
+ROLE_UPDATER = 'updater'
+ROLE_WRAPPED_SECURITY_GROUP = 'wrapped-security-group'
+ROLE_UNKNOWN = 'unknown'
+
+
+def _name_pattern(name):
+    """ Convert a name constant to a wildcard pattern, by replacing the
+    format fields with *.  The pattern works both as an EC2 filter value
+    and with fnmatch.
+    """
+    return re.sub(r'%\([a-z_]+\)s', '*', name)
+
+
+# The names that brkt-cli gives to the resources that it creates, by
+# resource type.  The first matching pattern determines the role.
+_NAMES = {
+    'image': [],
+    'snapshot': [
+        (_name_pattern(NAME_LOG_SNAPSHOT), ROLE_LOGS),
+        (_name_pattern(NAME_ORIGINAL_SNAPSHOT), ROLE_ORIGINAL),
+        (_name_pattern(NAME_ENCRYPTED_ROOT_SNAPSHOT), ROLE_ENCRYPTED_ROOT),
+        (_name_pattern(NAME_METAVISOR_ROOT_SNAPSHOT), ROLE_METAVISOR_ROOT),
+    ],
+    'volume': [
+        (_name_pattern(NAME_ORIGINAL_VOLUME), ROLE_ORIGINAL),
+        (_name_pattern(NAME_ENCRYPTED_ROOT_VOLUME), ROLE_ENCRYPTED_ROOT),
+        (_name_pattern(NAME_METAVISOR_ROOT_VOLUME), ROLE_METAVISOR_ROOT),
+    ],
+    'instance': [
+        (_name_pattern(NAME_ENCRYPTOR), ROLE_ENCRYPTOR),
+        (_name_pattern(NAME_GUEST_CREATOR), ROLE_GUEST),
+        (_name_pattern(NAME_METAVISOR_UPDATER), ROLE_UPDATER),
+    ],
+    'security-group': [
+        (_name_pattern(NAME_ENCRYPTOR_SECURITY_GROUP), ROLE_SECURITY_GROUP),
+        (_name_pattern(NAME_INSTANCE_SECURITY_GROUP),
+         ROLE_WRAPPED_SECURITY_GROUP),
+    ]
+}
+
+# Images are the only resources that brkt-cli tags without a name.
+_DEFAULT_ROLES = {
+    'image': ROLE_ENCRYPTED_IMAGE
+}
+
+
+class InventoryItem(object):
+    """ A resource that was created by brkt-cli. """
+
+    def __init__(self, region, resource_type, resource_id, name=None,
+                 session_id=None, role=None, created=None, state=None,
+                 instance_ids=None, image_ids=None):
+        self.region = region
+        self.resource_type = resource_type
+        self.id = resource_id
+        self.name = name
+        self.session_id = session_id
+        self.role = role or ROLE_UNKNOWN
+        self.created = created
+        self.state = state
+        # The instances that a volume is attached to.
+        self.instance_ids = instance_ids or []
+        # The images that use a snapshot.
+        self.image_ids = image_ids or []
+
+    def to_dict(self):
+        created = None
+        if self.created:
+            created = self.created.isoformat()
+        return {
+            'region': self.region,
+            'type': self.resource_type,
+            'id': self.id,
+            'name': self.name,
+            'session_id': self.session_id,
+            'role': self.role,
+            'created': created,
+            'state': self.state,
+            'instance_ids': self.instance_ids,
+            'image_ids': self.image_ids
+        }
+
+    def __repr__(self):
+        return '<InventoryItem %s %s %s>' % (
+            self.region, self.resource_type, self.id)
+
+
+def _tags_to_dict(tags):
+    return {t['Key']: t['Value'] for t in (tags or [])}
+
+
+def _resource_name(resource_type, resource, tags):
+    if resource_type == 'security-group':
+        return resource.group_name
+    if resource_type == 'image':
+        return resource.name
+    return tags.get('Name')
+
+
+def _created_time(resource_type, resource):
+    """ Return the time that the resource was created as a datetime, or
+    None if it's not available.  Security groups don't have a creation
+    time.
+    """
+    if resource_type == 'image':
+        value = getattr(resource, 'creation_date', None)
+        if value:
+            try:
+                return iso8601.parse_date(value)
+            except iso8601.ParseError:
+                log.debug('Unable to parse creation date %s', value)
+        return None
+    attr = {
+        'snapshot': 'start_time',
+        'volume': 'create_time',
+        'instance': 'launch_time'
+    }.get(resource_type)
+    if not attr:
+        return None
+    value = getattr(resource, attr, None)
+    if isinstance(value, datetime.datetime):
+        return value
+    return None
+
+
+def _state(resource_type, resource):
+    if resource_type == 'instance':
+        return resource.state['Name']
+    if resource_type == 'security-group':
+        return None
+    return resource.state
+
+
+def _attached_instance_ids(resource_type, resource):
+    if resource_type != 'volume':
+        return []
+    return [a['InstanceId'] for a in resource.attachments or []]
+
+
+def _image_ids_by_snapshot(aws_svc):
+    """ Return a dictionary of snapshot id to the ids of the images that
+    are owned by this account and use the snapshot.
+    """
+    image_ids = {}
+    for image in aws_svc.list_resources('image'):
+        for bdm in image.block_device_mappings or []:
+            snapshot_id = bdm.get('Ebs', {}).get('SnapshotId')
+            if snapshot_id:
+                image_ids.setdefault(snapshot_id, []).append(image.id)
+    return image_ids
+
+
+def get_role(resource_type, name):
+    """ Return the role that a resource with the given name plays in
+    the encryption process, or None if the name doesn't match.
+    """
+    if name:
+        for pattern, role in _NAMES[resource_type]:
+            if fnmatch.fnmatchcase(name, pattern):
+                return role
+    return _DEFAULT_ROLES.get(resource_type)
+
+
+def _name_filters(resource_type):
+    patterns = [pattern for pattern, _ in _NAMES[resource_type]]
+    if not patterns:
+        return None
+    if resource_type == 'security-group':
+        return [{'Name': 'group-name', 'Values': patterns}]
+    return [{'Name': 'tag:Name', 'Values': patterns}]
+
+
+def _list_region(aws_svc, region, resource_type):
+    """ List the resources of the given type that were created by
+    brkt-cli, in the region that aws_svc is connected to.
+    """
+    filter_lists = [
+        [{'Name': 'tag-key', 'Values': [TAG_ENCRYPTOR_SESSION_ID]}]
+    ]
+    name_filters = _name_filters(resource_type)
+    if name_filters:
+        filter_lists.append(name_filters)
+
+    # A resource that is tagged and named is returned by both queries.
+    items = {}
+    for filters in filter_lists:
+        for resource in aws_svc.list_resources(resource_type, filters):
+            if resource.id in items:
+                continue
+            tags = _tags_to_dict(resource.tags)
+            name = _resource_name(resource_type, resource, tags)
+            items[resource.id] = InventoryItem(
+                region,
+                resource_type,
+                resource.id,
+                name=name,
+                session_id=tags.get(TAG_ENCRYPTOR_SESSION_ID),
+                role=get_role(resource_type, name),
+                created=_created_time(resource_type, resource),
+                state=_state(resource_type, resource),
+                instance_ids=_attached_instance_ids(resource_type, resource)
+            )
+    return items.values()
+
+
+def scan_region(aws_svc, region):
+    """ Return the resources in the given region that were created by
+    brkt-cli, as a list of InventoryItem.  aws_svc must already be
+    connected to the region.
+    """
+    items = []
+    for resource_type in RESOURCE_TYPES:
+        items.extend(_list_region(aws_svc, region, resource_type))
+
+    # Record which snapshots are in use, so that they aren't mistaken
+    # for leftovers.
+    image_ids = _image_ids_by_snapshot(aws_svc)
+    for item in items:
+        if item.resource_type == 'snapshot':
+            item.image_ids = image_ids.get(item.id, [])
+    log.debug('Found %d resources in %s', len(items), region)
+    return items
+
+
+def _sort_key(item):
+    return (
+        item.session_id or '',
+        item.region,
+        RESOURCE_TYPES.index(item.resource_type),
+        item.created or datetime.datetime.min.replace(tzinfo=iso8601.UTC),
+        item.id
+    )
+
+
+def scan_regions(new_aws_svc, regions, max_parallel=MAX_PARALLEL_REGIONS):
+    """ Scan the given regions concurrently.
+
+    :param new_aws_svc a function that takes a region name and returns a
+        BaseAWSService that is connected to that region
+    :param regions a list of region names
+    :return a tuple of the InventoryItems, sorted so that the resources
+        from each encryption session are together, and a dictionary of
+        region name to the ClientError that prevented the region from
+        being scanned
+    """
+    services = [new_aws_svc(region) for region in regions]
+    errors = {}
+
+    def _scan(aws_svc, region):
+        def _do_scan():
+            try:
+                return scan_region(aws_svc, region)
+            except ClientError as e:
+                log.debug('Unable to scan %s', region, exc_info=1)
+                errors[region] = e
+                return []
+        return _do_scan
+
+    results = util.run_concurrently(
+        [_scan(svc, region) for svc, region in zip(services, regions)],
+        max_workers=max_parallel
+    )
+    items = [item for region_items in results for item in region_items]
+    return sorted(items, key=_sort_key), errors
+
+
+def render_table(items):
+    """ Render the items as a table, with the resources from each
+    encryption session grouped together.
+    """
+    rows = [[
+        'SESSION', 'REGION', 'TYPE', 'ID', 'ROLE', 'STATE', 'CREATED', 'NAME'
+    ]]
+    for item in items:
+        created = '-'
+        if item.created:
+            created = item.created.strftime('%Y-%m-%d %H:%M')
+        rows.append([
+            item.session_id or '-',
+            item.region,
+            item.resource_type,
+            item.id,
+            item.role,
+            item.state or '-',
+            created,
+            item.name or '-'
+        ])
+    return util.render_table_rows(rows)
+
+
+def render_json(items):
+    """ Render the items as JSON, one item per line. """
+    return '\n'.join(
+        json.dumps(item.to_dict(), sort_keys=True) for item in items)
+
+
+def get_error_message(region, e):
+    code, message = aws_service.get_code_and_message(e)
+    return 'Unable to scan %s: %s' % (region, message or code)
@@ -0,0 +1,37 @@
+# Copyright 2017 Bracket Computing, Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License").
+# You may not use this file except in compliance with the License.
+# A copy of the License is located at
+#
+# https://github.com/brkt/brkt-cli/blob/master/LICENSE
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and
+# limitations under the License.
+
+from brkt_cli.aws import aws_args
+
+
+def setup_inventory_args(parser):
+    parser.add_argument(
+        '--region',
+        metavar='NAME',
+        dest='regions',
+        action='append',
+        help=(
+            'Only scan this region.  May be specified multiple times.  '
+            'By default, all regions are scanned.'
+        )
+    )
+    parser.add_argument(
+        '--json',
+        dest='json',
+        action='store_true',
+        default=False,
+        help='Print one JSON object per resource, instead of a table'
+    )
+    aws_args.add_retry_timeout(parser)
+    aws_args.add_retry_initial_sleep_seconds(parser)
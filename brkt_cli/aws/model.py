@@ -72,6 +72,7 @@ class Image(TaggedEC2Object):
         self.ramdisk_id = None
         self.name = None
         self.description = None
+        self.creation_date = None
         self.product_codes = None  # ProductCodes()
         self.billing_products = None  # BillingProducts()
         self.block_device_mappings = list()
@@ -276,6 +277,7 @@ class SecurityGroup(TaggedEC2Object):
         self.id = id
         self.owner_id = owner_id
         self.name = name
+        self.group_name = name
         self.description = description
         self.vpc_id = None
         self.rules = None  # IPPermissionsList()
@@ -344,9 +346,11 @@ class Volume(TaggedEC2Object):
         self.id = None
         self.create_time = None
         self.status = None
+        self.state = None
         self.size = None
         self.snapshot_id = None
         self.attach_data = None
+        self.attachments = []
         self.zone = None
         self.volume_type = None
         self.iops = None
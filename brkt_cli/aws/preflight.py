@@ -0,0 +1,145 @@
+# Copyright 2017 Bracket Computing, Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License").
+# You may not use this file except in compliance with the License.
+# A copy of the License is located at
+#
+# https://github.com/brkt/brkt-cli/blob/master/LICENSE
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Validate the command line before an AWS subcommand does any work.
+
+Each validation check makes one or more AWS calls.  Checks that don't
+depend on each other run concurrently, and every failure is reported at
+once.  The region list rarely changes, so it's cached in
+~/.brkt/aws_regions.json instead of calling DescribeRegions on every run.
+"""
+
+import errno
+import json
+import logging
+import os
+import time
+
+from botocore.exceptions import ClientError
+
+from brkt_cli import util
+from brkt_cli.aws import aws_service
+from brkt_cli.config import CONFIG_DIR
+from brkt_cli.validation import ValidationError
+
+log = logging.getLogger(__name__)
+
+REGION_CACHE_PATH = os.path.join(CONFIG_DIR, 'aws_regions.json')
+REGION_CACHE_TTL = 24 * 60 * 60
+
+
+def _read_region_cache(path, ttl):
+    """ Return the cached region names, or None if the cache doesn't
+    exist, is older than ttl seconds, or can't be parsed.
+    """
+    try:
+        age = time.time() - os.path.getmtime(path)
+        if not 0 <= age < ttl:
+            return None
+        with open(path) as f:
+            names = json.load(f)
+    except (IOError, OSError) as e:
+        if e.errno != errno.ENOENT:
+            log.debug('Unable to read %s: %s', path, e)
+        return None
+    except ValueError as e:
+        log.debug('Invalid region cache %s: %s', path, e)
+        return None
+    if not isinstance(names, list):
+        return None
+    return names
+
+
+def _write_region_cache(path, names):
+    try:
+        util.write_file_atomically(path, json.dumps(names))
+    except (IOError, OSError) as e:
+        # The regions are looked up again on the next run.
+        log.debug('Unable to write region cache %s: %s', path, e)
+
+
+def get_region_names(aws_svc, cache_path=None, ttl=REGION_CACHE_TTL,
+                     refresh=False):
+    """ Return the names of the available regions.  If cache_path is
+    specified, the names are read from the cache when it's younger than
+    ttl seconds, and the cache is updated after calling DescribeRegions.
+
+    :param refresh if True, ignore the cached names
+    """
+    if cache_path and not refresh:
+        names = _read_region_cache(cache_path, ttl)
+        if names:
+            return names
+
+    names = sorted(r.name for r in aws_svc.get_regions())
+    if cache_path:
+        _write_region_cache(cache_path, names)
+    return names
+
+
+def validate_region(aws_svc, region_name, cache_path=None,
+                    ttl=REGION_CACHE_TTL):
+    """ Check that the specified region is a valid AWS region.
+
+    :raise ValidationError if the region is invalid
+    """
+    region_names = get_region_names(aws_svc, cache_path=cache_path, ttl=ttl)
+    if region_name in region_names:
+        return
+    if cache_path:
+        # The region may have been added since the cache was written.
+        region_names = get_region_names(
+            aws_svc, cache_path=cache_path, refresh=True)
+        if region_name in region_names:
+            return
+    raise ValidationError(
+        '%s does not exist.  AWS regions are %s' %
+        (region_name, ', '.join(region_names))
+    )
+
+
+def run_checks(checks, max_workers=None):
+    """ Call the given validation checks concurrently, and wait for all of
+    them to finish.  A ClientError that is raised by a check is reported
+    as a validation failure.
+
+    :param checks a list of functions that take no arguments
+    :return a list of the return values, in the same order as checks
+    :raise ValidationError if any of the checks failed.  The message
+        includes every failure.
+    """
+    def _run(check):
+        def _f():
+            try:
+                return check(), None
+            except ValidationError as e:
+                return None, e
+            except ClientError as e:
+                log.debug('', exc_info=1)
+                _, message = aws_service.get_code_and_message(e)
+                return None, ValidationError(message)
+        return _f
+
+    results = util.run_concurrently(
+        [_run(check) for check in checks], max_workers=max_workers)
+    errors = [e for _, e in results if e]
+    if len(errors) == 1:
+        raise errors[0]
+    if errors:
+        raise ValidationError(
+            'Found %d problems:\n%s' % (
+                len(errors), '\n'.join('  ' + e.message for e in errors))
+        )
+    return [result for result, _ in results]
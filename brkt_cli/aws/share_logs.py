@@ -12,59 +12,158 @@
 # License for the specific language governing permissions and
 # limitations under the License.
 
+import json
 import logging
 import os
-import boto3
 import re
-import time
+import tarfile
+import tempfile
+import urllib
 import botocore
-from brkt_cli.aws import aws_service, boto3_device
+from brkt_cli.aws import aws_service, boto3_device, ebs_snapshot
 from brkt_cli.validation import ValidationError
-from brkt_cli import util
+from brkt_cli import aws_clients, util
 
 log = logging.getLogger(__name__)
 
+# Images taken on 4/3/2017 from:
+# https://aws.amazon.com/amazon-linux-ami/
+IMAGES_BY_REGION = {
+    "us-east-1": "ami-0b33d91d",
+    "us-east-2": "ami-c55673a0",
+    "us-west-1": "ami-165a0876",
+    "us-west-2": "ami-f173cc91",
+    "ap-south-1": "ami-f9daac96",
+    "ap-northeast-2": "ami-dac312b4",
+    "ap-southeast-1": "ami-dc9339bf",
+    "ap-southeast-2": "ami-1c47407f",
+    "ap-northeast-1": "ami-56d4ad31",
+    "eu-central-1": "ami-af0fc0c0",
+    "eu-west-1": "ami-70edb016",
+    "eu-west-2": "ami-f1949e95",
+}
+
+# Device names for the Metavisor volumes that are attached to the helper
+# instance in batch mode.  The helper sees /dev/sdf as /dev/xvdf.
+BATCH_DEVICE_NAMES = (
+    ['/dev/sd%s' % c for c in 'fghijklmnopqrstuvwxyz'] +
+    ['/dev/xvdb%s' % c for c in 'abcdefghijklmnopqrs']
+)
+
+# The helper uploads this object after the logs, to signal that it's done.
+DONE_SUFFIX = '.done'
+
+# The part size for multipart uploads of the logs file.
+MULTIPART_CHUNKSIZE = '64MB'
+
+# The number of seconds between HeadObject calls while waiting for the
+# logs file, and the long polling time for SQS ReceiveMessage calls.
+WAIT_DELAY_SECONDS = 7
+SQS_WAIT_TIME_SECONDS = 20
+
+
+def _get_bucket_region(response):
+    """ Return the bucket region from a HeadBucket response or error
+    response, or None if it's not available.
+    """
+    headers = response.get('ResponseMetadata', {}).get('HTTPHeaders', {})
+    return headers.get('x-amz-bucket-region')
+
+
+def _get_created_objects(body):
+    """ Return the (bucket, key) of each object in an S3 ObjectCreated
+    event notification.  Other messages, such as s3:TestEvent, return an
+    empty list.
+    """
+    try:
+        event = json.loads(body)
+    except ValueError:
+        return []
+    objects = []
+    for record in event.get('Records', []):
+        if not record.get('eventName', '').startswith('ObjectCreated:'):
+            continue
+        s3 = record.get('s3', {})
+        objects.append((
+            s3.get('bucket', {}).get('name'),
+            urllib.unquote_plus(s3.get('object', {}).get('key', ''))
+        ))
+    return objects
+
+
+def _prepare_bucket(logs_svc, bucket, path, region):
+    """ Check the bucket and create it if necessary.
+
+    :return the S3 resource
+    """
+    s3 = logs_svc.s3_connect()
+    # Check bucket for file and bucket permissions
+    bucket_exists = logs_svc.check_bucket_file(bucket, path, region, s3)
+
+    if not bucket_exists:
+        log.info('Creating new bucket')
+        # If bucket isn't already owned create new one
+        new_bucket = logs_svc.make_bucket(bucket, region, s3)
+        # Reconnect with updated bucket list
+        s3 = logs_svc.s3_connect()
+        # Allow public write access to new bucket
+        new_bucket.Acl().put(ACL='public-read-write')
+    return s3
+
+
+def _snapshot_root_volume(aws_svc, instance_id):
+    """ Start a snapshot of the instance's root volume. """
+    # Get instance from ID
+    instance = aws_svc.get_instance(instance_id)
+    # Find name of the root device
+    root_name = instance.root_device_name
+    # Get root volume ID
+    root_dev = boto3_device.get_device(
+        instance.block_device_mappings, root_name)
+    # Create a snapshot of the root volume
+    return aws_svc.create_snapshot(
+        volume_id=root_dev['Ebs']['VolumeId'],
+        name="temp-logs-snapshot"
+    )
+
 
 def share(aws_svc=None, logs_svc=None, instance_id=None, region=None,
-          snapshot_id=None, bucket=None, path=None, subnet_id=None):
+          snapshot_id=None, bucket=None, path=None, subnet_id=None,
+          direct=False, queue_url=None):
+    """ Copy the Metavisor logs from the instance or snapshot to the S3
+    bucket.
+
+    :param direct if True, read the logs from the snapshot with the EBS
+        direct APIs, instead of launching an instance that copies them
+    :param queue_url if specified, wait for the upload to finish by
+        receiving the S3 event notification from this SQS queue, instead
+        of polling the bucket
+    """
 
     log.info('Sharing logs')
     snapshot = None
     new_instance = None
 
     try:
-        s3 = logs_svc.s3_connect()
-        # Check bucket for file and bucket permissions
-        bucket_exists = logs_svc.check_bucket_file(bucket, path, region, s3)
-
-        if not bucket_exists:
-            log.info('Creating new bucket')
-            # If bucket isn't already owned create new one
-            new_bucket = logs_svc.make_bucket(bucket, region, s3)
-            # Reconnect with updated bucket list
-            s3 = logs_svc.s3_connect()
-            # Allow public write access to new bucket
-            new_bucket.Acl().put(ACL='public-read-write')
+        s3 = _prepare_bucket(logs_svc, bucket, path, region)
 
         if not snapshot_id:
-            # Get instance from ID
-            instance = aws_svc.get_instance(instance_id)
-            # Find name of the root device
-            root_name = instance.root_device_name
-            # Get root volume ID
-            root_dev = boto3_device.get_device(
-                instance.block_device_mappings, root_name)
-            # Create a snapshot of the root volume
-            snapshot = aws_svc.create_snapshot(
-                volume_id=root_dev['Ebs']['VolumeId'],
-                name="temp-logs-snapshot"
-            )
+            snapshot = _snapshot_root_volume(aws_svc, instance_id)
             # Wait for snapshot to post
             log.info('Waiting for snapshot...')
             aws_service.wait_for_snapshots(aws_svc, snapshot.id)
 
         else:  # Taking logs from a snapshot
             snapshot = aws_svc.get_snapshot(snapshot_id)
+            if snapshot.state != 'completed':
+                # The log snapshot that is saved when encryption fails is
+                # not waited for.
+                log.info('Waiting for snapshot...')
+                aws_service.wait_for_snapshots(aws_svc, snapshot.id)
+
+        if direct:
+            _share_direct(logs_svc, snapshot.id, bucket, path, region, s3)
+            return
 
         # Split path name into path and file
         os.path.split(path)
@@ -90,23 +189,6 @@ def share(aws_svc=None, logs_svc=None, instance_id=None, region=None,
         )
         bdm = [mv_disk]
 
-        # Images taken on 4/3/2017 from:
-        # https://aws.amazon.com/amazon-linux-ami/
-        IMAGES_BY_REGION = {
-            "us-east-1": "ami-0b33d91d",
-            "us-east-2": "ami-c55673a0",
-            "us-west-1": "ami-165a0876",
-            "us-west-2": "ami-f173cc91",
-            "ap-south-1": "ami-f9daac96",
-            "ap-northeast-2": "ami-dac312b4",
-            "ap-southeast-1": "ami-dc9339bf",
-            "ap-southeast-2": "ami-1c47407f",
-            "ap-northeast-1": "ami-56d4ad31",
-            "eu-central-1": "ami-af0fc0c0",
-            "eu-west-1": "ami-70edb016",
-            "eu-west-2": "ami-f1949e95",
-        }
-
         image_id = IMAGES_BY_REGION[region]
 
         # Launch new instance, with volume and startup script
@@ -121,7 +203,8 @@ def share(aws_svc=None, logs_svc=None, instance_id=None, region=None,
 
         # wait for file to upload
         log.info('Waiting for file to upload')
-        logs_svc.wait_bucket_file(bucket, path, region, s3)
+        _wait_for_upload(logs_svc, bucket, path, region, s3, queue_url)
+        _log_url(region, bucket, path)
         log.info('Deleting new snapshot and instance')
 
     finally:
@@ -132,21 +215,228 @@ def share(aws_svc=None, logs_svc=None, instance_id=None, region=None,
             aws_service.clean_up(aws_svc, snapshot_ids=[snapshot.id])
 
 
+def _share_direct(logs_svc, snapshot_id, bucket, path, region, s3):
+    """ Read the logs from the snapshot locally and upload them to the
+    bucket.
+    """
+    log.info('Reading logs from %s', snapshot_id)
+    reader = ebs_snapshot.SnapshotBlockReader(
+        logs_svc.ebs_connect(region), snapshot_id)
+    with tempfile.NamedTemporaryFile(suffix='.tar.gz') as f:
+        count = ebs_snapshot.extract_logs(reader, f)
+        f.flush()
+        log.debug(
+            'Copied %d files, fetched %d blocks', count,
+            reader.blocks_fetched)
+        log.info('Uploading logs')
+        logs_svc.upload_file(f.name, bucket, path, s3)
+    _log_url(region, bucket, path)
+
+
+def _wait_for_upload(logs_svc, bucket, path, region, s3, queue_url,
+                     attempts=40):
+    if queue_url:
+        logs_svc.wait_bucket_event(
+            queue_url, bucket, path, region,
+            timeout=attempts * WAIT_DELAY_SECONDS)
+    else:
+        logs_svc.wait_bucket_file(bucket, path, region, s3, attempts=attempts)
+
+
+def _log_url(region, bucket, path):
+    log.info('Logs available at https://s3-%s.amazonaws.com/%s/%s',
+             region, bucket, path)
+
+
+def _make_batch_script(sources, bucket, path):
+    """ Return the startup script for the helper instance in batch mode.
+
+    :param sources a list of (source id, device name)
+    """
+    acl = '--no-sign-request --acl public-read-write'
+    lines = ['#!/bin/bash', 'cd /mnt', 'touch status.txt']
+    tar_paths = ['./status.txt']
+    for source_id, device_name in sources:
+        # Amazon Linux exposes /dev/sdX as /dev/xvdX.  The logs are on the
+        # fourth partition.
+        device = device_name.replace('/dev/sd', '/dev/xvd')
+        lines.append(
+            'mkdir -p %(id)s && '
+            'mount -t ufs -o ro,ufstype=ufs2 %(device)s4 %(id)s && '
+            'echo "%(id)s ok" >> status.txt || '
+            'echo "%(id)s failed" >> status.txt' %
+            {'id': source_id, 'device': device}
+        )
+        tar_paths.extend(['./%s/log' % source_id, './%s/crash' % source_id])
+    lines.extend([
+        'tar czf /tmp/logs.tar.gz --ignore-failed-read %s' %
+        ' '.join(tar_paths),
+        'aws configure set default.s3.multipart_threshold %s' %
+        MULTIPART_CHUNKSIZE,
+        'aws configure set default.s3.multipart_chunksize %s' %
+        MULTIPART_CHUNKSIZE,
+        'aws s3 cp /tmp/logs.tar.gz s3://%s/%s %s' % (bucket, path, acl),
+        # Signal completion with a single small object, after the logs
+        # file upload has finished.
+        'aws s3 cp status.txt s3://%s/%s%s %s' % (
+            bucket, path, DONE_SUFFIX, acl),
+    ])
+    return '\n'.join(lines) + '\n'
+
+
+def share_batch(aws_svc=None, logs_svc=None, instance_ids=None,
+                snapshot_ids=None, region=None, bucket=None, path=None,
+                subnet_id=None, direct=False, queue_url=None):
+    """ Copy the Metavisor logs from several instances or snapshots to a
+    single file in the S3 bucket.  The root volumes of the instances are
+    snapshotted at the same time.  The snapshots are then attached to a
+    single helper instance, which uploads the logs in one tar file with a
+    directory for each instance or snapshot.  With direct=True, the logs
+    are read with the EBS direct APIs and no instance is launched.
+
+    Snapshots that are passed in snapshot_ids are not deleted.
+    """
+    instance_ids = instance_ids or []
+    snapshot_ids = snapshot_ids or []
+    if len(instance_ids) + len(snapshot_ids) > len(BATCH_DEVICE_NAMES):
+        raise ValidationError(
+            'Logs can be shared from at most %d instances and snapshots' %
+            len(BATCH_DEVICE_NAMES))
+
+    log.info('Sharing logs from %d instances and snapshots',
+             len(instance_ids) + len(snapshot_ids))
+    new_snapshot_ids = []
+    new_instance = None
+
+    try:
+        s3 = _prepare_bucket(logs_svc, bucket, path, region)
+
+        # CreateSnapshot returns immediately, so all of the snapshots are
+        # in progress at the same time.
+        sources = []
+        for instance_id in instance_ids:
+            snapshot = _snapshot_root_volume(aws_svc, instance_id)
+            new_snapshot_ids.append(snapshot.id)
+            sources.append((instance_id, snapshot))
+        for snapshot_id in snapshot_ids:
+            sources.append((snapshot_id, aws_svc.get_snapshot(snapshot_id)))
+        pending_ids = [
+            s.id for _, s in sources
+            if s.id in new_snapshot_ids or s.state != 'completed'
+        ]
+        if pending_ids:
+            log.info('Waiting for snapshots...')
+            aws_service.wait_for_snapshots(aws_svc, *pending_ids)
+
+        if direct:
+            _share_direct_batch(logs_svc, sources, bucket, path, region, s3)
+            return
+
+        bdm = []
+        script_sources = []
+        for (source_id, snapshot), device_name in zip(
+                sources, BATCH_DEVICE_NAMES):
+            bdm.append(boto3_device.make_device(
+                device_name=device_name,
+                volume_type='gp2',
+                snapshot_id=snapshot.id,
+                delete_on_termination=True,
+                volume_size=snapshot.volume_size
+            ))
+            script_sources.append((source_id, device_name))
+
+        new_instance = aws_svc.run_instance(
+            IMAGES_BY_REGION[region], instance_type='m4.large',
+            block_device_mappings=bdm,
+            user_data=_make_batch_script(script_sources, bucket, path),
+            ebs_optimized=False, subnet_id=subnet_id)
+        log.info('Waiting for instance...')
+        aws_service.wait_for_instance(aws_svc, new_instance.id)
+
+        log.info('Waiting for file to upload')
+        _wait_for_upload(
+            logs_svc, bucket, path + DONE_SUFFIX, region, s3, queue_url,
+            attempts=40 + 5 * len(sources))
+        _log_url(region, bucket, path)
+    finally:
+        aws_service.clean_up(
+            aws_svc,
+            instance_ids=[new_instance.id] if new_instance else None,
+            snapshot_ids=new_snapshot_ids
+        )
+
+
+def _share_direct_batch(logs_svc, sources, bucket, path, region, s3):
+    """ Read the logs from each snapshot locally, into a single tar file
+    with a directory for each source, and upload it to the bucket.
+    """
+    ebs = logs_svc.ebs_connect(region)
+    with tempfile.NamedTemporaryFile(suffix='.tar.gz') as f:
+        tar = tarfile.open(fileobj=f, mode='w:gz')
+        try:
+            for source_id, snapshot in sources:
+                log.info('Reading logs from %s', snapshot.id)
+                reader = ebs_snapshot.SnapshotBlockReader(ebs, snapshot.id)
+                try:
+                    ebs_snapshot.add_logs(
+                        tar, reader, prefix='./' + source_id)
+                except util.BracketError as e:
+                    log.error(
+                        'Unable to read logs from %s: %s', source_id, e)
+        finally:
+            tar.close()
+        f.flush()
+        log.info('Uploading logs')
+        logs_svc.upload_file(f.name, bucket, path, s3)
+    _log_url(region, bucket, path)
+
+
 class ShareLogsService():
 
-    def wait_bucket_file(self, bucket, path, region, s3):
-        bucket = s3.Bucket(bucket)
-        for i in range(40):
-            try:
-                bucket.Object(path).get()
-                log.info('Logs available at https://s3-%s.amazonaws.com/%s/%s'
-                    % (region, bucket.name, path))
-                return
-            except botocore.exceptions.ClientError as e:
-                if e.response['Error']['Code'] == 'NoSuchKey':
-                    time.sleep(7)
-                else:
-                    raise
+    def wait_bucket_file(self, bucket, path, region, s3, attempts=40):
+        """ Wait for the object to exist, with HeadObject calls.
+
+        :raise BracketError if the object doesn't exist after the given
+            number of attempts
+        """
+        waiter = s3.meta.client.get_waiter('object_exists')
+        try:
+            waiter.wait(
+                Bucket=bucket,
+                Key=path,
+                WaiterConfig={
+                    'Delay': WAIT_DELAY_SECONDS,
+                    'MaxAttempts': attempts
+                }
+            )
+        except botocore.exceptions.WaiterError as e:
+            log.debug('Object %s not found: %s', path, e)
+            raise util.BracketError("Can't upload logs file")
+
+    def wait_bucket_event(self, queue_url, bucket, path, region,
+                          timeout=WAIT_DELAY_SECONDS * 40):
+        """ Wait for the ObjectCreated event for the object to arrive on
+        the SQS queue.  The bucket must already be configured to send
+        s3:ObjectCreated:* notifications to the queue.  Messages for other
+        objects are left on the queue.
+
+        :raise BracketError if the event doesn't arrive before the timeout
+        """
+        sqs = self.sqs_connect(region)
+        deadline = util.Deadline(timeout)
+        while not deadline.is_expired():
+            response = sqs.receive_message(
+                QueueUrl=queue_url,
+                MaxNumberOfMessages=10,
+                WaitTimeSeconds=SQS_WAIT_TIME_SECONDS
+            )
+            for message in response.get('Messages', []):
+                if (bucket, path) in _get_created_objects(message['Body']):
+                    sqs.delete_message(
+                        QueueUrl=queue_url,
+                        ReceiptHandle=message['ReceiptHandle']
+                    )
+                    return
         raise util.BracketError("Can't upload logs file")
 
     def make_bucket(self, bucket, region, s3):
@@ -155,39 +445,58 @@ class ShareLogsService():
                     'LocationConstraint': region})
 
     def check_bucket_file(self, bucket, path, region, s3):
-        # go through all owned buckets
-        for b in s3.buckets.all():
-            # Check if users owns a bucket matching input
-            if bucket == b.name:
-                try:
-                    s3.meta.client.head_bucket(Bucket=bucket)
-                except botocore.exceptions.ClientError as e:
-                    code = int(e.response['Error']['Code'])
-                    # If bucket is owned, but in wrong region
-                    if code == 400:
-                        raise ValidationError("Bucket must be in %s" % region)
-                    raise
-                # check for a matching file in bucket
-                for file in b.objects.all():
-                    if file.key == path:
-                        raise ValidationError(
-                            "File already exists, delete and retry")
-                # check that everyone has write access to bucket
-                acl = b.Acl()
-                for grant in acl.grants:
-                    if grant['Grantee']['Type'] == 'CanonicalUser':
-                        continue
-                    uri = grant['Grantee']['URI']
-                    perm = grant['Permission']
-                    if perm == 'WRITE' and uri == 'http:' + \
-                        '//acs.amazonaws.com/groups/global/AllUsers':
-                        # check that file name is valid
-                        self.validate_file_name(path)
-                        return True
-                    else:
-                        raise ValidationError("Bucket permissions invalid:" +
-                            "Everyone must have 'Write' object access")
-        return False
+        """ Check that the bucket can be used for sharing logs, and that
+        the logs file doesn't already exist.  The bucket and the file are
+        checked with HeadBucket and HeadObject, so the check doesn't
+        depend on the number of buckets or objects.
+
+        :return True if the bucket exists, False if it needs to be created
+        :raise ValidationError if the bucket or file can't be used
+        """
+        client = s3.meta.client
+        try:
+            response = client.head_bucket(Bucket=bucket)
+        except botocore.exceptions.ClientError as e:
+            code = e.response['Error']['Code']
+            if code in ('404', 'NoSuchBucket'):
+                return False
+            # If bucket is owned, but in wrong region
+            if _get_bucket_region(e.response) not in (None, region) or \
+                    code in ('301', '400'):
+                raise ValidationError("Bucket must be in %s" % region)
+            if code in ('403', 'AccessDenied'):
+                raise ValidationError(
+                    'Bucket %s is owned by another account' % bucket)
+            raise
+        if _get_bucket_region(response) not in (None, region):
+            raise ValidationError("Bucket must be in %s" % region)
+
+        # check for a matching file in bucket
+        try:
+            client.head_object(Bucket=bucket, Key=path)
+        except botocore.exceptions.ClientError as e:
+            if e.response['Error']['Code'] not in ('404', 'NoSuchKey'):
+                raise
+        else:
+            raise ValidationError("File already exists, delete and retry")
+
+        # check that everyone has write access to bucket
+        acl = s3.Bucket(bucket).Acl()
+        for grant in acl.grants:
+            if grant['Grantee']['Type'] == 'CanonicalUser':
+                continue
+            uri = grant['Grantee']['URI']
+            perm = grant['Permission']
+            if perm == 'WRITE' and uri == 'http:' + \
+                '//acs.amazonaws.com/groups/global/AllUsers':
+                # check that file name is valid
+                self.validate_file_name(path)
+                return True
+            else:
+                raise ValidationError("Bucket permissions invalid:" +
+                    "Everyone must have 'Write' object access")
+        raise ValidationError("Bucket permissions invalid:" +
+            "Everyone must have 'Write' object access")
 
     def validate_file_name(self, path):
         """
@@ -203,4 +512,17 @@ class ShareLogsService():
         return 0
 
     def s3_connect(self):
-        return boto3.resource('s3')
+        return aws_clients.resource('s3')
+
+    def ebs_connect(self, region):
+        return aws_clients.client('ebs', region_name=region)
+
+    def sqs_connect(self, region):
+        return aws_clients.client('sqs', region_name=region)
+
+    def upload_file(self, filename, bucket, path, s3):
+        # upload_file() switches to a multipart upload for large files.
+        # Use the same ACL as the uploads from the helper instance, so
+        # that the logs can be read from the URL that we print.
+        s3.Bucket(bucket).upload_file(
+            filename, path, ExtraArgs={'ACL': 'public-read-write'})
@@ -19,14 +19,23 @@ def setup_share_logs_args(parser, parsed_config):
     parser.add_argument(
         '--snapshot',
         metavar='ID',
-        dest='snapshot_id',
-        help='The snapshot with Bracket system logs to be shared'
+        dest='snapshot_ids',
+        action='append',
+        help=(
+            'The snapshot with Bracket system logs to be shared.  May be '
+            'specified multiple times'
+        )
     )
     parser.add_argument(
         '--instance',
         metavar='ID',
-        dest='instance_id',
-        help='The instance with Bracket system logs to be shared'
+        dest='instance_ids',
+        action='append',
+        help=(
+            'The instance with Bracket system logs to be shared.  May be '
+            'specified multiple times, to share the logs from all of the '
+            'instances in a single file'
+        )
     )
     parser.add_argument(
         '--region',
@@ -56,6 +65,24 @@ def setup_share_logs_args(parser, parsed_config):
         help='Launch instances in this subnet',
         required=False
     )
+    parser.add_argument(
+        '--direct',
+        action='store_true',
+        help=(
+            'Read the logs directly from the snapshot with the EBS direct '
+            'APIs, instead of launching an instance to copy them'
+        )
+    )
+    parser.add_argument(
+        '--sqs-queue',
+        metavar='URL',
+        dest='queue_url',
+        help=(
+            'Wait for the logs file with the S3 event notifications that '
+            'the bucket sends to this SQS queue, instead of polling the '
+            'bucket'
+        )
+    )
     aws_args.add_no_validate(parser)
     aws_args.add_retry_timeout(parser)
     aws_args.add_retry_initial_sleep_seconds(parser)
@@ -11,12 +11,16 @@
 # CONDITIONS OF ANY KIND, either express or implied. See the
 # License for the specific language governing permissions and
 # limitations under the License.
+import os
+import shutil
+import tempfile
+import time
 import unittest
 
 import brkt_cli
 import brkt_cli.aws
 import brkt_cli.util
-from brkt_cli.aws import test_aws_service, boto3_device, boto3_tag
+from brkt_cli.aws import preflight, test_aws_service, boto3_device, boto3_tag
 from brkt_cli.aws.aws_constants import (
     TAG_ENCRYPTOR, TAG_ENCRYPTOR_AMI, TAG_ENCRYPTOR_SESSION_ID
 )
@@ -263,3 +267,104 @@ class TestValidation(unittest.TestCase):
         # Bogus region.
         with self.assertRaises(ValidationError):
             brkt_cli.aws._validate_region(aws_svc, 'foobar')
+
+    def test_validate_reports_all_errors(self):
+        """ Test that _validate() reports every failure at once. """
+        aws_svc, encryptor_image, guest_image = build_aws_service()
+        guest_image.name = 'My image'
+        subnet = Subnet()
+        subnet.id = 'subnet-' + new_id()
+        subnet.vpc_id = 'vpc-1'
+        aws_svc.subnets[subnet.id] = subnet
+        sg = aws_svc.create_security_group('test', 'test', vpc_id='vpc-2')
+
+        with self.assertRaises(ValidationError) as cm:
+            brkt_cli.aws._validate(
+                aws_svc,
+                guest_image.id,
+                encrypted_ami_name=guest_image.name,
+                subnet_id=subnet.id,
+                security_group_ids=[sg.id]
+            )
+        message = cm.exception.message
+        self.assertTrue(message.startswith('Found 3 problems'))
+        self.assertIn('already own an image named My image', message)
+        self.assertIn('must be in the same VPC', message)
+        self.assertIn('is not a Bracket Encryptor image', message)
+
+
+class TestPreflight(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.cache_path = os.path.join(self.tmpdir, 'aws_regions.json')
+        self.aws_svc = test_aws_service.DummyAWSService()
+        self.describe_count = 0
+        get_regions = self.aws_svc.get_regions
+
+        def _get_regions():
+            self.describe_count += 1
+            return get_regions()
+        self.aws_svc.get_regions = _get_regions
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_region_cache(self):
+        """ Test that the region list is read from the cache until it
+        expires.
+        """
+        preflight.validate_region(
+            self.aws_svc, 'us-west-2', cache_path=self.cache_path)
+        preflight.validate_region(
+            self.aws_svc, 'eu-west-1', cache_path=self.cache_path)
+        self.assertEqual(1, self.describe_count)
+        self.assertEqual(
+            ['eu-west-1', 'us-west-2'],
+            preflight.get_region_names(
+                self.aws_svc, cache_path=self.cache_path))
+
+        # Expire the cache.
+        mtime = time.time() - preflight.REGION_CACHE_TTL - 1
+        os.utime(self.cache_path, (mtime, mtime))
+        preflight.validate_region(
+            self.aws_svc, 'us-west-2', cache_path=self.cache_path)
+        self.assertEqual(2, self.describe_count)
+
+    def test_region_cache_refresh(self):
+        """ Test that the cache is refreshed when the region isn't in it,
+        and that a bogus region is still rejected.
+        """
+        preflight.validate_region(
+            self.aws_svc, 'us-west-2', cache_path=self.cache_path)
+        self.aws_svc.regions.append(
+            brkt_cli.aws.model.RegionInfo(name='ap-south-1'))
+        preflight.validate_region(
+            self.aws_svc, 'ap-south-1', cache_path=self.cache_path)
+        self.assertEqual(2, self.describe_count)
+
+        with self.assertRaises(ValidationError):
+            preflight.validate_region(
+                self.aws_svc, 'foobar', cache_path=self.cache_path)
+
+    def test_invalid_cache(self):
+        with open(self.cache_path, 'w') as f:
+            f.write('not json')
+        preflight.validate_region(
+            self.aws_svc, 'us-west-2', cache_path=self.cache_path)
+        self.assertEqual(1, self.describe_count)
+
+    def test_run_checks(self):
+        """ Test that run_checks() returns the results in order, and
+        converts ClientError to ValidationError.
+        """
+        self.assertEqual(
+            [1, 2], preflight.run_checks([lambda: 1, lambda: 2]))
+
+        def _client_error():
+            raise test_aws_service.new_client_error(
+                'InvalidSubnetID.NotFound', 'Subnet not found')
+
+        with self.assertRaises(ValidationError) as cm:
+            preflight.run_checks([lambda: 1, _client_error])
+        self.assertEqual('Subnet not found', cm.exception.message)
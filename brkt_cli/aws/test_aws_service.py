@@ -11,12 +11,15 @@
 # CONDITIONS OF ANY KIND, either express or implied. See the
 # License for the specific language governing permissions and
 # limitations under the License.
+import fnmatch
 import logging
 import ssl
 import unittest
 import uuid
 
+import boto3
 from botocore.exceptions import ClientError
+from botocore.stub import Stubber
 
 import brkt_cli
 import brkt_cli.aws
@@ -64,6 +67,28 @@ class RunInstanceArgs(object):
         self.instance_profile_name = None
 
 
+def _matches_filters(resource, filters):
+    """ Return True if the resource matches all of the given Describe
+    filters.  Only the tag-key, tag:<key> and group-name filters are
+    supported.
+    """
+    tags = {t['Key']: t['Value'] for t in resource.tags}
+    for f in filters:
+        if f['Name'] == 'tag-key':
+            values = tags.keys()
+        elif f['Name'].startswith('tag:'):
+            key = f['Name'][len('tag:'):]
+            values = [tags[key]] if key in tags else []
+        elif f['Name'] == 'group-name':
+            values = [resource.group_name]
+        else:
+            raise Exception('Unsupported filter: %s' % f['Name'])
+        if not any(fnmatch.fnmatchcase(value, pattern)
+                   for value in values for pattern in f['Values']):
+            return False
+    return True
+
+
 class DummyAWSService(aws_service.BaseAWSService):
 
     def __init__(self):
@@ -125,9 +150,62 @@ class DummyAWSService(aws_service.BaseAWSService):
                      instance_profile_name=None,
                      name=None,
                      description=None):
+        instance = self._new_instance(
+            image_id,
+            security_group_ids=security_group_ids,
+            instance_type=instance_type,
+            placement=placement,
+            subnet_id=subnet_id,
+            user_data=user_data,
+            ebs_optimized=ebs_optimized,
+            instance_profile_name=instance_profile_name
+        )
+        self.create_tags(instance.id, name=name, description=description)
+        return instance
+
+    def run_instances(self,
+                      image_id,
+                      count,
+                      security_group_ids=None,
+                      instance_type='c4.xlarge',
+                      placement=None,
+                      block_device_mappings=None,
+                      subnet_ids=None,
+                      user_data=None,
+                      ebs_optimized=True,
+                      instance_profile_name=None,
+                      name=None,
+                      description=None):
+        subnet_ids = subnet_ids or [None]
+        instances = []
+        for n in range(count):
+            instances.append(self._new_instance(
+                image_id,
+                security_group_ids=security_group_ids,
+                instance_type=instance_type,
+                placement=placement,
+                subnet_id=subnet_ids[n % len(subnet_ids)],
+                user_data=user_data,
+                ebs_optimized=ebs_optimized,
+                instance_profile_name=instance_profile_name
+            ))
+        self.create_tags(
+            [i.id for i in instances], name=name, description=description)
+        return instances
+
+    def _new_instance(self,
+                      image_id,
+                      security_group_ids=None,
+                      instance_type='c4.xlarge',
+                      placement=None,
+                      subnet_id=None,
+                      user_data=None,
+                      ebs_optimized=True,
+                      instance_profile_name=None):
         instance = Instance()
         instance.id = 'i-' + new_id()
         instance.image_id = image_id
+        instance.subnet_id = subnet_id
         instance.root_device_name = '/dev/sda1'
         instance.state['Name'] = 'pending'
         instance.state['Code'] = 0
@@ -164,8 +242,6 @@ class DummyAWSService(aws_service.BaseAWSService):
             args.instance_profile_name = instance_profile_name
             self.run_instance_callback(args)
 
-        self.create_tags(instance.id, name=name, description=description)
-
         return instance
 
     def get_instance(self, instance_id, retry=True):
@@ -186,14 +262,23 @@ class DummyAWSService(aws_service.BaseAWSService):
                 self.transition_to_running[instance_id] = True
         return instance
 
+    def get_instances(self, *instance_ids):
+        return [self.get_instance(id) for id in instance_ids]
+
     def create_tags(self, resource_id, name=None, description=None):
         if self.create_tags_callback:
             self.create_tags_callback(resource_id, name, description)
 
+        if isinstance(resource_id, basestring):
+            resource_ids = [resource_id]
+        else:
+            resource_ids = resource_id
         for resources in (
             self.instances, self.images, self.snapshots, self.volumes
         ):
-            if resource_id in resources:
+            for resource_id in resource_ids:
+                if resource_id not in resources:
+                    continue
                 r = resources[resource_id]
                 for key, value in self.default_tags.iteritems():
                     boto3_tag.set_value(r.tags, key, value)
@@ -201,7 +286,6 @@ class DummyAWSService(aws_service.BaseAWSService):
                     boto3_tag.set_value(r.tags, 'Name', name)
                 if description:
                     boto3_tag.set_value(r.tags, 'Description', description)
-        pass
 
     def stop_instance(self, instance_id):
         instance = self.instances[instance_id]
@@ -227,6 +311,10 @@ class DummyAWSService(aws_service.BaseAWSService):
         instance.state['Name'] = 'terminated'
         return instance
 
+    def terminate_instances(self, instance_ids):
+        for instance_id in instance_ids:
+            self.terminate_instance(instance_id)
+
     def get_volume(self, volume_id):
         volume = self.volumes[volume_id]
         if self.get_volume_callback:
@@ -242,6 +330,17 @@ class DummyAWSService(aws_service.BaseAWSService):
     def get_snapshots(self, *snapshot_ids):
         return [self.get_snapshot(id) for id in snapshot_ids]
 
+    def list_resources(self, resource_type, filters=None):
+        resources = {
+            'image': self.images,
+            'snapshot': self.snapshots,
+            'volume': self.volumes,
+            'instance': self.instances,
+            'security-group': self.security_groups
+        }[resource_type]
+        return [r for r in resources.values()
+                if _matches_filters(r, filters or [])]
+
     def get_snapshot(self, snapshot_id):
         snapshot = self.snapshots[snapshot_id]
 
@@ -387,7 +486,7 @@ class DummyAWSService(aws_service.BaseAWSService):
     def create_security_group(self, name, description, vpc_id=None):
         if self.create_security_group_callback:
             self.create_security_group_callback(vpc_id)
-        sg = SecurityGroup()
+        sg = SecurityGroup(name=name, description=description)
         sg.id = 'sg-%s' % new_id()
         sg.vpc_id = vpc_id or self.default_vpc.id
         self.security_groups[sg.id] = sg
@@ -651,3 +750,88 @@ class TestSnapshotProgress(unittest.TestCase):
             '1: 25%, 2: 50%',
             aws_service._get_snapshot_progress_text([s1, s2])
         )
+
+
+class TestDescribeCollections(unittest.TestCase):
+    """ Test that AWSService lists resources with paginated Describe
+    calls, and doesn't load each resource individually.  The Stubber fails
+    the test if an unexpected API call is made.
+    """
+
+    def setUp(self):
+        brkt_cli.util.SLEEP_ENABLED = False
+        self.aws_svc = aws_service.AWSService(new_id())
+        self.aws_svc.ec2 = boto3.resource('ec2', region_name='us-west-2')
+        self.stubber = Stubber(self.aws_svc.ec2.meta.client)
+        self.stubber.activate()
+
+    def tearDown(self):
+        self.stubber.deactivate()
+
+    def test_get_volumes(self):
+        filters = [{'Name': 'tag:SessionId', 'Values': ['123']}]
+        page_size = aws_service.DESCRIBE_VOLUMES_PAGE_SIZE
+        self.stubber.add_response(
+            'describe_volumes',
+            {'Volumes': [{'VolumeId': 'vol-1', 'Size': 8}],
+             'NextToken': 'page-2'},
+            {'Filters': filters, 'MaxResults': page_size}
+        )
+        self.stubber.add_response(
+            'describe_volumes',
+            {'Volumes': [{'VolumeId': 'vol-2', 'Size': 16}]},
+            {'Filters': filters, 'MaxResults': page_size,
+             'NextToken': 'page-2'}
+        )
+        volumes = self.aws_svc.get_volumes(
+            tag_key='SessionId', tag_value='123')
+        self.assertEqual(
+            [('vol-1', 8), ('vol-2', 16)],
+            [(v.id, v.size) for v in volumes]
+        )
+        self.stubber.assert_no_pending_responses()
+
+    def test_get_snapshots(self):
+        self.stubber.add_response(
+            'describe_snapshots',
+            {'Snapshots': [
+                {'SnapshotId': 'snap-1', 'State': 'completed'},
+                {'SnapshotId': 'snap-2', 'State': 'pending'}
+            ]},
+            {'SnapshotIds': ['snap-1', 'snap-2']}
+        )
+        snapshots = self.aws_svc.get_snapshots('snap-1', 'snap-2')
+        self.assertEqual(
+            ['completed', 'pending'], [s.state for s in snapshots])
+        self.stubber.assert_no_pending_responses()
+
+    def test_get_snapshots_empty(self):
+        """ Test that we don't list every snapshot when no IDs are
+        specified.
+        """
+        self.assertEqual([], self.aws_svc.get_snapshots())
+
+    def test_get_images(self):
+        self.stubber.add_response(
+            'describe_images',
+            {'Images': [{'ImageId': 'ami-1', 'Name': 'my-image'}]},
+            {'Owners': ['self'],
+             'Filters': [{'Name': 'name', 'Values': ['my-image']}]}
+        )
+        images = self.aws_svc.get_images(name='my-image', owner_alias='self')
+        self.assertEqual(['my-image'], [i.name for i in images])
+        self.stubber.assert_no_pending_responses()
+
+    def test_retry(self):
+        """ Test that the whole listing is retried when the Describe call
+        fails.
+        """
+        self.stubber.add_client_error(
+            'describe_snapshots', 'InvalidSnapshot.NotFound')
+        self.stubber.add_response(
+            'describe_snapshots',
+            {'Snapshots': [{'SnapshotId': 'snap-1', 'State': 'completed'}]},
+            {'SnapshotIds': ['snap-1']}
+        )
+        snapshots = self.aws_svc.get_snapshots('snap-1')
+        self.assertEqual(['snap-1'], [s.id for s in snapshots])
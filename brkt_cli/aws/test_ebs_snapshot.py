@@ -0,0 +1,339 @@
+# Copyright 2017 Bracket Computing, Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License").
+# You may not use this file except in compliance with the License.
+# A copy of the License is located at
+#
+# https://github.com/brkt/brkt-cli/blob/master/LICENSE
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and
+# limitations under the License.
+import base64
+import hashlib
+import struct
+import tarfile
+import threading
+import unittest
+from StringIO import StringIO
+
+from brkt_cli import ufs
+from brkt_cli.aws import ebs_snapshot
+from brkt_cli.util import BracketError
+
+BLOCK_SIZE = 512 * 1024
+
+
+class FakeEBS(object):
+    """ A stand-in for the EBS direct APIs, which serves the blocks of a
+    disk image.  Blocks that only contain zeros are not listed.
+    """
+
+    def __init__(self, data, block_size=BLOCK_SIZE, page_size=2):
+        self.block_size = block_size
+        self.page_size = page_size
+        self.blocks = {}
+        for index in range(0, (len(data) + block_size - 1) // block_size):
+            block = data[index * block_size:(index + 1) * block_size]
+            block += '\0' * (block_size - len(block))
+            if block.strip('\0'):
+                self.blocks[index] = block
+        self.get_calls = []
+        self.lock = threading.Lock()
+
+    def list_snapshot_blocks(self, SnapshotId, MaxResults=None,
+                             NextToken=None):
+        indexes = sorted(self.blocks)
+        start = int(NextToken or 0)
+        end = start + self.page_size
+        response = {
+            'Blocks': [
+                {'BlockIndex': i, 'BlockToken': 'token-%d' % i}
+                for i in indexes[start:end]
+            ],
+            'BlockSize': self.block_size,
+            'VolumeSize': 1
+        }
+        if end < len(indexes):
+            response['NextToken'] = str(end)
+        return response
+
+    def get_snapshot_block(self, SnapshotId, BlockIndex, BlockToken):
+        assert BlockToken == 'token-%d' % BlockIndex
+        with self.lock:
+            self.get_calls.append(BlockIndex)
+        data = self.blocks[BlockIndex]
+        return {
+            'BlockData': StringIO(data),
+            'Checksum': base64.b64encode(hashlib.sha256(data).digest()),
+            'ChecksumAlgorithm': 'SHA256',
+            'DataLength': len(data)
+        }
+
+
+class UFSBuilder(object):
+    """ Build a minimal UFS2 filesystem image with one cylinder group. """
+
+    BSIZE = 4096
+    FSIZE = 1024
+    FRAG = 4
+    IPG = 64
+    FPG = 4096
+    IBLKNO = 80
+
+    def __init__(self):
+        self.data = bytearray(self.FPG * self.FSIZE)
+        self.next_frag = self.IBLKNO + self.IPG * ufs.DINODE_SIZE // self.FSIZE
+        self.next_ino = ufs.ROOT_INO + 1
+
+    def _alloc(self, data):
+        """ Write the data to a new block and return its fragment address.
+        """
+        address = self.next_frag
+        self.next_frag += self.FRAG
+        offset = address * self.FSIZE
+        self.data[offset:offset + len(data)] = data
+        return address
+
+    def _write_inode(self, ino, mode, size, db=(), ib=(), link=None):
+        data = bytearray(ufs.DINODE_SIZE)
+        struct.pack_into(
+            '<HhII4xQ16xq', data, 0, mode, 1, 0, 0, size, 1500000000)
+        if link is not None:
+            data[112:112 + len(link)] = link
+        else:
+            db = list(db) + [0] * (ufs.NDADDR - len(db))
+            ib = list(ib) + [0] * (ufs.NIADDR - len(ib))
+            struct.pack_into('<12q', data, 112, *db)
+            struct.pack_into('<3q', data, 208, *ib)
+        offset = self.IBLKNO * self.FSIZE + ino * ufs.DINODE_SIZE
+        self.data[offset:offset + ufs.DINODE_SIZE] = data
+
+    def _new_ino(self):
+        ino = self.next_ino
+        self.next_ino += 1
+        return ino
+
+    def _write_data(self, ino, mode, data):
+        addresses = []
+        for start in range(0, len(data), self.BSIZE):
+            chunk = data[start:start + self.BSIZE]
+            if chunk.strip('\0'):
+                addresses.append(self._alloc(chunk))
+            else:
+                addresses.append(0)
+        db = addresses[:ufs.NDADDR]
+        ib = []
+        if len(addresses) > ufs.NDADDR:
+            pointers = addresses[ufs.NDADDR:]
+            ib = [self._alloc(struct.pack('<%dq' % len(pointers), *pointers))]
+        self._write_inode(ino, mode, len(data), db, ib)
+        return ino
+
+    def add_file(self, data):
+        return self._write_data(self._new_ino(), 0100644, data)
+
+    def add_symlink(self, target):
+        ino = self._new_ino()
+        self._write_inode(ino, 0120777, len(target), link=target)
+        return ino
+
+    def add_dir(self, entries, ino=None):
+        """ Add a directory with the given {name: inode number} entries. """
+        ino = ino or self._new_ino()
+        records = [('.', ino), ('..', ufs.ROOT_INO)] + sorted(entries.items())
+        chunks = []
+        chunk = ''
+        for name, entry_ino in records:
+            reclen = (8 + len(name) + 3) // 4 * 4
+            if len(chunk) + reclen > ufs.DIRBLKSIZ:
+                chunks.append(chunk)
+                chunk = ''
+            chunk += struct.pack(
+                '<IHBB', entry_ino, reclen, 0, len(name)) + name
+            chunk += '\0' * (reclen - 8 - len(name))
+        chunks.append(chunk)
+        data = ''.join(_pad_dir_block(chunk) for chunk in chunks)
+        return self._write_data(ino, 0040755, data)
+
+    def build(self, root_entries):
+        self.add_dir(root_entries, ino=ufs.ROOT_INO)
+        sb = bytearray(ufs.SBLOCKSIZE)
+        struct.pack_into('<i', sb, 16, self.IBLKNO)
+        struct.pack_into('<iii', sb, 48, self.BSIZE, self.FSIZE, self.FRAG)
+        struct.pack_into(
+            '<iI', sb, 116, self.BSIZE // 8, self.BSIZE // ufs.DINODE_SIZE)
+        struct.pack_into('<Ii', sb, 184, self.IPG, self.FPG)
+        struct.pack_into('<I', sb, 1372, ufs.FS_UFS2_MAGIC)
+        self.data[ufs.SBLOCK_UFS2:ufs.SBLOCK_UFS2 + len(sb)] = sb
+        return str(self.data)
+
+
+def _pad_dir_block(chunk):
+    """ Extend the last record in the directory block to the end of the
+    block.
+    """
+    offset = 0
+    while True:
+        _, reclen = struct.unpack_from('<IH', chunk, offset)
+        if offset + reclen >= len(chunk):
+            break
+        offset += reclen
+    reclen = ufs.DIRBLKSIZ - offset
+    chunk = chunk[:offset + 4] + struct.pack('<H', reclen) + \
+        chunk[offset + 6:]
+    return chunk + '\0' * (ufs.DIRBLKSIZ - len(chunk))
+
+
+PARTITION_OFFSET = 1024 * 1024
+
+# More than NDADDR blocks, with a hole, so that the indirect block and
+# holes are read.
+BIG_FILE = ''.join(chr(i % 251) for i in range(20 * 4096 + 100))
+BIG_FILE = BIG_FILE[:14 * 4096] + '\0' * 4096 + BIG_FILE[15 * 4096:]
+
+
+def make_disk(mbr_type=0xa5, include_crash=True):
+    """ Return a disk image with a UFS2 filesystem in partition 4. """
+    builder = UFSBuilder()
+    messages = builder.add_file('Metavisor started\n')
+    big = builder.add_file(BIG_FILE)
+    link = builder.add_symlink('messages')
+    log_entries = {'messages': messages, 'big': big, 'link': link}
+    # Enough entries to fill more than one directory block.
+    for i in range(40):
+        log_entries['old-%02d.log' % i] = builder.add_file('log %d\n' % i)
+    root_entries = {
+        'log': builder.add_dir(log_entries),
+        'etc': builder.add_dir({'rc.conf': builder.add_file('x=1\n')})
+    }
+    if include_crash:
+        root_entries['crash'] = builder.add_dir(
+            {'core.txt': builder.add_file('panic\n')})
+    fs = builder.build(root_entries)
+
+    mbr = bytearray(ebs_snapshot.SECTOR_SIZE)
+    struct.pack_into(
+        '<4xB3xII', mbr, 446 + 16 * 3, mbr_type,
+        PARTITION_OFFSET // ebs_snapshot.SECTOR_SIZE,
+        len(fs) // ebs_snapshot.SECTOR_SIZE)
+    mbr[510:512] = '\x55\xaa'
+    disk = bytearray(PARTITION_OFFSET)
+    disk[:len(mbr)] = mbr
+    return str(disk) + fs
+
+
+class TestSnapshotBlockReader(unittest.TestCase):
+
+    def setUp(self):
+        self.disk = make_disk()
+        self.ebs = FakeEBS(self.disk)
+        self.reader = ebs_snapshot.SnapshotBlockReader(
+            self.ebs, 'snap-1', max_workers=4, cache_blocks=4)
+
+    def test_read(self):
+        """ Test reading across block boundaries, and reading blocks that
+        were never written.
+        """
+        for offset, length in [
+                (0, 512),
+                (BLOCK_SIZE - 10, 20),
+                (PARTITION_OFFSET + ufs.SBLOCK_UFS2, 8192),
+                (PARTITION_OFFSET - 100, BLOCK_SIZE * 3)]:
+            self.assertEqual(
+                self.disk[offset:offset + length],
+                self.reader.read(offset, length)
+            )
+        self.assertEqual(
+            '\0' * 100, self.reader.read(len(self.disk) + BLOCK_SIZE, 100))
+        self.assertEqual(sorted(self.ebs.blocks), sorted(self._tokens()))
+
+    def _tokens(self):
+        return self.reader._tokens.keys()
+
+    def test_cache(self):
+        """ Test that blocks are fetched once while they're cached. """
+        self.reader.read(0, 10)
+        self.reader.read(100, 10)
+        self.assertEqual([0], self.ebs.get_calls)
+        self.reader.prefetch([(0, len(self.disk))])
+        self.assertEqual(4, len(self.reader._cache))
+
+    def test_checksum_mismatch(self):
+        get_snapshot_block = self.ebs.get_snapshot_block
+
+        def _corrupt(**kwargs):
+            response = get_snapshot_block(**kwargs)
+            response['BlockData'] = StringIO('x' * BLOCK_SIZE)
+            return response
+
+        self.ebs.get_snapshot_block = _corrupt
+        with self.assertRaises(BracketError):
+            self.reader.read(0, 10)
+
+
+class TestExtractLogs(unittest.TestCase):
+
+    def _extract(self, disk):
+        reader = ebs_snapshot.SnapshotBlockReader(
+            FakeEBS(disk), 'snap-1', max_workers=4)
+        out = StringIO()
+        count = ebs_snapshot.extract_logs(reader, out)
+        out.seek(0)
+        return count, tarfile.open(fileobj=out, mode='r:gz')
+
+    def test_extract_logs(self):
+        count, tar = self._extract(make_disk())
+        names = tar.getnames()
+        self.assertEqual(43, count)
+        self.assertIn('./log', names)
+        self.assertIn('./crash/core.txt', names)
+        self.assertIn('./log/old-39.log', names)
+        self.assertFalse([n for n in names if n.startswith('./etc')])
+
+        self.assertEqual(
+            'Metavisor started\n',
+            tar.extractfile('./log/messages').read()
+        )
+        self.assertEqual(BIG_FILE, tar.extractfile('./log/big').read())
+        link = tar.getmember('./log/link')
+        self.assertTrue(link.issym())
+        self.assertEqual('messages', link.linkname)
+        self.assertTrue(tar.getmember('./log').isdir())
+
+    def test_missing_directory(self):
+        """ Test that a missing log directory is skipped. """
+        _, tar = self._extract(make_disk(include_crash=False))
+        self.assertFalse(
+            [n for n in tar.getnames() if n.startswith('./crash')])
+        self.assertIn('./log/messages', tar.getnames())
+
+    def test_gpt(self):
+        """ Test finding the log partition in a GPT partition table. """
+        disk = bytearray(make_disk(mbr_type=0xee))
+        header = bytearray(ebs_snapshot.SECTOR_SIZE)
+        header[:8] = 'EFI PART'
+        struct.pack_into('<QII', header, 72, 2, 128, 128)
+        disk[512:1024] = header
+        entry = bytearray(128)
+        entry[:16] = 'x' * 16
+        first = PARTITION_OFFSET // ebs_snapshot.SECTOR_SIZE
+        struct.pack_into('<QQ', entry, 32, first, first + 8191)
+        offset = 2 * ebs_snapshot.SECTOR_SIZE + 3 * 128
+        disk[offset:offset + 128] = entry
+
+        device = ufs.FileDevice(StringIO(str(disk)))
+        self.assertEqual(
+            (PARTITION_OFFSET, 8192 * ebs_snapshot.SECTOR_SIZE),
+            ebs_snapshot.get_partition(device, 4)
+        )
+        with self.assertRaises(BracketError):
+            ebs_snapshot.get_partition(device, 1)
+
+    def test_no_filesystem(self):
+        disk = make_disk()
+        disk = disk[:PARTITION_OFFSET] + '\0' * (len(disk) - PARTITION_OFFSET)
+        with self.assertRaises(ufs.UFSError):
+            self._extract(disk)
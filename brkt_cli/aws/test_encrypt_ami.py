@@ -20,7 +20,7 @@ import zlib
 import brkt_cli
 import brkt_cli.aws
 import brkt_cli.util
-from brkt_cli import ValidationError, encryptor_service
+from brkt_cli import ValidationError, encryptor_service, trace
 from brkt_cli.aws import (
     aws_service, encrypt_ami, update_ami, test_aws_service,
     boto3_device)
@@ -163,6 +163,24 @@ class TestRunEncryption(unittest.TestCase):
         except encryptor_service.EncryptionError as e:
             self.assertIsNone(e.console_output_file)
 
+    def test_encryption_error_log_snapshot(self):
+        """ Test that the encryption error is raised without waiting for
+        the log snapshot to complete.
+        """
+        aws_svc, encryptor_image, guest_image = build_aws_service()
+        aws_svc.console_output_text = None
+
+        with self.assertRaises(encryptor_service.EncryptionError) as cm:
+            encrypt_ami.encrypt(
+                aws_svc=aws_svc,
+                enc_svc_cls=FailedEncryptionService,
+                image_id=guest_image.id,
+                encryptor_ami=encryptor_image.id,
+                crypto_policy=CRYPTO_GCM
+            )
+        log_snapshot = aws_svc.snapshots[cm.exception.log_snapshot_id]
+        self.assertEqual('pending', log_snapshot.state)
+
     def test_console_output_when_encryptor_cant_be_reached(self):
         """ Test that we save the console log when we can't reach
         the encryption service.
@@ -182,6 +200,54 @@ class TestRunEncryption(unittest.TestCase):
         except encryptor_service.EncryptionError as e:
             self.assertIsNotNone(e.console_output_file)
 
+    def test_fatal_console_output(self):
+        """ Test that encryption fails right away when the encryptor
+        console shows a panic, instead of waiting for the timeout.
+        """
+        aws_svc, encryptor_image, guest_image = build_aws_service()
+        aws_svc.console_output_text = (
+            'Starting up.\npanic: cannot mount root\n')
+
+        with self.assertRaises(encryptor_service.EncryptionError) as cm:
+            encrypt_ami.encrypt(
+                aws_svc=aws_svc,
+                enc_svc_cls=CantContactEncryptionService,
+                image_id=guest_image.id,
+                encryptor_ami=encryptor_image.id,
+                crypto_policy=CRYPTO_GCM,
+                encryption_start_timeout=3600
+            )
+        self.assertIn('panic: cannot mount root', cm.exception.message)
+        self.assertIsNotNone(cm.exception.console_output_file)
+        os.remove(cm.exception.console_output_file.name)
+
+    def test_trace(self):
+        """ Test that the stages of encryption are recorded when tracing
+        is enabled.
+        """
+        aws_svc, encryptor_image, guest_image = build_aws_service()
+        tracer = trace.enable()
+        try:
+            encrypt_ami.encrypt(
+                aws_svc=aws_svc,
+                enc_svc_cls=DummyEncryptorService,
+                image_id=guest_image.id,
+                encryptor_ami=encryptor_image.id,
+                crypto_policy=CRYPTO_GCM
+            )
+        finally:
+            trace.disable()
+        spans = dict((s.name, s) for s in tracer.finished_spans())
+        for name in ('_run_encryptor_instance',
+                     '_snapshot_encrypted_instance', '_register_ami',
+                     'clean_up'):
+            self.assertEqual(spans['encrypt'].id, spans[name].parent_id)
+        for name in ('wait_for_encryptor_up', 'wait_for_encryption'):
+            self.assertEqual(
+                spans['_snapshot_encrypted_instance'].id,
+                spans[name].parent_id)
+        self.assertEqual(trace.API, spans['run_instance'].category)
+
     def test_delete_orphaned_volumes(self):
         """ Test that we clean up instance volumes that are orphaned by AWS.
         """
@@ -0,0 +1,208 @@
+# Copyright 2017 Bracket Computing, Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License").
+# You may not use this file except in compliance with the License.
+# A copy of the License is located at
+#
+# https://github.com/brkt/brkt-cli/blob/master/LICENSE
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and
+# limitations under the License.
+import datetime
+import unittest
+
+import iso8601
+
+from brkt_cli import util
+from brkt_cli.aws import gc, inventory, test_aws_service
+from brkt_cli.aws.inventory import InventoryItem
+from brkt_cli.aws.model import Snapshot, Volume
+from brkt_cli.aws.test_aws_service import new_client_error
+
+NOW = datetime.datetime(2017, 6, 1, tzinfo=iso8601.UTC)
+MIN_AGE = datetime.timedelta(days=1)
+OLD = NOW - datetime.timedelta(days=2)
+NEW = NOW - datetime.timedelta(hours=1)
+
+
+def _item(resource_type, resource_id, session_id='old', **kwargs):
+    return InventoryItem(
+        'us-west-2', resource_type, resource_id, session_id=session_id,
+        **kwargs)
+
+
+class TestPlan(unittest.TestCase):
+
+    def _plan(self, items):
+        actions = gc.make_plan(items, MIN_AGE, now=NOW)
+        return {a.item.id: a for a in actions}
+
+    def test_session_age(self):
+        """ Test that resources are deleted only when the most recent
+        resource in their session is older than the minimum age.
+        """
+        actions = self._plan([
+            _item('instance', 'i-old', role=inventory.ROLE_ENCRYPTOR,
+                  state='running', created=OLD),
+            _item('security-group', 'sg-old',
+                  role=inventory.ROLE_SECURITY_GROUP),
+            _item('instance', 'i-running', session_id='new',
+                  role=inventory.ROLE_ENCRYPTOR, state='running',
+                  created=OLD),
+            _item('volume', 'vol-new', session_id='new', state='available',
+                  created=NEW),
+            _item('security-group', 'sg-unknown', session_id=None,
+                  role=inventory.ROLE_SECURITY_GROUP)
+        ])
+        self.assertTrue(actions['i-old'].delete)
+        self.assertTrue(actions['sg-old'].delete)
+        self.assertFalse(actions['i-running'].delete)
+        self.assertEqual('newer than 1d', actions['i-running'].reason)
+        self.assertFalse(actions['vol-new'].delete)
+        self.assertFalse(actions['sg-unknown'].delete)
+        self.assertEqual('unknown age', actions['sg-unknown'].reason)
+
+    def test_keep(self):
+        """ Test that images, the snapshots that they use, and resources
+        that brkt-cli doesn't clean up are never deleted.
+        """
+        actions = self._plan([
+            _item('image', 'ami-1', role=inventory.ROLE_ENCRYPTED_IMAGE,
+                  state='available', created=OLD),
+            _item('snapshot', 'snap-used', state='completed',
+                  image_ids=['ami-1'], created=OLD),
+            _item('snapshot', 'snap-unused', state='completed',
+                  created=OLD),
+            _item('instance', 'i-wrapped', state='running', created=OLD),
+            _item('instance', 'i-terminated', role=inventory.ROLE_ENCRYPTOR,
+                  state='terminated', created=OLD),
+            _item('security-group', 'sg-wrapped',
+                  role=inventory.ROLE_WRAPPED_SECURITY_GROUP)
+        ])
+        self.assertFalse(actions['ami-1'].delete)
+        self.assertFalse(actions['snap-used'].delete)
+        self.assertEqual('used by ami-1', actions['snap-used'].reason)
+        self.assertTrue(actions['snap-unused'].delete)
+        self.assertFalse(actions['i-wrapped'].delete)
+        self.assertNotIn('i-terminated', actions)
+        self.assertFalse(actions['sg-wrapped'].delete)
+
+    def test_attached_volumes(self):
+        """ Test that a volume is only deleted if the instances that it's
+        attached to are also deleted.
+        """
+        actions = self._plan([
+            _item('instance', 'i-encryptor', role=inventory.ROLE_ENCRYPTOR,
+                  state='stopped', created=OLD),
+            _item('volume', 'vol-1', state='in-use',
+                  instance_ids=['i-encryptor'], created=OLD),
+            _item('volume', 'vol-2', state='in-use',
+                  instance_ids=['i-other'], created=OLD)
+        ])
+        self.assertTrue(actions['vol-1'].delete)
+        self.assertFalse(actions['vol-2'].delete)
+        self.assertEqual('attached to i-other', actions['vol-2'].reason)
+
+    def test_order(self):
+        """ Test that instances come before the resources that depend on
+        them.
+        """
+        actions = gc.make_plan([
+            _item('security-group', 'sg-1',
+                  role=inventory.ROLE_SECURITY_GROUP),
+            _item('volume', 'vol-1', state='available', created=OLD),
+            _item('instance', 'i-1', role=inventory.ROLE_ENCRYPTOR,
+                  state='running', created=OLD)
+        ], MIN_AGE, now=NOW)
+        self.assertEqual(
+            ['i-1', 'vol-1', 'sg-1'], [a.item.id for a in actions])
+        lines = gc.render_plan(actions).splitlines()
+        self.assertEqual(4, len(lines))
+        self.assertTrue(lines[1].startswith('delete'))
+
+
+class TestCollect(unittest.TestCase):
+
+    def setUp(self):
+        util.SLEEP_ENABLED = False
+
+    def tearDown(self):
+        util.SLEEP_ENABLED = True
+
+    def test_collect(self):
+        """ Test that collect() terminates instances before deleting
+        other resources, and reports the resources that couldn't be
+        deleted.
+        """
+        aws_svc, _, guest_image = test_aws_service.build_aws_service()
+        calls = []
+
+        instance = aws_svc.run_instance(guest_image.id)
+        volume = aws_svc.create_volume(8, 'us-west-2a')
+        sg = aws_svc.create_security_group('Bracket Encryptor 1', 'Test')
+        snapshots = []
+        for _ in range(2):
+            snapshot = Snapshot()
+            snapshot.id = 'snap-' + test_aws_service.new_id()
+            aws_svc.snapshots[snapshot.id] = snapshot
+            snapshots.append(snapshot)
+
+        def _terminate(instance_id):
+            calls.append(instance_id)
+
+        def _delete_snapshot(snapshot_id):
+            calls.append(snapshot_id)
+            if snapshot_id == snapshots[1].id:
+                raise new_client_error('InvalidSnapshot.InUse')
+
+        def _delete_security_group(sg_id):
+            calls.append(sg_id)
+
+        aws_svc.terminate_instance_callback = _terminate
+        aws_svc.delete_snapshot_callback = _delete_snapshot
+        aws_svc.delete_security_group_callback = _delete_security_group
+
+        items = [
+            _item('instance', instance.id, role=inventory.ROLE_ENCRYPTOR,
+                  state='running', created=OLD),
+            _item('volume', volume.id, state='available', created=OLD),
+            _item('snapshot', snapshots[0].id, state='completed',
+                  created=OLD),
+            _item('snapshot', snapshots[1].id, state='completed',
+                  created=OLD),
+            _item('security-group', sg.id,
+                  role=inventory.ROLE_SECURITY_GROUP)
+        ]
+        actions = gc.make_plan(items, MIN_AGE, now=NOW)
+        self.assertTrue(all(a.delete for a in actions))
+
+        failures = gc.collect(
+            lambda region: aws_svc, actions, max_parallel=2,
+            calls_per_second=1000)
+
+        self.assertEqual(instance.id, calls[0])
+        self.assertEqual(
+            sorted([snapshots[0].id, snapshots[1].id, sg.id]),
+            sorted(calls[1:]))
+        self.assertEqual('terminated', instance.state['Name'])
+        self.assertNotIn(volume.id, aws_svc.volumes)
+        self.assertEqual(
+            [snapshots[1].id], [item.id for item, _ in failures])
+
+    def test_dry_run_plan(self):
+        """ Test that making a plan doesn't delete anything. """
+        aws_svc = test_aws_service.DummyAWSService()
+        volume = Volume()
+        volume.id = 'vol-1'
+        volume.state = 'available'
+        volume.create_time = OLD
+        aws_svc.volumes[volume.id] = volume
+        aws_svc.create_tags(volume.id)
+
+        items = inventory.scan_region(aws_svc, 'us-west-2')
+        actions = gc.make_plan(items, MIN_AGE, now=NOW)
+        self.assertEqual(['vol-1'], [a.item.id for a in actions if a.delete])
+        self.assertIn(volume.id, aws_svc.volumes)
@@ -0,0 +1,167 @@
+# Copyright 2017 Bracket Computing, Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License").
+# You may not use this file except in compliance with the License.
+# A copy of the License is located at
+#
+# https://github.com/brkt/brkt-cli/blob/master/LICENSE
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and
+# limitations under the License.
+import datetime
+import json
+import unittest
+
+import iso8601
+
+from brkt_cli.aws import boto3_tag, inventory, test_aws_service
+from brkt_cli.aws.aws_constants import (
+    NAME_ENCRYPTOR,
+    NAME_ENCRYPTOR_SECURITY_GROUP,
+    NAME_LOG_SNAPSHOT,
+    TAG_ENCRYPTOR_SESSION_ID
+)
+from brkt_cli.aws.model import Snapshot, Volume
+from brkt_cli.aws.test_aws_service import new_client_error
+
+
+class TestInventory(unittest.TestCase):
+
+    def setUp(self):
+        self.aws_svc = test_aws_service.DummyAWSService()
+        self.session_id = self.aws_svc.default_tags[TAG_ENCRYPTOR_SESSION_ID]
+
+    def test_get_role(self):
+        self.assertEqual(
+            inventory.ROLE_ENCRYPTOR,
+            inventory.get_role('instance', NAME_ENCRYPTOR))
+        self.assertEqual(
+            inventory.ROLE_LOGS,
+            inventory.get_role(
+                'snapshot', NAME_LOG_SNAPSHOT % {'instance_id': 'i-123'}))
+        self.assertEqual(
+            inventory.ROLE_SECURITY_GROUP,
+            inventory.get_role(
+                'security-group',
+                NAME_ENCRYPTOR_SECURITY_GROUP % {'nonce': 'abc'}))
+        self.assertEqual(
+            inventory.ROLE_ENCRYPTED_IMAGE,
+            inventory.get_role('image', 'My image (encrypted abc)'))
+        self.assertIsNone(inventory.get_role('volume', 'My volume'))
+        self.assertIsNone(inventory.get_role('instance', None))
+
+    def test_scan_region(self):
+        """ Test that scan_region() finds resources by tag and by name,
+        and ignores resources that weren't created by brkt-cli.
+        """
+        aws_svc = self.aws_svc
+
+        # Tagged and named.
+        tagged = Volume()
+        tagged.id = 'vol-tagged'
+        aws_svc.volumes[tagged.id] = tagged
+        aws_svc.create_tags(tagged.id, name=NAME_ENCRYPTOR)
+
+        # Named but not tagged.
+        snapshot = Snapshot()
+        snapshot.id = 'snap-named'
+        snapshot.start_time = datetime.datetime(
+            2017, 1, 2, 3, 4, tzinfo=iso8601.UTC)
+        boto3_tag.set_value(
+            snapshot.tags, 'Name',
+            NAME_LOG_SNAPSHOT % {'instance_id': 'i-123'})
+        aws_svc.snapshots[snapshot.id] = snapshot
+
+        sg = aws_svc.create_security_group(
+            NAME_ENCRYPTOR_SECURITY_GROUP % {'nonce': 'abc'}, 'Test')
+
+        # Neither tagged nor named.
+        other = Volume()
+        other.id = 'vol-other'
+        aws_svc.volumes[other.id] = other
+
+        items = inventory.scan_region(aws_svc, 'us-west-2')
+        by_id = {item.id: item for item in items}
+
+        self.assertEqual(1, len([i for i in items if i.id == tagged.id]))
+        self.assertEqual(self.session_id, by_id[tagged.id].session_id)
+        self.assertEqual(inventory.ROLE_UNKNOWN, by_id[tagged.id].role)
+
+        self.assertIsNone(by_id[snapshot.id].session_id)
+        self.assertEqual(inventory.ROLE_LOGS, by_id[snapshot.id].role)
+        self.assertEqual(snapshot.start_time, by_id[snapshot.id].created)
+
+        self.assertEqual(inventory.ROLE_SECURITY_GROUP, by_id[sg.id].role)
+        self.assertNotIn(other.id, by_id)
+
+    def test_scan_regions(self):
+        """ Test that scan_regions() scans every region, groups the
+        results by session, and reports the regions that can't be scanned.
+        """
+        services = {}
+
+        def _new_aws_svc(region):
+            aws_svc = test_aws_service.DummyAWSService()
+            aws_svc.connect(region)
+            services[region] = aws_svc
+            return aws_svc
+
+        regions = ['us-west-2', 'eu-west-1', 'ap-south-1']
+        items, errors = inventory.scan_regions(
+            _new_aws_svc, regions[:2], max_parallel=2)
+        self.assertEqual([], items)
+        self.assertEqual({}, errors)
+
+        services.clear()
+
+        def _new_aws_svc_with_resources(region):
+            aws_svc = _new_aws_svc(region)
+            volume = Volume()
+            volume.id = 'vol-' + region
+            aws_svc.volumes[volume.id] = volume
+            aws_svc.create_tags(volume.id)
+            if region == 'ap-south-1':
+                def _fail(resource_type, filters=None):
+                    raise new_client_error('AuthFailure')
+                aws_svc.list_resources = _fail
+            return aws_svc
+
+        items, errors = inventory.scan_regions(
+            _new_aws_svc_with_resources, regions)
+        self.assertEqual(['ap-south-1'], errors.keys())
+        self.assertEqual(
+            ['vol-eu-west-1', 'vol-us-west-2'], sorted(i.id for i in items))
+
+        # Items are grouped by session.
+        session_ids = [i.session_id for i in items]
+        self.assertEqual(sorted(session_ids), session_ids)
+
+    def test_render(self):
+        created = datetime.datetime(2017, 1, 2, 3, 4, tzinfo=iso8601.UTC)
+        items = [
+            inventory.InventoryItem(
+                'us-west-2', 'image', 'ami-123', name='My image',
+                session_id='abc', role=inventory.ROLE_ENCRYPTED_IMAGE,
+                created=created),
+            inventory.InventoryItem(
+                'us-west-2', 'security-group', 'sg-123')
+        ]
+
+        lines = inventory.render_table(items).splitlines()
+        self.assertEqual(3, len(lines))
+        self.assertTrue(lines[0].startswith('SESSION'))
+        self.assertIn('2017-01-02 03:04', lines[1])
+        self.assertIn('ami-123', lines[1])
+        self.assertTrue(lines[2].startswith('-'))
+
+        lines = inventory.render_json(items).splitlines()
+        d = json.loads(lines[0])
+        self.assertEqual('ami-123', d['id'])
+        self.assertEqual('abc', d['session_id'])
+        self.assertEqual(created.isoformat(), d['created'])
+        d = json.loads(lines[1])
+        self.assertIsNone(d['created'])
+        self.assertEqual(inventory.ROLE_UNKNOWN, d['role'])
@@ -12,9 +12,15 @@
 # License for the specific language governing permissions and
 # limitations under the License.
 
+import json
+import tarfile
 import unittest
+from StringIO import StringIO
+
+from botocore.exceptions import ClientError, WaiterError
+
 import brkt_cli
-from brkt_cli.aws import share_logs, boto3_device
+from brkt_cli.aws import share_logs, boto3_device, test_ebs_snapshot
 from brkt_cli.aws.model import Instance, Snapshot
 from brkt_cli.validation import ValidationError
 
@@ -56,15 +62,41 @@ class Meta():
         self.client = Client()
 
 
+def _client_error(code, operation_name):
+    return ClientError(
+        {'Error': {'Code': code, 'Message': 'Not Found'}}, operation_name)
+
+
+class Waiter():
+    def __init__(self):
+        self.error = None
+
+    def wait(self, Bucket, Key, WaiterConfig):
+        if self.error:
+            raise self.error
+
+
 class Client():
     def __init__(self):
         self.region = 'matching'
-        self.value = None
+        self.waiter = Waiter()
 
     def head_bucket(self, Bucket):
+        if Bucket != 'test-bucket':
+            raise _client_error('404', 'HeadBucket')
+        headers = {}
         if self.region == 'unmatching':
-            raise ValidationError()
-        return self.value
+            headers['x-amz-bucket-region'] = 'other-region'
+        return {'ResponseMetadata': {'HTTPHeaders': headers}}
+
+    def head_object(self, Bucket, Key):
+        if Key != 'matching':
+            raise _client_error('404', 'HeadObject')
+        return {}
+
+    def get_waiter(self, name):
+        assert name == 'object_exists'
+        return self.waiter
 
 
 class Objects():
@@ -168,8 +200,7 @@ class TestShareLogs(unittest.TestCase):
                 "test-bucket", "matching", "matching", s3)
 
         # Tests if the bucket doesn't have write permission
-        for b in s3.buckets.all():
-            b.acl.grant['Permission'] = 'read'
+        s3.Bucket('test-bucket').acl.grant['Permission'] = 'read'
         with self.assertRaises(ValidationError):
             aws_svc.check_bucket_file(
                 "test-bucket", "file", "matching", s3)
@@ -186,3 +217,260 @@ class TestShareLogs(unittest.TestCase):
         share_logs.share(aws_svc, logs_svc, instance_id=instance_id, 
         snapshot_id=snapshot_id, region=region, bucket=bucket, path=path,
         subnet_id=None)
+
+    def test_direct(self):
+        """ Test that logs are read from the snapshot and uploaded without
+        launching an instance.
+        """
+        disk = test_ebs_snapshot.make_disk()
+
+        class DirectTestService(ShareLogsTestService):
+            uploaded = None
+
+            def ebs_connect(self, region):
+                return test_ebs_snapshot.FakeEBS(disk)
+
+            def upload_file(self, filename, bucket, path, s3):
+                with open(filename) as f:
+                    DirectTestService.uploaded = (bucket, path, f.read())
+
+            def delete_snapshot(self, snapshot_id):
+                pass
+
+        ShareLogsTestService.created = False
+        svc = DirectTestService()
+        share_logs.share(
+            svc, svc, instance_id='test-instance', region='us-west-2',
+            bucket='test-bucket', path='test/path', direct=True)
+        self.assertFalse(ShareLogsTestService.created)
+
+        bucket, path, data = DirectTestService.uploaded
+        self.assertEqual(('test-bucket', 'test/path'), (bucket, path))
+        tar = tarfile.open(fileobj=StringIO(data), mode='r:gz')
+        self.assertIn('./log/messages', tar.getnames())
+
+    def test_upload_file_acl(self):
+        """ Test that a direct upload uses the same ACL as the uploads
+        from the helper instance.
+        """
+        s3 = FakeS3()
+        share_logs.ShareLogsService().upload_file(
+            'logs.tar.gz', 'test-bucket', 'test/path', s3)
+        self.assertEqual(
+            [('test-bucket', 'logs.tar.gz', 'test/path',
+              {'ACL': 'public-read-write'})],
+            s3.uploads
+        )
+
+
+class FakeS3(object):
+    """ Stands in for the S3 resource, and records the calls to
+    Bucket().upload_file().
+    """
+    def __init__(self):
+        self.uploads = []
+
+    def Bucket(self, name):
+        s3 = self
+
+        class _Bucket(object):
+            def upload_file(self, filename, key, ExtraArgs=None):
+                s3.uploads.append((name, filename, key, ExtraArgs))
+        return _Bucket()
+
+
+class BatchTestService(ShareLogsTestService):
+    """ Records the snapshots and the helper instance that are created in
+    batch mode.
+    """
+
+    def __init__(self, disk=None):
+        self.disk = disk
+        self.snapshot_ids = []
+        self.deleted_snapshot_ids = []
+        self.run_instance_args = None
+        self.waited_for = None
+        self.uploaded = None
+        self.terminated = False
+
+    def create_snapshot(self, volume_id, name):
+        snapshot = Snapshot()
+        snapshot.id = 'snap-%d' % len(self.snapshot_ids)
+        snapshot.volume_size = 5
+        self.snapshot_ids.append(snapshot.id)
+        return snapshot
+
+    def get_snapshots(self, *snapshot_ids):
+        snapshots = []
+        for snapshot_id in snapshot_ids:
+            snapshot = Snapshot()
+            snapshot.id = snapshot_id
+            snapshot.state = 'completed'
+            snapshots.append(snapshot)
+        return snapshots
+
+    def get_snapshot(self, snapshot_id):
+        return self.get_snapshots(snapshot_id)[0]
+
+    def delete_snapshot(self, snapshot_id):
+        self.deleted_snapshot_ids.append(snapshot_id)
+
+    def run_instance(self, image_id, instance_type, block_device_mappings,
+                     user_data, ebs_optimized, subnet_id):
+        self.run_instance_args = (block_device_mappings, user_data)
+        instance = Instance()
+        instance.id = 'i-helper'
+        return instance
+
+    def terminate_instance(self, instance_id):
+        self.terminated = True
+
+    def get_instance(self, instance_id):
+        instance = ShareLogsTestService.get_instance(self, instance_id)
+        if self.terminated:
+            instance.state['Name'] = 'terminated'
+        return instance
+
+    def wait_bucket_file(self, bucket, path, region, s3, attempts=40):
+        self.waited_for = path
+
+    def ebs_connect(self, region):
+        return test_ebs_snapshot.FakeEBS(self.disk)
+
+    def upload_file(self, filename, bucket, path, s3):
+        with open(filename) as f:
+            self.uploaded = (bucket, path, f.read())
+
+
+class TestShareLogsBatch(unittest.TestCase):
+
+    def setUp(self):
+        brkt_cli.util.SLEEP_ENABLED = False
+
+    def test_batch(self):
+        """ Test that the root volumes of all instances are attached to a
+        single helper instance, and that completion is signalled with a
+        single object.
+        """
+        svc = BatchTestService()
+        share_logs.share_batch(
+            svc, svc, instance_ids=['i-1', 'i-2', 'i-3'],
+            region='us-west-2', bucket='test-bucket', path='logs.tar.gz')
+
+        bdm, user_data = svc.run_instance_args
+        self.assertEqual(
+            ['/dev/sdf', '/dev/sdg', '/dev/sdh'],
+            [d['DeviceName'] for d in bdm])
+        self.assertEqual(
+            ['snap-0', 'snap-1', 'snap-2'],
+            [d['Ebs']['SnapshotId'] for d in bdm])
+        self.assertIn('/dev/xvdg4 i-2', user_data)
+        self.assertIn('./i-3/log', user_data)
+        self.assertIn('s3://test-bucket/logs.tar.gz.done', user_data)
+        self.assertEqual('logs.tar.gz.done', svc.waited_for)
+        self.assertEqual(
+            ['snap-0', 'snap-1', 'snap-2'], svc.deleted_snapshot_ids)
+
+    def test_batch_snapshots_not_deleted(self):
+        svc = BatchTestService()
+        share_logs.share_batch(
+            svc, svc, snapshot_ids=['snap-a', 'snap-b'],
+            region='us-west-2', bucket='test-bucket', path='logs.tar.gz')
+        self.assertEqual([], svc.deleted_snapshot_ids)
+
+    def test_too_many(self):
+        svc = BatchTestService()
+        ids = ['i-%d' % i for i in range(
+            len(share_logs.BATCH_DEVICE_NAMES) + 1)]
+        with self.assertRaises(ValidationError):
+            share_logs.share_batch(
+                svc, svc, instance_ids=ids, region='us-west-2',
+                bucket='test-bucket', path='logs.tar.gz')
+
+    def test_batch_direct(self):
+        """ Test that the logs from each snapshot are written to their own
+        directory in a single tar file.
+        """
+        svc = BatchTestService(disk=test_ebs_snapshot.make_disk())
+        share_logs.share_batch(
+            svc, svc, instance_ids=['i-1', 'i-2'], region='us-west-2',
+            bucket='test-bucket', path='logs.tar.gz', direct=True)
+        self.assertIsNone(svc.run_instance_args)
+
+        _, _, data = svc.uploaded
+        names = tarfile.open(fileobj=StringIO(data), mode='r:gz').getnames()
+        self.assertIn('./i-1/log/messages', names)
+        self.assertIn('./i-2/crash/core.txt', names)
+
+
+def _event(bucket, key, event_name='ObjectCreated:Put'):
+    return json.dumps({
+        'Records': [{
+            'eventName': event_name,
+            's3': {'bucket': {'name': bucket}, 'object': {'key': key}}
+        }]
+    })
+
+
+class SQS(object):
+    def __init__(self, bodies):
+        self.messages = [
+            {'Body': body, 'ReceiptHandle': 'handle-%d' % i}
+            for i, body in enumerate(bodies)
+        ]
+        self.deleted = []
+
+    def receive_message(self, QueueUrl, MaxNumberOfMessages,
+                        WaitTimeSeconds):
+        messages = self.messages[:1]
+        self.messages = self.messages[1:]
+        return {'Messages': messages}
+
+    def delete_message(self, QueueUrl, ReceiptHandle):
+        self.deleted.append(ReceiptHandle)
+
+
+class TestShareLogsCompletion(unittest.TestCase):
+
+    def test_get_created_objects(self):
+        self.assertEqual(
+            [('bucket', 'logs/a b.tar.gz')],
+            share_logs._get_created_objects(
+                _event('bucket', 'logs/a+b.tar.gz'))
+        )
+        self.assertEqual(
+            [],
+            share_logs._get_created_objects(
+                _event('bucket', 'logs.tar.gz', 'ObjectRemoved:Delete'))
+        )
+        self.assertEqual(
+            [], share_logs._get_created_objects('{"Event": "s3:TestEvent"}'))
+        self.assertEqual([], share_logs._get_created_objects('not json'))
+
+    def test_wait_bucket_event(self):
+        """ Test that only the message for the logs file is deleted. """
+        sqs = SQS([
+            _event('bucket', 'other.tar.gz'),
+            _event('bucket', 'logs.tar.gz')
+        ])
+        logs_svc = share_logs.ShareLogsService()
+        logs_svc.sqs_connect = lambda region: sqs
+        logs_svc.wait_bucket_event(
+            'https://queue', 'bucket', 'logs.tar.gz', 'us-west-2')
+        self.assertEqual(['handle-1'], sqs.deleted)
+
+    def test_wait_bucket_event_timeout(self):
+        logs_svc = share_logs.ShareLogsService()
+        logs_svc.sqs_connect = lambda region: SQS([])
+        with self.assertRaises(brkt_cli.util.BracketError):
+            logs_svc.wait_bucket_event(
+                'https://queue', 'bucket', 'logs.tar.gz', 'us-west-2',
+                timeout=0)
+
+    def test_wait_bucket_file_timeout(self):
+        s3 = S3()
+        s3.meta.client.waiter.error = WaiterError(
+            'ObjectExists', 'Max attempts exceeded', {})
+        with self.assertRaises(brkt_cli.util.BracketError):
+            share_logs.ShareLogsService().wait_bucket_file(
+                'test-bucket', 'logs.tar.gz', 'us-west-2', s3)
@@ -22,6 +22,7 @@ from brkt_cli.aws import (
     encrypt_ami, test_aws_service, update_ami
 )
 from brkt_cli.aws.test_aws_service import build_aws_service
+from brkt_cli.aws.update_ami import update_amis
 from brkt_cli.test_encryptor_service import (
     DummyEncryptorService,
     FailedEncryptionService
@@ -206,3 +207,89 @@ class TestRunUpdate(unittest.TestCase):
         )
 
         self.assertTrue(self.encrypted_instance.ena_support)
+
+
+class TestUpdateAmis(unittest.TestCase):
+
+    def setUp(self):
+        util.SLEEP_ENABLED = False
+
+    def _encrypt(self, aws_svc, encryptor_image, guest_image):
+        return encrypt_ami.encrypt(
+            aws_svc=aws_svc,
+            enc_svc_cls=DummyEncryptorService,
+            image_id=guest_image.id,
+            encryptor_ami=encryptor_image.id,
+            crypto_policy=CRYPTO_GCM
+        )
+
+    def test_shared_security_group(self):
+        """ Test that all of the updaters share one temporary security
+        group, which is deleted when the updates are done.
+        """
+        aws_svc, encryptor_image, guest_image = build_aws_service()
+        encrypted_ami_ids = [
+            self._encrypt(aws_svc, encryptor_image, guest_image)
+            for _ in range(3)
+        ]
+
+        created = []
+        deleted = []
+        sg_ids = set()
+
+        def run_instance_callback(args):
+            if args.image_id == encryptor_image.id:
+                sg_ids.update(args.security_group_ids)
+
+        aws_svc.create_security_group_callback = created.append
+        aws_svc.delete_security_group_callback = deleted.append
+        aws_svc.run_instance_callback = run_instance_callback
+
+        results = update_amis(
+            aws_svc,
+            [(ami_id, 'Updated %d' % n)
+             for n, ami_id in enumerate(encrypted_ami_ids)],
+            encryptor_image.id,
+            enc_svc_class=DummyEncryptorService,
+            new_aws_svc=lambda: aws_svc,
+            max_parallel=3
+        )
+
+        self.assertEqual(1, len(created))
+        self.assertEqual(1, len(sg_ids))
+        self.assertEqual(list(sg_ids), deleted)
+        self.assertEqual(
+            encrypted_ami_ids, [r.encrypted_ami for r in results])
+        for result in results:
+            self.assertIsNone(result.error)
+            self.assertIn(result.updated_ami, aws_svc.images)
+
+    def test_partial_failure(self):
+        """ Test that a failure to update one AMI doesn't affect the
+        others.
+        """
+        aws_svc, encryptor_image, guest_image = build_aws_service()
+        encrypted_ami_ids = [
+            self._encrypt(aws_svc, encryptor_image, guest_image)
+            for _ in range(2)
+        ]
+
+        def run_instance_callback(args):
+            if args.image_id == encrypted_ami_ids[0]:
+                raise test_aws_service.new_client_error(
+                    'InsufficientInstanceCapacity')
+
+        aws_svc.run_instance_callback = run_instance_callback
+        results = update_amis(
+            aws_svc,
+            [(ami_id, 'Updated %d' % n)
+             for n, ami_id in enumerate(encrypted_ami_ids)],
+            encryptor_image.id,
+            security_group_ids=['sg-1'],
+            enc_svc_class=DummyEncryptorService
+        )
+
+        self.assertIsNotNone(results[0].error)
+        self.assertIsNone(results[0].updated_ami)
+        self.assertIsNone(results[1].error)
+        self.assertIsNotNone(results[1].updated_ami)
@@ -30,6 +30,7 @@ from brkt_cli.instance_config_args import (
     instance_config_args_to_values,
     instance_config_from_values
 )
+from brkt_cli.validation import ValidationError
 
 
 class TestWrappedInstanceName(unittest.TestCase):
@@ -179,6 +180,75 @@ class TestRunEncryption(unittest.TestCase):
         )
 
 
+class TestFleet(unittest.TestCase):
+
+    def setUp(self):
+        brkt_cli.util.SLEEP_ENABLED = False
+
+    def test_fleet(self):
+        """ Test that the instances are spread across subnets, tagged
+        with a single call, and wrapped with their own service objects.
+        """
+        aws_svc, encryptor_image, guest_image = build_aws_service()
+        for subnet_id in ('subnet-1', 'subnet-2'):
+            subnet = Subnet()
+            subnet.id = subnet_id
+            subnet.vpc_id = 'vpc-1'
+            aws_svc.subnets[subnet_id] = subnet
+
+        self.tagged = []
+
+        def create_tags_callback(resource_id, name, description):
+            if name == 'web':
+                self.tagged.append(resource_id)
+
+        self.new_svc_calls = 0
+
+        def new_aws_svc():
+            self.new_svc_calls += 1
+            return aws_svc
+
+        aws_svc.create_tags_callback = create_tags_callback
+        instances = wrap_image.launch_wrapped_images(
+            aws_svc=aws_svc,
+            image_id=guest_image.id,
+            metavisor_ami=encryptor_image.id,
+            count=5,
+            wrapped_instance_name='web',
+            subnet_ids=['subnet-1', 'subnet-2'],
+            new_aws_svc=new_aws_svc
+        )
+        self.assertEqual(5, len(instances))
+        self.assertEqual(5, len(set(i.id for i in instances)))
+        self.assertEqual(
+            ['subnet-1', 'subnet-2', 'subnet-1', 'subnet-2', 'subnet-1'],
+            [i.subnet_id for i in instances]
+        )
+        self.assertEqual([[i.id for i in instances]], self.tagged)
+        self.assertEqual(5, self.new_svc_calls)
+        for instance in instances:
+            self.assertEqual('running', instance.state['Name'])
+
+    def test_subnets_in_different_vpcs(self):
+        aws_svc, encryptor_image, guest_image = build_aws_service()
+        for subnet_id, vpc_id in (('subnet-1', 'vpc-1'),
+                                  ('subnet-2', 'vpc-2')):
+            subnet = Subnet()
+            subnet.id = subnet_id
+            subnet.vpc_id = vpc_id
+            aws_svc.subnets[subnet_id] = subnet
+
+        with self.assertRaises(ValidationError):
+            wrap_image.launch_wrapped_images(
+                aws_svc=aws_svc,
+                image_id=guest_image.id,
+                metavisor_ami=encryptor_image.id,
+                count=2,
+                subnet_ids=['subnet-1', 'subnet-2']
+            )
+        self.assertEqual(0, len(aws_svc.instances))
+
+
 class TestBrktEnv(unittest.TestCase):
 
     def setUp(self):
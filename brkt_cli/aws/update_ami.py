@@ -23,9 +23,8 @@ running the AWS command line utility.
 
 import json
 import logging
-import os
 
-from brkt_cli import encryptor_service
+from brkt_cli import encryptor_service, trace
 from brkt_cli.aws import boto3_device, aws_service
 from brkt_cli.aws.aws_constants import (
     NAME_GUEST_CREATOR, DESCRIPTION_GUEST_CREATOR, NAME_METAVISOR_UPDATER,
@@ -36,6 +35,7 @@ from brkt_cli.aws.aws_service import (
     clean_up,
     wait_for_volume_attached,
     stop_and_wait, log_exception_console)
+from brkt_cli.console_tailer import ConsoleTailer, SnapshotDiffer
 from brkt_cli.encryptor_service import (
     wait_for_encryptor_up,
     wait_for_encryption
@@ -45,14 +45,99 @@ from brkt_cli.instance_config import (
     INSTANCE_UPDATER_MODE,
 )
 from brkt_cli.user_data import gzip_user_data
-from brkt_cli.util import Deadline
+from brkt_cli.util import Deadline, run_concurrently
 
 log = logging.getLogger(__name__)
 
 MV_ROOT_DEVICE_NAME = '/dev/sda1'
 GUEST_ROOT_DEVICE_NAME = '/dev/sdf'
 
+# The maximum number of AMIs that update_amis() updates at the same time.
+MAX_PARALLEL_UPDATES = 10
+
+
+class UpdateResult(object):
+    """ The result of updating one encrypted AMI with update_amis(). """
+
+    def __init__(self, encrypted_ami, updated_ami=None, error=None):
+        self.encrypted_ami = encrypted_ami
+        self.updated_ami = updated_ami
+        self.error = error
+
+
+@trace.traced()
+def update_amis(aws_svc, encrypted_amis, updater_ami,
+                subnet_id=None, security_group_ids=None,
+                enc_svc_class=encryptor_service.EncryptorService,
+                guest_instance_type='m4.large',
+                updater_instance_type='m4.large',
+                instance_config=None,
+                status_port=encryptor_service.ENCRYPTOR_STATUS_PORT,
+                new_aws_svc=None,
+                max_parallel=MAX_PARALLEL_UPDATES):
+    """ Update several encrypted AMIs with the same updater AMI.  If
+    security groups are not specified, a single temporary security group
+    is shared by all of the updaters.  The AMIs are updated max_parallel
+    at a time, and a failure to update one AMI doesn't affect the others.
+
+    :param encrypted_amis a list of (encrypted AMI id, updated AMI name)
+        tuples
+    :param new_aws_svc a function that returns a new connected
+        BaseAWSService.  Each AMI is updated with its own service object,
+        since boto3 resources are not thread-safe.  If not specified, the
+        AMIs are updated one at a time with aws_svc.
+    :return a list of UpdateResult, in the same order as encrypted_amis
+    """
+    if instance_config is None:
+        instance_config = InstanceConfig(mode=INSTANCE_UPDATER_MODE)
 
+    temp_sg_id = None
+    try:
+        if not security_group_ids:
+            vpc_id = None
+            if subnet_id:
+                vpc_id = aws_svc.get_subnet(subnet_id).vpc_id
+            temp_sg_id = create_encryptor_security_group(
+                aws_svc, vpc_id=vpc_id, status_port=status_port).id
+            security_group_ids = [temp_sg_id]
+
+        if new_aws_svc:
+            services = [new_aws_svc() for _ in encrypted_amis]
+        else:
+            services = [aws_svc] * len(encrypted_amis)
+            max_parallel = 1
+
+        def _update(svc, encrypted_ami, encrypted_ami_name):
+            def _f():
+                try:
+                    updated_ami = update_ami(
+                        svc, encrypted_ami, updater_ami, encrypted_ami_name,
+                        subnet_id=subnet_id,
+                        security_group_ids=security_group_ids,
+                        enc_svc_class=enc_svc_class,
+                        guest_instance_type=guest_instance_type,
+                        updater_instance_type=updater_instance_type,
+                        instance_config=instance_config,
+                        status_port=status_port
+                    )
+                    return UpdateResult(encrypted_ami, updated_ami=updated_ami)
+                except Exception as e:
+                    log.debug('', exc_info=1)
+                    log.error('Unable to update %s: %s', encrypted_ami, e)
+                    return UpdateResult(encrypted_ami, error=e)
+            return _f
+
+        return run_concurrently(
+            [_update(svc, ami, name)
+             for svc, (ami, name) in zip(services, encrypted_amis)],
+            max_workers=max_parallel
+        )
+    finally:
+        if temp_sg_id:
+            clean_up(aws_svc, security_group_ids=[temp_sg_id])
+
+
+@trace.traced()
 def update_ami(aws_svc, encrypted_ami, updater_ami, encrypted_ami_name,
                subnet_id=None, security_group_ids=None,
                enc_svc_class=encryptor_service.EncryptorService,
@@ -154,32 +239,32 @@ def update_ami(aws_svc, encrypted_ami, updater_ami, encrypted_ami_name,
             host_ips.append(updater.public_ip_address)
         if updater.private_ip_address:
             host_ips.append(updater.private_ip_address)
-            log.info('Adding %s to NO_PROXY environment variable' %
-                 updater.private_ip_address)
-            if os.environ.get('NO_PROXY'):
-                os.environ['NO_PROXY'] += "," + \
-                    updater.private_ip_address
-            else:
-                os.environ['NO_PROXY'] = updater.private_ip_address
 
         # Step 2. Wait for the encryption service to start up, so that we know
         # that Metavisor is done initializing.
         enc_svc = enc_svc_class(host_ips, port=status_port)
         log.info('Waiting for updater service on %s (port %s on %s)',
                  updater.id, enc_svc.port, ', '.join(host_ips))
-        try:
-            wait_for_encryptor_up(enc_svc, Deadline(600))
-        except:
-            log.error('Unable to connect to encryptor instance.')
-            raise
-
-        try:
-            wait_for_encryption(enc_svc)
-        except Exception as e:
-            # Stop the updater instance, to make the console log available.
-            stop_and_wait(aws_svc, updater.id)
-            log_exception_console(aws_svc, e, updater.id)
-            raise
+        tailer = ConsoleTailer(
+            SnapshotDiffer(lambda: aws_svc.get_console_output(updater.id)),
+            updater.id
+        )
+        with tailer:
+            try:
+                wait_for_encryptor_up(
+                    enc_svc, Deadline(600), check=tailer.check)
+            except:
+                log.error('Unable to connect to encryptor instance.')
+                raise
+
+            try:
+                wait_for_encryption(enc_svc, check=tailer.check)
+            except Exception as e:
+                # Stop the updater instance, to make the console log
+                # available.
+                stop_and_wait(aws_svc, updater.id)
+                log_exception_console(aws_svc, e, updater.id)
+                raise
 
         aws_svc.stop_instance(updater.id)
         updater = wait_for_instance(aws_svc, updater.id, state="stopped")
@@ -13,13 +13,18 @@
 # limitations under the License.
 
 from brkt_cli.aws import aws_args
+from brkt_cli.aws.update_ami import MAX_PARALLEL_UPDATES
 
 
 def setup_update_encrypted_ami(parser, parsed_config):
     parser.add_argument(
-        'ami',
+        'amis',
         metavar='ID',
-        help='The encrypted AMI that will be updated'
+        nargs='+',
+        help=(
+            'The encrypted AMI that will be updated.  If more than one AMI '
+            'is specified, the AMIs are updated concurrently.'
+        )
     )
     parser.add_argument(
         '--encrypted-ami-name',
@@ -43,6 +48,17 @@ def setup_update_encrypted_ami(parser, parsed_config):
         help='The instance type to use when running the updater instance',
         default='m4.large'
     )
+    parser.add_argument(
+        '--max-parallel',
+        metavar='N',
+        dest='max_parallel',
+        type=int,
+        default=MAX_PARALLEL_UPDATES,
+        help=(
+            'The maximum number of AMIs that are updated at the same time '
+            '(default: %(default)s)'
+        )
+    )
     aws_args.add_no_validate(parser)
     aws_args.add_region(parser, parsed_config)
     aws_args.add_security_group(parser, parsed_config)
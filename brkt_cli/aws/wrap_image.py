@@ -33,13 +33,14 @@ running the AWS command line utility.
 
 import logging
 
+from brkt_cli import trace
 from brkt_cli.user_data import gzip_user_data
 
 from brkt_cli.aws import aws_service, boto3_device
 from brkt_cli.aws.aws_service import (
-    EBS_OPTIMIZED_INSTANCES, wait_for_instance, clean_up)
+    EBS_OPTIMIZED_INSTANCES, wait_for_instance, wait_for_instances, clean_up)
 from brkt_cli.instance_config import InstanceConfig
-from brkt_cli.util import make_nonce, append_suffix
+from brkt_cli.util import make_nonce, append_suffix, run_concurrently
 from brkt_cli.validation import ValidationError
 
 # End user-visible terminology.  These are resource names and descriptions
@@ -54,6 +55,10 @@ NAME_WRAPPED_IMAGE_SUFFIX = ' (wrapped %(nonce)s)'
 
 INSTANCE_NAME_MAX_LENGTH = 128
 
+# The default number of instances that are wrapped at the same time when
+# launching a fleet.
+MAX_PARALLEL_WRAPS = 10
+
 log = logging.getLogger(__name__)
 
 
@@ -73,6 +78,7 @@ def get_name_from_image(image):
     return name
 
 
+@trace.traced()
 def create_instance_security_group(aws_svc, vpc_id=None):
     """ Creates a default security group to allow SSH access. This ensures
     that even if a security group is not specified in the arguments, the
@@ -105,10 +111,42 @@ def _get_metavisor_root_device(aws_svc, metavisor_ami):
     return mv_image_root_dev
 
 
+@trace.traced()
 def launch_wrapped_image(aws_svc, image_id, metavisor_ami,
                          wrapped_instance_name=None, subnet_id=None,
                          security_group_ids=None, instance_type='m4.large',
                          instance_config=None, iam=None):
+    instances = launch_wrapped_images(
+        aws_svc, image_id, metavisor_ami, 1,
+        wrapped_instance_name=wrapped_instance_name,
+        subnet_ids=[subnet_id] if subnet_id else None,
+        security_group_ids=security_group_ids,
+        instance_type=instance_type,
+        instance_config=instance_config,
+        iam=iam
+    )
+    return instances[0]
+
+
+@trace.traced()
+def launch_wrapped_images(aws_svc, image_id, metavisor_ami, count,
+                          wrapped_instance_name=None, subnet_ids=None,
+                          security_group_ids=None, instance_type='m4.large',
+                          instance_config=None, iam=None, new_aws_svc=None,
+                          max_parallel=MAX_PARALLEL_WRAPS):
+    """ Launch count wrapped instances of the guest image.  The guest
+    instances are launched with as few RunInstances calls as possible,
+    spread evenly across the given subnets, and are then wrapped
+    max_parallel at a time.
+
+    :param subnet_ids the subnets to launch in.  All of the subnets must be
+        in the same VPC.
+    :param new_aws_svc a function that returns a new connected
+        BaseAWSService.  Each instance is wrapped with its own service
+        object, since boto3 resources are not thread-safe.  If not
+        specified, the instances are wrapped one at a time with aws_svc.
+    :return a list of the wrapped Instance objects
+    """
     # If the guest already has /dev/sdf mounted, don't try to put the guest
     # root there.
     guest_image = aws_svc.get_image(image_id)
@@ -120,60 +158,82 @@ def launch_wrapped_image(aws_svc, image_id, metavisor_ami,
         )
 
     # Verify that we have access to the Metavisor AMI and snapshot before
-    # launching the guest instance.
-    _get_metavisor_root_device(aws_svc, metavisor_ami)
+    # launching the guest instances.
+    mv_image_root_dev = _get_metavisor_root_device(aws_svc, metavisor_ami)
 
     if not wrapped_instance_name:
         wrapped_instance_name = get_name_from_image(guest_image)
 
-    instance = None
+    instances = []
     temp_sg = None
     completed = False
 
     try:
-        log.info('Running guest instance.')
+        log.info('Running %d guest instances.', count)
         if not security_group_ids:
-            vpc_id = None
-            if subnet_id:
-                subnet = aws_svc.get_subnet(subnet_id)
-                vpc_id = subnet.vpc_id
+            vpc_ids = set()
+            for subnet_id in subnet_ids or []:
+                vpc_ids.add(aws_svc.get_subnet(subnet_id).vpc_id)
+            if len(vpc_ids) > 1:
+                raise ValidationError('Subnets must be in the same VPC.')
+            vpc_id = vpc_ids.pop() if vpc_ids else None
             temp_sg = create_instance_security_group(
                 aws_svc, vpc_id=vpc_id)
             security_group_ids = [temp_sg.id]
 
-        instance = aws_svc.run_instance(
+        instances = aws_svc.run_instances(
             image_id,
-            subnet_id=subnet_id,
+            count,
+            subnet_ids=subnet_ids,
             instance_type=instance_type,
             ebs_optimized=instance_type in EBS_OPTIMIZED_INSTANCES,
             security_group_ids=security_group_ids,
             name=wrapped_instance_name,
             instance_profile_name=iam
         )
-
-        wait_for_instance(aws_svc, instance.id)
-        instance = wrap_instance(
-            aws_svc, instance.id, metavisor_ami, instance_config)
+        instance_ids = [i.id for i in instances]
+        wait_for_instances(aws_svc, instance_ids)
+
+        def _wrap(instance_id):
+            def _f():
+                svc = new_aws_svc() if new_aws_svc else aws_svc
+                return wrap_instance(
+                    svc, instance_id, metavisor_ami,
+                    instance_config=instance_config,
+                    mv_image_root_dev=mv_image_root_dev
+                )
+            return _f
+
+        if not new_aws_svc:
+            max_parallel = 1
+        instances = run_concurrently(
+            [_wrap(id) for id in instance_ids], max_workers=max_parallel)
         completed = True
     finally:
         if not completed:
             sg_ids = []
             if temp_sg:
                 sg_ids.append(temp_sg.id)
-            instance_ids = []
-            if instance:
-                instance_ids.append(instance.id)
 
             clean_up(
                 aws_svc,
-                instance_ids=instance_ids,
+                instance_ids=[i.id for i in instances],
                 security_group_ids=sg_ids
             )
 
-    return instance
+    return instances
+
 
+@trace.traced()
+def wrap_instance(aws_svc, instance_id, metavisor_ami, instance_config=None,
+                  mv_image_root_dev=None):
+    """ Move the root volume of the given instance to /dev/sdf and
+    replace it with a Metavisor root volume.
 
-def wrap_instance(aws_svc, instance_id, metavisor_ami, instance_config=None):
+    :param mv_image_root_dev the root device of the Metavisor AMI, if the
+        caller has already looked it up
+    :return the wrapped Instance object
+    """
     instance = aws_svc.get_instance(instance_id)
 
     # If the guest already has /dev/sdf mounted, don't try to put the guest
@@ -184,7 +244,9 @@ def wrap_instance(aws_svc, instance_id, metavisor_ami, instance_config=None):
             instance_id
         )
 
-    mv_image_root_dev = _get_metavisor_root_device(aws_svc, metavisor_ami)
+    if not mv_image_root_dev:
+        mv_image_root_dev = _get_metavisor_root_device(
+            aws_svc, metavisor_ami)
     guest_root_vol = None
     mv_root_vol = None
     completed = False
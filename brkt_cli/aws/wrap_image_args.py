@@ -45,6 +45,24 @@ def setup_wrap_image_args(parser, parsed_config):
     aws_args.add_region(parser, parsed_config)
     aws_args.add_security_group(parser, parsed_config)
     aws_args.add_subnet(parser, parsed_config)
+    parser.add_argument(
+        '--count',
+        metavar='N',
+        type=int,
+        default=1,
+        help='Number of wrapped instances to launch'
+    )
+    parser.add_argument(
+        '--fleet-subnet',
+        metavar='ID',
+        dest='fleet_subnet_ids',
+        action='append',
+        help=(
+            'Spread the wrapped instances across this subnet, in addition '
+            'to the one specified by --subnet.  May be specified multiple '
+            'times.'
+        )
+    )
     aws_args.add_aws_tag(parser)
     aws_args.add_metavisor_version(parser)
     aws_args.add_key(parser, help='SSH key pair name')
@@ -0,0 +1,172 @@
+# Copyright 2017 Bracket Computing, Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License").
+# You may not use this file except in compliance with the License.
+# A copy of the License is located at
+#
+# https://github.com/brkt/brkt-cli/blob/master/LICENSE
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Create boto3 clients and resources from a single shared session.
+
+Creating a boto3 client loads the service model and builds an endpoint,
+which is a measurable part of the time that brkt-cli spends in AWS calls.
+Creating clients from the same session in several threads at once is not
+safe.  ClientFactory creates each client the first time that it's needed,
+caches it by service, region, signing and proxy settings, and serializes
+creation with a lock.  A boto3 client is thread-safe once it's created,
+so cached clients are shared by all threads.  Resource objects are not
+thread-safe, so resource() returns a new resource that uses the cached
+client.
+"""
+
+import logging
+import os
+import threading
+
+import boto3.session
+import botocore
+from botocore.config import Config
+
+log = logging.getLogger(__name__)
+
+# The size of each client's connection pool, when no more than this many
+# threads make calls at the same time.  This is the botocore default.
+DEFAULT_MAX_POOL_CONNECTIONS = 10
+
+# The number of times that botocore retries throttling errors and
+# transient network errors.  More threads make throttling more likely, so
+# more retries are allowed when the concurrency level is higher than
+# DEFAULT_MAX_POOL_CONNECTIONS.
+DEFAULT_MAX_ATTEMPTS = 5
+HIGH_CONCURRENCY_MAX_ATTEMPTS = 10
+
+# botocore reads the proxy settings from the environment when a client is
+# created.
+_PROXY_VARIABLES = (
+    'HTTP_PROXY', 'HTTPS_PROXY', 'NO_PROXY',
+    'http_proxy', 'https_proxy', 'no_proxy'
+)
+
+
+def _proxy_environment():
+    return tuple(os.environ.get(name) for name in _PROXY_VARIABLES)
+
+
+class ClientFactory(object):
+    """ Create and cache the boto3 clients for a single session.  The
+    session, and therefore the credentials, is shared by every client that
+    the factory creates.
+    """
+
+    def __init__(self, session=None,
+                 max_pool_connections=DEFAULT_MAX_POOL_CONNECTIONS):
+        self._session = session
+        self.max_pool_connections = max_pool_connections
+        self.max_attempts = DEFAULT_MAX_ATTEMPTS
+        self._clients = {}
+        self._resource_classes = {}
+        self._lock = threading.Lock()
+
+    @property
+    def session(self):
+        with self._lock:
+            return self._get_session()
+
+    def _get_session(self):
+        if not self._session:
+            self._session = boto3.session.Session()
+        return self._session
+
+    def set_max_concurrency(self, n):
+        """ Size the connection pools and retries for n threads that make
+        calls with the same client.  Clients that were already created
+        are discarded, so that new clients get the larger pools.
+        """
+        with self._lock:
+            if n <= self.max_pool_connections:
+                return
+            log.debug('Setting max_pool_connections to %d', n)
+            self.max_pool_connections = n
+            self.max_attempts = HIGH_CONCURRENCY_MAX_ATTEMPTS
+            self._clients.clear()
+
+    def _config(self, unsigned):
+        kwargs = {
+            'max_pool_connections': self.max_pool_connections,
+            'retries': {'max_attempts': self.max_attempts}
+        }
+        if unsigned:
+            kwargs['signature_version'] = botocore.UNSIGNED
+        return Config(**kwargs)
+
+    def client(self, service_name, region_name=None, unsigned=False):
+        """ Return the client for the given service and region, creating
+        it if necessary.
+
+        :param unsigned if True, requests are not signed.  This is used to
+            read from public S3 buckets without credentials.
+        """
+        key = (service_name, region_name, unsigned, _proxy_environment())
+        with self._lock:
+            client = self._clients.get(key)
+            if not client:
+                log.debug(
+                    'Creating %s client for region %s', service_name,
+                    region_name)
+                client = self._get_session().client(
+                    service_name,
+                    region_name=region_name,
+                    config=self._config(unsigned)
+                )
+                self._clients[key] = client
+            return client
+
+    def resource(self, service_name, region_name=None, unsigned=False):
+        """ Return a new service resource for the given service and region,
+        which uses the cached client.
+        """
+        client = self.client(
+            service_name, region_name=region_name, unsigned=unsigned)
+        with self._lock:
+            cls = self._resource_classes.get(service_name)
+            if not cls:
+                # The resource class is built from the resource model.
+                # Build it once, and instantiate it on top of the cached
+                # client each time.
+                resource = self._get_session().resource(
+                    service_name,
+                    region_name=region_name,
+                    config=self._config(unsigned)
+                )
+                cls = resource.__class__
+                self._resource_classes[service_name] = cls
+        return cls(client=client)
+
+
+_factory = ClientFactory()
+
+
+def get_factory():
+    """ Return the ClientFactory that is shared by the whole process. """
+    return _factory
+
+
+def client(service_name, region_name=None, unsigned=False):
+    return _factory.client(
+        service_name, region_name=region_name, unsigned=unsigned)
+
+
+def resource(service_name, region_name=None, unsigned=False):
+    return _factory.resource(
+        service_name, region_name=region_name, unsigned=unsigned)
+
+
+def set_max_concurrency(n):
+    _factory.set_max_concurrency(n)
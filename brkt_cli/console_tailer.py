@@ -0,0 +1,157 @@
+# Copyright 2017 Bracket Computing, Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License").
+# You may not use this file except in compliance with the License.
+# A copy of the License is located at
+#
+# https://github.com/brkt/brkt-cli/blob/master/LICENSE
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Watch the console output of an instance while it runs.
+
+The encryption status is only available once Metavisor has brought up
+networking.  If Metavisor panics during boot, brkt-cli would otherwise wait
+for the full encryption start timeout before failing.  ConsoleTailer
+fetches the console output in a background thread, writes new lines to
+the debug log, and remembers the first line that matches a fatal pattern.
+The code that waits for encryption calls check(), which raises
+EncryptionError as soon as a fatal line has been seen.
+"""
+
+import logging
+import re
+import threading
+
+from brkt_cli.encryptor_service import EncryptionError
+
+log = logging.getLogger(__name__)
+
+# The number of seconds between console output fetches.
+DEFAULT_POLL_INTERVAL = 15
+
+# Console lines that mean that the instance will never finish booting.
+FATAL_CONSOLE_PATTERNS = (
+    r'panic: ',
+    r'Fatal trap \d+',
+    r'Fatal double fault',
+    r'mountroot>',
+    r'Kernel panic',
+)
+
+# The number of bytes from the start of the console output that are used to
+# find where it overlaps with the previous output.
+_HEAD_SIZE = 16
+
+
+class SnapshotDiffer(object):
+    """ Return the new text in console output that is fetched as a
+    snapshot of the whole console buffer, such as EC2 GetConsoleOutput.
+    The buffer is truncated at the front when it gets full, so new output
+    is found after the end of the previously seen output.
+    """
+
+    def __init__(self, get_output):
+        """
+        :param get_output a function that returns the current console
+            output, or None if it's not available
+        """
+        self.get_output = get_output
+        self.previous = ''
+
+    def __call__(self):
+        output = self.get_output() or ''
+        previous = self.previous
+        self.previous = output
+        if output.startswith(previous):
+            return output[len(previous):]
+        # Find the longest end of the previous output that the new output
+        # starts with.
+        head = output[:_HEAD_SIZE]
+        index = previous.find(head) if head else -1
+        while index >= 0:
+            if output.startswith(previous[index:]):
+                return output[len(previous) - index:]
+            index = previous.find(head, index + 1)
+        return output
+
+
+class ConsoleTailer(object):
+
+    def __init__(self, fetch, name, interval=DEFAULT_POLL_INTERVAL,
+                 patterns=FATAL_CONSOLE_PATTERNS):
+        """
+        :param fetch a function that returns the console output that was
+            written since the previous call
+        :param name the instance name or id, used in log messages
+        """
+        self.fetch = fetch
+        self.name = name
+        self.interval = interval
+        self.regexp = re.compile('|'.join(patterns))
+        self.fatal_line = None
+        self._partial = ''
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def poll(self):
+        """ Fetch new console output, log the new lines and check them
+        for fatal patterns.
+
+        :return the new complete lines
+        """
+        text = self._partial + (self.fetch() or '')
+        lines = text.split('\n')
+        # Keep the last line until it's complete.
+        self._partial = lines.pop()
+        for line in lines:
+            line = line.rstrip('\r')
+            log.debug('%s console: %s', self.name, line)
+            if self.fatal_line is None and self.regexp.search(line):
+                log.error('Fatal error on %s console: %s', self.name, line)
+                self.fatal_line = line
+        return lines
+
+    def _run(self):
+        while not self._stopped.is_set():
+            try:
+                self.poll()
+            except Exception as e:
+                log.debug(
+                    'Unable to get console output for %s: %s', self.name, e)
+            if self.fatal_line is not None:
+                return
+            self._stopped.wait(self.interval)
+
+    def start(self):
+        self._thread = threading.Thread(
+            target=self._run, name='console-' + self.name)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+    def check(self):
+        """ Raise EncryptionError if a fatal console line has been seen.
+        """
+        if self.fatal_line is not None:
+            raise EncryptionError(
+                'Fatal error on the console of %s: %s' %
+                (self.name, self.fatal_line.strip())
+            )
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
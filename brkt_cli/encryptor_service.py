@@ -13,12 +13,17 @@
 # limitations under the License.
 
 import abc
+import httplib
 import json
 import logging
+import Queue
+import socket
+import threading
 import time
-import urllib2
+import urllib
+import urlparse
 
-from brkt_cli import validation
+from brkt_cli import trace, validation
 from brkt_cli.util import (
     BracketError,
     Deadline,
@@ -34,6 +39,10 @@ ENCRYPT_FAILED = 'failed'
 ENCRYPT_ENCRYPTING = 'encrypting'
 ENCRYPTOR_STATUS_PORT = 80
 
+# The range of seconds between attempts to contact the encryption service.
+PROBE_MIN_DELAY = 1
+PROBE_MAX_DELAY = 10
+
 FAILURE_CODE_AWS_PERMISSIONS = 'insufficient_aws_permissions'
 FAILURE_CODE_GET_YETI_CONFIG = 'failed_get_yeti_config'
 FAILURE_CODE_INVALID_NTP_SERVERS = 'invalid_ntp_servers'
@@ -89,7 +98,49 @@ class EncryptorConnectionError(Exception):
         super(EncryptorConnectionError, self).__init__(msg)
 
 
+def _is_private_address(hostname):
+    """ Return True if hostname is a private or loopback IPv4 address. """
+    try:
+        octets = [ord(c) for c in socket.inet_aton(hostname)]
+    except socket.error:
+        return False
+    return (
+        octets[0] in (10, 127) or
+        (octets[0] == 172 and 16 <= octets[1] <= 31) or
+        (octets[0] == 192 and octets[1] == 168)
+    )
+
+
+def _get_proxy(hostname):
+    """ Return the (host, port) of the HTTP proxy that is used to reach
+    hostname, or None if hostname is reached directly.  Private addresses
+    are always reached directly, since a proxy outside the VPC can't
+    reach them.
+    """
+    if _is_private_address(hostname) or urllib.proxy_bypass(hostname):
+        return None
+    proxy = urllib.getproxies().get('http')
+    if not proxy:
+        return None
+    if '://' not in proxy:
+        proxy = 'http://' + proxy
+    parsed = urlparse.urlparse(proxy)
+    return parsed.hostname, parsed.port or 80
+
+
 class EncryptorService(BaseEncryptorService):
+    """ Gets the encryption status from the encryptor instance.
+
+    The first request is sent to all of the hostnames at the same time.
+    The first one that responds is used from then on, over a persistent
+    connection.  Each service has its own connections and proxy settings,
+    so the process environment is not modified.
+    """
+
+    def __init__(self, hostnames, port=ENCRYPTOR_STATUS_PORT):
+        super(EncryptorService, self).__init__(hostnames, port)
+        # The connection to the hostname that responded first.
+        self._connection = None
 
     def is_encryptor_up(self):
         try:
@@ -100,54 +151,152 @@ class EncryptorService(BaseEncryptorService):
             log.debug("Couldn't get encryptor status: %s", e)
             return False
 
-    def get_status(self, timeout_secs=2):
-        exceptions_by_host = {}
-        info = None
-        successful_hostname = None
+    def _connect(self, hostname, timeout_secs):
+        proxy = _get_proxy(hostname)
+        if proxy:
+            log.debug('Connecting to %s through proxy %s:%d',
+                      hostname, proxy[0], proxy[1])
+            return httplib.HTTPConnection(
+                proxy[0], proxy[1], timeout=timeout_secs)
+        return httplib.HTTPConnection(
+            hostname, self.port, timeout=timeout_secs)
+
+    def _request(self, conn, hostname):
+        """ Send the status request over the given connection.
+
+        :return the response body
+        :raise IOError or HTTPException if the request failed
+        """
+        if _get_proxy(hostname):
+            url = 'http://%s:%d/' % (hostname, self.port)
+        else:
+            url = '/'
+        conn.request('GET', url)
+        r = conn.getresponse()
+        data = r.read()
+        if r.status != 200:
+            raise IOError('HTTP %d %s' % (r.status, r.reason))
+        return data
+
+    def _race(self, timeout_secs):
+        """ Send the status request to all hostnames at the same time.
+        Keep the connection to the first hostname that responds.
+
+        :return the response body
+        :raise EncryptorConnectionError if no hostname responded
+        """
+        results = Queue.Queue()
+        lock = threading.Lock()
+        winner = []
+
+        def _probe(hostname):
+            conn = self._connect(hostname, timeout_secs)
+            try:
+                data = self._request(conn, hostname)
+            except (IOError, httplib.HTTPException) as e:
+                conn.close()
+                results.put((hostname, None, e))
+                return
+            with lock:
+                won = not winner
+                if won:
+                    winner.append(hostname)
+            if won:
+                results.put((hostname, conn, data))
+            else:
+                conn.close()
 
         for hostname in self.hostnames:
-            url = 'http://%s:%d' % (hostname, self.port)
+            t = threading.Thread(target=_probe, args=(hostname,))
+            t.daemon = True
+            t.start()
+
+        exceptions_by_host = {}
+        while len(exceptions_by_host) < len(self.hostnames):
             try:
-                r = urllib2.urlopen(url, timeout=timeout_secs)
-                data = r.read()
-            except IOError as e:
-                log.debug(
-                    'Unable to connect to %s:%s - %s',
-                    hostname, self.port, e)
-                exceptions_by_host[hostname] = e
-                continue
-
-            info = json.loads(data)
-            info['percent_complete'] = 0
-            bytes_total = info.get('bytes_total')
-            if info['state'] == ENCRYPT_SUCCESSFUL:
-                info['percent_complete'] = 100
-            elif ((bytes_total is not None) and
-                  (bytes_total > 0)):
-                ratio = float(info['bytes_written']) / info['bytes_total']
-                info['percent_complete'] = int(100 * ratio)
-            successful_hostname = hostname
-            break
-
-        if info:
-            # Don't try the other hostnames again, now that we have one that
-            # is known to work.
-            self.hostnames = [successful_hostname]
-            return info
-        else:
-            raise EncryptorConnectionError(self.port, exceptions_by_host)
+                hostname, conn, result = results.get(
+                    timeout=timeout_secs + 1)
+            except Queue.Empty:
+                break
+            if conn:
+                log.debug('Using %s:%s for encryptor status',
+                          hostname, self.port)
+                # Don't try the other hostnames again, now that we have
+                # one that is known to work.
+                self.hostnames = [hostname]
+                self._connection = conn
+                return result
+            log.debug(
+                'Unable to connect to %s:%s - %s', hostname, self.port, result)
+            exceptions_by_host[hostname] = result
 
+        with lock:
+            # Any probe that finishes from now on is too late.
+            winner.append(None)
+        for hostname in self.hostnames:
+            if hostname not in exceptions_by_host:
+                exceptions_by_host[hostname] = IOError('timed out')
+        raise EncryptorConnectionError(self.port, exceptions_by_host)
 
-def wait_for_encryptor_up(enc_svc, deadline):
+    def _get_pinned(self, timeout_secs):
+        hostname = self.hostnames[0]
+        try:
+            return self._request(self._connection, hostname)
+        except (IOError, httplib.HTTPException) as e:
+            log.debug(
+                'Request to %s:%s failed, reconnecting - %s',
+                hostname, self.port, e)
+            self._connection.close()
+        # The encryptor may have closed the idle connection.  Try once
+        # more on a new one.
+        self._connection = self._connect(hostname, timeout_secs)
+        try:
+            return self._request(self._connection, hostname)
+        except (IOError, httplib.HTTPException) as e:
+            log.debug(
+                'Unable to connect to %s:%s - %s', hostname, self.port, e)
+            raise EncryptorConnectionError(self.port, {hostname: e})
+
+    def get_status(self, timeout_secs=2):
+        if self._connection:
+            data = self._get_pinned(timeout_secs)
+        else:
+            data = self._race(timeout_secs)
+
+        info = json.loads(data)
+        info['percent_complete'] = 0
+        bytes_total = info.get('bytes_total')
+        if info['state'] == ENCRYPT_SUCCESSFUL:
+            info['percent_complete'] = 100
+        elif ((bytes_total is not None) and
+              (bytes_total > 0)):
+            ratio = float(info['bytes_written']) / info['bytes_total']
+            info['percent_complete'] = int(100 * ratio)
+        return info
+
+
+@trace.traced()
+def wait_for_encryptor_up(enc_svc, deadline, check=None):
+    """ Wait for the encryption service to respond.
+
+    :param check a function that is called while waiting, which raises an
+        exception to stop waiting early
+    """
     start = time.time()
+    delay = PROBE_MIN_DELAY
     while not deadline.is_expired():
+        if check:
+            check()
         if enc_svc.is_encryptor_up():
             log.debug(
                 'Encryption service is up after %.1f seconds',
                 time.time() - start
             )
             return
-        sleep(5)
+        # Probe often at first, in case the encryptor is already up, and
+        # back off while it boots.
+        sleep(delay)
+        delay = min(delay * 2, PROBE_MAX_DELAY)
     raise EncryptionError(
         'Unable to contact encryptor instance at %s, port %d.' %
         (', '.join(enc_svc.hostnames), enc_svc.port)
@@ -198,8 +347,15 @@ def _handle_failure_code(failure_code):
     raise EncryptionError(msg)
 
 
+@trace.traced()
 def wait_for_encryption(enc_svc,
-                        progress_timeout=ENCRYPTION_PROGRESS_TIMEOUT):
+                        progress_timeout=ENCRYPTION_PROGRESS_TIMEOUT,
+                        check=None):
+    """ Wait for encryption to finish.
+
+    :param check a function that is called while waiting, which raises an
+        exception to stop waiting early
+    """
     err_count = 0
     max_errs = 10
     start_time = time.time()
@@ -209,6 +365,8 @@ def wait_for_encryption(enc_svc,
     last_state = ''
 
     while err_count < max_errs:
+        if check:
+            check()
         try:
             status = enc_svc.get_status()
             err_count = 0
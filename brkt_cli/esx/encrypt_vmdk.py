@@ -27,6 +27,7 @@ Before running brkt encrypt-vmdk, do "pip install pyvmomi".
 """
 
 import logging
+from brkt_cli import trace
 from brkt_cli.encryptor_service import (
     wait_for_encryptor_up,
     wait_for_encryption,
@@ -43,6 +44,7 @@ from brkt_cli.util import CRYPTO_XTS
 log = logging.getLogger(__name__)
 
 
+@trace.traced()
 def create_ovf_image_from_mv_vm(vc_swc, enc_svc_cls, vm, guest_vmdk,
                                 crypto_policy, vm_name=None, create_ovf=False,
                                 create_ova=False, target_path=None,
@@ -178,6 +180,7 @@ def create_ovf_image_from_mv_vm(vc_swc, enc_svc_cls, vm, guest_vmdk,
         log.info("Done")
 
 
+@trace.traced()
 def encrypt_from_s3(vc_swc, enc_svc_cls, guest_vmdk, crypto_policy,
                     vm_name=None, create_ovf=False, create_ova=False,
                     target_path=None, image_name=None, ovftool_path=None,
@@ -207,6 +210,7 @@ def encrypt_from_s3(vc_swc, enc_svc_cls, guest_vmdk, crypto_policy,
                                 serial_port_file_name, status_port, static_ip)
 
 
+@trace.traced()
 def encrypt_from_local_ovf(vc_swc, enc_svc_cls, guest_vmdk, crypto_policy,
                            vm_name=None, create_ovf=False, create_ova=False,
                             target_path=None, image_name=None, ovftool_path=None,
@@ -244,6 +248,7 @@ def encrypt_from_local_ovf(vc_swc, enc_svc_cls, guest_vmdk, crypto_policy,
                                 status_port, static_ip)
 
 
+@trace.traced()
 def encrypt_from_vmdk(vc_swc, enc_svc_cls, guest_vmdk, crypto_policy,
                       vm_name=None, create_ovf=False, create_ova=False,
                       target_path=None, image_name=None, ovftool_path=None,
@@ -19,19 +19,19 @@ import datetime
 import ssl
 import atexit
 import os
+import re
 import signal
 import hashlib
 import requests
 import socket
 import struct
+import tarfile
 import xml.etree.ElementTree
 from functools import wraps
 from operator import attrgetter
 from threading import Thread
 from httplib import BadStatusLine
 
-import boto3
-from botocore.handlers import disable_signing
 from pyVim import connect
 from pyVmomi import vmodl
 from pyVmomi import vim
@@ -42,8 +42,10 @@ from brkt_cli.util import (
     validate_ip_address,
     validate_dns_name_ip_address
 )
+from brkt_cli import aws_clients
 from brkt_cli import crypto
 from brkt_cli import mv_version
+from brkt_cli import trace
 from brkt_cli.instance_config import INSTANCE_UPDATER_MODE
 from brkt_cli.validation import ValidationError
 
@@ -83,6 +85,131 @@ def compute_sha1_of_file(filename):
     return hash_sha1.hexdigest()
 
 
+def parse_ovf_manifest(contents):
+    """ Parse the contents of an OVF manifest.  Each line of the manifest
+    is in the form ALGORITHM(file name)= digest, for example
+    SHA1(disk1.vmdk)= 3b5f...
+
+    :return a dictionary that maps file name to an (algorithm, digest) tuple
+    """
+    digests = dict()
+    for line in contents.splitlines():
+        m = re.match(r'\s*(\w+)\((.+)\)\s*=\s*([0-9a-fA-F]+)\s*$', line)
+        if m:
+            digests[m.group(2)] = (m.group(1).lower(), m.group(3).lower())
+    return digests
+
+
+class HashingReader(object):
+    """ File-like wrapper that hashes the data as it is read.  The length
+    is known up front, so that requests can send a Content-Length header
+    when the reader is used as a request body.
+    """
+    def __init__(self, fileobj, size, algorithm='sha1'):
+        self.fileobj = fileobj
+        self.size = size
+        self.algorithm = algorithm
+        self.hash = hashlib.new(algorithm)
+
+    def __len__(self):
+        return self.size
+
+    def __nonzero__(self):
+        # requests drops a request body that is false, so an empty disk
+        # would otherwise be posted without one.
+        return True
+
+    def read(self, size=None):
+        if size is None or size < 0:
+            data = self.fileobj.read()
+        else:
+            data = self.fileobj.read(size)
+        self.hash.update(data)
+        return data
+
+    def hexdigest(self):
+        return self.hash.hexdigest()
+
+
+class OvaReader(object):
+    """ Reads the contents of an OVA sequentially, without extracting it
+    to disk.  The OVF spec requires the descriptor to be the first file
+    in the archive, optionally followed by the manifest and certificate,
+    and then the disks.
+    """
+    def __init__(self, fileobj):
+        self.tar = tarfile.open(fileobj=fileobj, mode='r|')
+        self.manifest = dict()
+        self.descriptor_name = None
+        self.descriptor = None
+        self._next_member = None
+
+    def _read_member(self, member):
+        return self.tar.extractfile(member).read()
+
+    def read_descriptor(self):
+        """ Read the OVF descriptor and manifest from the beginning of
+        the OVA.
+
+        :return the OVF descriptor as a string
+        :raise ValidationError if the OVA does not start with an OVF
+            descriptor
+        """
+        member = self.tar.next()
+        if member is None or not member.name.endswith('.ovf'):
+            raise ValidationError(
+                'OVA does not start with an OVF descriptor')
+        self.descriptor_name = member.name
+        self.descriptor = self._read_member(member)
+
+        member = self.tar.next()
+        if member is not None and member.name.endswith('.mf'):
+            self.manifest = parse_ovf_manifest(self._read_member(member))
+            member = self.tar.next()
+        self._next_member = member
+        return self.descriptor
+
+    def disks(self):
+        """ Generate a (file name, HashingReader) tuple for each remaining
+        file in the OVA.  Each reader must be consumed before the
+        generator is advanced.
+        """
+        member = self._next_member
+        self._next_member = None
+        while member is not None:
+            if member.isfile() and not member.name.endswith('.cert'):
+                algorithm = self.manifest.get(member.name, ('sha1',))[0]
+                reader = HashingReader(
+                    self.tar.extractfile(member), member.size, algorithm)
+                yield member.name, reader
+            member = self.tar.next()
+
+    def verify(self, name, reader):
+        """ Verify the digest of a file that was read with a
+        HashingReader against the manifest.
+
+        :raise ValidationError if the digest does not match
+        """
+        if name not in self.manifest:
+            return
+        algorithm, digest = self.manifest[name]
+        if reader.algorithm != algorithm or reader.hexdigest() != digest:
+            raise ValidationError(
+                "File %s checksum does not match the OVA manifest" % name)
+
+    def verify_descriptor(self):
+        """ Verify the digest of the OVF descriptor against the manifest.
+
+        :raise ValidationError if the digest does not match
+        """
+        if self.descriptor_name not in self.manifest:
+            return
+        algorithm, digest = self.manifest[self.descriptor_name]
+        if hashlib.new(algorithm, self.descriptor).hexdigest() != digest:
+            raise ValidationError(
+                "OVF descriptor checksum does not match the OVA manifest")
+
+
 class StaticIPConfiguration(object):
     def __init__(self, ip, mask, gw, dns, dns_domain):
         self.ip = ip
@@ -301,6 +428,11 @@ class BaseVCenterService(object):
     def upload_ovf_to_vcenter(self, target_path, ovf_name, vm_name=None):
         pass
 
+    @abc.abstractmethod
+    def upload_ova_to_vcenter(self, ova_path, vm_name=None,
+                              validate_mf=False):
+        pass
+
     @abc.abstractmethod
     def get_vm_name(self, vm):
         pass
@@ -406,6 +538,7 @@ class VCenterService(BaseVCenterService):
                                            port=self.port)
         atexit.register(connect.Disconnect, self.si)
 
+    @trace.traced(category=trace.API)
     def connect(self):
         func = None
         try:
@@ -521,6 +654,7 @@ class VCenterService(BaseVCenterService):
         vm = self.__get_obj(content, [vim.VirtualMachine], vm_name)
         return vm
 
+    @trace.traced(category=trace.API)
     def power_on(self, vm):
         self.validate_connection()
         if format(vm.runtime.powerState) == "poweredOn":
@@ -528,6 +662,7 @@ class VCenterService(BaseVCenterService):
         task = vm.PowerOnVM_Task()
         self.__wait_for_task(task)
 
+    @trace.traced(category=trace.API)
     def power_off(self, vm):
         self.validate_connection()
         if format(vm.runtime.powerState) != "poweredOn":
@@ -535,6 +670,7 @@ class VCenterService(BaseVCenterService):
         task = vm.PowerOffVM_Task()
         self.__wait_for_task(task)
 
+    @trace.traced(category=trace.API)
     def destroy_vm(self, vm):
         self.validate_connection()
         log.info("Destroying VM %s", vm.config.name)
@@ -553,6 +689,7 @@ class VCenterService(BaseVCenterService):
             task = f.DeleteDatastoreFile_Task(vm_disk_name, datacenter)
         self.__wait_for_task(task)
 
+    @trace.traced(category=trace.API)
     def get_ip_address(self, vm):
         self.validate_connection()
         retry = 0
@@ -563,6 +700,7 @@ class VCenterService(BaseVCenterService):
             retry = retry + 1
         return (vm.guest.ipAddress)
 
+    @trace.traced(category=trace.API)
     def create_vm(self, memoryGB=1, numCPUs=1, vm_name=None):
         self.validate_connection()
         content = self.si.RetrieveContent()
@@ -615,6 +753,7 @@ class VCenterService(BaseVCenterService):
         vm = self.__get_obj(content, [vim.VirtualMachine], vm_name)
         return vm
 
+    @trace.traced(category=trace.API)
     def reconfigure_vm_cpu_ram(self, vm):
         self.validate_connection()
         vm_name = vm.config.name
@@ -624,6 +763,7 @@ class VCenterService(BaseVCenterService):
         task = vm.ReconfigVM_Task(spec=spec)
         self.__wait_for_task(task)
 
+    @trace.traced(category=trace.API)
     def configure_static_ip(self, vm, static_ip):
         self.validate_connection()
         log.info("Configuring static IP address")
@@ -679,6 +819,7 @@ class VCenterService(BaseVCenterService):
         task = vm.ReconfigVM_Task(spec=spec)
         self.__wait_for_task(task)
 
+    @trace.traced(category=trace.API)
     def add_serial_port_to_file(self, vm, filename):
         self.validate_connection()
         content = self.si.RetrieveContent()
@@ -700,6 +841,7 @@ class VCenterService(BaseVCenterService):
         self.__wait_for_task(task)
         log.info("Console messages will be dumped to file %s", filename)
 
+    @trace.traced(category=trace.API)
     def delete_serial_port_to_file(self, vm, filename):
         self.validate_connection()
         delete_device = None
@@ -722,6 +864,7 @@ class VCenterService(BaseVCenterService):
         log.info("Console message will no longer be dumped to file %s",
                  filename)
 
+    @trace.traced(category=trace.API)
     def add_cdrom(self, vm=None):
         self.validate_connection()
         # Find the IDE controller
@@ -751,6 +894,7 @@ class VCenterService(BaseVCenterService):
         task = vm.Reconfigure(configSpec)
         self.__wait_for_task(task)
 
+    @trace.traced(category=trace.API)
     def add_disk(self, vm, disk_size=12*1024*1024,
                  filename=None, unit_number=0):
         self.validate_connection()
@@ -790,6 +934,7 @@ class VCenterService(BaseVCenterService):
         else:
             log.info("%dKB empty disk added to %s", disk_size, vm.config.name)
 
+    @trace.traced(category=trace.API)
     def detach_disk(self, vm, unit_number=2):
         self.validate_connection()
         delete_device = None
@@ -814,6 +959,7 @@ class VCenterService(BaseVCenterService):
                  unit_number, vm.config.name)
         return delete_device
 
+    @trace.traced(category=trace.API)
     def clone_disk(self, source_disk=None, source_disk_name=None,
                    dest_disk=None, dest_disk_name=None):
         self.validate_connection()
@@ -856,6 +1002,7 @@ class VCenterService(BaseVCenterService):
         self.__wait_for_task(task)
         return dest_disk_name
 
+    @trace.traced(category=trace.API)
     def delete_disk(self, disk_name):
         self.validate_connection()
         content = self.si.RetrieveContent()
@@ -892,6 +1039,7 @@ class VCenterService(BaseVCenterService):
         raise Exception("Did not find disk at %d of VM %s" %
                         (unit_number, vm.config.name))
 
+    @trace.traced(category=trace.API)
     def clone_vm(self, vm, powerOn=False, vm_name=None, template=False):
         self.validate_connection()
         if self.esx_host:
@@ -960,6 +1108,7 @@ class VCenterService(BaseVCenterService):
             log.exception("Failed to create user-data %s" % e)
             raise
 
+    @trace.traced(category=trace.API)
     def send_userdata(self, vm, user_data_str):
         self.validate_connection()
         spec = vim.vm.ConfigSpec()
@@ -988,6 +1137,7 @@ class VCenterService(BaseVCenterService):
             except:
                 return
 
+    @trace.traced()
     def export_to_ovf(self, vm, target_path, ovf_name=None):
         self.validate_connection()
         if (os.path.exists(target_path) is False):
@@ -1053,6 +1203,7 @@ class VCenterService(BaseVCenterService):
             lease.HttpNfcLeaseComplete()
         return ovf_path
 
+    @trace.traced()
     def convert_ovf_to_ova(self, ovftool_path, ovf_path):
         ova_list = list(ovf_path)
         ova_list[len(ova_list)-1] = 'a'
@@ -1067,6 +1218,7 @@ class VCenterService(BaseVCenterService):
                      % (ovf_path, e))
         return ova_path
 
+    @trace.traced()
     def convert_ova_to_ovf(self, ovftool_path, ova_path):
         ovf_list = list(ova_path)
         ovf_list[len(ovf_list)-1] = 'f'
@@ -1083,39 +1235,10 @@ class VCenterService(BaseVCenterService):
                 return ovfd
         return None
 
-    def upload_ovf_to_vcenter(self, target_path, ovf_name,
-                              vm_name=None, validate_mf=True):
-        self.validate_connection()
-        vm = None
-        content = self.si.RetrieveContent()
-        manager = self.si.content.ovfManager
-        ovf_path = os.path.join(target_path, ovf_name)
-        if validate_mf:
-            # Load checksums for each file
-            mf_checksum = None
-            if ovf_name.endswith('.ovf'):
-                mf_file_name = ovf_name[:ovf_name.find(".ovf")] + "-brkt.mf"
-            else:
-                mf_file_name = ovf_name + '-brkt.mf'
-            mf_path = os.path.join(target_path, mf_file_name)
-            # Deprecate this code over time
-            if not os.path.exists(mf_path):
-                if ovf_name.endswith('.ovf'):
-                    mf_file_name = ovf_name[:ovf_name.find(".ovf")] + ".mf"
-                else:
-                    mf_file_name = ovf_name + '.mf'
-                mf_path = os.path.join(target_path, mf_file_name)
-            # end deprecate code
-            with open(mf_path, 'r') as mf_file:
-                mf_checksum = json.load(mf_file)
-            # Validate ovf file
-            ovf_checksum = mf_checksum[(os.path.split(ovf_path))[1]]
-            if ovf_checksum != compute_sha1_of_file(ovf_path):
-                raise ValidationError("OVF file checksum does not match. "
-                                      "Validate the Metavisor OVF image.")
-        # Load the OVF file
-        spec_params = vim.OvfManager.CreateImportSpecParams()
-        ovfd = self.get_ovf_descriptor(ovf_path)
+    def _prepare_ovf_descriptor(self, ovfd):
+        """ Remove the network interfaces (and the property section on an
+        ESX host) from the given OVF descriptor.
+        """
         e = xml.etree.ElementTree.fromstring(ovfd)
         for child in e:
             if "VirtualSystem" in child.tag:
@@ -1135,7 +1258,18 @@ class VCenterService(BaseVCenterService):
                                             found = True
                             if found:
                                 child_2.remove(child_3)
-        ovfd = xml.etree.ElementTree.tostring(e)
+        return xml.etree.ElementTree.tostring(e)
+
+    def _import_vapp(self, content, ovfd, vm_name):
+        """ Create the import spec for the given OVF descriptor and start
+        importing it into vCenter.
+
+        :return a tuple of the import spec result and the HttpNfcLease,
+            once the lease is ready for the disks to be uploaded
+        """
+        manager = self.si.content.ovfManager
+        spec_params = vim.OvfManager.CreateImportSpecParams()
+        ovfd = self._prepare_ovf_descriptor(ovfd)
         datacenter = self.__get_obj(content, [vim.Datacenter],
                                     self.datacenter_name)
         datastore = self.__get_obj(content, [vim.Datastore],
@@ -1148,9 +1282,6 @@ class VCenterService(BaseVCenterService):
                                                resource_pool,
                                                datastore,
                                                spec_params)
-        timestamp = datetime.datetime.utcnow().isoformat() + 'Z'
-        if vm_name is None:
-            vm_name = "Encryptor-VM-" + timestamp
         if import_spec.importSpec is None or \
            import_spec.importSpec.configSpec is None:
            log.error("Import specification error %s warning %s",
@@ -1203,6 +1334,64 @@ class VCenterService(BaseVCenterService):
                                   name="keepalive-upload")
         keepalive_thread.daemon = True
         keepalive_thread.start()
+        return import_spec, lease
+
+    def _upload_disk(self, device_url, data):
+        """ Upload the disk contents to the device URL of an import lease.
+        data is either an open file or a file-like object that supports
+        read() and len().
+        """
+        dev_url = device_url.url
+        if self.esx_host:
+            host_name = "https://" + self.host
+            dev_url = device_url.url.replace("https://*", host_name)
+        headers = {"Content-Type" : "application/x-vnd.vmware-streamVmdk",
+                   "Connection" : "Keep-Alive"}
+        if data is not None and hasattr(data, '__len__'):
+            # requests leaves out the Content-Length of an empty body,
+            # so set it here for zero-length disks.
+            headers["Content-Length"] = str(len(data))
+        # Disable verification as VMDK upload happens directly
+        # to the ESX host.
+        return requests.post(dev_url, data=data, verify=False,
+                             headers=headers)
+
+    @trace.traced()
+    def upload_ovf_to_vcenter(self, target_path, ovf_name,
+                              vm_name=None, validate_mf=True):
+        self.validate_connection()
+        vm = None
+        content = self.si.RetrieveContent()
+        ovf_path = os.path.join(target_path, ovf_name)
+        if validate_mf:
+            # Load checksums for each file
+            mf_checksum = None
+            if ovf_name.endswith('.ovf'):
+                mf_file_name = ovf_name[:ovf_name.find(".ovf")] + "-brkt.mf"
+            else:
+                mf_file_name = ovf_name + '-brkt.mf'
+            mf_path = os.path.join(target_path, mf_file_name)
+            # Deprecate this code over time
+            if not os.path.exists(mf_path):
+                if ovf_name.endswith('.ovf'):
+                    mf_file_name = ovf_name[:ovf_name.find(".ovf")] + ".mf"
+                else:
+                    mf_file_name = ovf_name + '.mf'
+                mf_path = os.path.join(target_path, mf_file_name)
+            # end deprecate code
+            with open(mf_path, 'r') as mf_file:
+                mf_checksum = json.load(mf_file)
+            # Validate ovf file
+            ovf_checksum = mf_checksum[(os.path.split(ovf_path))[1]]
+            if ovf_checksum != compute_sha1_of_file(ovf_path):
+                raise ValidationError("OVF file checksum does not match. "
+                                      "Validate the Metavisor OVF image.")
+        # Load the OVF file
+        ovfd = self.get_ovf_descriptor(ovf_path)
+        timestamp = datetime.datetime.utcnow().isoformat() + 'Z'
+        if vm_name is None:
+            vm_name = "Encryptor-VM-" + timestamp
+        import_spec, lease = self._import_vapp(content, ovfd, vm_name)
         try:
             count = 0
             for device_url in lease.info.deviceUrl:
@@ -1228,18 +1417,10 @@ class VCenterService(BaseVCenterService):
                                               "Validate the Metavisor OVF image."
                                               % d_file_name)
                 count = count + 1
-                dev_url = device_url.url
-                if self.esx_host:
-                    host_name = "https://" + self.host
-                    dev_url = device_url.url.replace("https://*", host_name)
-                headers = {"Content-Type" : "application/x-vnd.vmware-streamVmdk",
-                           "Connection" : "Keep-Alive"}
                 with open(file_path, 'rb') as f:
-                    # Disable verification as VMDK upload happens directly
-                    # to the ESX host.
-                    retry(requests.post,
+                    retry(self._upload_disk,
                           on=requests.exceptions.ConnectionError)(
-                          dev_url, data=f, verify=False, headers=headers)
+                          device_url, f)
             vm = self.__get_obj(content, [vim.VirtualMachine], vm_name)
         except Exception as e:
             log.error("Exception while uploading OVF %s" % e)
@@ -1253,6 +1434,64 @@ class VCenterService(BaseVCenterService):
             lease.HttpNfcLeaseComplete()
         return vm
 
+    @trace.traced()
+    def upload_ova_to_vcenter(self, ova_path, vm_name=None,
+                              validate_mf=False):
+        """ Import an OVA into vCenter without unpacking it to disk.  The
+        OVA is read sequentially.  The OVF descriptor is parsed as soon
+        as it is read, and each disk is streamed straight from the tar
+        archive to its HttpNfcLease device URL.  If the OVA contains a
+        manifest and validate_mf is True, each file is hashed as it is
+        uploaded and verified against the manifest.
+
+        :return the imported VM
+        """
+        self.validate_connection()
+        vm = None
+        lease = None
+        content = self.si.RetrieveContent()
+        if vm_name is None:
+            timestamp = datetime.datetime.utcnow().isoformat() + 'Z'
+            vm_name = "Encryptor-VM-" + timestamp
+        try:
+            with open(ova_path, 'rb') as ova_file:
+                ova = OvaReader(ova_file)
+                ovfd = ova.read_descriptor()
+                import_spec, lease = self._import_vapp(content, ovfd,
+                                                       vm_name)
+                device_urls = dict(
+                    (d.importKey, d) for d in lease.info.deviceUrl)
+                disks = dict()
+                for file_item in import_spec.fileItem:
+                    disks[file_item.path] = device_urls[file_item.deviceId]
+                for name, reader in ova.disks():
+                    if name not in disks:
+                        log.debug("Skipping %s in %s", name, ova_path)
+                        continue
+                    log.info("Uploading %s from %s", name, ova_path)
+                    self._upload_disk(disks.pop(name), reader)
+                    if validate_mf:
+                        ova.verify(name, reader)
+                if disks:
+                    raise Exception("Disks %s not found in %s" %
+                                    (', '.join(sorted(disks)), ova_path))
+                if validate_mf:
+                    ova.verify_descriptor()
+            vm = self.__get_obj(content, [vim.VirtualMachine], vm_name)
+        except Exception as e:
+            log.error("Exception while uploading OVA %s" % e)
+            if lease:
+                vm = self.__get_obj(content, [vim.VirtualMachine], vm_name)
+                if vm:
+                    lease.HttpNfcLeaseComplete()
+                    self.destroy_vm(vm)
+            raise
+        finally:
+            self.upload_ovf_complete = True
+            if lease:
+                lease.HttpNfcLeaseComplete()
+        return vm
+
     def get_vm_name(self, vm):
         return vm.config.name
 
@@ -1341,6 +1580,7 @@ def need_to_download_from_s3(file_list):
     return fetch_s3_objects
 
 
+@trace.traced()
 def download_ovf_from_s3(bucket_name, version=None, proxy=None):
     log.info("Fetching Metavisor OVF from S3")
     if bucket_name is None:
@@ -1355,10 +1595,8 @@ def download_ovf_from_s3(bucket_name, version=None, proxy=None):
             os.environ["HTTP_PROXY"] = "http://%s:%d" % (proxy.host, proxy.port)
             os.environ["HTTPS_PROXY"] = "https://%s:%d" % (proxy.host, proxy.port)
 
-        s3 = boto3.resource('s3')
-
-        if not (set(['AWS_ACCESS_KEY_ID', 'AWS_SECRET_ACCESS_KEY']) <= set(os.environ)):
-            s3.meta.client.meta.events.register('choose-signer.s3.*', disable_signing)
+        unsigned = not (set(['AWS_ACCESS_KEY_ID', 'AWS_SECRET_ACCESS_KEY']) <= set(os.environ))
+        s3 = aws_clients.resource('s3', unsigned=unsigned)
 
         mv = mv_version.get_version(version=version,
                                     bucket=bucket_name)
@@ -1394,6 +1632,7 @@ def download_ovf_from_s3(bucket_name, version=None, proxy=None):
         raise
 
 
+@trace.traced()
 def launch_mv_vm_from_s3(vc_swc, ovf_name, download_file_list,
                          vm_name=None, cleanup=True):
     # Launch OVF
@@ -13,6 +13,7 @@
 # limitations under the License.
 import logging
 import os
+from brkt_cli import trace
 from brkt_cli.encryptor_service import (
     wait_for_encryptor_up,
     wait_for_encryption,
@@ -28,6 +29,7 @@ from brkt_cli.esx.esx_service import (
 log = logging.getLogger(__name__)
 
 
+@trace.traced()
 def update_ovf_image_mv_vm(vc_swc, enc_svc_cls, guest_vm, mv_vm,
                            template_vm_name, target_path, ovf_name,
                            ova_name, ovftool_path, user_data_str,
@@ -126,6 +128,7 @@ def update_ovf_image_mv_vm(vc_swc, enc_svc_cls, guest_vm, mv_vm,
     log.info("Done")
 
 
+@trace.traced()
 def launch_guest_vm(vc_swc, template_vm_name, target_path, ovf_name,
                     ova_name, ovftool_path):
     log.info("Launching encrypted guest VM")
@@ -133,11 +136,10 @@ def launch_guest_vm(vc_swc, template_vm_name, target_path, ovf_name,
         template_vm = vc_swc.find_vm(template_vm_name)
         vm = vc_swc.clone_vm(template_vm)
     elif ova_name:
+        # Stream the disks straight out of the OVA, rather than
+        # unpacking it with ovftool first.
         ova = os.path.join(target_path, ova_name + ".ova")
-        vc_swc.convert_ova_to_ovf(ovftool_path, ova)
-        ovf_name = ova_name + ".ovf"
-        vm = vc_swc.upload_ovf_to_vcenter(target_path, ovf_name,
-                                          validate_mf=False)
+        vm = vc_swc.upload_ova_to_vcenter(ova)
     elif ovf_name:
         vm = vc_swc.upload_ovf_to_vcenter(target_path, ovf_name + ".ovf",
                                           validate_mf=False)
@@ -147,6 +149,7 @@ def launch_guest_vm(vc_swc, template_vm_name, target_path, ovf_name,
     return vm
 
 
+@trace.traced()
 def update_from_s3(vc_swc, enc_svc_cls, template_vm_name=None,
                    target_path=None, ovf_name=None, ova_name=None,
                    ovftool_path=None, mv_ovf_name=None,
@@ -183,6 +186,7 @@ def update_from_s3(vc_swc, enc_svc_cls, template_vm_name=None,
                            static_ip)
 
 
+@trace.traced()
 def update_from_local_ovf(vc_swc, enc_svc_cls, template_vm_name=None,
                           target_path=None, ovf_name=None, ova_name=None,
                           ovftool_path=None, source_image_path=None,
@@ -223,6 +227,7 @@ def update_from_local_ovf(vc_swc, enc_svc_cls, template_vm_name=None,
                            static_ip)
 
 
+@trace.traced()
 def update_from_vmdk(vc_swc, enc_svc_cls, template_vm_name=None,
                      target_path=None, ovf_name=None, ova_name=None,
                      ovftool_path=None, metavisor_vmdk=None,
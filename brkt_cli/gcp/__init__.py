@@ -70,7 +70,6 @@ def run_encrypt(values, config):
         instance_config=ic,
         crypto_policy=values.crypto,
         image_project=values.image_project,
-        keep_encryptor=values.keep_encryptor,
         image_file=values.image_file,
         image_bucket=values.bucket,
         network=values.network,
@@ -85,6 +84,87 @@ def run_encrypt(values, config):
     return 0
 
 
+def _parse_batch_images(image_strings, default_zone):
+    """ Parse the ID[:ZONE] strings specified on the command line.
+
+    :return a list of (image, zone) tuples
+    :raise ValidationError if any of the strings are malformed
+    """
+    images = []
+    for s in image_strings:
+        image, _, zone = s.partition(':')
+        if not image:
+            raise ValidationError('%s is not in the format ID[:ZONE]' % s)
+        images.append((image, zone or default_zone))
+    return images
+
+
+def run_encrypt_batch(values, config):
+    session_id = util.make_nonce()
+    gcp_svc = gcp_service.GCPService(values.project, session_id, log)
+    check_args(values, gcp_svc, config)
+    if values.max_parallel < 1:
+        raise ValidationError('--max-parallel must be at least 1')
+
+    images = []
+    for image, zone in _parse_batch_images(values.images, values.zone):
+        encrypted_image_name = gcp_service.get_image_name(None, image)
+        gcp_service.validate_image_name(encrypted_image_name)
+        if values.validate:
+            gcp_service.validate_images(gcp_svc,
+                                        encrypted_image_name,
+                                        values.encryptor_image,
+                                        image,
+                                        values.image_project)
+        images.append((image, zone, encrypted_image_name))
+    if values.validate and values.gcp_tags:
+        validate_tags(values.gcp_tags)
+
+    if not values.verbose:
+        logging.getLogger('googleapiclient').setLevel(logging.ERROR)
+
+    brkt_env = brkt_cli.brkt_env_from_values(values, config)
+    lt = instance_config_args.get_launch_token(values, config)
+    ic = instance_config_from_values(
+        values,
+        mode=INSTANCE_CREATOR_MODE,
+        brkt_env=brkt_env,
+        launch_token=lt
+    )
+    results = encrypt_gcp_image.encrypt_images(
+        gcp_svc=gcp_svc,
+        new_gcp_svc=lambda: gcp_service.GCPService(
+            values.project, util.make_nonce(), log),
+        enc_svc_cls=encryptor_service.EncryptorService,
+        images=images,
+        encryptor_image=values.encryptor_image,
+        instance_config=ic,
+        crypto_policy=values.crypto,
+        max_parallel=values.max_parallel,
+        image_project=values.image_project,
+        image_file=values.image_file,
+        image_bucket=values.bucket,
+        network=values.network,
+        subnetwork=values.subnetwork,
+        status_port=values.status_port,
+        cleanup=values.cleanup,
+        gcp_tags=values.gcp_tags
+    )
+
+    # Print one line per image to stdout, in case the caller wants to
+    # process the output.  Log messages go to stderr.
+    rows = []
+    for r in results:
+        if r.succeeded:
+            rows.append([r.image_id, r.zone, r.encrypted_image_name])
+        else:
+            rows.append([r.image_id, r.zone, 'FAILED: %s' % r.error])
+    print(util.render_table_rows(rows))
+    if all(r.succeeded for r in results):
+        return 0
+    return 1
+
+
 def run_update(values, config):
     session_id = util.make_nonce()
     gcp_svc = gcp_service.GCPService(values.project, session_id, log)
@@ -121,7 +201,6 @@ def run_update(values, config):
         encrypted_image_name=encrypted_image_name,
         zone=values.zone,
         instance_config=ic,
-        keep_encryptor=values.keep_encryptor,
         image_file=values.image_file,
         image_bucket=values.bucket,
         network=values.network,
@@ -139,6 +218,8 @@ def run_launch(values, config):
     gcp_svc = gcp_service.GCPService(values.project, None, log)
     if values.ssd_scratch_disks > 8:
         raise ValidationError("Maximum of 8 SSD scratch disks are supported")
+    if values.count < 1:
+        raise ValidationError("--count must be at least 1")
 
     # Use the token in the image unless a token or tags were specified on
     # the command line.
@@ -168,7 +249,7 @@ def run_launch(values, config):
     if values.gcp_tags:
         validate_tags(values.gcp_tags)
 
-    encrypted_instance_id = launch_gcp_image.launch(log,
+    instance_names = launch_gcp_image.launch_instances(log,
                             gcp_svc,
                             values.image,
                             values.instance_name,
@@ -179,8 +260,10 @@ def run_launch(values, config):
                             values.subnetwork,
                             metadata,
                             values.ssd_scratch_disks,
-                            values.gcp_tags)
-    print(encrypted_instance_id)
+                            values.gcp_tags,
+                            count=values.count)
+    for name in instance_names:
+        print(name)
     return 0
 
 
@@ -339,7 +422,7 @@ def share_logs(values, gcp_svc):
         try:
             if snap:
                 gcp_svc.delete_snapshot(snapshot_name)
-            gcp_svc.cleanup(values.zone, None)
+            gcp_svc.cleanup(values.zone)
         except Exception as e:
             log.warn("Failed during cleanup: %s", e)
     return 0
@@ -387,6 +470,18 @@ class GCPSubcommand(Subcommand):
             encrypt_gcp_image_parser, parsed_config)
         setup_instance_config_args(encrypt_gcp_image_parser, parsed_config)
 
+        encrypt_batch_parser = gcp_subparsers.add_parser(
+            'encrypt-batch',
+            description=(
+                'Create encrypted GCP images from many existing images, '
+                'in parallel'),
+            help='Encrypt many GCP images',
+            formatter_class=brkt_cli.SortingHelpFormatter
+        )
+        encrypt_gcp_image_args.setup_encrypt_gcp_image_batch_args(
+            encrypt_batch_parser, parsed_config)
+        setup_instance_config_args(encrypt_batch_parser, parsed_config)
+
         update_gcp_image_parser = gcp_subparsers.add_parser(
             'update',
             description=(
@@ -440,6 +535,8 @@ class GCPSubcommand(Subcommand):
     def run(self, values):
         if values.gcp_subcommand == 'encrypt':
             return run_encrypt(values, self.config)
+        if values.gcp_subcommand == 'encrypt-batch':
+            return run_encrypt_batch(values, self.config)
         if values.gcp_subcommand == 'update':
             return run_update(values, self.config)
         if values.gcp_subcommand == 'launch':
@@ -459,6 +556,10 @@ def check_args(values, gcp_svc, cli_config):
         if values.bucket != 'prod':
             raise ValidationError(
                 "Please provide either an encryptor image or an image bucket")
+    if getattr(values, 'keep_encryptor', False):
+        log.warn(
+            '--keep-encryptor is deprecated and will be removed in a future '
+            'release.  Encryptor images are always kept.')
     # Verify we have a valid launch token
     instance_config_args.get_launch_token(values, cli_config)
 
@@ -1,16 +1,25 @@
 #!/usr/bin/env python
 
+import copy
 import httplib
 import logging
 import socket
 
+from brkt_cli import trace
 from brkt_cli.encryptor_service import (
     ENCRYPTOR_STATUS_PORT,
     wait_for_encryption,
     wait_for_encryptor_up
 )
+from brkt_cli.console_tailer import ConsoleTailer
 from brkt_cli.gcp.gcp_service import gcp_metadata_from_userdata
-from brkt_cli.util import Deadline, retry, append_suffix
+from brkt_cli.gcp.serial_console import SerialConsoleReader
+from brkt_cli.util import (
+    append_suffix,
+    Deadline,
+    retry,
+    run_concurrently
+)
 from googleapiclient import errors
 from brkt_cli.util import CRYPTO_XTS
 
@@ -18,6 +27,7 @@ from brkt_cli.util import CRYPTO_XTS
 log = logging.getLogger(__name__)
 
 
+@trace.traced()
 def setup_encryption(gcp_svc,
                      image_id,
                      encrypted_image_disk,
@@ -26,34 +36,42 @@ def setup_encryption(gcp_svc,
                      image_project,
                      crypto_policy):
     try:
-        # create disk from guest image
-        gcp_svc.disk_from_image(zone, image_id, instance_name, image_project)
-        log.info('Waiting for guest root disk to become ready')
-        gcp_svc.wait_for_detach(zone, instance_name)
-
-        guest_size = gcp_svc.get_disk_size(zone, instance_name)
+        # The guest root disk is the size of the guest image, so all of
+        # the disks can be sized up front and created together.
+        guest_size = int(
+            gcp_svc.get_image(image_id, image_project)['diskSizeGb'])
         # create blank disk. the encrypted image will be
         # dd'd to this disk. Blank disk should be 2x the size
         # of the unencrypted guest root (GCM)
-        log.info('Creating disk for encrypted image')
         if crypto_policy == CRYPTO_XTS:
-            gcp_svc.create_disk(zone, encrypted_image_disk, guest_size + 1)
+            encrypted_size = guest_size + 1
         else:
-            gcp_svc.create_disk(zone, encrypted_image_disk, guest_size * 2 + 1)
+            encrypted_size = guest_size * 2 + 1
         #
         # Amazing but true - just attach a big drive to get more IOPS
         # to be shared by all volumes attached to this VM. We don't
         # use the dummy-iops drive but get to use it's IOPS for other
         # drives.
         #
-        log.info('Creating dummy IOPS disk')
         dummy_name = append_suffix(encrypted_image_disk, "-dummy-iops", 64)
-        gcp_svc.create_disk(zone, dummy_name, 500)
+        log.info('Creating guest root disk, disk for encrypted image and '
+                 'dummy IOPS disk')
+        gcp_svc.create_disks(zone, [
+            {
+                'name': instance_name,
+                'size': guest_size,
+                'image': image_id,
+                'image_project': image_project
+            },
+            {'name': encrypted_image_disk, 'size': encrypted_size},
+            {'name': dummy_name, 'size': 500}
+        ])
     except:
         log.info('Encryption setup failed')
         raise
 
 
+@trace.traced()
 def do_encryption(gcp_svc,
                   enc_svc_cls,
                   zone,
@@ -83,30 +101,36 @@ def do_encryption(gcp_svc,
                          metadata=metadata,
                          tags=gcp_tags)
 
+    console = SerialConsoleReader(gcp_svc, zone, encryptor)
+    tailer = ConsoleTailer(console, encryptor)
     try:
-        host_ips = []
-        ip = gcp_svc.get_instance_ip(encryptor, zone)
-        if ip:
-            host_ips.append(ip)
-        pvt_ip = gcp_svc.get_private_ip(encryptor, zone)
-        if pvt_ip:
-            host_ips.append(pvt_ip)
-        enc_svc = enc_svc_cls(host_ips, port=status_port)
-        wait_for_encryptor_up(enc_svc, Deadline(600))
-        log.info(
-            'Waiting for encryption service on %s (%s:%s)',
-            encryptor, ip, enc_svc.port
-        )
-        wait_for_encryption(enc_svc)
+        with tailer:
+            host_ips = []
+            ip = gcp_svc.get_instance_ip(encryptor, zone)
+            if ip:
+                host_ips.append(ip)
+            pvt_ip = gcp_svc.get_private_ip(encryptor, zone)
+            if pvt_ip:
+                host_ips.append(pvt_ip)
+            enc_svc = enc_svc_cls(host_ips, port=status_port)
+            wait_for_encryptor_up(
+                enc_svc, Deadline(600), check=tailer.check)
+            log.info(
+                'Waiting for encryption service on %s (%s:%s)',
+                encryptor, ip, enc_svc.port
+            )
+            wait_for_encryption(enc_svc, check=tailer.check)
     except:
-        f = gcp_svc.write_serial_console_file(zone, encryptor)
+        f = console.save()
         if f:
             log.info('Encryption failed. Writing console to %s' % f)
         raise
+    console.discard()
     retry(function=gcp_svc.delete_instance,
             on=[httplib.BadStatusLine, socket.error, errors.HttpError])(zone, encryptor)
 
 
+@trace.traced()
 def create_image(gcp_svc, zone, encrypted_image_disk, encrypted_image_name, encryptor):
     try:
         # snapshot encrypted guest disk
@@ -127,26 +151,24 @@ def create_image(gcp_svc, zone, encrypted_image_disk, encrypted_image_name, encr
         raise
 
 
+@trace.traced()
 def encrypt(gcp_svc, enc_svc_cls, image_id, encryptor_image,
             encrypted_image_name, zone, instance_config, crypto_policy,
-            image_project=None, keep_encryptor=False, image_file=None,
+            image_project=None, image_file=None,
             image_bucket=None, network=None, subnetwork=None,
             status_port=ENCRYPTOR_STATUS_PORT, cleanup=True, gcp_tags=None):
     try:
-        # create metavisor image from file in GCS bucket
+        # create metavisor image from file in GCS bucket, or reuse the
+        # one that a previous run created
         log.info('Retrieving encryptor image from GCS bucket')
         if not encryptor_image:
             try:
-                encryptor_image = gcp_svc.get_latest_encryptor_image(zone,
+                encryptor_image = gcp_svc.get_cached_encryptor_image(
                     image_bucket, image_file=image_file)
             except errors.HttpError as e:
                 encryptor_image = None
                 log.exception('GCP API call to create image from file failed')
                 return
-        else:
-            # Keep user provided encryptor image
-            keep_encryptor = True
-
         # For GCP there is no way to identify the encryptor type
         # Default to XTS
         if crypto_policy is None:
@@ -178,4 +200,81 @@ def encrypt(gcp_svc, enc_svc_cls, image_id, encryptor_image,
             log.info("Not cleaning up")
             return
         log.info("Cleaning up")
-        gcp_svc.cleanup(zone, encryptor_image, keep_encryptor)
+        gcp_svc.cleanup(zone)
+
+
+class EncryptionResult(object):
+    """ The outcome of encrypting one image in a batch. """
+    def __init__(self, image_id, zone, encrypted_image_name):
+        self.image_id = image_id
+        self.zone = zone
+        self.encrypted_image_name = encrypted_image_name
+        self.error = None
+
+    @property
+    def succeeded(self):
+        return self.error is None
+
+
+@trace.traced()
+def encrypt_images(gcp_svc, new_gcp_svc, enc_svc_cls, images,
+                   encryptor_image, instance_config, crypto_policy,
+                   max_parallel=4, image_project=None, image_file=None,
+                   image_bucket=None, network=None, subnetwork=None,
+                   status_port=ENCRYPTOR_STATUS_PORT, cleanup=True,
+                   gcp_tags=None):
+    """ Encrypt many images concurrently.  The encryptor image is created
+    once, or reused from a previous run, and shared by all of the
+    encryption pipelines.  Each pipeline runs with its own GCP service,
+    so that it owns the disks and instances that it creates.
+
+    :param gcp_svc the GCP service used for creating the encryptor image
+    :param new_gcp_svc a function that returns a new GCP service object
+        with its own session id
+    :param images a list of (image_id, zone, encrypted_image_name) tuples
+    :param max_parallel the maximum number of images that are encrypted
+        at the same time
+    :return a list of EncryptionResult objects, in the same order as images
+    """
+    if not encryptor_image:
+        log.info('Retrieving encryptor image from GCS bucket')
+        encryptor_image = gcp_svc.get_cached_encryptor_image(
+            image_bucket, image_file=image_file)
+
+    results = [
+        EncryptionResult(image_id, zone, encrypted_image_name)
+        for image_id, zone, encrypted_image_name in images
+    ]
+
+    def _encrypt(result):
+        pipeline_svc = new_gcp_svc()
+        log.info('Encrypting %s in %s with session %s',
+                 result.image_id, result.zone, pipeline_svc.get_session_id())
+        try:
+            encrypted_image_name = encrypt(
+                gcp_svc=pipeline_svc,
+                enc_svc_cls=enc_svc_cls,
+                image_id=result.image_id,
+                encryptor_image=encryptor_image,
+                encrypted_image_name=result.encrypted_image_name,
+                zone=result.zone,
+                instance_config=copy.deepcopy(instance_config),
+                crypto_policy=crypto_policy,
+                image_project=image_project,
+                network=network,
+                subnetwork=subnetwork,
+                status_port=status_port,
+                cleanup=cleanup,
+                gcp_tags=gcp_tags
+            )
+            if not encrypted_image_name:
+                result.error = 'GCP API request failed'
+        except Exception as e:
+            log.exception('Encryption of %s failed', result.image_id)
+            result.error = str(e) or e.__class__.__name__
+
+    run_concurrently(
+        [lambda r=r: _encrypt(r) for r in results],
+        max_workers=max_parallel
+    )
+    return results
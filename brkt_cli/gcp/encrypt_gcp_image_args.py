@@ -32,6 +32,32 @@ def setup_encrypt_gcp_image_args(parser, parsed_config):
         help='Specify the name of the generated encrypted image',
         required=False
     )
+    _add_encrypt_args(parser, parsed_config)
+
+
+def setup_encrypt_gcp_image_batch_args(parser, parsed_config):
+    parser.add_argument(
+        'images',
+        metavar='ID[:ZONE]',
+        nargs='+',
+        help=(
+            'An image that will be encrypted, optionally followed by the '
+            'zone to encrypt it in.  Images without a zone are encrypted '
+            'in the zone specified by --zone.'
+        )
+    )
+    parser.add_argument(
+        '--max-parallel',
+        metavar='N',
+        dest='max_parallel',
+        type=int,
+        default=4,
+        help='The maximum number of images that are encrypted at once'
+    )
+    _add_encrypt_args(parser, parsed_config)
+
+
+def _add_encrypt_args(parser, parsed_config):
     gcp_args.add_gcp_zone(parser, parsed_config)
     gcp_args.add_no_validate(parser)
     gcp_args.add_gcp_project(parser, parsed_config)
@@ -0,0 +1,153 @@
+# Copyright 2017 Bracket Computing, Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License").
+# You may not use this file except in compliance with the License.
+# A copy of the License is located at
+#
+# https://github.com/brkt/brkt-cli/blob/master/LICENSE
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Load the discovery documents that describe the GCP APIs.
+
+Building an API client requires the API's discovery document.  Fetching
+and parsing it on every run is slow, and fails on networks that can't
+reach the discovery service.  Documents are cached in ~/.brkt/discovery
+and refreshed when they are older than DISCOVERY_CACHE_TTL.  If a
+document can't be refreshed, the stale copy is used, followed by the copy
+that ships with brkt-cli in brkt_cli/gcp/discovery.
+"""
+
+import errno
+import json
+import logging
+import os
+import socket
+import time
+
+import httplib2
+from googleapiclient import discovery, errors, http
+
+from brkt_cli import trace, util
+from brkt_cli.config import CONFIG_DIR
+
+log = logging.getLogger(__name__)
+
+DISCOVERY_CACHE_DIR = os.path.join(CONFIG_DIR, 'discovery')
+DISCOVERY_CACHE_TTL = 24 * 60 * 60
+DISCOVERY_TIMEOUT = 10
+STATIC_DISCOVERY_DIR = os.path.join(os.path.dirname(__file__), 'discovery')
+
+
+def _document_filename(api, version):
+    return '%s.%s.json' % (api, version)
+
+
+def _read_document(path):
+    """ Return the contents of the discovery document at the given path,
+    or None if it doesn't exist or can't be parsed.
+    """
+    try:
+        with open(path) as f:
+            content = f.read()
+    except IOError as e:
+        if e.errno != errno.ENOENT:
+            log.debug('Unable to read discovery document %s: %s', path, e)
+        return None
+    try:
+        json.loads(content)
+    except ValueError as e:
+        log.debug('Invalid discovery document %s: %s', path, e)
+        return None
+    return content
+
+
+def _write_document(path, content):
+    try:
+        util.write_file_atomically(path, content)
+    except (IOError, OSError) as e:
+        # The document is still used when it can't be cached.
+        log.debug('Unable to write discovery document %s: %s', path, e)
+
+
+def fetch_discovery_document(api, version, http=None):
+    """ Download the discovery document for the given API from the
+    discovery service.
+
+    :return the document as a string
+    :raise errors.HttpError if the discovery service returns an error
+    :raise socket.error, httplib2.HttpLib2Error if the discovery service
+        can't be reached
+    :raise ValueError if the document is not valid JSON
+    """
+    http = http or httplib2.Http(timeout=DISCOVERY_TIMEOUT)
+    uri = discovery.DISCOVERY_URI.format(api=api, apiVersion=version)
+    resp, content = http.request(uri)
+    if resp.status >= 400:
+        raise errors.HttpError(resp, content, uri=uri)
+    json.loads(content)
+    return content
+
+
+def get_discovery_document(api, version, http=None,
+                           cache_dir=DISCOVERY_CACHE_DIR,
+                           static_dir=STATIC_DISCOVERY_DIR,
+                           ttl=DISCOVERY_CACHE_TTL):
+    """ Return the discovery document for the given API.  The cached copy
+    is returned if it's younger than ttl seconds.  Otherwise the document
+    is downloaded and cached.
+
+    :return the document as a string
+    :raise errors.HttpError, socket.error, httplib2.HttpLib2Error if the
+        document is not cached and can't be downloaded
+    """
+    filename = _document_filename(api, version)
+    cache_path = os.path.join(cache_dir, filename)
+    cached = _read_document(cache_path)
+    if cached:
+        age = time.time() - os.path.getmtime(cache_path)
+        if 0 <= age < ttl:
+            return cached
+
+    try:
+        content = fetch_discovery_document(api, version, http=http)
+    except (socket.error, httplib2.HttpLib2Error, errors.HttpError,
+            ValueError):
+        stale = cached or _read_document(os.path.join(static_dir, filename))
+        if not stale:
+            raise
+        log.warn(
+            'Unable to download the discovery document for %s %s.  '
+            'Using a cached copy.', api, version)
+        log.debug('Discovery error', exc_info=1)
+        # Don't try to download the document again until the TTL expires,
+        # so that every run doesn't wait for the discovery service to
+        # time out.
+        _write_document(cache_path, stale)
+        return stale
+
+    _write_document(cache_path, content)
+    return content
+
+
+class TracedHttpRequest(http.HttpRequest):
+    """ Records a trace span for each API call. """
+
+    def execute(self, http=None, num_retries=0):
+        with trace.span(self.methodId or self.uri, category=trace.API):
+            return super(TracedHttpRequest, self).execute(
+                http=http, num_retries=num_retries)
+
+
+def build(api, version, credentials=None):
+    """ Build a client for the given API, using the cached discovery
+    document.
+    """
+    return discovery.build_from_document(
+        get_discovery_document(api, version), credentials=credentials,
+        requestBuilder=TracedHttpRequest)
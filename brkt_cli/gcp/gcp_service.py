@@ -1,21 +1,26 @@
 #!/usr/bin/env python
 
 import abc
+import base64
 import datetime
+import httplib
 import json
 import re
 import socket
-import tempfile
+import threading
 import time
 import uuid
 
+import httplib2
 import brkt_cli.util
+from brkt_cli import trace
+from brkt_cli.gcp import gcp_discovery
 from brkt_cli.util import (
     append_suffix,
     BracketError,
     make_nonce
 )
-from googleapiclient import discovery, errors
+from googleapiclient import errors
 from oauth2client.client import GoogleCredentials
 
 from brkt_cli.validation import ValidationError
@@ -24,6 +29,28 @@ from brkt_cli.validation import ValidationError
 GCP_NAME_MAX_LENGTH = 63
 LATEST_IMAGE = 'latest.image.tar.gz'
 
+# The maximum number of calls that the API accepts in a batch request.
+MAX_BATCH_SIZE = 1000
+
+# The default number of instance insert requests that are sent at the
+# same time when launching a fleet.
+MAX_PARALLEL_INSERTS = 10
+
+# Labels that identify the encryptor images in the image registry, and the
+# Metavisor image file that each one was created from.
+LABEL_ENCRYPTOR_IMAGE = 'brkt-encryptor-image'
+LABEL_SOURCE_BUCKET = 'brkt-source-bucket'
+LABEL_SOURCE_NAME = 'brkt-source-name'
+LABEL_SOURCE_GENERATION = 'brkt-source-generation'
+LABEL_SOURCE_MD5 = 'brkt-source-md5'
+LABEL_LAST_USED = 'brkt-last-used'
+
+# The number of most recently used encryptor images that are kept in the
+# registry, and the minimum time that an image must be unused before it
+# can be garbage collected.
+ENCRYPTOR_IMAGE_CACHE_SIZE = 3
+ENCRYPTOR_IMAGE_MIN_IDLE_SECS = 24 * 60 * 60
+
 
 brkt_image_buckets = {
     'prod': 'brkt-prod-images',
@@ -37,14 +64,44 @@ def retry(function, timeout=15.0):
         function, on=[socket.error, errors.HttpError], timeout=timeout)
 
 
-def execute_gcp_api_call(gcp_object):
-    return gcp_object.execute()
+def execute_gcp_api_call(gcp_object, http=None):
+    return gcp_object.execute(http=http)
 
 
 class InstanceError(BracketError):
     pass
 
 
+class OperationError(BracketError):
+    pass
+
+
+def _operation_key(link):
+    """ Return the part of a resource URL that follows the project name,
+    for example zones/us-central1-a/disks/my-disk or global/images/my-image.
+    This is used for matching operations to the resources they modify.
+    """
+    m = re.search(r'((zones/[^/]+)|global)/[^/]+/[^/]+$', link)
+    if m:
+        return m.group(0)
+    return link
+
+
+def _label_value(value):
+    """ Convert the given string to a valid label value, which may only
+    contain lower case letters, numbers, hyphens and underscores.
+    """
+    return re.sub(r'[^a-z0-9_\-]', '-', value.lower())[:GCP_NAME_MAX_LENGTH]
+
+
+def _disk_key(zone, name):
+    return 'zones/%s/disks/%s' % (zone, name)
+
+
+def _instance_key(zone, name):
+    return 'zones/%s/instances/%s' % (zone, name)
+
+
 class BaseGCPService(object):
     __metaclass__ = abc.ABCMeta
 
@@ -60,6 +117,14 @@ class BaseGCPService(object):
     def list_zones(self):
         pass
 
+    @abc.abstractmethod
+    def wait_operation(self, operation):
+        pass
+
+    @abc.abstractmethod
+    def wait_operations(self, operations):
+        pass
+
     @abc.abstractmethod
     def get_session_id(self):
         pass
@@ -104,6 +169,18 @@ class BaseGCPService(object):
     def delete_disk(self, zone, disk):
         pass
 
+    @abc.abstractmethod
+    def delete_instances(self, zone, instances):
+        pass
+
+    @abc.abstractmethod
+    def delete_disks(self, zone, disks):
+        pass
+
+    @abc.abstractmethod
+    def create_disks(self, zone, disks):
+        pass
+
     @abc.abstractmethod
     def wait_instance(self, name, zone):
         pass
@@ -116,6 +193,14 @@ class BaseGCPService(object):
     def get_private_ip(self, name, zone):
         pass
 
+    @abc.abstractmethod
+    def get_serial_port_output(self, zone, instance, start=0, http=None):
+        pass
+
+    @abc.abstractmethod
+    def new_http(self):
+        pass
+
     @abc.abstractmethod
     def detach_disk(self, zone, instance, diskName):
         pass
@@ -157,7 +242,8 @@ class BaseGCPService(object):
         pass
 
     @abc.abstractmethod
-    def create_gcp_image_from_file(self, zone, image_name, file_name, bucket):
+    def create_gcp_image_from_file(self, zone, image_name, file_name, bucket,
+                                   labels=None):
         pass
 
     @abc.abstractmethod
@@ -181,11 +267,7 @@ class BaseGCPService(object):
         pass
 
     @abc.abstractmethod
-    def get_latest_encryptor_image(self,
-                                   zone,
-                                   image_name,
-                                   bucket,
-                                   image_file=None):
+    def get_cached_encryptor_image(self, bucket, image_file=None):
         pass
 
     @abc.abstractmethod
@@ -204,12 +286,16 @@ class BaseGCPService(object):
                      tags=None):
         pass
 
+    @abc.abstractmethod
+    def run_instances(self, zone, instances, max_parallel):
+        pass
+
     @abc.abstractmethod
     def get_disk(self, zone, disk_name):
         pass
 
     @abc.abstractmethod
-    def cleanup(self, zone, encryptor_image, keep_encryptor=False):
+    def cleanup(self, zone):
         pass
 
 
@@ -217,12 +303,38 @@ class GCPService(BaseGCPService):
     def __init__(self, project, session_id, logger):
         super(GCPService, self).__init__(project, session_id, logger)
         self.credentials = GoogleCredentials.get_application_default()
-        self.compute = discovery.build(
-            'compute', 'v1', credentials=self.credentials)
 
-        self.storage = discovery.build(
-            'storage', 'v1', credentials=self.credentials)
+        # API clients are built on first use, since building a client
+        # requires loading its discovery document.
+        self._clients = {}
+        self._clients_lock = threading.Lock()
+
+        # Operations that have been started but not waited on yet, keyed
+        # by the resource that they modify.
+        self.operations = {}
 
+    def _get_client(self, api, version):
+        with self._clients_lock:
+            if api not in self._clients:
+                self._clients[api] = gcp_discovery.build(
+                    api, version, credentials=self.credentials)
+            return self._clients[api]
+
+    @property
+    def compute(self):
+        return self._get_client('compute', 'v1')
+
+    @compute.setter
+    def compute(self, client):
+        self._clients['compute'] = client
+
+    @property
+    def storage(self):
+        return self._get_client('storage', 'v1')
+
+    @storage.setter
+    def storage(self, client):
+        self._clients['storage'] = client
 
     # Create bucket/check permissions 
     def check_bucket_name(self, bucket, project):
@@ -264,6 +376,7 @@ class GCPService(BaseGCPService):
             else:
                 raise ValidationError(e)
 
+    @trace.traced()
     def wait_bucket_file(self, bucket, file):
         for i in range(48):
             try:
@@ -291,22 +404,179 @@ class GCPService(BaseGCPService):
         public_image = request.execute(num_retries=5)
         return public_image['name']
 
-    def cleanup(self, zone, encryptor_image, keep_encryptor=False):
+    @trace.traced()
+    def cleanup(self, zone):
         try:
-            for instance in self.instances[:]:
-                self.log.info('deleting instance %s' % instance)
-                self.delete_instance(zone, instance)
-            for disk in self.disks[:]:
-                self.log.info('deleting disk %s' % disk)
-                if self.disk_exists(zone, disk):
+            instances = self.instances[:]
+            if instances:
+                self.log.info('deleting instances %s' % ', '.join(instances))
+                self.delete_instances(zone, instances)
+                self._wait_for_tracked_operations(
+                    [_instance_key(zone, i) for i in instances])
+
+            # Look up all of the disks in one batch.  The instances are
+            # gone, so the disks are detached unless something else is
+            # still using them.
+            disks = self.disks[:]
+            responses = self.execute_batch(
+                [self.compute.disks().get(
+                    project=self.project, zone=zone, disk=d)
+                 for d in disks],
+                not_found_ok=True
+            )
+            existing = []
+            for disk, response in zip(disks, responses):
+                if not response:
+                    self.disks.remove(disk)
+                    continue
+                if response.get('users'):
                     self.wait_for_detach(zone, disk)
-                    self.delete_disk(zone, disk)
-            if not keep_encryptor and encryptor_image:
-                self.log.info('Deleting encryptor image %s' % encryptor_image)
-                self.delete_image(encryptor_image)
+                existing.append(disk)
+            if existing:
+                self.log.info('deleting disks %s' % ', '.join(existing))
+                self.delete_disks(zone, existing)
+                self._wait_for_tracked_operations(
+                    [_disk_key(zone, d) for d in existing])
         except:
             self.log.exception('Cleanup failed')
 
+    def _track_operation(self, operation, key=None):
+        """ Remember the given operation, so that a later call to one of
+        the wait methods can wait for it to finish.
+
+        :param key the resource that is modified by the operation.
+            Defaults to the operation's target.
+        :return the operation
+        """
+        if not key:
+            key = _operation_key(operation['targetLink'])
+        self.operations[key] = operation
+        return operation
+
+    def _wait_for_tracked_operations(self, keys):
+        """ Wait for the tracked operations on the given resources to
+        finish, and stop tracking them.
+        """
+        operations = []
+        for key in keys:
+            operation = self.operations.pop(key, None)
+            if operation:
+                operations.append(operation)
+        if operations:
+            self.wait_operations(operations)
+
+    def execute_batch(self, requests, not_found_ok=False, timeout=15.0):
+        """ Execute the given API requests in as few HTTP round trips as
+        possible, using batch requests.  If a batch request fails before
+        all of its results are received, only the requests without a
+        result are sent again.
+
+        :param requests a list of HttpRequest objects
+        :param not_found_ok if True, return None for a request that failed
+            with a 404 instead of raising an exception
+        :param timeout stop retrying if this number of seconds have lapsed
+        :return a list of the responses, in the same order as requests
+        :raise the HttpError of the first request that failed
+        """
+        responses = [None] * len(requests)
+        exceptions = []
+
+        for start in xrange(0, len(requests), MAX_BATCH_SIZE):
+            pending = range(start, min(start + MAX_BATCH_SIZE, len(requests)))
+            start_time = time.time()
+            for attempt in xrange(1, 1000):
+                results = {}
+
+                def _callback(request_id, response, exception,
+                              results=results):
+                    results[int(request_id)] = (response, exception)
+
+                batch = self.compute.new_batch_http_request(callback=_callback)
+                for i in pending:
+                    batch.add(requests[i], request_id=str(i))
+                try:
+                    with trace.span('batch', category=trace.API,
+                                    requests=len(pending), attempt=attempt):
+                        execute_gcp_api_call(batch)
+                    error = None
+                except (socket.error, errors.HttpError) as e:
+                    error = e
+
+                for i, (response, exception) in results.iteritems():
+                    if not exception:
+                        responses[i] = response
+                    elif not (not_found_ok and
+                              isinstance(exception, errors.HttpError) and
+                              exception.resp.status == 404):
+                        exceptions.append((i, exception))
+                pending = [i for i in pending if i not in results]
+                if not pending:
+                    break
+                if not error:
+                    # The batch response didn't include every request.
+                    error = BracketError(
+                        'No response for %d batched requests' % len(pending))
+                if time.time() - start_time > timeout:
+                    self.log.error(
+                        'Exceeded timeout of %s seconds for batch request',
+                        timeout)
+                    raise error
+                self.log.warn(
+                    'Batch request failed: %s.  Retrying %d requests.',
+                    error, len(pending))
+                brkt_cli.util.sleep(0.25 * attempt)
+
+        if exceptions:
+            raise sorted(exceptions)[0][1]
+        return responses
+
+    def new_http(self):
+        """ Return a new authorized Http object.  httplib2 is not
+        thread-safe, so each thread needs its own.
+        """
+        return self.credentials.authorize(httplib2.Http())
+
+    def wait_operation(self, operation, http=None):
+        """ Wait for the given operation to finish, using the server-side
+        long poll of the zoneOperations or globalOperations wait call.
+
+        :return the finished operation
+        :raise OperationError if the operation failed
+        """
+        name = operation['name']
+        while operation['status'] != 'DONE':
+            if operation.get('zone'):
+                zone = operation['zone'].rsplit('/', 1)[-1]
+                req = self.compute.zoneOperations().wait(
+                    project=self.project, zone=zone, operation=name)
+            else:
+                req = self.compute.globalOperations().wait(
+                    project=self.project, operation=name)
+            operation = retry(execute_gcp_api_call, timeout=30.0)(req, http)
+        if 'error' in operation:
+            messages = [e.get('message', e.get('code'))
+                        for e in operation['error'].get('errors', [])]
+            raise OperationError(
+                'Operation %s on %s failed: %s' % (
+                    operation.get('operationType'),
+                    operation.get('targetLink'),
+                    ', '.join(messages)))
+        return operation
+
+    def wait_operations(self, operations):
+        """ Wait for all of the given operations to finish.  Each
+        operation is waited on in its own thread.
+
+        :return the list of finished operations
+        :raise OperationError if any of the operations failed
+        """
+        if len(operations) == 1:
+            return [self.wait_operation(operations[0])]
+        return brkt_cli.util.run_concurrently(
+            [lambda op=op: self.wait_operation(op, http=self.new_http())
+             for op in operations]
+        )
+
     def list_zones(self):
         zones = []
         zones_resp = self.compute.zones().list(project=self.project).execute()
@@ -323,7 +593,9 @@ class GCPService(BaseGCPService):
             project=self.project, snapshot=name)
         return retry(execute_gcp_api_call)(snap_req)
 
+    @trace.traced()
     def wait_snapshot(self, snapshot):
+        self._wait_for_tracked_operations(['global/snapshots/%s' % snapshot])
         while True:
             if self.get_snapshot(snapshot)['status'] == 'READY':
                 return
@@ -371,29 +643,61 @@ class GCPService(BaseGCPService):
     def delete_instance(self, zone, instance):
         if instance in self.instances:
             self.instances.remove(instance)
-        return self.compute.instances().delete(project=self.project,
-               zone=zone, instance=instance).execute()
+        return self._track_operation(self.compute.instances().delete(
+            project=self.project, zone=zone, instance=instance).execute())
 
     def delete_image(self, image):
-        return self.compute.images().delete(project=self.project,
-               image=image).execute()
+        return self._track_operation(self.compute.images().delete(
+            project=self.project, image=image).execute())
 
     def delete_disk(self, zone, disk):
         # remove disk if we're tracking it
         if disk in self.disks:
             self.disks.remove(disk)
-        return self.compute.disks().delete(project=self.project,
-               zone=zone, disk=disk).execute()
+        return self._track_operation(self.compute.disks().delete(
+            project=self.project, zone=zone, disk=disk).execute())
+
+    @trace.traced()
+    def delete_instances(self, zone, instances):
+        """ Delete the given instances with a single batch request.
+
+        :return the list of delete operations
+        """
+        for instance in instances:
+            if instance in self.instances:
+                self.instances.remove(instance)
+        operations = self.execute_batch(
+            [self.compute.instances().delete(
+                project=self.project, zone=zone, instance=i)
+             for i in instances]
+        )
+        return [self._track_operation(op) for op in operations]
+
+    @trace.traced()
+    def delete_disks(self, zone, disks):
+        """ Delete the given disks with a single batch request.
+
+        :return the list of delete operations
+        """
+        for disk in disks:
+            if disk in self.disks:
+                self.disks.remove(disk)
+        operations = self.execute_batch(
+            [self.compute.disks().delete(
+                project=self.project, zone=zone, disk=d)
+             for d in disks]
+        )
+        return [self._track_operation(op) for op in operations]
 
+    @trace.traced()
     def wait_instance(self, name, zone):
-        instance = self.compute.instances().list(project=self.project,
-                zone=zone)
+        self._wait_for_tracked_operations([_instance_key(zone, name)])
+        instance = self.compute.instances().get(project=self.project,
+                zone=zone, instance=name)
         while True:
             instance_data = retry(execute_gcp_api_call)(instance)
-            if 'items' in instance_data:
-                for i in instance_data['items']:
-                    if name == i['name'] and i['status'] == 'RUNNING':
-                        return
+            if instance_data['status'] == 'RUNNING':
+                return
             self.log.info('Waiting for ' + name + ' to become ready')
             time.sleep(5)
 
@@ -420,32 +724,35 @@ class GCPService(BaseGCPService):
             return instance[nw][0]['networkIP']
         self.log.info("Couldn't find private IP address for this instance.")
 
-    def write_serial_console_file(self, zone, instance):
-        try:
-            serial_port_out = self.compute.instances().getSerialPortOutput(
-                    project=self.project,
-                    instance=instance,
-                    zone=zone).execute()
-            if 'contents' in serial_port_out:
-                with tempfile.NamedTemporaryFile(prefix='serial-console-',
-                                                 suffix='-%s.out' % self.session_id,
-                                                 delete=False) as t:
-                    t.write(serial_port_out['contents'])
-                return t.name
-        except:
-            self.log.exception('Unable to write serial console contents')
-
-        return None
+    def get_serial_port_output(self, zone, instance, start=0, http=None):
+        """ Return the serial console output of the instance, starting at
+        the given byte offset.  The response contains the contents, the
+        start offset of the contents and the offset of the next byte.
 
+        :param http the Http object to use.  This is called from a
+            background thread while encryption runs, so the caller passes
+            an Http object that is only used by that thread.
+        """
+        req = self.compute.instances().getSerialPortOutput(
+            project=self.project, zone=zone, instance=instance, start=start)
+        return brkt_cli.util.retry(
+            execute_gcp_api_call,
+            on=[httplib.BadStatusLine, socket.error, errors.HttpError]
+        )(req, http)
 
     def detach_disk(self, zone, instance, diskName):
         detach_req = self.compute.instances().detachDisk(project=self.project,
                 instance=instance, zone=zone, deviceName=diskName)
-        retry(execute_gcp_api_call)(detach_req)
+        self._track_operation(
+            retry(execute_gcp_api_call)(detach_req),
+            key=_disk_key(zone, diskName)
+        )
         # wait for disk ready
         return self.wait_for_detach(zone, diskName)
 
+    @trace.traced()
     def wait_for_disk(self, zone, diskName):
+        self._wait_for_tracked_operations([_disk_key(zone, diskName)])
         disk_req = self.compute.disks().get(zone=zone,
                                             project=self.project,
                                             disk=diskName)
@@ -459,7 +766,16 @@ class GCPService(BaseGCPService):
         disk_info = self.compute.disks().get(zone=zone, project=self.project, disk=diskName).execute()
         return int(disk_info['sizeGb'])
 
+    @trace.traced()
     def wait_for_detach(self, zone, diskName):
+        # The disk is detached when the operation that detaches it, or
+        # deletes the instance that it's attached to, has finished.
+        keys = [_disk_key(zone, diskName)]
+        for key, operation in self.operations.items():
+            if key.startswith('zones/%s/instances/' % zone) and \
+                    operation.get('operationType') == 'delete':
+                keys.append(key)
+        self._wait_for_tracked_operations(keys)
         detach_req = self.compute.disks().get(zone=zone,
                                               project=self.project,
                                               disk=diskName)
@@ -478,14 +794,22 @@ class GCPService(BaseGCPService):
         except:
             return False
 
+    @trace.traced()
     def create_snapshot(self, zone, disk, snapshot_name):
         disk_url = "projects/%s/zones/%s/disks/%s" % (self.project, zone, disk)
         body = {'sourceDisk': disk_url, 'name': snapshot_name}
-        self.compute.disks().createSnapshot(project=self.project, disk=disk, body=body, zone=zone).execute()
+        return self._track_operation(
+            self.compute.disks().createSnapshot(
+                project=self.project, disk=disk, body=body, zone=zone
+            ).execute(),
+            key='global/snapshots/%s' % snapshot_name
+        )
 
     def delete_snapshot(self, snapshot_name):
-        self.compute.snapshots().delete(project=self.project, snapshot=snapshot_name).execute()
+        return self._track_operation(self.compute.snapshots().delete(
+            project=self.project, snapshot=snapshot_name).execute())
 
+    @trace.traced()
     def disk_from_image(self, zone, image, name, image_project=None):
         if self.disk_exists(zone, name):
             return
@@ -495,34 +819,25 @@ class GCPService(BaseGCPService):
 
         image_info = self.compute.images().get(project=project,
                                                  image=image).execute()
-        base = "projects/%s/zones/%s" % (self.project, zone)
-        body = {
-                "name": name,
-                "zone": base,
-                "type": base + "/diskTypes/pd-ssd",
-                "sourceImage": "projects/%s/global/images/%s" % (project, image),
-                "sizeGb": image_info['diskSizeGb']
-        }
-        self.compute.disks().insert(project=self.project,
-                zone=zone, body=body).execute()
+        body = self._disk_body(zone, name, image_info['diskSizeGb'],
+                               image=image, image_project=project)
+        operation = self._track_operation(self.compute.disks().insert(
+            project=self.project, zone=zone, body=body).execute())
         self.disks.append(name)
+        return operation
 
+    @trace.traced()
     def disk_from_snapshot(self, zone, snapshot, name):
         if self.disk_exists(zone, name):
             return
         snap_info = self.compute.snapshots().get(project=self.project,
                                                  snapshot=snapshot).execute()
-        base = "projects/%s/zones/%s" % (self.project, zone)
-        body = {
-                "name": name,
-                "zone": base,
-                "type": base + "/diskTypes/pd-ssd",
-                "sourceSnapshot": "projects/%s/global/snapshots/%s" % (self.project, snapshot),
-                "sizeGb": snap_info['diskSizeGb']
-        }
-        self.compute.disks().insert(project=self.project,
-                zone=zone, body=body).execute()
+        body = self._disk_body(zone, name, snap_info['diskSizeGb'],
+                               snapshot=snapshot)
+        operation = self._track_operation(self.compute.disks().insert(
+            project=self.project, zone=zone, body=body).execute())
         self.disks.append(name)
+        return operation
 
     def create_disk(self, zone, name, size=25):
         if name not in self.disks:
@@ -530,6 +845,16 @@ class GCPService(BaseGCPService):
         if self.disk_exists(zone, name):
             return
 
+        body = self._disk_body(zone, name, size)
+        self._track_operation(self.compute.disks().insert(
+            project=self.project, zone=zone, body=body).execute())
+        self.wait_for_disk(zone, name)
+
+    def _disk_body(self, zone, name, size, image=None, image_project=None,
+                   snapshot=None):
+        """ Return the request body for creating a pd-ssd disk, either
+        blank or from an image or snapshot.
+        """
         base = "projects/%s/zones/%s" % (self.project, zone)
         body = {
             "name": name,
@@ -537,9 +862,46 @@ class GCPService(BaseGCPService):
             "type": base + "/diskTypes/pd-ssd",
             "sizeGb": str(size)
         }
-        self.compute.disks().insert(project=self.project,
-                zone=zone, body=body).execute()
-        self.wait_for_disk(zone, name)
+        if image:
+            body["sourceImage"] = "projects/%s/global/images/%s" % (
+                image_project or self.project, image)
+        if snapshot:
+            body["sourceSnapshot"] = "projects/%s/global/snapshots/%s" % (
+                self.project, snapshot)
+        return body
+
+    @trace.traced()
+    def create_disks(self, zone, disks):
+        """ Create the given disks with a single batch request, and
+        wait for all of them to become ready.  Disks that already exist
+        are skipped.
+
+        :param disks a list of dictionaries that contain the name and
+            size of each disk, and optionally image and image_project or
+            snapshot to create the disk from
+        :return the list of finished operations
+        """
+        # Skip the disks that already exist, such as the ones that were
+        # created by an earlier run.
+        existing = self.execute_batch(
+            [self.compute.disks().get(
+                project=self.project, zone=zone, disk=d['name'])
+             for d in disks],
+            not_found_ok=True
+        )
+        disks = [d for d, e in zip(disks, existing) if not e]
+        if not disks:
+            return []
+        for disk in disks:
+            if disk['name'] not in self.disks:
+                self.disks.append(disk['name'])
+        operations = self.execute_batch(
+            [self.compute.disks().insert(
+                project=self.project, zone=zone,
+                body=self._disk_body(zone, **d))
+             for d in disks]
+        )
+        return self.wait_operations(operations)
 
     def create_ssd_disk(self, zone):
         name = 'scratch-' + str(uuid.uuid4().hex)
@@ -554,26 +916,34 @@ class GCPService(BaseGCPService):
         }
         return body
 
+    @trace.traced()
     def create_gcp_image_from_disk(self, zone, image_name, disk_name):
         build_disk = "projects/%s/zones/%s/disks/%s" % (self.project,
                 zone, disk_name)
-        self.compute.images().insert(body={"rawdisk": {},
-            "name": image_name,
-            "sourceDisk": build_disk},
-            project=self.project).execute()
-
-    def create_gcp_image_from_file(self, zone, image_name, file_name, bucket):
+        return self._track_operation(self.compute.images().insert(
+            body={"rawdisk": {},
+                  "name": image_name,
+                  "sourceDisk": build_disk},
+            project=self.project).execute())
+
+    @trace.traced()
+    def create_gcp_image_from_file(self, zone, image_name, file_name, bucket,
+                                   labels=None):
         source = "https://storage.googleapis.com/%s/%s" % (bucket, file_name)
-        self.compute.images().insert(
-            body={
-                "rawDisk": {
-                    "source": source
-                },
-                "name": image_name,
+        body = {
+            "rawDisk": {
+                "source": source
             },
-            project=self.project).execute()
+            "name": image_name,
+        }
+        if labels:
+            body["labels"] = labels
+        return self._track_operation(self.compute.images().insert(
+            body=body, project=self.project).execute())
 
+    @trace.traced()
     def wait_image(self, image_name):
+        self._wait_for_tracked_operations(['global/images/%s' % image_name])
         image_req = self.compute.images().get(image=image_name, project=self.project)
         while True:
             if retry(execute_gcp_api_call, timeout=30.0)(image_req)['status'] == 'READY':
@@ -611,26 +981,149 @@ class GCPService(BaseGCPService):
 
         return youngest['name']
 
-    def get_latest_encryptor_image(self,
-                                   zone,
-                                   bucket,
-                                   image_file=None):
+    @trace.traced()
+    def get_cached_encryptor_image(self, bucket, image_file=None):
+        """ Return the name of an encryptor image that was created from
+        the given Metavisor image file, creating the image if necessary.
+
+        Encryptor images are kept in a registry, so that later runs can
+        reuse them.  Each image is named after the MD5 hash of the file
+        that it was created from, and is labeled with the file's bucket,
+        name, generation and MD5 hash, and the time that it was last
+        used.  Images in the registry are not deleted by cleanup().
+        Instead, the least recently used images are garbage collected by
+        gc_encryptor_images().
+        """
         if bucket in brkt_image_buckets:
             bucket = brkt_image_buckets[bucket]
-
-        image_name = 'encryptor-%s' % self.get_session_id()
-        # if image_file is not provided try to get latest.image.tar.gz
-        # if latest.image.tar.gz doesnt exist return the newest image
         if not image_file:
             image_file = self.get_image_file(bucket)
-        self.create_gcp_image_from_file(zone,
-                                        image_name,
-                                        image_file,
-                                        bucket)
+        file_info = retry(execute_gcp_api_call)(
+            self.storage.objects().get(bucket=bucket, object=image_file))
+        if file_info.get('md5Hash'):
+            content_key = base64.b64decode(file_info['md5Hash']).encode('hex')
+        else:
+            # Composite objects don't have an MD5 hash.
+            content_key = 'g' + file_info['generation']
+        image_name = 'encryptor-%s' % content_key
+
+        image = None
+        try:
+            image = self.get_image(image_name)
+        except errors.HttpError as e:
+            if e.resp.status != 404:
+                raise
+        if image and image['status'] == 'FAILED':
+            self.log.info('Deleting failed encryptor image %s', image_name)
+            self.wait_operation(self.delete_image(image_name))
+            image = None
+
+        now = str(int(time.time()))
+        if image:
+            self.log.info('Using cached encryptor image %s', image_name)
+            self._touch_encryptor_image(image, now)
+        else:
+            self.log.info('Creating encryptor image %s from %s/%s',
+                          image_name, bucket, image_file)
+            labels = {
+                LABEL_ENCRYPTOR_IMAGE: 'true',
+                LABEL_SOURCE_BUCKET: _label_value(bucket),
+                LABEL_SOURCE_NAME: _label_value(image_file),
+                LABEL_SOURCE_GENERATION: file_info['generation'],
+                LABEL_SOURCE_MD5: content_key,
+                LABEL_LAST_USED: now
+            }
+            try:
+                self.create_gcp_image_from_file(
+                    None, image_name, image_file, bucket, labels=labels)
+            except errors.HttpError as e:
+                # Another run may have started creating the same image.
+                if e.resp.status != 409:
+                    raise
         self.wait_image(image_name)
-        self.encryptor_image = image_name
+
+        if not image:
+            # A new Metavisor image was published, so older encryptor
+            # images may no longer be needed.
+            try:
+                self.gc_encryptor_images(exclude=[image_name])
+            except Exception as e:
+                self.log.warn(
+                    'Unable to garbage collect encryptor images: %s', e)
         return image_name
 
+    def _touch_encryptor_image(self, image, timestamp):
+        """ Update the last used time of the given encryptor image.  This
+        is best effort, since another run may be updating the labels at the
+        same time.
+        """
+        labels = dict(image.get('labels', {}))
+        labels[LABEL_LAST_USED] = timestamp
+        request = self.compute.images().setLabels(
+            project=self.project,
+            resource=image['name'],
+            body={
+                'labels': labels,
+                'labelFingerprint': image.get('labelFingerprint')
+            }
+        )
+        try:
+            execute_gcp_api_call(request)
+        except errors.HttpError as e:
+            self.log.debug(
+                'Unable to update labels of %s: %s', image['name'], e)
+
+    def list_encryptor_images(self):
+        """ Return all images in the encryptor image registry. """
+        images = []
+        request = self.compute.images().list(project=self.project)
+        while request:
+            resp = retry(execute_gcp_api_call)(request)
+            images += resp.get('items', [])
+            request = self.compute.images().list_next(request, resp)
+        return [i for i in images
+                if i.get('labels', {}).get(LABEL_ENCRYPTOR_IMAGE) == 'true']
+
+    def gc_encryptor_images(self, keep=ENCRYPTOR_IMAGE_CACHE_SIZE,
+                            min_idle_secs=ENCRYPTOR_IMAGE_MIN_IDLE_SECS,
+                            exclude=None):
+        """ Delete the least recently used images in the encryptor image
+        registry.  The keep most recently used images are not deleted,
+        and neither are images that were used in the last min_idle_secs
+        seconds, since another run may still be using them.
+
+        :param exclude a list of image names that must not be deleted
+        :return the names of the deleted images
+        """
+        exclude = exclude or []
+
+        def _last_used(image):
+            try:
+                return int(image['labels'].get(LABEL_LAST_USED, 0))
+            except ValueError:
+                return 0
+
+        images = sorted(
+            self.list_encryptor_images(), key=_last_used, reverse=True)
+        now = time.time()
+        expired = [
+            i['name'] for i in images[keep:]
+            if i['name'] not in exclude and
+            now - _last_used(i) > min_idle_secs
+        ]
+        if expired:
+            self.log.info('Deleting unused encryptor images %s',
+                          ', '.join(expired))
+            operations = self.execute_batch(
+                [self.compute.images().delete(
+                    project=self.project, image=name)
+                 for name in expired]
+            )
+            for operation in operations:
+                self._track_operation(operation)
+        return expired
+
+    @trace.traced()
     def run_instance(self,
                      zone,
                      name,
@@ -644,7 +1137,93 @@ class GCPService(BaseGCPService):
                      image_project=None,
                      subnet=None,
                      tags=None):
+        config = self._instance_body(
+            zone, name, image, network=network, disks=disks,
+            metadata=metadata, delete_boot=delete_boot,
+            block_project_ssh_keys=block_project_ssh_keys,
+            instance_type=instance_type, image_project=image_project,
+            subnet=subnet)
+        instance_req = self.compute.instances().insert(
+            project=self.project,
+            zone=zone,
+            body=config)
+        self._track_operation(
+            retry(execute_gcp_api_call, timeout=30.0)(instance_req))
+        if tags:
+            self.log.info("Setting instance tags %s", tags)
+            self.set_tags(zone, name, tags)
+        self.wait_instance(name, zone)
+        self.get_disk_size(zone, name)
+        self.instances.append(name)
+
+    @trace.traced()
+    def run_instances(self, zone, instances,
+                      max_parallel=MAX_PARALLEL_INSERTS):
+        """ Launch several instances, sending at most max_parallel insert
+        requests at the same time, and wait for all of them to start.
 
+        :param instances a list of dictionaries that contain the keyword
+            arguments to run_instance() for each instance, except zone
+        :return the instance resources, in the same order as instances
+        """
+        configs = []
+        for instance in instances:
+            instance = dict(instance)
+            tags = instance.pop('tags', None)
+            config = self._instance_body(
+                zone, instance.pop('name'), instance.pop('image'),
+                **instance)
+            if tags:
+                # Setting the tags in the insert request saves a setTags
+                # call per instance.
+                config['tags'] = {'items': tags}
+            configs.append(config)
+
+        def _insert(config):
+            def _f():
+                request = self.compute.instances().insert(
+                    project=self.project, zone=zone, body=config)
+                operation = retry(execute_gcp_api_call, timeout=30.0)(
+                    request, http=self.new_http())
+                # Track the instance as soon as it's inserted, so that
+                # cleanup() deletes it if another insert fails.
+                self._track_operation(operation)
+                self.instances.append(config['name'])
+            return _f
+
+        brkt_cli.util.run_concurrently(
+            [_insert(c) for c in configs], max_workers=max_parallel)
+        names = [c['name'] for c in configs]
+        self._wait_for_tracked_operations(
+            [_instance_key(zone, name) for name in names])
+
+        # Get all of the instances in one batch request, until they're
+        # running.
+        result = {}
+        pending = names
+        while True:
+            # execute_batch() retries the requests that fail.
+            responses = self.execute_batch(
+                [self.compute.instances().get(
+                    project=self.project, zone=zone, instance=name)
+                 for name in pending]
+            )
+            for instance_data in responses:
+                result[instance_data['name']] = instance_data
+            pending = [i['name'] for i in responses
+                       if i['status'] != 'RUNNING']
+            if not pending:
+                return [result[name] for name in names]
+            self.log.info(
+                'Waiting for %d instances to become ready', len(pending))
+            time.sleep(5)
+
+    def _instance_body(self, zone, name, image, network='default',
+                       disks=[], metadata={}, delete_boot=True,
+                       block_project_ssh_keys=False,
+                       instance_type='n1-standard-4', image_project=None,
+                       subnet=None):
+        """ Return the request body for inserting an instance. """
         if block_project_ssh_keys:
             if 'items' not in metadata:
                 metadata['items'] = []
@@ -703,18 +1282,7 @@ class GCPService(BaseGCPService):
             subnetwork = "projects/%s/regions/%s/subnetworks/%s" % (
                 self.project, zone[:-2], subnet)
             config['networkInterfaces'][0]['subnetwork'] = subnetwork
-
-        instance_req = self.compute.instances().insert(
-            project=self.project,
-            zone=zone,
-            body=config)
-        retry(execute_gcp_api_call, timeout=30.0)(instance_req)
-        if tags:
-            self.log.info("Setting instance tags %s", tags)
-            self.set_tags(zone, name, tags)
-        self.wait_instance(name, zone)
-        self.get_disk_size(zone, name)
-        self.instances.append(name)
+        return config
 
     def get_disk(self, zone, disk_name):
         source_disk = "projects/%s/zones/%s/disks/%s" % (self.project,
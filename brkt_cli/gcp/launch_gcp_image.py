@@ -1,39 +1,90 @@
 import logging
 import uuid
 
+from brkt_cli.gcp.gcp_service import (
+    GCP_NAME_MAX_LENGTH,
+    MAX_PARALLEL_INSERTS
+)
 from brkt_cli.util import (
     append_suffix
 )
 
 log = logging.getLogger(__name__)
 
-def launch(log, gcp_svc, image_id, instance_name, zone, delete_boot, instance_type, network, subnetwork, metadata={}, ssd_disks=0, gcp_tags=None):
+
+def _instance_names(instance_name, count):
     if not instance_name:
-        instance_name = 'brkt' + '-' + str(uuid.uuid4().hex)
-
-    snap_name = append_suffix(instance_name, '-snap', 64)
-    log.info("Creating guest root disk from snapshot")
-    gcp_svc.disk_from_snapshot(zone, image_id, snap_name)
-    gcp_svc.wait_for_disk(zone, snap_name)
-    log.info("Starting instance")
-    guest_disk = gcp_svc.get_disk(zone, snap_name)
-    guest_disk['autoDelete'] = True
-    disks = [guest_disk]
-    for x in range(ssd_disks):
-        ssd_disk = gcp_svc.create_ssd_disk(zone)
-        disks.append(ssd_disk)
-    gcp_svc.run_instance(zone=zone,
-                         name=instance_name,
-                         image=image_id,
-                         disks=disks,
-                         metadata=metadata,
-                         delete_boot=delete_boot,
-                         network=network,
-                         subnet=subnetwork,
-                         instance_type=instance_type,
-                         tags=gcp_tags)
-    gcp_svc.wait_instance(instance_name, zone)
-    log.info("Instance %s (%s) launched successfully" % (instance_name,
-             gcp_svc.get_instance_ip(instance_name, zone)))
-
-    return instance_name
+        return ['brkt' + '-' + str(uuid.uuid4().hex) for _ in range(count)]
+    if count == 1:
+        return [instance_name]
+    return [append_suffix(instance_name, '-%d' % n, GCP_NAME_MAX_LENGTH)
+            for n in range(1, count + 1)]
+
+
+def launch(log, gcp_svc, image_id, instance_name, zone, delete_boot, instance_type, network, subnetwork, metadata={}, ssd_disks=0, gcp_tags=None):
+    return launch_instances(
+        log, gcp_svc, image_id, instance_name, zone, delete_boot,
+        instance_type, network, subnetwork, metadata=metadata,
+        ssd_disks=ssd_disks, gcp_tags=gcp_tags)[0]
+
+
+def launch_instances(log, gcp_svc, image_id, instance_name, zone,
+                     delete_boot, instance_type, network, subnetwork,
+                     metadata={}, ssd_disks=0, gcp_tags=None, count=1,
+                     max_parallel=MAX_PARALLEL_INSERTS):
+    """ Launch count instances of the encrypted image.  The guest root
+    disks are created from the encrypted snapshot in one batch request,
+    and the instances are inserted max_parallel at a time.  If
+    instance_name is specified and count is greater than 1, the instances
+    are named instance_name-1, instance_name-2, etc.
+
+    :return the names of the instances
+    """
+    names = _instance_names(instance_name, count)
+    snap_names = [append_suffix(name, '-snap', 64) for name in names]
+
+    log.info("Creating %d guest root disks from snapshot", count)
+    size = gcp_svc.get_snapshot(image_id)['diskSizeGb']
+    gcp_svc.create_disks(
+        zone,
+        [{'name': snap_name, 'size': size, 'snapshot': image_id}
+         for snap_name in snap_names]
+    )
+
+    log.info("Starting %d instances", count)
+    instances = []
+    for name, snap_name in zip(names, snap_names):
+        guest_disk = gcp_svc.get_disk(zone, snap_name)
+        guest_disk['autoDelete'] = True
+        disks = [guest_disk]
+        for x in range(ssd_disks):
+            ssd_disk = gcp_svc.create_ssd_disk(zone)
+            disks.append(ssd_disk)
+        instances.append({
+            'name': name,
+            'image': image_id,
+            'disks': disks,
+            'metadata': metadata,
+            'delete_boot': delete_boot,
+            'network': network,
+            'subnet': subnetwork,
+            'instance_type': instance_type,
+            'tags': gcp_tags
+        })
+    try:
+        instance_data = gcp_svc.run_instances(
+            zone, instances, max_parallel=max_parallel)
+    except:
+        # Don't leave part of the fleet and the guest root disks behind.
+        log.error('Unable to start %d instances.  Cleaning up.', count)
+        gcp_svc.cleanup(zone)
+        raise
+
+    for name, data in zip(names, instance_data):
+        try:
+            ip = data['networkInterfaces'][0]['accessConfigs'][0]['natIP']
+        except (KeyError, IndexError):
+            ip = None
+        log.info("Instance %s (%s) launched successfully" % (name, ip))
+
+    return names
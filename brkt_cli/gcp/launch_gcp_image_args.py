@@ -22,6 +22,16 @@ def setup_launch_gcp_image_args(parser, parsed_config):
         dest='instance_type',
         default='n1-standard-1'
     )
+    parser.add_argument(
+        '--count',
+        metavar='N',
+        type=int,
+        default=1,
+        help=(
+            'Number of instances to launch.  If --instance-name is also '
+            'specified, the instances are named NAME-1, NAME-2, etc.'
+        )
+    )
     gcp_args.add_gcp_zone(parser, parsed_config)
     parser.add_argument(
         '--no-delete-boot',
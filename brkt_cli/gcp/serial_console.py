@@ -0,0 +1,111 @@
+# Copyright 2017 Bracket Computing, Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License").
+# You may not use this file except in compliance with the License.
+# A copy of the License is located at
+#
+# https://github.com/brkt/brkt-cli/blob/master/LICENSE
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Read the serial console of a GCP instance incrementally.
+
+getSerialPortOutput accepts a start offset and returns the offset of the
+next byte, so each call only downloads output that was written since the
+previous call.  The output is appended to a local file, which is rolled
+over when it reaches a maximum size.
+"""
+
+import logging
+import os
+import tempfile
+
+log = logging.getLogger(__name__)
+
+# The size at which the console file is rolled over to <name>.1.
+MAX_FILE_BYTES = 16 * 1024 * 1024
+
+
+class SerialConsoleReader(object):
+    """ A fetch function for ConsoleTailer that returns the serial console
+    output that was written since the previous call, and saves it to a
+    local file.
+    """
+
+    def __init__(self, gcp_svc, zone, instance, max_bytes=MAX_FILE_BYTES):
+        self.gcp_svc = gcp_svc
+        self.zone = zone
+        self.instance = instance
+        self.max_bytes = max_bytes
+        # httplib2 isn't thread-safe, so the reads from the tailer thread
+        # share an Http object of their own.
+        self.http = gcp_svc.new_http()
+        self.next = 0
+        self.bytes_read = 0
+        self.path = None
+        self._file = None
+        self._file_bytes = 0
+
+    def _write(self, contents):
+        if not self._file:
+            with tempfile.NamedTemporaryFile(
+                    prefix='serial-console-',
+                    suffix='-%s.out' % self.gcp_svc.session_id,
+                    delete=False) as t:
+                self.path = t.name
+            self._file = open(self.path, 'wb')
+        elif self._file_bytes + len(contents) > self.max_bytes:
+            self._file.close()
+            os.rename(self.path, self.path + '.1')
+            self._file = open(self.path, 'wb')
+            self._file_bytes = 0
+        self._file.write(contents)
+        self._file.flush()
+        self._file_bytes += len(contents)
+
+    def __call__(self):
+        output = self.gcp_svc.get_serial_port_output(
+            self.zone, self.instance, start=self.next, http=self.http)
+        start = int(output.get('start', self.next))
+        if start > self.next:
+            # The instance keeps a limited amount of console output.
+            log.debug(
+                'Skipped %d bytes of %s console output that are no longer '
+                'available', start - self.next, self.instance)
+        self.next = int(output.get('next', start))
+        contents = output.get('contents', '')
+        if isinstance(contents, unicode):
+            contents = contents.encode('utf-8')
+        if contents:
+            self.bytes_read += len(contents)
+            self._write(contents)
+        return contents
+
+    def save(self):
+        """ Read any remaining output and close the console file.
+
+        :return the path to the console file, or None if no output was read
+        """
+        try:
+            self()
+        except Exception:
+            log.exception('Unable to read serial console contents')
+        if self._file:
+            self._file.close()
+            self._file = None
+        return self.path
+
+    def discard(self):
+        """ Close and delete the console file. """
+        if self._file:
+            self._file.close()
+            self._file = None
+        for path in (self.path, self.path and self.path + '.1'):
+            if path and os.path.exists(path):
+                os.remove(path)
+        self.path = None
@@ -14,12 +14,15 @@
 
 import logging
 
+from brkt_cli import trace
+from brkt_cli.console_tailer import ConsoleTailer
 from brkt_cli.encryptor_service import (
     ENCRYPTOR_STATUS_PORT,
     wait_for_encryption,
     wait_for_encryptor_up
 )
 from brkt_cli.gcp.gcp_service import gcp_metadata_from_userdata
+from brkt_cli.gcp.serial_console import SerialConsoleReader
 from brkt_cli.util import Deadline
 
 """
@@ -30,26 +33,23 @@ on an existing encrypted GCP image.
 log = logging.getLogger(__name__)
 
 
+@trace.traced()
 def update_gcp_image(gcp_svc, enc_svc_cls, image_id, encryptor_image,
                      encrypted_image_name, zone, instance_config,
-                     keep_encryptor=False, image_file=None,
-                     image_bucket=None, network=None,
+                     image_file=None, image_bucket=None, network=None,
                      subnetwork=None, status_port=ENCRYPTOR_STATUS_PORT,
                      cleanup=True, gcp_tags=None):
     snap_created = None
     instance_name = 'brkt-updater-' + gcp_svc.get_session_id()
     updater = instance_name + '-metavisor'
-    updater_launched = False
+    console = None
     try:
-        # create image from file in GCS bucket
+        # create image from file in GCS bucket, or reuse the one that a
+        # previous run created
         log.info('Retrieving encryptor image from GCS bucket')
         if not encryptor_image:
-            encryptor_image = gcp_svc.get_latest_encryptor_image(zone,
+            encryptor_image = gcp_svc.get_cached_encryptor_image(
                 image_bucket, image_file=image_file)
-        else:
-            # Keep user provided encryptor image
-            keep_encryptor = True
-
         encrypted_image_disk = instance_name + '-guest'
 
         # Create disk from encrypted guest snapshot. This disk
@@ -72,31 +72,32 @@ def update_gcp_image(gcp_svc, enc_svc_cls, image_id, encryptor_image,
                              delete_boot=False,
                              metadata=user_data,
                              tags=gcp_tags)
-        host_ips = []
-        ip = gcp_svc.get_instance_ip(updater, zone)
-        if ip:
-            host_ips.append(ip)
-        pvt_ip = gcp_svc.get_private_ip(updater, zone)
-        if pvt_ip:
-            host_ips.append(pvt_ip)
-        updater_launched = True
-        enc_svc = enc_svc_cls(host_ips, port=status_port)
+        console = SerialConsoleReader(gcp_svc, zone, updater)
+        tailer = ConsoleTailer(console, updater)
+        with tailer:
+            host_ips = []
+            ip = gcp_svc.get_instance_ip(updater, zone)
+            if ip:
+                host_ips.append(ip)
+            pvt_ip = gcp_svc.get_private_ip(updater, zone)
+            if pvt_ip:
+                host_ips.append(pvt_ip)
+            enc_svc = enc_svc_cls(host_ips, port=status_port)
 
-        # wait for updater to finish and guest root disk
-        wait_for_encryptor_up(enc_svc, Deadline(600))
-        log.info(
-            'Waiting for updater service on %s (%s:%s)',
-            updater, ip, enc_svc.port
-        )
-        try:
-            wait_for_encryption(enc_svc)
-        except:
-            raise
+            # wait for updater to finish and guest root disk
+            wait_for_encryptor_up(
+                enc_svc, Deadline(600), check=tailer.check)
+            log.info(
+                'Waiting for updater service on %s (%s:%s)',
+                updater, ip, enc_svc.port
+            )
+            wait_for_encryption(enc_svc, check=tailer.check)
+        console.discard()
+        console = None
 
         # delete updater instance
         log.info('Deleting updater instance')
         gcp_svc.delete_instance(zone, updater)
-        updater_launched = False
 
         # wait for updater root disk
         gcp_svc.wait_for_detach(zone, updater)
@@ -108,8 +109,8 @@ def update_gcp_image(gcp_svc, enc_svc_cls, image_id, encryptor_image,
         gcp_svc.wait_image(encrypted_image_name)
         gcp_svc.wait_snapshot(encrypted_image_name)
     except:
-        if updater_launched:
-            f = gcp_svc.write_serial_console_file(zone, updater)
+        if console:
+            f = console.save()
             if f:
                 log.info('Update failed. Writing console to %s' % f)
         log.info("Update failed. Cleaning up")
@@ -117,10 +118,10 @@ def update_gcp_image(gcp_svc, enc_svc_cls, image_id, encryptor_image,
             gcp_svc.delete_snapshot(encrypted_image_name)
         if not cleanup:
             return
-        gcp_svc.cleanup(zone, encryptor_image, keep_encryptor)
+        gcp_svc.cleanup(zone)
         raise
     finally:
         if not cleanup:
             return
-        gcp_svc.cleanup(zone, encryptor_image, keep_encryptor)
+        gcp_svc.cleanup(zone)
     return encrypted_image_name
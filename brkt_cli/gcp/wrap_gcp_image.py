@@ -16,13 +16,11 @@ def wrap_guest_image(gcp_svc, image_id, encryptor_image, zone,
                      instance_type='n1-standard-4', network=None,
                      subnet=None, cleanup=True, ssd_disks=0, gcp_tags=None):
     try:
-        keep_encryptor = True
         if not encryptor_image:
             log.info('Retrieving encryptor image from GCP bucket')
             try:
-                encryptor_image = gcp_svc.get_latest_encryptor_image(zone,
+                encryptor_image = gcp_svc.get_cached_encryptor_image(
                     image_bucket, image_file=image_file)
-                keep_encryptor = False
             except errors.HttpError as e:
                 encryptor_image = None
                 log.exception('GCP API call to retrieve image failed')
@@ -65,12 +63,10 @@ def wrap_guest_image(gcp_svc, image_id, encryptor_image, zone,
     except errors.HttpError as e:
         log.exception('GCP API request failed: {}'.format(e.message))
     finally:
+        # The encryptor image is either user provided or cached for reuse
+        # by later runs, so it is never deleted here.
         if not cleanup:
             log.info("Not cleaning up")
-        else:
-            if not keep_encryptor and encryptor_image:
-                log.info('Deleting encryptor image %s' % encryptor_image)
-                gcp_svc.delete_image(encryptor_image)
 
     return instance_name
 
@@ -18,8 +18,7 @@ import logging
 import re
 from distutils.version import LooseVersion
 
-import boto3
-from botocore.handlers import disable_signing
+from brkt_cli import aws_clients
 
 
 log = logging.getLogger(__name__)
@@ -60,9 +59,8 @@ def get_s3_versions(bucket):
     else:
         version_prefix = 'metavisor-'
 
-    s3 = boto3.resource('s3')
-    s3.meta.client.meta.events.register('choose-signer.s3.*', disable_signing)
-    paginator = s3.meta.client.get_paginator('list_objects')
+    s3 = aws_clients.client('s3', unsigned=True)
+    paginator = s3.get_paginator('list_objects')
     page_iterator = paginator.paginate(Bucket=bucket,
                                        Delimiter='/',
                                        Prefix=version_prefix)
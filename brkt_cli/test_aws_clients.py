@@ -0,0 +1,145 @@
+# Copyright 2017 Bracket Computing, Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License").
+# You may not use this file except in compliance with the License.
+# A copy of the License is located at
+#
+# https://github.com/brkt/brkt-cli/blob/master/LICENSE
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and
+# limitations under the License.
+import os
+import unittest
+
+import boto3.session
+import botocore
+
+from brkt_cli import aws_clients, util
+from brkt_cli.aws import aws_service
+
+
+def _new_factory():
+    session = boto3.session.Session(
+        aws_access_key_id='AKIDEXAMPLE',
+        aws_secret_access_key='secret',
+        region_name='us-west-2'
+    )
+    return aws_clients.ClientFactory(session=session)
+
+
+class TestClientFactory(unittest.TestCase):
+
+    def setUp(self):
+        self.factory = _new_factory()
+
+    def test_client_is_cached(self):
+        """ Test that the factory returns the same client for the same
+        service and region, and a different client otherwise.
+        """
+        c1 = self.factory.client('ec2', region_name='us-west-2')
+        c2 = self.factory.client('ec2', region_name='us-west-2')
+        self.assertIs(c1, c2)
+        self.assertIsNot(
+            c1, self.factory.client('ec2', region_name='us-east-1'))
+        self.assertIsNot(
+            c1,
+            self.factory.client('ec2', region_name='us-west-2', unsigned=True)
+        )
+
+    def test_config(self):
+        """ Test that clients are created with the pool size, retries and
+        signing settings.
+        """
+        c = self.factory.client('s3', unsigned=True)
+        self.assertEqual(
+            aws_clients.DEFAULT_MAX_POOL_CONNECTIONS,
+            c.meta.config.max_pool_connections
+        )
+        self.assertEqual(
+            aws_clients.DEFAULT_MAX_ATTEMPTS,
+            c.meta.config.retries['total_max_attempts'] - 1
+        )
+        self.assertEqual(botocore.UNSIGNED, c.meta.config.signature_version)
+
+    def test_resource_uses_cached_client(self):
+        """ Test that each resource is new, and uses the cached client. """
+        r1 = self.factory.resource('ec2', region_name='us-west-2')
+        r2 = self.factory.resource('ec2', region_name='us-west-2')
+        self.assertIsNot(r1, r2)
+        self.assertIs(r1.meta.client, r2.meta.client)
+        self.assertIs(
+            self.factory.client('ec2', region_name='us-west-2'),
+            r1.meta.client
+        )
+
+    def test_set_max_concurrency(self):
+        """ Test that increasing the concurrency level replaces the cached
+        clients with clients that have larger pools.
+        """
+        c1 = self.factory.client('ec2', region_name='us-west-2')
+        self.factory.set_max_concurrency(4)
+        self.assertIs(c1, self.factory.client('ec2', region_name='us-west-2'))
+
+        self.factory.set_max_concurrency(32)
+        c2 = self.factory.client('ec2', region_name='us-west-2')
+        self.assertIsNot(c1, c2)
+        self.assertEqual(32, c2.meta.config.max_pool_connections)
+        self.assertEqual(
+            aws_clients.HIGH_CONCURRENCY_MAX_ATTEMPTS,
+            c2.meta.config.retries['total_max_attempts'] - 1
+        )
+
+    def test_proxy_environment(self):
+        """ Test that a new client is created when the proxy settings in
+        the environment change.
+        """
+        saved = dict(os.environ)
+        try:
+            for name in aws_clients._PROXY_VARIABLES:
+                os.environ.pop(name, None)
+            c1 = self.factory.client('s3')
+            os.environ['HTTPS_PROXY'] = 'https://proxy.example.com:8888'
+            self.assertIsNot(c1, self.factory.client('s3'))
+        finally:
+            os.environ.clear()
+            os.environ.update(saved)
+
+
+class TestAWSServiceClients(unittest.TestCase):
+
+    def test_lazy_clients(self):
+        """ Test that AWSService creates its EC2 client and resource on
+        first use, for the region that it's connected to.
+        """
+        factory = _new_factory()
+        aws_svc = aws_service.AWSService('123', client_factory=factory)
+        self.assertEqual({}, factory._clients)
+        self.assertEqual(
+            'us-east-1', aws_svc.ec2client.meta.region_name)
+
+        aws_svc.connect('us-west-1')
+        self.assertEqual('us-west-1', aws_svc.ec2client.meta.region_name)
+        self.assertIs(aws_svc.ec2client, aws_svc.ec2.meta.client)
+
+    def test_resource_per_thread(self):
+        """ Test that each thread gets its own EC2 resource, which uses
+        the shared client.
+        """
+        factory = _new_factory()
+        aws_svc = aws_service.AWSService('123', client_factory=factory)
+        aws_svc.connect('us-west-1')
+        main_ec2 = aws_svc.ec2
+        self.assertIs(main_ec2, aws_svc.ec2)
+
+        results = util.run_concurrently([lambda: aws_svc.ec2] * 2)
+        self.assertIsNot(results[0], results[1])
+        for ec2 in results:
+            self.assertIsNot(main_ec2, ec2)
+            self.assertIs(main_ec2.meta.client, ec2.meta.client)
+
+        # A new resource is created after connecting to another region.
+        aws_svc.connect('us-east-2')
+        self.assertEqual('us-east-2', aws_svc.ec2.meta.client.meta.region_name)
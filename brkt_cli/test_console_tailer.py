@@ -0,0 +1,96 @@
+# Copyright 2017 Bracket Computing, Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License").
+# You may not use this file except in compliance with the License.
+# A copy of the License is located at
+#
+# https://github.com/brkt/brkt-cli/blob/master/LICENSE
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and
+# limitations under the License.
+import unittest
+
+from brkt_cli import console_tailer, encryptor_service
+from brkt_cli.console_tailer import ConsoleTailer, SnapshotDiffer
+
+
+class TestSnapshotDiffer(unittest.TestCase):
+
+    def test_append(self):
+        """ Test that only the text after the previous output is returned.
+        """
+        outputs = [None, 'one\n', 'one\ntwo\n', 'one\ntwo\n']
+        differ = SnapshotDiffer(lambda: outputs.pop(0))
+        self.assertEqual('', differ())
+        self.assertEqual('one\n', differ())
+        self.assertEqual('two\n', differ())
+        self.assertEqual('', differ())
+
+    def test_truncated(self):
+        """ Test that new output is found when the console buffer is
+        truncated at the front.
+        """
+        outputs = [
+            'line one\nline two\nline three\n',
+            'line two\nline three\nline four\n',
+            'no overlap\n'
+        ]
+        differ = SnapshotDiffer(lambda: outputs.pop(0))
+        differ()
+        self.assertEqual('line four\n', differ())
+        self.assertEqual('no overlap\n', differ())
+
+
+class TestConsoleTailer(unittest.TestCase):
+
+    def test_partial_lines(self):
+        """ Test that a line is not returned until it's complete.
+        """
+        chunks = ['Booting', ' Metavisor\r\nmounting', ' root\n']
+        tailer = ConsoleTailer(lambda: chunks.pop(0), 'i-123')
+        self.assertEqual([], tailer.poll())
+        self.assertEqual(['Booting Metavisor\r'], tailer.poll())
+        self.assertEqual(['mounting root'], tailer.poll())
+        tailer.check()
+
+    def test_fatal_pattern(self):
+        """ Test that check() raises EncryptionError with the first fatal
+        line.
+        """
+        chunks = ['ok\nFatal trap 12: page fault\npanic: page fault\n']
+        tailer = ConsoleTailer(lambda: chunks.pop(0), 'i-123')
+        tailer.poll()
+        self.assertEqual('Fatal trap 12: page fault', tailer.fatal_line)
+        with self.assertRaises(encryptor_service.EncryptionError) as cm:
+            tailer.check()
+        self.assertIn('i-123', cm.exception.message)
+
+    def test_thread(self):
+        """ Test that the background thread stops polling after a fatal
+        line, and that errors from fetch are ignored.
+        """
+        calls = []
+
+        def fetch():
+            calls.append(1)
+            if len(calls) == 1:
+                raise Exception('Console not available')
+            return 'mountroot>\n'
+
+        tailer = ConsoleTailer(fetch, 'i-123', interval=0)
+        tailer.start()
+        tailer._thread.join(10)
+        tailer.stop()
+        self.assertEqual(2, len(calls))
+        self.assertEqual('mountroot>', tailer.fatal_line)
+
+    def test_default_patterns(self):
+        regexp = ConsoleTailer(None, 'i-123').regexp
+        for line in ('panic: vm_fault', 'Fatal double fault',
+                     'Kernel panic - not syncing'):
+            self.assertTrue(regexp.search(line), line)
+        self.assertFalse(regexp.search('Metavisor started'))
+        self.assertEqual(15, console_tailer.DEFAULT_POLL_INTERVAL)
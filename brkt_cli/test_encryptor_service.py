@@ -11,6 +11,10 @@
 # CONDITIONS OF ANY KIND, either express or implied. See the
 # License for the specific language governing permissions and
 # limitations under the License.
+import BaseHTTPServer
+import json
+import os
+import threading
 import unittest
 
 import brkt_cli
@@ -141,3 +145,114 @@ class TestEncryptionService(unittest.TestCase):
         for failure_code in failure_codes:
             with self.assertRaises(encryptor_service.EncryptionError):
                 encryptor_service._handle_failure_code(failure_code)
+
+
+class _StatusHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+        self.server.connections += 1
+
+    def do_GET(self):
+        self.server.paths.append(self.path)
+        body = json.dumps({
+            'state': encryptor_service.ENCRYPT_ENCRYPTING,
+            'bytes_written': 25,
+            'bytes_total': 100
+        })
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestStatusConnection(unittest.TestCase):
+
+    def setUp(self):
+        self.server = BaseHTTPServer.HTTPServer(
+            ('127.0.0.1', 0), _StatusHandler)
+        self.server.connections = 0
+        self.server.paths = []
+        self.port = self.server.server_address[1]
+        t = threading.Thread(target=self.server.serve_forever)
+        t.daemon = True
+        t.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_race(self):
+        """ Test that the hostname that responds is used from then on,
+        over a single connection.
+        """
+        # Nothing listens on 127.0.0.2, so the connection is refused.
+        svc = encryptor_service.EncryptorService(
+            ['127.0.0.2', '127.0.0.1'], port=self.port)
+        status = svc.get_status()
+        self.assertEqual(25, status['percent_complete'])
+        self.assertEqual(['127.0.0.1'], svc.hostnames)
+        svc.get_status()
+        self.assertEqual(1, self.server.connections)
+        self.assertEqual(['/', '/'], self.server.paths)
+
+    def test_reconnect(self):
+        """ Test that a new connection is made when the pinned connection
+        is closed.
+        """
+        svc = encryptor_service.EncryptorService(
+            ['127.0.0.1'], port=self.port)
+        svc.get_status()
+        svc._connection.close()
+        svc.get_status()
+        self.assertEqual(2, self.server.connections)
+
+    def test_no_response(self):
+        svc = encryptor_service.EncryptorService(
+            ['127.0.0.2', '127.0.0.3'], port=self.port)
+        with self.assertRaises(encryptor_service.EncryptorConnectionError) \
+                as cm:
+            svc.get_status()
+        self.assertEqual(
+            set(['127.0.0.2', '127.0.0.3']),
+            set(cm.exception.exceptions_by_host.keys())
+        )
+        self.assertFalse(svc.is_encryptor_up())
+
+
+class TestProxy(unittest.TestCase):
+
+    def setUp(self):
+        self.environ = dict(os.environ)
+        for name in ('http_proxy', 'HTTP_PROXY', 'no_proxy', 'NO_PROXY'):
+            os.environ.pop(name, None)
+
+    def tearDown(self):
+        os.environ.clear()
+        os.environ.update(self.environ)
+
+    def test_private_address(self):
+        self.assertTrue(encryptor_service._is_private_address('10.1.2.3'))
+        self.assertTrue(encryptor_service._is_private_address('172.31.0.1'))
+        self.assertTrue(encryptor_service._is_private_address('192.168.0.1'))
+        self.assertFalse(encryptor_service._is_private_address('172.32.0.1'))
+        self.assertFalse(encryptor_service._is_private_address('54.1.2.3'))
+        self.assertFalse(encryptor_service._is_private_address('example.com'))
+
+    def test_get_proxy(self):
+        """ Test that the proxy is only used for public addresses, and
+        that NO_PROXY is not modified.
+        """
+        self.assertIsNone(encryptor_service._get_proxy('54.1.2.3'))
+        os.environ['http_proxy'] = 'proxy.example.com:3128'
+        self.assertEqual(
+            ('proxy.example.com', 3128),
+            encryptor_service._get_proxy('54.1.2.3')
+        )
+        self.assertIsNone(encryptor_service._get_proxy('10.0.0.5'))
+        self.assertNotIn('no_proxy', os.environ)
+        self.assertNotIn('NO_PROXY', os.environ)
@@ -0,0 +1,150 @@
+# Copyright 2017 Bracket Computing, Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License").
+# You may not use this file except in compliance with the License.
+# A copy of the License is located at
+#
+# https://github.com/brkt/brkt-cli/blob/master/LICENSE
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and
+# limitations under the License.
+import json
+import StringIO
+import unittest
+
+from brkt_cli import trace, util
+from brkt_cli.aws import aws_service
+
+
+class FakeClock(object):
+
+    def __init__(self):
+        self.now = 100.0
+
+    def time(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+class TestTrace(unittest.TestCase):
+
+    def setUp(self):
+        util.SLEEP_ENABLED = False
+        self.clock = FakeClock()
+        self.tracer = trace.enable(clock=self.clock)
+
+    def tearDown(self):
+        trace.disable()
+
+    def _spans(self):
+        return dict((s.name, s) for s in self.tracer.finished_spans())
+
+    def test_nesting(self):
+        """ Test that a span opened inside another span is its child, and
+        that durations come from the clock.
+        """
+        with trace.span('outer', image='ami-1'):
+            self.clock.advance(1)
+            with trace.span('inner', category=trace.API) as inner:
+                self.clock.advance(2)
+                inner.set(attempts=1)
+        spans = self._spans()
+        self.assertIsNone(spans['outer'].parent_id)
+        self.assertEqual(spans['outer'].id, spans['inner'].parent_id)
+        self.assertEqual(3, spans['outer'].duration)
+        self.assertEqual(2, spans['inner'].duration)
+        self.assertEqual({'image': 'ami-1'}, spans['outer'].attrs)
+        self.assertEqual({'attempts': 1}, spans['inner'].attrs)
+        self.assertIsNone(trace.current())
+
+    def test_error(self):
+        with self.assertRaises(ValueError):
+            with trace.span('failing'):
+                raise ValueError()
+        self.assertEqual(
+            'ValueError', self._spans()['failing'].attrs['error'])
+
+    def test_disabled(self):
+        """ Test that nothing is recorded when tracing is off. """
+        trace.disable()
+        with trace.span('ignored') as s:
+            s.set(x=1)
+        self.assertEqual([], self.tracer.finished_spans())
+
+    def test_traced(self):
+        @trace.traced()
+        def wait_for_thing(x):
+            self.clock.advance(x)
+            return x * 2
+
+        self.assertEqual('wait_for_thing', wait_for_thing.__name__)
+        self.assertEqual(10, wait_for_thing(5))
+        self.assertEqual(5, self._spans()['wait_for_thing'].duration)
+
+    def test_worker_threads(self):
+        """ Test that spans in threads started by run_concurrently() are
+        children of the span that started them.
+        """
+        def _work():
+            with trace.span('work'):
+                pass
+
+        with trace.span('parent') as parent:
+            util.run_concurrently([_work, _work])
+        work = [s for s in self.tracer.finished_spans() if s.name == 'work']
+        self.assertEqual(2, len(work))
+        for s in work:
+            self.assertEqual(parent.id, s.parent_id)
+            self.assertNotEqual('MainThread', s.thread_name)
+
+    def test_retry_boto(self):
+        """ Test that each attempt of an AWS API call is recorded. """
+        calls = []
+
+        def describe_things():
+            calls.append(1)
+            if len(calls) < 3:
+                raise aws_service.ClientError(
+                    {'Error': {'Code': '503', 'Message': 'Slow down'}},
+                    'DescribeThings')
+            return 'ok'
+
+        self.assertEqual('ok', aws_service.retry_boto(describe_things)())
+        spans = self.tracer.finished_spans()
+        self.assertEqual(['describe_things'] * 3, [s.name for s in spans])
+        self.assertEqual(
+            ['ClientError', 'ClientError', None],
+            [s.attrs.get('error') for s in spans])
+        self.assertEqual(set([trace.API]), set(s.category for s in spans))
+
+    def test_json_lines(self):
+        with trace.span('outer'):
+            with trace.span('inner'):
+                self.clock.advance(1.5)
+        f = StringIO.StringIO()
+        self.tracer.write_json_lines(f)
+        lines = [json.loads(l) for l in f.getvalue().splitlines()]
+        self.assertEqual(['outer', 'inner'], [l['name'] for l in lines])
+        self.assertEqual(lines[0]['id'], lines[1]['parent_id'])
+        self.assertEqual(1.5, lines[1]['duration'])
+        self.assertEqual(100.0, lines[1]['start'])
+
+    def test_chrome_trace(self):
+        with trace.span('encrypt'):
+            self.clock.advance(0.25)
+        f = StringIO.StringIO()
+        self.tracer.write_chrome_trace(f)
+        events = json.loads(f.getvalue())['traceEvents']
+        metadata = [e for e in events if e['ph'] == 'M']
+        complete = [e for e in events if e['ph'] == 'X']
+        self.assertEqual('MainThread', metadata[0]['args']['name'])
+        self.assertEqual(1, len(complete))
+        self.assertEqual('encrypt', complete[0]['name'])
+        self.assertEqual(100000000, complete[0]['ts'])
+        self.assertEqual(250000, complete[0]['dur'])
+        self.assertEqual(metadata[0]['tid'], complete[0]['tid'])
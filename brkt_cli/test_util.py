@@ -12,6 +12,10 @@
 # License for the specific language governing permissions and
 # limitations under the License.
 from datetime import datetime, timedelta
+import os
+import shutil
+import tempfile
+import threading
 import time
 import unittest
 
@@ -149,6 +153,126 @@ class TestRetry(unittest.TestCase):
         self.assertEqual(6, self.num_calls)
 
 
+class TestRunConcurrently(unittest.TestCase):
+
+    def test_results_in_order(self):
+        functions = [lambda n=n: n * n for n in range(10)]
+        self.assertEqual(
+            [n * n for n in range(10)],
+            util.run_concurrently(functions, max_workers=3)
+        )
+
+    def test_max_workers(self):
+        """ Test that no more than max_workers functions run at the same
+        time.
+        """
+        lock = threading.Lock()
+        state = {'running': 0, 'max_running': 0}
+
+        def _work():
+            with lock:
+                state['running'] += 1
+                state['max_running'] = max(
+                    state['max_running'], state['running'])
+            time.sleep(0.01)
+            with lock:
+                state['running'] -= 1
+
+        util.run_concurrently([_work] * 8, max_workers=2)
+        self.assertEqual(2, state['max_running'])
+
+    def test_exception(self):
+        """ Test that an exception is raised after all functions have
+        finished.
+        """
+        calls = []
+
+        def _fail():
+            raise TestException()
+
+        def _succeed():
+            time.sleep(0.01)
+            calls.append(1)
+
+        with self.assertRaises(TestException):
+            util.run_concurrently([_fail, _succeed, _succeed])
+        self.assertEqual(2, len(calls))
+
+
+class FakeClock(object):
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+
+class TestRateLimiter(unittest.TestCase):
+
+    def setUp(self):
+        self.sleeps = []
+        self.real_sleep = util.sleep
+        util.sleep = self.sleeps.append
+
+    def tearDown(self):
+        util.sleep = self.real_sleep
+
+    def test_wait(self):
+        """ Test that calls are spaced by the interval, and that idle
+        time is not accumulated.
+        """
+        clock = FakeClock()
+        limiter = util.RateLimiter(4, clock=clock)
+        limiter.wait()
+        limiter.wait()
+        limiter.wait()
+        self.assertEqual([0.25, 0.5], self.sleeps)
+
+        del self.sleeps[:]
+        clock.now += 10
+        limiter.wait()
+        self.assertEqual([], self.sleeps)
+
+
+class TestWriteFileAtomically(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_write(self):
+        """ Test that the directory is created, an existing file is
+        replaced, and no temporary files are left behind.
+        """
+        path = os.path.join(self.directory, 'cache', 'file.json')
+        util.write_file_atomically(path, 'one')
+        util.write_file_atomically(path, 'two')
+        with open(path) as f:
+            self.assertEqual('two', f.read())
+        self.assertEqual(
+            ['file.json'], os.listdir(os.path.dirname(path)))
+
+    def test_error(self):
+        """ Test that the temporary file is removed when the file can't
+        be moved into place.
+        """
+        def _move(src, dst):
+            raise OSError('Permission denied')
+
+        move = shutil.move
+        shutil.move = _move
+        try:
+            with self.assertRaises(OSError):
+                util.write_file_atomically(
+                    os.path.join(self.directory, 'file.json'), 'data')
+        finally:
+            shutil.move = move
+        self.assertEqual([], os.listdir(self.directory))
+
+
 class TestTimestamp(unittest.TestCase):
 
     def test_datetime_to_timestamp(self):
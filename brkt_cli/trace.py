@@ -0,0 +1,260 @@
+# Copyright 2017 Bracket Computing, Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License").
+# You may not use this file except in compliance with the License.
+# A copy of the License is located at
+#
+# https://github.com/brkt/brkt-cli/blob/master/LICENSE
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Record how long each stage of a command and each cloud API call takes.
+
+Code marks a stage with the span() context manager or the traced()
+decorator.  Spans nest: a span that starts while another span is open in
+the same thread becomes its child.  Tracing is off until enable() is
+called, and span() does nothing while it's off.
+
+The recorded spans can be written as JSON lines, one span per line, or in
+the Chrome trace event format, which can be loaded in chrome://tracing or
+https://ui.perfetto.dev.
+"""
+
+import itertools
+import json
+import os
+import threading
+import time
+
+# Span categories.
+STAGE = 'stage'
+API = 'api'
+
+FORMAT_CHROME = 'chrome'
+FORMAT_JSON_LINES = 'jsonl'
+FORMATS = (FORMAT_CHROME, FORMAT_JSON_LINES)
+
+_tracer = None
+
+
+class Span(object):
+
+    def __init__(self, tracer, name, category, attrs):
+        self.tracer = tracer
+        self.id = None
+        self.parent_id = None
+        self.name = name
+        self.category = category
+        self.attrs = attrs
+        self.thread_name = None
+        self.start = None
+        self.duration = None
+
+    def set(self, **attrs):
+        """ Add attributes to the span. """
+        self.attrs.update(attrs)
+
+    def __enter__(self):
+        self.tracer._open(self)
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        if exc_type:
+            self.attrs['error'] = exc_type.__name__
+        self.tracer._close(self)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'parent_id': self.parent_id,
+            'name': self.name,
+            'category': self.category,
+            'thread': self.thread_name,
+            'start': self.start,
+            'duration': self.duration,
+            'attrs': self.attrs,
+        }
+
+
+class _NullSpan(object):
+    """ Returned by span() when tracing is off. """
+
+    def set(self, **attrs):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class Tracer(object):
+    """ Collects the spans that are recorded by all threads. """
+
+    def __init__(self, clock=time):
+        self.clock = clock
+        self.spans = []
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _stack(self):
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def current(self):
+        """ Return the innermost open span in this thread, or None. """
+        stack = self._stack()
+        return stack[-1] if stack else None
+
+    def set_parent(self, parent):
+        """ Make parent the parent of the spans that are opened by this
+        thread while it has no open span.  This is used to connect the
+        spans in a worker thread to the span that started it.
+        """
+        self._local.parent = parent
+
+    def span(self, name, category=STAGE, **attrs):
+        return Span(self, name, category, attrs)
+
+    def _open(self, span):
+        stack = self._stack()
+        parent = stack[-1] if stack else getattr(self._local, 'parent', None)
+        with self._lock:
+            span.id = next(self._ids)
+        span.parent_id = parent.id if parent else None
+        span.thread_name = threading.current_thread().name
+        span.start = self.clock.time()
+        stack.append(span)
+
+    def _close(self, span):
+        span.duration = self.clock.time() - span.start
+        stack = self._stack()
+        if span in stack:
+            stack.remove(span)
+        with self._lock:
+            self.spans.append(span)
+
+    def finished_spans(self):
+        """ Return the closed spans, in the order that they started. """
+        with self._lock:
+            spans = list(self.spans)
+        return sorted(spans, key=lambda s: (s.start, s.id))
+
+    def write_json_lines(self, f):
+        for span in self.finished_spans():
+            f.write(json.dumps(span.to_dict(), sort_keys=True) + '\n')
+
+    def write_chrome_trace(self, f):
+        """ Write the spans as complete ("X") events in the Chrome trace
+        event format, with one row per thread.
+        """
+        pid = os.getpid()
+        thread_ids = {}
+        events = []
+        for span in self.finished_spans():
+            if span.thread_name not in thread_ids:
+                tid = len(thread_ids) + 1
+                thread_ids[span.thread_name] = tid
+                events.append({
+                    'name': 'thread_name', 'ph': 'M', 'pid': pid,
+                    'tid': tid, 'args': {'name': span.thread_name}
+                })
+            args = dict(span.attrs)
+            args['id'] = span.id
+            if span.parent_id:
+                args['parent_id'] = span.parent_id
+            events.append({
+                'name': span.name,
+                'cat': span.category,
+                'ph': 'X',
+                'ts': int(span.start * 1000000),
+                'dur': int(span.duration * 1000000),
+                'pid': pid,
+                'tid': thread_ids[span.thread_name],
+                'args': args,
+            })
+        json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+
+    def write(self, path, format=FORMAT_CHROME):
+        with open(path, 'w') as f:
+            if format == FORMAT_JSON_LINES:
+                self.write_json_lines(f)
+            else:
+                self.write_chrome_trace(f)
+
+
+def enable(clock=time):
+    """ Start recording spans.
+
+    :return the Tracer that records them
+    """
+    global _tracer
+    _tracer = Tracer(clock=clock)
+    return _tracer
+
+
+def disable():
+    global _tracer
+    _tracer = None
+
+
+def get_tracer():
+    """ Return the active Tracer, or None if tracing is off. """
+    return _tracer
+
+
+def span(name, category=STAGE, **attrs):
+    """ Return a context manager that records the time spent in its
+    block.
+
+    :param attrs values that are written with the span, such as an
+        instance id
+    """
+    tracer = _tracer
+    if tracer is None:
+        return _NULL_SPAN
+    return tracer.span(name, category, **attrs)
+
+
+def current():
+    """ Return the innermost open span in this thread, or None. """
+    tracer = _tracer
+    return tracer.current() if tracer else None
+
+
+def set_parent(parent):
+    tracer = _tracer
+    if tracer:
+        tracer.set_parent(parent)
+
+
+def traced(name=None, category=STAGE):
+    """ Decorator that records a span for each call to the function.
+
+    :param name the span name, or None to use the function name
+    """
+    def _decorator(function):
+        span_name = name or getattr(function, '__name__', repr(function))
+
+        def _traced(*args, **kwargs):
+            if _tracer is None:
+                return function(*args, **kwargs)
+            with _tracer.span(span_name, category):
+                return function(*args, **kwargs)
+
+        _traced.__name__ = getattr(function, '__name__', span_name)
+        _traced.__doc__ = getattr(function, '__doc__', None)
+        return _traced
+    return _decorator
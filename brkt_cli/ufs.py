@@ -0,0 +1,290 @@
+# Copyright 2017 Bracket Computing, Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License").
+# You may not use this file except in compliance with the License.
+# A copy of the License is located at
+#
+# https://github.com/brkt/brkt-cli/blob/master/LICENSE
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Read files from a UFS2 filesystem, without mounting it.
+
+Metavisor keeps its logs on a UFS2 partition.  This module implements the
+small read-only subset of UFS2 that is needed to copy files from that
+partition: the superblock, inodes, directories and the direct and indirect
+block pointers.  Soft updates journals, snapshots and extended attributes
+are ignored.
+
+The filesystem is read from a device, which is any object that has a
+read(offset, length) method.  If the device also has a
+prefetch(extents) method, it's called with the extents that a file is
+about to read, so that the device can fetch them concurrently.
+"""
+
+import logging
+import posixpath
+import stat
+import struct
+
+from brkt_cli.util import BracketError
+
+log = logging.getLogger(__name__)
+
+SBLOCK_UFS2 = 65536
+SBLOCKSIZE = 8192
+FS_UFS2_MAGIC = 0x19540119
+ROOT_INO = 2
+DINODE_SIZE = 256
+DIRBLKSIZ = 512
+
+# The number of direct and indirect block pointers in an inode.
+NDADDR = 12
+NIADDR = 3
+
+# Symlinks that are shorter than this are stored in the block pointers.
+MAXSYMLINKLEN = (NDADDR + NIADDR) * 8
+
+# The number of bytes that are passed to the device's prefetch() method
+# when a file is read sequentially.
+READ_AHEAD_BYTES = 8 * 1024 * 1024
+
+
+class UFSError(BracketError):
+    pass
+
+
+class FileDevice(object):
+    """ A device that reads from a file object, such as a disk image. """
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+
+    def read(self, offset, length):
+        self.fileobj.seek(offset)
+        data = self.fileobj.read(length)
+        return data + '\0' * (length - len(data))
+
+
+class PartitionDevice(object):
+    """ A device that reads from a partition of another device. """
+
+    def __init__(self, device, offset):
+        self.device = device
+        self.offset = offset
+
+    def read(self, offset, length):
+        return self.device.read(self.offset + offset, length)
+
+    def prefetch(self, extents):
+        prefetch = getattr(self.device, 'prefetch', None)
+        if prefetch:
+            prefetch([(self.offset + o, length) for o, length in extents])
+
+
+class Inode(object):
+
+    def __init__(self, number, data):
+        self.number = number
+        (self.mode, self.nlink, self.uid, self.gid, self.size,
+         self.mtime) = struct.unpack_from('<HhII4xQ16xq', data)
+        self.db = struct.unpack_from('<%dq' % NDADDR, data, 112)
+        self.ib = struct.unpack_from('<%dq' % NIADDR, data, 208)
+        # Short symlinks are stored in place of the block pointers.
+        self._short_link = data[112:112 + MAXSYMLINKLEN]
+
+    @property
+    def is_dir(self):
+        return stat.S_ISDIR(self.mode)
+
+    @property
+    def is_file(self):
+        return stat.S_ISREG(self.mode)
+
+    @property
+    def is_symlink(self):
+        return stat.S_ISLNK(self.mode)
+
+    def __repr__(self):
+        return '<Inode %d mode=%o size=%d>' % (
+            self.number, self.mode, self.size)
+
+
+class FileSystem(object):
+    """ A read-only UFS2 filesystem. """
+
+    def __init__(self, device):
+        self.device = device
+        sb = device.read(SBLOCK_UFS2, SBLOCKSIZE)
+        (magic,) = struct.unpack_from('<I', sb, 1372)
+        if magic != FS_UFS2_MAGIC:
+            raise UFSError('UFS2 superblock not found')
+        (self.iblkno,) = struct.unpack_from('<i', sb, 16)
+        (self.bsize, self.fsize, self.frag) = struct.unpack_from(
+            '<iii', sb, 48)
+        (self.nindir, self.inopb) = struct.unpack_from('<iI', sb, 116)
+        (self.ipg, self.fpg) = struct.unpack_from('<Ii', sb, 184)
+        log.debug(
+            'UFS2 filesystem: bsize=%d, fsize=%d, ipg=%d, fpg=%d',
+            self.bsize, self.fsize, self.ipg, self.fpg)
+
+    def get_inode(self, ino):
+        """ Return the Inode with the given number. """
+        cg = ino // self.ipg
+        frag = (cg * self.fpg + self.iblkno +
+                ((ino % self.ipg) // self.inopb) * self.frag)
+        offset = frag * self.fsize + (ino % self.inopb) * DINODE_SIZE
+        return Inode(ino, self.device.read(offset, DINODE_SIZE))
+
+    def _read_indirect(self, address, level, count):
+        """ Return up to count data block addresses that are referenced by
+        the indirect block at the given address.  A level 0 block points
+        at data blocks, a level 1 block points at level 0 blocks, and so
+        on.
+        """
+        span = self.nindir ** level
+        if not address:
+            return [0] * count
+        data = self.device.read(address * self.fsize, self.bsize)
+        pointers = struct.unpack_from('<%dq' % self.nindir, data)
+        addresses = []
+        for pointer in pointers:
+            if len(addresses) >= count:
+                break
+            if level == 0:
+                addresses.append(pointer)
+            else:
+                addresses.extend(self._read_indirect(
+                    pointer, level - 1, min(span, count - len(addresses))))
+        return addresses
+
+    def block_addresses(self, inode):
+        """ Return the fragment address of each logical block in the file,
+        or 0 for holes.
+        """
+        nblocks = (inode.size + self.bsize - 1) // self.bsize
+        addresses = list(inode.db[:min(nblocks, NDADDR)])
+        for level, address in enumerate(inode.ib):
+            remaining = nblocks - len(addresses)
+            if remaining <= 0:
+                break
+            addresses.extend(self._read_indirect(
+                address, level, min(remaining, self.nindir ** (level + 1))))
+        return addresses
+
+    def open(self, inode):
+        """ Return a file object that reads the contents of the file. """
+        return UFSFile(self, inode)
+
+    def read_file(self, inode):
+        return self.open(inode).read()
+
+    def readlink(self, inode):
+        if inode.size < MAXSYMLINKLEN:
+            return inode._short_link[:inode.size]
+        return self.read_file(inode)
+
+    def list_dir(self, inode):
+        """ Return the entries in the directory as a list of
+        (name, inode number), excluding . and ..
+        """
+        if not inode.is_dir:
+            raise UFSError('Inode %d is not a directory' % inode.number)
+        data = self.read_file(inode)
+        entries = []
+        for start in range(0, len(data), DIRBLKSIZ):
+            offset = start
+            end = start + DIRBLKSIZ
+            while offset < end:
+                ino, reclen, _, namlen = struct.unpack_from(
+                    '<IHBB', data, offset)
+                if reclen == 0:
+                    break
+                name = data[offset + 8:offset + 8 + namlen]
+                if ino and name not in ('.', '..'):
+                    entries.append((name, ino))
+                offset += reclen
+        return entries
+
+    def lookup(self, path):
+        """ Return the Inode for the given path, relative to the root
+        directory.
+
+        :raise UFSError if the path does not exist
+        """
+        inode = self.get_inode(ROOT_INO)
+        for name in [n for n in path.split('/') if n and n != '.']:
+            entries = dict(self.list_dir(inode))
+            if name not in entries:
+                raise UFSError('%s does not exist' % path)
+            inode = self.get_inode(entries[name])
+        return inode
+
+    def walk(self, path):
+        """ Generate (path, Inode) for the given path and everything under
+        it, with each directory before its contents.
+        """
+        inode = self.lookup(path)
+        stack = [(path, inode)]
+        while stack:
+            path, inode = stack.pop()
+            yield path, inode
+            if inode.is_dir:
+                entries = sorted(self.list_dir(inode), reverse=True)
+                for name, ino in entries:
+                    stack.append(
+                        (posixpath.join(path, name), self.get_inode(ino)))
+
+
+class UFSFile(object):
+    """ A file object that reads a file sequentially. """
+
+    def __init__(self, fs, inode):
+        self.fs = fs
+        self.inode = inode
+        self.position = 0
+        self._addresses = fs.block_addresses(inode)
+        self._read_ahead_blocks = max(1, READ_AHEAD_BYTES // fs.bsize)
+        # Blocks before this logical block number have been prefetched.
+        self._prefetched = 0
+
+    def _block_length(self, lbn):
+        return min(self.fs.bsize, self.inode.size - lbn * self.fs.bsize)
+
+    def _prefetch(self, lbn):
+        if lbn < self._prefetched:
+            return
+        end = min(lbn + self._read_ahead_blocks, len(self._addresses))
+        extents = [
+            (self._addresses[i] * self.fs.fsize, self._block_length(i))
+            for i in range(lbn, end) if self._addresses[i]
+        ]
+        self._prefetched = end
+        prefetch = getattr(self.fs.device, 'prefetch', None)
+        if prefetch and extents:
+            prefetch(extents)
+
+    def read(self, size=-1):
+        remaining = self.inode.size - self.position
+        if size < 0 or size > remaining:
+            size = remaining
+        chunks = []
+        while size > 0:
+            lbn = self.position // self.fs.bsize
+            self._prefetch(lbn)
+            skip = self.position % self.fs.bsize
+            length = min(size, self._block_length(lbn) - skip)
+            address = self._addresses[lbn]
+            if address:
+                chunks.append(self.fs.device.read(
+                    address * self.fs.fsize + skip, length))
+            else:
+                chunks.append('\0' * length)
+            self.position += length
+            size -= length
+        return ''.join(chunks)
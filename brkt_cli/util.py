@@ -13,15 +13,22 @@
 # limitations under the License.
 import abc
 import base64
+import errno
 import json
 import logging
+import os
 import re
+import shutil
+import sys
+import tempfile
+import threading
 import time
 import uuid
 from datetime import datetime, timedelta
 
 import iso8601
 
+from brkt_cli import trace
 from brkt_cli.validation import ValidationError
 
 SLEEP_ENABLED = True
@@ -114,6 +121,77 @@ def retry(function, on=None, exception_checker=None, timeout=15.0,
     return _wrapped
 
 
+def run_concurrently(functions, max_workers=None):
+    """ Call each of the given functions in its own thread and wait for
+    all of them to finish.
+
+    :param functions a list of functions that take no arguments
+    :param max_workers the maximum number of functions that run at the
+        same time, or None for no limit
+    :return a list of the return values, in the same order as functions
+    :raise the first exception raised by any of the functions, after all
+        of the functions have finished
+    """
+    results = [None] * len(functions)
+    errors = [None] * len(functions)
+    semaphore = None
+    if max_workers:
+        semaphore = threading.BoundedSemaphore(max_workers)
+    # Spans that the functions record are children of the current span.
+    parent = trace.current()
+
+    def _run(index, function):
+        trace.set_parent(parent)
+        try:
+            results[index] = function()
+        except BaseException:
+            errors[index] = sys.exc_info()
+        finally:
+            if semaphore:
+                semaphore.release()
+
+    threads = []
+    for index, function in enumerate(functions):
+        if semaphore:
+            semaphore.acquire()
+        t = threading.Thread(
+            target=_run, args=(index, function), name='brkt-worker-%d' % index)
+        t.daemon = True
+        t.start()
+        threads.append(t)
+    for t in threads:
+        # Join with a timeout, so that KeyboardInterrupt is delivered
+        # to the main thread.
+        while t.is_alive():
+            t.join(1)
+
+    for exc_info in errors:
+        if exc_info:
+            raise exc_info[0], exc_info[1], exc_info[2]
+    return results
+
+
+class RateLimiter(object):
+    """ Limit the rate of calls that are made by multiple threads.  Each
+    call to wait() blocks until at least 1 / calls_per_second seconds have
+    passed since the previous call returned.
+    """
+
+    def __init__(self, calls_per_second, clock=time):
+        self.interval = 1.0 / calls_per_second
+        self.clock = clock
+        self._next_time = 0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        with self._lock:
+            now = self.clock.time()
+            delay = self._next_time - now
+            self._next_time = max(now, self._next_time) + self.interval
+        if delay > 0:
+            sleep(delay)
+
+
 def get_domain_from_brkt_env(brkt_env):
     """Return the domain string from the api_host in the brkt_env. """
 
@@ -283,6 +361,31 @@ def write_to_file_or_stdout(content, path=None):
         raise ValidationError('Unable to write to %s: %s' % (path, e))
 
 
+def write_file_atomically(path, content):
+    """ Write the content to the given path by writing a temporary file
+    in the same directory and moving it into place, so that readers never
+    see a partially written file.  The directory is created if necessary.
+
+    :raise IOError or OSError if the file can't be written
+    """
+    directory = os.path.dirname(path)
+    try:
+        os.makedirs(directory, 0755)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+    f = tempfile.NamedTemporaryFile(
+        delete=False, prefix='brkt_cli', dir=directory)
+    try:
+        f.write(content)
+        f.close()
+        shutil.move(f.name, path)
+    except:
+        f.close()
+        os.remove(f.name)
+        raise
+
+
 def pretty_print_json(d, indent=4):
     """ Format the given dictionary as a JSON string.
     """
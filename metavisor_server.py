@@ -0,0 +1,316 @@
+#!/usr/bin/env python
+# Copyright 2017 Bracket Computing, Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License").
+# You may not use this file except in compliance with the License.
+# A copy of the License is located at
+#
+# https://github.com/brkt/brkt-cli/blob/master/LICENSE
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+A fake Metavisor encryption status server, for testing EncryptorService
+and the code that polls it over real HTTP connections.
+
+The server follows a script: a list of phases, each of which lasts for a
+number of seconds or a number of requests.  A phase sets the encryption
+state, the range of bytes_written that it progresses through, the failure
+code, and whether requests are answered, dropped, left hanging or answered
+with an HTTP error.
+
+Run this module to load test the status polling path:
+
+    python metavisor_server.py --clients 500 --polls 20
+"""
+
+import argparse
+import BaseHTTPServer
+import json
+import logging
+import SocketServer
+import threading
+import time
+
+from brkt_cli import util
+from brkt_cli.encryptor_service import (
+    ENCRYPT_ENCRYPTING,
+    ENCRYPT_INITIALIZING,
+    ENCRYPT_SUCCESSFUL,
+    EncryptorService
+)
+
+log = logging.getLogger(__name__)
+
+# What the server does with a request.
+RESPOND = 'respond'
+DROP = 'drop'
+HANG = 'hang'
+ERROR = 'error'
+
+DEFAULT_BYTES_TOTAL = 8 * 1024 * 1024 * 1024
+
+
+def linear(fraction):
+    return fraction
+
+
+def ease_out(fraction):
+    """ Fast at first, then slower, like a disk that has zeros at the
+    end.
+    """
+    return 1 - (1 - fraction) ** 2
+
+
+class Phase(object):
+
+    def __init__(self, state=ENCRYPT_ENCRYPTING, seconds=None, requests=None,
+                 progress=(0.0, 0.0), curve=linear, failure_code=None,
+                 action=RESPOND):
+        """
+        :param seconds the length of the phase in seconds
+        :param requests the length of the phase in requests.  If neither
+            seconds nor requests is specified, the phase lasts forever.
+        :param progress the fractions of bytes_total that are written at
+            the start and end of the phase.  A stall has the same start
+            and end.
+        :param curve maps the fraction of the phase that has elapsed to
+            the fraction of progress
+        """
+        self.state = state
+        self.seconds = seconds
+        self.requests = requests
+        self.progress = progress
+        self.curve = curve
+        self.failure_code = failure_code
+        self.action = action
+
+    def elapsed(self, seconds, requests):
+        """ Return the fraction of the phase that has elapsed. """
+        fractions = []
+        if self.seconds:
+            fractions.append(seconds / float(self.seconds))
+        if self.requests:
+            fractions.append(requests / float(self.requests))
+        return min(1.0, max(fractions or [0.0]))
+
+
+class Script(object):
+    """ Steps through the phases as requests arrive.  The last phase
+    lasts forever.
+    """
+
+    def __init__(self, phases, bytes_total=DEFAULT_BYTES_TOTAL, clock=time):
+        self.phases = list(phases)
+        self.bytes_total = bytes_total
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.index = 0
+        self.phase_start = None
+        self.phase_requests = 0
+
+    def next_status(self):
+        """ Advance the script by one request.
+
+        :return a tuple of the action and the status dictionary
+        """
+        with self.lock:
+            now = self.clock.time()
+            if self.phase_start is None:
+                self.phase_start = now
+            while True:
+                phase = self.phases[self.index]
+                elapsed = phase.elapsed(
+                    now - self.phase_start, self.phase_requests)
+                if elapsed < 1.0 or self.index == len(self.phases) - 1:
+                    break
+                self.index += 1
+                self.phase_start = now
+                self.phase_requests = 0
+            self.phase_requests += 1
+
+        start, end = phase.progress
+        fraction = start + (end - start) * phase.curve(elapsed)
+        status = {
+            'state': phase.state,
+            'bytes_written': int(self.bytes_total * fraction),
+            'bytes_total': self.bytes_total,
+        }
+        if phase.failure_code:
+            status['failure_code'] = phase.failure_code
+        return phase.action, status
+
+
+def encryption_script(requests=10, bytes_total=DEFAULT_BYTES_TOTAL,
+                      curve=linear):
+    """ Return a script for an encryption that succeeds after the given
+    number of requests.
+    """
+    return Script([
+        Phase(ENCRYPT_INITIALIZING, requests=1),
+        Phase(ENCRYPT_ENCRYPTING, requests=requests, progress=(0.0, 1.0),
+              curve=curve),
+        Phase(ENCRYPT_SUCCESSFUL, progress=(1.0, 1.0)),
+    ], bytes_total=bytes_total)
+
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+        self.server.count('connections')
+
+    def do_GET(self):
+        self.server.count('requests')
+        action, status = self.server.script.next_status()
+        if action in (DROP, HANG):
+            if action == HANG:
+                time.sleep(self.server.hang_seconds)
+            self.server.count('dropped')
+            self.close_connection = 1
+            return
+        if action == ERROR:
+            self.send_error(500, 'Scripted error')
+            return
+        body = json.dumps(status)
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class FakeMetavisor(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """ Serves the encryption status from a Script on 127.0.0.1, on a
+    free port.
+    """
+    daemon_threads = True
+    # Allow many clients to connect at the same time.
+    request_queue_size = 1024
+
+    def __init__(self, script, hang_seconds=5):
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', 0), _Handler)
+        self.script = script
+        self.hang_seconds = hang_seconds
+        self.port = self.server_address[1]
+        self.stats = {'connections': 0, 'requests': 0, 'dropped': 0}
+        self._stats_lock = threading.Lock()
+        self._thread = None
+
+    def count(self, name):
+        with self._stats_lock:
+            self.stats[name] += 1
+
+    def start(self):
+        self._thread = threading.Thread(
+            target=self.serve_forever, kwargs={'poll_interval': 0.05})
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        self._thread.join()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+
+class LoadTestResult(object):
+
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.seconds = 0.0
+        self.latencies = []
+        self.connections = 0
+
+    def percentile(self, p):
+        if not self.latencies:
+            return 0.0
+        latencies = sorted(self.latencies)
+        index = min(len(latencies) - 1, int(len(latencies) * p / 100.0))
+        return latencies[index]
+
+    def __str__(self):
+        return (
+            '%d requests, %d errors, %d connections in %.2f seconds '
+            '(%.0f requests/s), latency p50 %.1f ms, p99 %.1f ms' % (
+                self.requests, self.errors, self.connections, self.seconds,
+                self.requests / max(self.seconds, 0.001),
+                self.percentile(50) * 1000, self.percentile(99) * 1000)
+        )
+
+
+def load_test(clients=200, polls=10, interval=0.0, reuse=True,
+              script=None):
+    """ Poll a FakeMetavisor from many clients at the same time.
+
+    :param reuse if True, each client keeps one EncryptorService and
+        connection.  If False, each poll uses a new one.
+    :return a LoadTestResult
+    """
+    script = script or Script([Phase(progress=(0.0, 1.0), seconds=60)])
+    result = LoadTestResult()
+    lock = threading.Lock()
+
+    with FakeMetavisor(script) as server:
+        def _client():
+            enc_svc = None
+            for _ in range(polls):
+                if not reuse or not enc_svc:
+                    enc_svc = EncryptorService(
+                        ['127.0.0.1'], port=server.port)
+                start = time.time()
+                try:
+                    enc_svc.get_status(timeout_secs=10)
+                    error = False
+                except Exception as e:
+                    log.debug('Status request failed: %s', e)
+                    error = True
+                latency = time.time() - start
+                with lock:
+                    result.requests += 1
+                    result.errors += error
+                    result.latencies.append(latency)
+                if interval:
+                    time.sleep(interval)
+
+        start = time.time()
+        util.run_concurrently([_client] * clients)
+        result.seconds = time.time() - start
+        result.connections = server.stats['connections']
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Load test the encryption status polling path')
+    parser.add_argument('--clients', type=int, default=200)
+    parser.add_argument('--polls', type=int, default=10)
+    parser.add_argument(
+        '--interval', type=float, default=0.0,
+        help='Seconds between polls from each client')
+    parser.add_argument(
+        '--no-reuse', dest='reuse', action='store_false',
+        help='Open a new connection for each poll')
+    values = parser.parse_args()
+    print load_test(
+        clients=values.clients, polls=values.polls,
+        interval=values.interval, reuse=values.reuse)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,586 @@
+#!/usr/bin/env python
+# Copyright 2017 Bracket Computing, Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License").
+# You may not use this file except in compliance with the License.
+# A copy of the License is located at
+#
+# https://github.com/brkt/brkt-cli/blob/master/LICENSE
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+A local stand-in for vSphere HttpNfcLease transfers, for measuring the
+throughput of VCenterService.export_to_ovf(), upload_ovf_to_vcenter() and
+upload_ova_to_vcenter() without a vCenter.
+
+NfcServer runs in its own process, so that its CPU time is not counted
+against the code that is measured.  It serves disk contents for export
+leases and accepts streamVmdk POSTs for import leases, with a configurable
+bandwidth and time to first byte.  FakeServiceInstance stands in for the
+pyVmomi ServiceInstance, and hands out leases whose device URLs point at
+the server.  The VCenterService code under test runs unmodified.
+
+Run this module to benchmark the transfer code paths:
+
+    python nfc_server.py --size-mb 1024 --bandwidth-mbps 0
+"""
+
+import argparse
+import BaseHTTPServer
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import Queue
+import resource
+import shutil
+import SocketServer
+import tarfile
+import tempfile
+import time
+import urlparse
+
+import requests
+from pyVmomi import vim
+
+from brkt_cli.esx import esx_service
+
+log = logging.getLogger(__name__)
+
+MB = 1024 * 1024
+GB = 1024 * MB
+
+# The size of the reads and writes that the server makes.
+_IO_SIZE = 64 * 1024
+
+# The number of seconds that a benchmark may run before it's killed.
+BENCHMARK_TIMEOUT = 30 * 60
+
+OVF_DESCRIPTOR = """<?xml version="1.0" encoding="UTF-8"?>
+<Envelope xmlns="http://schemas.dmtf.org/ovf/envelope/1"
+          xmlns:ovf="http://schemas.dmtf.org/ovf/envelope/1">
+  <References>%(files)s
+  </References>
+  <VirtualSystem ovf:id="nfc-benchmark">
+    <VirtualHardwareSection/>
+  </VirtualSystem>
+</Envelope>
+"""
+
+
+def _pattern():
+    """ Return 1 MiB of incompressible data, the same every time. """
+    return ''.join(hashlib.sha512(str(i)).digest() for i in range(MB / 64))
+
+
+def iter_disk(size):
+    """ Generate the contents of an exported disk of the given size. """
+    block = _pattern()
+    while size > 0:
+        chunk = block[:size]
+        size -= len(chunk)
+        yield chunk
+
+
+def disk_sha1(size):
+    h = hashlib.sha1()
+    for chunk in iter_disk(size):
+        h.update(chunk)
+    return h.hexdigest()
+
+
+class _Throttle(object):
+    """ Limits a transfer to bandwidth bytes per second. """
+
+    def __init__(self, bandwidth):
+        self.bandwidth = bandwidth
+        self.start = time.time()
+        self.transferred = 0
+
+    def update(self, n):
+        self.transferred += n
+        if self.bandwidth:
+            ahead = (self.start + float(self.transferred) / self.bandwidth -
+                     time.time())
+            if ahead > 0:
+                time.sleep(ahead)
+
+
+class _NfcHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def _send_json(self, value):
+        body = json.dumps(value)
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        url = urlparse.urlparse(self.path)
+        if url.path == '/stats':
+            self._send_json(self.server.imports)
+            return
+        if not url.path.startswith('/export/'):
+            self.send_error(404)
+            return
+        # /export/<size>/<file name>, so that the file name is the last
+        # part of the URL, as with vSphere.
+        size = int(url.path.split('/')[2])
+        time.sleep(self.server.latency)
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Content-Length', str(size))
+        self.end_headers()
+        throttle = _Throttle(self.server.bandwidth)
+        for chunk in iter_disk(size):
+            for i in range(0, len(chunk), _IO_SIZE):
+                data = chunk[i:i + _IO_SIZE]
+                self.wfile.write(data)
+                throttle.update(len(data))
+
+    def _read_body(self):
+        """ Generate the request body, with or without chunked transfer
+        encoding.
+        """
+        if self.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+            while True:
+                size = int(self.rfile.readline().split(';')[0], 16)
+                if size == 0:
+                    self.rfile.readline()
+                    return
+                while size > 0:
+                    data = self.rfile.read(min(size, _IO_SIZE))
+                    size -= len(data)
+                    yield data
+                self.rfile.readline()
+        else:
+            remaining = int(self.headers.get('Content-Length', 0))
+            while remaining > 0:
+                data = self.rfile.read(min(remaining, _IO_SIZE))
+                if not data:
+                    return
+                remaining -= len(data)
+                yield data
+
+    def do_POST(self):
+        url = urlparse.urlparse(self.path)
+        if not url.path.startswith('/import/'):
+            self.send_error(404)
+            return
+        time.sleep(self.server.latency)
+        throttle = _Throttle(self.server.bandwidth)
+        h = hashlib.sha1()
+        received = 0
+        for data in self._read_body():
+            h.update(data)
+            received += len(data)
+            throttle.update(len(data))
+        name = url.path[len('/import/'):]
+        self.server.imports[name] = {'bytes': received, 'sha1': h.hexdigest()}
+        self.send_response(200)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+class _NfcHTTPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+def _serve(queue, bandwidth, latency):
+    server = _NfcHTTPServer(('127.0.0.1', 0), _NfcHandler)
+    server.bandwidth = bandwidth
+    server.latency = latency
+    server.imports = {}
+    queue.put(server.server_address[1])
+    server.serve_forever()
+
+
+class NfcServer(object):
+    """ Runs the stand-in NFC server in a child process.
+
+    :param bandwidth the bytes per second of each transfer, or 0 for no
+        limit
+    :param latency the seconds before the first byte of each transfer
+    """
+
+    def __init__(self, bandwidth=0, latency=0.0):
+        self.bandwidth = bandwidth
+        self.latency = latency
+        self.url = None
+        self._process = None
+
+    def start(self):
+        queue = multiprocessing.Queue()
+        self._process = multiprocessing.Process(
+            target=_serve, args=(queue, self.bandwidth, self.latency))
+        self._process.daemon = True
+        self._process.start()
+        self.url = 'http://127.0.0.1:%d' % queue.get(timeout=30)
+
+    def stop(self):
+        self._process.terminate()
+        self._process.join()
+
+    def imports(self):
+        """ Return a dictionary of the name of each imported disk to the
+        number of bytes and SHA1 digest that the server received.
+        """
+        return requests.get(self.url + '/stats').json()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+
+# Stand-ins for the pyVmomi managed objects that the transfer code uses.
+
+class _Object(object):
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+class FakeLease(object):
+
+    def __init__(self, device_urls):
+        self.state = vim.HttpNfcLease.State.ready
+        self.error = None
+        self.info = _Object(deviceUrl=device_urls, leaseTimeout=None)
+        self.progress = []
+
+    def HttpNfcLeaseProgress(self, percent):
+        self.progress.append(percent)
+
+    def HttpNfcLeaseComplete(self):
+        self.state = vim.HttpNfcLease.State.done
+
+
+class FakeVM(object):
+
+    def __init__(self, name, nfc_url, disks=None):
+        """
+        :param disks a list of (file name, size) tuples for export
+        """
+        self.name = name
+        self.nfc_url = nfc_url
+        self.disks = disks or []
+
+    def ExportVm(self):
+        return FakeLease([
+            _Object(key='disk-%d' % i, importKey=None,
+                    url='%s/export/%d/%s' % (self.nfc_url, size, name))
+            for i, (name, size) in enumerate(self.disks)
+        ])
+
+
+class FakeServiceInstance(object):
+    """ Stands in for the pyVmomi ServiceInstance.  The inventory has one
+    datacenter, datastore and cluster, and the VMs that were added or
+    imported.
+    """
+
+    def __init__(self, nfc_url, datacenter_name='dc', datastore_name='ds',
+                 cluster_name='cluster'):
+        self.nfc_url = nfc_url
+        self.disk_names = []
+        resource_pool = _Object(ImportVApp=self._import_vapp)
+        self.inventory = {
+            vim.Datacenter: [_Object(name=datacenter_name, vmFolder=None)],
+            vim.Datastore: [_Object(name=datastore_name)],
+            vim.ComputeResource: [
+                _Object(name=cluster_name, resourcePool=resource_pool)],
+            vim.VirtualMachine: [],
+        }
+        self.content = _Object(
+            rootFolder=None,
+            viewManager=_Object(CreateContainerView=self._container_view),
+            ovfManager=_Object(
+                CreateImportSpec=self._create_import_spec,
+                CreateDescriptor=self._create_descriptor
+            )
+        )
+
+    def RetrieveContent(self):
+        return self.content
+
+    def add_vm(self, vm):
+        self.inventory[vim.VirtualMachine].append(vm)
+
+    def _container_view(self, root, vimtype, recursive):
+        return _Object(view=list(self.inventory.get(vimtype[0], [])))
+
+    def _create_import_spec(self, ovfd, resource_pool, datastore, params):
+        file_items = [
+            _Object(path=name, deviceId='/nfc-benchmark/disk-%d' % i)
+            for i, name in enumerate(self.disk_names)
+        ]
+        import_spec = _Object(configSpec=vim.vm.ConfigSpec())
+        return _Object(importSpec=import_spec, fileItem=file_items,
+                       error=None, warning=None)
+
+    def _import_vapp(self, import_spec, folder):
+        self.add_vm(FakeVM(import_spec.configSpec.name, self.nfc_url))
+        return FakeLease([
+            _Object(key='disk-%d' % i,
+                    importKey='/nfc-benchmark/disk-%d' % i,
+                    url='%s/import/%s' % (self.nfc_url, name))
+            for i, name in enumerate(self.disk_names)
+        ])
+
+    def _create_descriptor(self, vm, params):
+        files = ''.join(
+            '\n    <File ovf:href="%s" ovf:id="%s" ovf:size="%d"/>' %
+            (f.path, f.deviceId, f.size) for f in params.ovfFiles)
+        return _Object(ovfDescriptor=OVF_DESCRIPTOR % {'files': files})
+
+
+def make_vcenter_service(si):
+    """ Return a VCenterService that talks to the given
+    FakeServiceInstance.
+    """
+    svc = esx_service.VCenterService(
+        '127.0.0.1', 'user', 'password', 443, 'dc', 'ds', False, 'cluster',
+        1, 1, 'nfc-benchmark', 'VM Network', 'VirtualPortGroup',
+        False, False, False)
+    svc.si = si
+    return svc
+
+
+def write_ovf(directory, disks, name='nfc-benchmark'):
+    """ Write an OVF, its -brkt.mf manifest and disks of the given sizes
+    to directory.
+
+    :param disks a list of (file name, size) tuples
+    :return the OVF file name
+    """
+    checksums = {}
+    for disk_name, size in disks:
+        h = hashlib.sha1()
+        with open(os.path.join(directory, disk_name), 'wb') as f:
+            for chunk in iter_disk(size):
+                f.write(chunk)
+                h.update(chunk)
+        checksums[disk_name] = h.hexdigest()
+    files = ''.join(
+        '\n    <File ovf:href="%s" ovf:id="file%d"/>' % (disk_name, i)
+        for i, (disk_name, _) in enumerate(disks))
+    ovf_name = name + '.ovf'
+    ovf_path = os.path.join(directory, ovf_name)
+    with open(ovf_path, 'w') as f:
+        f.write(OVF_DESCRIPTOR % {'files': files})
+    checksums[ovf_name] = esx_service.compute_sha1_of_file(ovf_path)
+    with open(os.path.join(directory, name + '-brkt.mf'), 'w') as f:
+        json.dump(checksums, f)
+    return ovf_name
+
+
+def write_ova(directory, disks, name='nfc-benchmark'):
+    """ Write an OVA with a manifest, containing disks of the given sizes,
+    to directory.
+
+    :return the path to the OVA
+    """
+    ovf_dir = tempfile.mkdtemp(dir=directory)
+    try:
+        ovf_name = write_ovf(ovf_dir, disks, name)
+        names = [ovf_name] + [disk_name for disk_name, _ in disks]
+        with open(os.path.join(ovf_dir, name + '.mf'), 'w') as f:
+            for n in names:
+                f.write('SHA1(%s)= %s\n' % (
+                    n, esx_service.compute_sha1_of_file(
+                        os.path.join(ovf_dir, n))))
+        ova_path = os.path.join(directory, name + '.ova')
+        with tarfile.open(ova_path, 'w') as tar:
+            for n in [ovf_name, name + '.mf'] + names[1:]:
+                tar.add(os.path.join(ovf_dir, n), arcname=n)
+    finally:
+        shutil.rmtree(ovf_dir)
+    return ova_path
+
+
+# Benchmarks.
+
+def _export(nfc_url, directory, disks):
+    si = FakeServiceInstance(nfc_url)
+    vm = FakeVM('export-vm', nfc_url, disks)
+    si.add_vm(vm)
+    target = tempfile.mkdtemp(dir=directory)
+    make_vcenter_service(si).export_to_ovf(vm, target, 'exported')
+
+
+def _import_ovf(nfc_url, directory, disks, validate_mf=True):
+    si = FakeServiceInstance(nfc_url)
+    si.disk_names = [disk_name for disk_name, _ in disks]
+    make_vcenter_service(si).upload_ovf_to_vcenter(
+        os.path.join(directory, 'ovf'), 'nfc-benchmark.ovf',
+        vm_name='imported-vm', validate_mf=validate_mf)
+
+
+def _import_ova(nfc_url, directory, disks):
+    si = FakeServiceInstance(nfc_url)
+    si.disk_names = [disk_name for disk_name, _ in disks]
+    make_vcenter_service(si).upload_ova_to_vcenter(
+        os.path.join(directory, 'nfc-benchmark.ova'), vm_name='imported-vm')
+
+
+BENCHMARKS = [
+    ('export', _export),
+    ('import-ovf', _import_ovf),
+    ('import-ovf-no-manifest',
+     lambda url, d, disks: _import_ovf(url, d, disks, validate_mf=False)),
+    ('import-ova', _import_ova),
+]
+
+
+def _measure(queue, function, args):
+    """ Run function in this process and put its resource usage in the
+    queue.
+    """
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    before = os.times()
+    start = time.time()
+    try:
+        function(*args)
+        error = None
+    except Exception as e:
+        log.exception('Benchmark failed')
+        error = str(e)
+    after = os.times()
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    queue.put({
+        'seconds': time.time() - start,
+        'cpu_seconds': (after[0] - before[0]) + (after[1] - before[1]),
+        # ru_maxrss is in KiB on Linux.
+        'peak_rss_mb': usage.ru_maxrss / 1024.0,
+        'rss_growth_mb': (usage.ru_maxrss - rss_before) / 1024.0,
+        'error': error,
+    })
+
+
+def _wait_for_result(queue, p, timeout):
+    """ Wait for the benchmark process to put its result in the queue.
+
+    :return the result, or a result with the error set if the process
+        exited without a result or didn't finish before the timeout
+    """
+    deadline = time.time() + timeout
+    while True:
+        try:
+            result = queue.get(timeout=1)
+            p.join()
+            return result
+        except Queue.Empty:
+            pass
+        if not p.is_alive():
+            error = 'exited with code %s' % p.exitcode
+            break
+        if time.time() > deadline:
+            p.terminate()
+            p.join()
+            error = 'timed out after %d seconds' % timeout
+            break
+    return {
+        'seconds': 0.0,
+        'cpu_seconds': 0.0,
+        'peak_rss_mb': 0.0,
+        'rss_growth_mb': 0.0,
+        'error': error,
+    }
+
+
+def run_benchmarks(size=64 * MB, disk_count=1, bandwidth=0, latency=0.0,
+                   names=None, timeout=BENCHMARK_TIMEOUT):
+    """ Run each benchmark in its own process, so that peak RSS is
+    measured separately.
+
+    :param timeout the number of seconds that each benchmark may run
+    :return a list of dictionaries with the name, throughput in MB/s,
+        CPU seconds per GB and peak RSS of each benchmark.  The error is
+        set for a benchmark that failed, crashed or timed out.
+    """
+    disks = [('disk%d.vmdk' % i, size) for i in range(disk_count)]
+    total = size * disk_count
+    directory = tempfile.mkdtemp(prefix='nfc-benchmark-')
+    results = []
+    try:
+        os.mkdir(os.path.join(directory, 'ovf'))
+        write_ovf(os.path.join(directory, 'ovf'), disks)
+        write_ova(directory, disks)
+        with NfcServer(bandwidth=bandwidth, latency=latency) as server:
+            for name, function in BENCHMARKS:
+                if names and name not in names:
+                    continue
+                queue = multiprocessing.Queue()
+                p = multiprocessing.Process(
+                    target=_measure,
+                    args=(queue, function, (server.url, directory, disks)))
+                p.start()
+                result = _wait_for_result(queue, p, timeout)
+                result['name'] = name
+                result['mb_per_sec'] = 0.0
+                if result['seconds']:
+                    result['mb_per_sec'] = total / MB / result['seconds']
+                result['cpu_seconds_per_gb'] = (
+                    result['cpu_seconds'] * GB / total)
+                results.append(result)
+    finally:
+        shutil.rmtree(directory)
+    return results
+
+
+def format_results(results):
+    lines = ['%-24s %10s %12s %14s %10s' % (
+        'benchmark', 'MB/s', 'CPU s/GB', 'peak RSS MB', 'error')]
+    for r in results:
+        lines.append('%-24s %10.1f %12.2f %14.1f %10s' % (
+            r['name'], r['mb_per_sec'], r['cpu_seconds_per_gb'],
+            r['peak_rss_mb'], r['error'] or ''))
+    return '\n'.join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmark OVF export and import against a local '
+                    'HttpNfcLease stand-in')
+    parser.add_argument('--size-mb', type=int, default=256,
+                        help='Size of each disk')
+    parser.add_argument('--disks', type=int, default=1,
+                        help='Number of disks')
+    parser.add_argument('--bandwidth-mbps', type=float, default=0,
+                        help='MB/s per transfer, or 0 for no limit')
+    parser.add_argument('--latency-ms', type=float, default=0,
+                        help='Time to first byte of each transfer')
+    parser.add_argument('--json', action='store_true',
+                        help='Print the results as JSON')
+    parser.add_argument('benchmarks', nargs='*', metavar='BENCHMARK',
+                        help='Benchmarks to run (%s).  Default: all' %
+                             ', '.join(name for name, _ in BENCHMARKS))
+    values = parser.parse_args()
+    results = run_benchmarks(
+        size=values.size_mb * MB,
+        disk_count=values.disks,
+        bandwidth=int(values.bandwidth_mbps * MB),
+        latency=values.latency_ms / 1000.0,
+        names=values.benchmarks
+    )
+    if values.json:
+        print json.dumps(results, indent=2)
+    else:
+        print format_results(results)
+
+
+if __name__ == '__main__':
+    main()
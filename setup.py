@@ -58,7 +58,8 @@ setup(
         'brkt_cli.make_user_data'
     ],
     install_requires=[
-        'boto3>=1.4.4',
+        'boto3>=1.10.32',
+        'botocore>=1.13.32',
         'google-api-python-client>=1.5.0',
         'iso8601>=0.1.11',
         'oauth2client<3,>= 2.0.0',
@@ -76,5 +77,6 @@ setup(
         ]
     },
     package_dir={'brkt_cli': 'brkt_cli'},
+    package_data={'brkt_cli.gcp': ['discovery/*.json']},
     test_suite='test test_gcp'
 )
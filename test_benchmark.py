@@ -0,0 +1,96 @@
+# Copyright 2017 Bracket Computing, Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License").
+# You may not use this file except in compliance with the License.
+# A copy of the License is located at
+#
+# https://github.com/brkt/brkt-cli/blob/master/LICENSE
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and
+# limitations under the License.
+import time
+import unittest
+
+import benchmark
+from brkt_cli import util
+
+
+class TestSimulator(unittest.TestCase):
+
+    def setUp(self):
+        util.SLEEP_ENABLED = False
+
+    def test_all_pipelines(self):
+        """ Test that every pipeline runs, makes API calls and takes
+        simulated time.
+        """
+        results = benchmark.run_benchmarks()
+        self.assertEqual(
+            benchmark.PIPELINES.keys(), [r.name for r in results])
+        for result in results:
+            self.assertGreater(result.seconds, 0, result.name)
+            self.assertGreater(result.total_calls(), 0, result.name)
+        self.assertFalse(util.SLEEP_ENABLED)
+
+    def test_deterministic(self):
+        """ Test that runs with the same seed report the same results. """
+        first = benchmark.run_benchmarks(['aws-encrypt'], seed=3)
+        second = benchmark.run_benchmarks(['aws-encrypt'], seed=3)
+        self.assertEqual(first[0].to_dict(), second[0].to_dict())
+
+    def test_virtual_clock(self):
+        """ Test that time is virtual while the simulator is active. """
+        real = time.time()
+        with benchmark.Simulator() as sim:
+            time.sleep(3600)
+            self.assertEqual(benchmark.START_TIME + 3600, time.time())
+            self.assertEqual(benchmark.START_TIME + 3600, sim.now)
+        self.assertLess(time.time() - real, 60)
+
+    def test_run_concurrently(self):
+        """ Test that functions that run concurrently take as long as the
+        slowest one, limited by max_workers.
+        """
+        with benchmark.Simulator() as sim:
+            sleeps = [lambda s=s: time.sleep(s) for s in (10, 20, 30)]
+            util.run_concurrently(sleeps)
+            self.assertEqual(benchmark.START_TIME + 30, sim.now)
+            util.run_concurrently(sleeps, max_workers=2)
+            self.assertEqual(benchmark.START_TIME + 30 + 40, sim.now)
+
+    def test_throttle_and_consistency(self):
+        """ Test that throttled calls wait for a token, and that a new
+        resource is not visible until the consistency delay has passed.
+        """
+        class Service(object):
+            def create_thing(self):
+                return 'thing-1'
+
+            def get_thing(self, thing_id):
+                return thing_id
+
+        profile = benchmark.Profile(
+            default_latency=0,
+            throttles={'*': (1, 1)},
+            consistency_delay=5
+        )
+        with benchmark.Simulator(profile=profile) as sim:
+            svc = sim.wrap(Service(), 'test')
+            result = sim.run('test', lambda: svc.get_thing(svc.create_thing()))
+        stage = result.stages[0]
+        self.assertEqual(
+            {'test.create_thing': 1, 'test.get_thing': 1}, stage.calls)
+        self.assertEqual(1, stage.throttled)
+        self.assertEqual(1, stage.consistency_waits)
+        self.assertEqual(5, result.seconds)
+
+    def test_token_bucket(self):
+        bucket = benchmark.TokenBucket(rate=2, burst=2)
+        self.assertEqual(0, bucket.take(0))
+        self.assertEqual(0, bucket.take(0))
+        self.assertEqual(0.5, bucket.take(0))
+        self.assertEqual(0.5, bucket.take(0.5))
+        self.assertEqual(0, bucket.take(10))
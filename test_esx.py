@@ -1,6 +1,9 @@
+import hashlib
 import logging
+import tarfile
 import unittest
 import datetime
+from StringIO import StringIO
 
 #import test
 from brkt_cli import util
@@ -19,6 +22,7 @@ from brkt_cli.util import (
     CRYPTO_XTS
 )
 from brkt_cli.instance_config import INSTANCE_UPDATER_MODE
+from brkt_cli.validation import ValidationError
 
 TOKEN = 'token'
 
@@ -232,6 +236,10 @@ class DummyVCenterService(esx_service.BaseVCenterService):
             ovf = self.ovfs[0]
         return self.clone_vm(ovf.vm, vm_name = ovf_name)
 
+    def upload_ova_to_vcenter(self, ova_path, vm_name=None,
+                              validate_mf=False):
+        return self.clone_vm(self.ovfs[0].vm, vm_name=vm_name)
+
     def get_vm_name(self, vm):
         return vm.name
 
@@ -528,3 +536,89 @@ class TestWrappedGuest(unittest.TestCase):
         self.assertEqual(template_vm.disks[1].size, 16*1024*1024)
         # Will be created as an instance, instead of a template
         self.assertFalse(template_vm.template)
+
+
+def _make_ova(files):
+    """ Return a StringIO that contains an OVA with the given list of
+    (name, contents) tuples.
+    """
+    buf = StringIO()
+    tar = tarfile.open(fileobj=buf, mode='w')
+    for name, contents in files:
+        info = tarfile.TarInfo(name)
+        info.size = len(contents)
+        tar.addfile(info, StringIO(contents))
+    tar.close()
+    buf.seek(0)
+    return buf
+
+
+def _sha1(contents):
+    return hashlib.sha1(contents).hexdigest()
+
+
+class TestOvaReader(unittest.TestCase):
+
+    def test_parse_ovf_manifest(self):
+        manifest = esx_service.parse_ovf_manifest(
+            'SHA1(guest.ovf)= ABC123\n'
+            'SHA256(guest-disk1.vmdk)= def456\n'
+            'garbage\n'
+        )
+        self.assertEqual(
+            {
+                'guest.ovf': ('sha1', 'abc123'),
+                'guest-disk1.vmdk': ('sha256', 'def456')
+            },
+            manifest
+        )
+
+    def test_read_ova(self):
+        ovf = '<Envelope/>'
+        disk1 = 'disk1' * 1000
+        disk2 = 'disk2' * 1000
+        mf = 'SHA1(guest.ovf)= %s\nSHA1(disk1.vmdk)= %s\n' % (
+            _sha1(ovf), _sha1(disk1))
+        ova = esx_service.OvaReader(_make_ova([
+            ('guest.ovf', ovf),
+            ('guest.mf', mf),
+            ('disk1.vmdk', disk1),
+            ('disk2.vmdk', disk2)
+        ]))
+
+        self.assertEqual(ovf, ova.read_descriptor())
+        ova.verify_descriptor()
+        contents = {}
+        for name, reader in ova.disks():
+            self.assertEqual(len(reader), 5000)
+            data = ''
+            while True:
+                chunk = reader.read(1024)
+                if not chunk:
+                    break
+                data += chunk
+            contents[name] = data
+            ova.verify(name, reader)
+            self.assertEqual(_sha1(data), reader.hexdigest())
+        self.assertEqual({'disk1.vmdk': disk1, 'disk2.vmdk': disk2}, contents)
+
+    def test_checksum_mismatch(self):
+        mf = 'SHA1(disk1.vmdk)= %s\n' % _sha1('something else')
+        ova = esx_service.OvaReader(_make_ova([
+            ('guest.ovf', '<Envelope/>'),
+            ('guest.mf', mf),
+            ('disk1.vmdk', 'disk1')
+        ]))
+        ova.read_descriptor()
+        for name, reader in ova.disks():
+            reader.read()
+            with self.assertRaises(ValidationError):
+                ova.verify(name, reader)
+
+    def test_descriptor_not_first(self):
+        ova = esx_service.OvaReader(_make_ova([
+            ('disk1.vmdk', 'disk1'),
+            ('guest.ovf', '<Envelope/>')
+        ]))
+        with self.assertRaises(ValidationError):
+            ova.read_descriptor()
@@ -1,15 +1,32 @@
+import argparse
+import base64
+import json
 import logging
+import os
+import shutil
+import socket
+import tempfile
+import threading
 import time
 import unittest
 import uuid
 
 import test
+import brkt_cli.gcp
 from brkt_cli import util
+from brkt_cli.config import CLIConfig
 from brkt_cli.gcp import encrypt_gcp_image
+from brkt_cli.gcp import gcp_discovery
 from brkt_cli.gcp import gcp_service
+from brkt_cli.gcp import launch_gcp_image
+from brkt_cli.gcp import serial_console
 from brkt_cli.gcp import update_gcp_image
 from brkt_cli.gcp import share_logs
 from brkt_cli.gcp import wrap_gcp_image
+from brkt_cli.encryptor_service import (
+    BaseEncryptorService,
+    EncryptionError
+)
 from brkt_cli.instance_config import InstanceConfig
 from brkt_cli.util import CRYPTO_GCM
 from brkt_cli.test_encryptor_service import (
@@ -17,6 +34,7 @@ from brkt_cli.test_encryptor_service import (
     FailedEncryptionService
 )
 from brkt_cli.validation import ValidationError
+from googleapiclient import errors
 
 NONEXISTANT_IMAGE = 'image'
 NONEXISTANT_PROJECT = 'project'
@@ -33,16 +51,16 @@ def _new_id():
 class DummyGCPService(gcp_service.BaseGCPService):
     def __init__(self):
         super(DummyGCPService, self).__init__('testproject', _new_id(), log)
+        self.serial_port_output = ''
+        self.serial_port_requests = []
 
-    def cleanup(self, zone, encryptor_image, keep_encryptor=False):
+    def cleanup(self, zone):
         for disk in self.disks[:]:
             if self.disk_exists(zone, disk):
                 self.wait_for_detach(zone, disk)
                 self.delete_disk(zone, disk)
         for instance in self.instances:
             self.delete_instance(zone, instance)
-        if not keep_encryptor:
-            self.delete_image(encryptor_image)
 
     class OACInserter():
         def execute(self):
@@ -63,6 +81,12 @@ class DummyGCPService(gcp_service.BaseGCPService):
     def list_zones(self):
         return ['us-central1-a']
 
+    def wait_operation(self, operation):
+        return operation
+
+    def wait_operations(self, operations):
+        return operations
+
     def get_session_id(self):
         return self.session_id
 
@@ -103,7 +127,7 @@ class DummyGCPService(gcp_service.BaseGCPService):
             raise
         if image_project and image_project == NONEXISTANT_PROJECT:
             raise
-        return True
+        return {'diskSizeGb': '10'}
 
     def image_exists(self, image, image_project=None):
         try:
@@ -139,6 +163,17 @@ class DummyGCPService(gcp_service.BaseGCPService):
     def get_private_ip(self, name, zone):
         return
 
+    def get_serial_port_output(self, zone, instance, start=0, http=None):
+        self.serial_port_requests.append(start)
+        return {
+            'contents': self.serial_port_output[start:],
+            'start': start,
+            'next': len(self.serial_port_output)
+        }
+
+    def new_http(self):
+        return None
+
     def detach_disk(self, zone, instance, diskName):
         return self.wait_for_detach(zone, diskName)
 
@@ -168,10 +203,23 @@ class DummyGCPService(gcp_service.BaseGCPService):
     def create_disk(self, zone, name, size):
         self.disks.append(name)
 
+    def create_disks(self, zone, disks):
+        for disk in disks:
+            self.disks.append(disk['name'])
+
+    def delete_instances(self, zone, instances):
+        for instance in instances:
+            self.delete_instance(zone, instance)
+
+    def delete_disks(self, zone, disks):
+        for disk in disks:
+            self.delete_disk(zone, disk)
+
     def create_gcp_image_from_disk(self, zone, image_name, disk_name):
         return
 
-    def create_gcp_image_from_file(self, zone, image_name, file_name, bucket):
+    def create_gcp_image_from_file(self, zone, image_name, file_name, bucket,
+                                   labels=None):
         return
 
     def wait_image(self, image_name):
@@ -194,12 +242,9 @@ class DummyGCPService(gcp_service.BaseGCPService):
     def get_image_file(self, bucket):
         pass
 
-    def get_latest_encryptor_image(self,
-                                   zone,
-                                   image_name,
-                                   bucket,
-                                   image_file=None):
-        pass
+    def get_cached_encryptor_image(self, bucket, image_file=None):
+        self.cached_image_calls = getattr(self, 'cached_image_calls', 0) + 1
+        return 'encryptor-image'
 
     def run_instance(self,
                      zone,
@@ -218,6 +263,23 @@ class DummyGCPService(gcp_service.BaseGCPService):
         if not delete_boot:
             self.disks.append(name)
 
+    def run_instances(self, zone, instances, max_parallel=None):
+        self.launched = getattr(self, 'launched', []) + instances
+        result = []
+        for instance in instances:
+            self.run_instance(zone, **instance)
+            result.append({
+                'name': instance['name'],
+                'status': 'RUNNING',
+                'networkInterfaces': [
+                    {'accessConfigs': [{'natIP': '10.0.0.1'}]}
+                ]
+            })
+        return result
+
+    def create_ssd_disk(self, zone):
+        return {'deviceName': 'scratch-' + _new_id(), 'type': 'SCRATCH'}
+
     def get_disk(self, zone, disk_name):
         source_disk = "projects/%s/zones/%s/disks/%s" % (self.project, zone, disk_name)
         return {
@@ -325,6 +387,187 @@ class TestRunEncryption(unittest.TestCase):
         self.assertEqual(len(gcp_svc.instances), 0)
 
 
+class CantContactEncryptionService(BaseEncryptorService):
+    def is_encryptor_up(self):
+        return False
+
+    def get_status(self):
+        return {}
+
+
+class TestSerialConsole(unittest.TestCase):
+
+    def setUp(self):
+        util.SLEEP_ENABLED = False
+
+    def test_incremental(self):
+        """ Test that only new console output is requested and saved. """
+        gcp_svc = DummyGCPService()
+        reader = serial_console.SerialConsoleReader(
+            gcp_svc, 'us-central1-a', 'encryptor')
+        gcp_svc.serial_port_output = 'one\n'
+        self.assertEqual('one\n', reader())
+        gcp_svc.serial_port_output += 'two\n'
+        self.assertEqual('two\n', reader())
+        self.assertEqual('', reader())
+        self.assertEqual([0, 4, 8], gcp_svc.serial_port_requests)
+
+        path = reader.save()
+        try:
+            with open(path) as f:
+                self.assertEqual('one\ntwo\n', f.read())
+        finally:
+            reader.discard()
+        self.assertFalse(os.path.exists(path))
+
+    def test_skipped_output(self):
+        """ Test that the next offset is taken from the response when
+        older output is no longer available.
+        """
+        gcp_svc = DummyGCPService()
+        gcp_svc.get_serial_port_output = \
+            lambda zone, instance, start, http: {
+                'contents': u'new\n', 'start': 100, 'next': 104
+            }
+        reader = serial_console.SerialConsoleReader(
+            gcp_svc, 'us-central1-a', 'encryptor')
+        self.assertEqual('new\n', reader())
+        self.assertEqual(104, reader.next)
+        reader.discard()
+
+    def test_reuse_http(self):
+        """ Test that every read uses the Http object that the reader
+        created.
+        """
+        gcp_svc = DummyGCPService()
+        http = object()
+        gcp_svc.new_http = lambda: http
+        https = []
+        gcp_svc.get_serial_port_output = \
+            lambda zone, instance, start, http: https.append(http) or {}
+        reader = serial_console.SerialConsoleReader(
+            gcp_svc, 'us-central1-a', 'encryptor')
+        reader()
+        reader()
+        self.assertEqual([http, http], https)
+
+    def test_roll_over(self):
+        """ Test that the console file is rolled over when it reaches the
+        maximum size.
+        """
+        gcp_svc = DummyGCPService()
+        reader = serial_console.SerialConsoleReader(
+            gcp_svc, 'us-central1-a', 'encryptor', max_bytes=6)
+        gcp_svc.serial_port_output = 'one\n'
+        reader()
+        gcp_svc.serial_port_output += 'two\n'
+        path = reader.save()
+        try:
+            with open(path + '.1') as f:
+                self.assertEqual('one\n', f.read())
+            with open(path) as f:
+                self.assertEqual('two\n', f.read())
+        finally:
+            reader.discard()
+        self.assertFalse(os.path.exists(path + '.1'))
+
+    def test_fatal_console_output(self):
+        """ Test that encryption fails right away when the encryptor
+        console shows a panic.
+        """
+        gcp_svc = DummyGCPService()
+        gcp_svc.serial_port_output = 'Starting up.\npanic: page fault\n'
+        with self.assertRaises(EncryptionError) as cm:
+            encrypt_gcp_image.encrypt(
+                gcp_svc=gcp_svc,
+                enc_svc_cls=CantContactEncryptionService,
+                image_id=IGNORE_IMAGE,
+                encryptor_image='encryptor-image',
+                encrypted_image_name='ubuntu-encrypted',
+                zone='us-central1-a',
+                crypto_policy=CRYPTO_GCM,
+                instance_config=InstanceConfig({'identity_token': TOKEN})
+            )
+        self.assertIn('panic: page fault', cm.exception.message)
+        self.assertEqual(0, len(gcp_svc.instances))
+
+        # The console output is saved in a file named after the session.
+        suffix = '-%s.out' % gcp_svc.session_id
+        paths = [
+            os.path.join(tempfile.gettempdir(), name)
+            for name in os.listdir(tempfile.gettempdir())
+            if name.startswith('serial-console-') and name.endswith(suffix)
+        ]
+        self.assertEqual(1, len(paths))
+        with open(paths[0]) as f:
+            self.assertEqual(gcp_svc.serial_port_output, f.read())
+        os.remove(paths[0])
+
+
+class TestEncryptImages(unittest.TestCase):
+
+    def setUp(self):
+        util.SLEEP_ENABLED = False
+
+    def test_encrypt_images(self):
+        """ Test that the encryptor image is retrieved once, and that each
+        pipeline cleans up after itself.
+        """
+        gcp_svc = DummyGCPService()
+        pipeline_svcs = []
+
+        def _new_gcp_svc():
+            svc = DummyGCPService()
+            pipeline_svcs.append(svc)
+            return svc
+
+        images = [
+            (IGNORE_IMAGE, 'us-central1-a', 'encrypted-1'),
+            (IGNORE_IMAGE, 'us-central1-b', 'encrypted-2'),
+            (IGNORE_IMAGE, 'us-east1-b', 'encrypted-3')
+        ]
+        results = encrypt_gcp_image.encrypt_images(
+            gcp_svc=gcp_svc,
+            new_gcp_svc=_new_gcp_svc,
+            enc_svc_cls=DummyEncryptorService,
+            images=images,
+            encryptor_image=None,
+            instance_config=InstanceConfig({'identity_token': TOKEN}),
+            crypto_policy=CRYPTO_GCM,
+            max_parallel=2
+        )
+        self.assertEqual(1, gcp_svc.cached_image_calls)
+        self.assertEqual(
+            ['encrypted-1', 'encrypted-2', 'encrypted-3'],
+            [r.encrypted_image_name for r in results]
+        )
+        self.assertEqual(
+            ['us-central1-a', 'us-central1-b', 'us-east1-b'],
+            [r.zone for r in results]
+        )
+        self.assertTrue(all(r.succeeded for r in results))
+        self.assertEqual(3, len(pipeline_svcs))
+        self.assertEqual(
+            3, len(set(svc.get_session_id() for svc in pipeline_svcs)))
+        for svc in pipeline_svcs:
+            self.assertEqual(0, len(svc.disks))
+            self.assertEqual(0, len(svc.instances))
+
+    def test_failure(self):
+        """ Test that a failed pipeline is reported in its result. """
+        results = encrypt_gcp_image.encrypt_images(
+            gcp_svc=DummyGCPService(),
+            new_gcp_svc=DummyGCPService,
+            enc_svc_cls=FailedEncryptionService,
+            images=[(IGNORE_IMAGE, 'us-central1-a', 'encrypted-1')],
+            encryptor_image='encryptor-image',
+            instance_config=InstanceConfig({'identity_token': TOKEN}),
+            crypto_policy=CRYPTO_GCM
+        )
+        self.assertFalse(results[0].succeeded)
+        self.assertIsNotNone(results[0].error)
+
+
 class TestImageValidation(unittest.TestCase):
 
     def setUp(self):
@@ -428,7 +671,713 @@ class GCPService3(DummyGCPService):
 
 class GCPService4(gcp_service.GCPService):
     def __init__(self):
-        super
+        self._clients = {}
+        self._clients_lock = threading.Lock()
+
+
+class FakeRequest(object):
+    def __init__(self, result):
+        self.result = result
+
+    def execute(self, http=None):
+        if isinstance(self.result, Exception):
+            raise self.result
+        return self.result
+
+
+class FakeOperations(object):
+    """ Stands in for zoneOperations() and globalOperations().  Each call
+    to wait() returns the next operation status in the list.
+    """
+    def __init__(self, statuses, error=None):
+        self.statuses = statuses
+        self.error = error
+        self.wait_calls = []
+
+    def wait(self, **kwargs):
+        self.wait_calls.append(kwargs)
+        operation = {'name': kwargs['operation'],
+                     'status': self.statuses.pop(0)}
+        if 'zone' in kwargs:
+            operation['zone'] = 'zones/' + kwargs['zone']
+        if operation['status'] == 'DONE' and self.error:
+            operation['error'] = {'errors': [{'message': self.error}]}
+        return FakeRequest(operation)
+
+
+class FakeResponse(object):
+    def __init__(self, status):
+        self.status = status
+        self.reason = ''
+
+
+class FakeBatch(object):
+    """ Stands in for BatchHttpRequest.  Requests whose result is an
+    HttpError are reported to the callback as failures.  If
+    compute.fail_after is set, the batch raises socket.error after
+    reporting that many results.
+    """
+    def __init__(self, compute, callback):
+        self.compute = compute
+        self.callback = callback
+        self.requests = []
+
+    def add(self, request, request_id):
+        self.requests.append((request_id, request))
+
+    def execute(self, http=None):
+        self.compute.batches.append(len(self.requests))
+        for n, (request_id, request) in enumerate(self.requests):
+            if n == self.compute.fail_after:
+                self.compute.fail_after = None
+                raise socket.error('Connection reset by peer')
+            if isinstance(request.result, errors.HttpError):
+                self.callback(request_id, None, request.result)
+            else:
+                self.callback(request_id, request.result, None)
+
+
+class FakeImages(object):
+    """ Stands in for images().  Images are stored in a dictionary
+    keyed by name.
+    """
+    def __init__(self, images=None):
+        self.images = images or {}
+        self.inserted = []
+        self.deleted = []
+
+    def _operation(self, name):
+        return {
+            'name': 'op-' + name,
+            'status': 'DONE',
+            'targetLink': 'https://www.googleapis.com/compute/v1/projects/'
+                          'testproject/global/images/' + name
+        }
+
+    def get(self, project, image):
+        if image not in self.images:
+            return FakeRequest(_http_error(404))
+        return FakeRequest(self.images[image])
+
+    def insert(self, project, body):
+        image = dict(body)
+        image['status'] = 'READY'
+        self.images[body['name']] = image
+        self.inserted.append(body['name'])
+        return FakeRequest(self._operation(body['name']))
+
+    def delete(self, project, image):
+        self.images.pop(image, None)
+        self.deleted.append(image)
+        return FakeRequest(self._operation(image))
+
+    def setLabels(self, project, resource, body):
+        self.images[resource]['labels'] = body['labels']
+        return FakeRequest(self._operation(resource))
+
+    def list(self, project):
+        return FakeRequest({'items': self.images.values()})
+
+    def list_next(self, request, response):
+        return None
+
+
+class FakeStorage(object):
+    """ Stands in for the storage API.  objects().get() returns the
+    metadata of the Metavisor image file.
+    """
+    def __init__(self, md5='abc', generation='1234'):
+        self.metadata = {'generation': generation}
+        if md5:
+            self.metadata['md5Hash'] = base64.b64encode(md5)
+
+    def objects(self):
+        return self
+
+    def get(self, bucket, object):
+        return FakeRequest(self.metadata)
+
+
+class FakeInstances(object):
+    """ Stands in for instances().  Inserted instances are running
+    immediately.
+    """
+    def __init__(self):
+        self.inserted = []
+        # Inserts of these instances fail.
+        self.fail = set()
+
+    def insert(self, project, zone, body):
+        if body['name'] in self.fail:
+            return FakeRequest(ValueError('Quota exceeded'))
+        self.inserted.append(body)
+        return FakeRequest({
+            'name': 'op-' + body['name'],
+            'status': 'DONE',
+            'targetLink': 'https://www.googleapis.com/compute/v1/projects/'
+                          '%s/zones/%s/instances/%s' % (
+                              project, zone, body['name'])
+        })
+
+    def get(self, project, zone, instance):
+        return FakeRequest({
+            'name': instance,
+            'status': 'RUNNING',
+            'networkInterfaces': [{'accessConfigs': [{'natIP': '10.0.0.1'}]}]
+        })
+
+
+class FakeDisks(object):
+    """ Stands in for disks().  Disks are stored in a dictionary keyed
+    by name.
+    """
+    def __init__(self, disks=None):
+        self.disks = disks or {}
+        self.inserted = []
+
+    def get(self, project, zone, disk):
+        if disk not in self.disks:
+            return FakeRequest(_http_error(404))
+        return FakeRequest(self.disks[disk])
+
+    def insert(self, project, zone, body):
+        self.disks[body['name']] = body
+        self.inserted.append(body['name'])
+        return FakeRequest({
+            'name': 'op-' + body['name'],
+            'status': 'DONE',
+            'targetLink': 'https://www.googleapis.com/compute/v1/projects/'
+                          '%s/zones/%s/disks/%s' % (
+                              project, zone, body['name'])
+        })
+
+
+class FakeCredentials(object):
+    def authorize(self, http):
+        return http
+
+
+class FakeCompute(object):
+    def __init__(self, zone_operations=None, global_operations=None,
+                 images=None, instances=None, disks=None):
+        self._zone_operations = zone_operations
+        self._global_operations = global_operations
+        self._images = images
+        self._instances = instances
+        self._disks = disks
+        self.batches = []
+        self.fail_after = None
+
+    def images(self):
+        return self._images
+
+    def instances(self):
+        return self._instances
+
+    def disks(self):
+        return self._disks
+
+    def new_batch_http_request(self, callback):
+        return FakeBatch(self, callback)
+
+    def zoneOperations(self):
+        return self._zone_operations
+
+    def globalOperations(self):
+        return self._global_operations
+
+
+class TestWaitOperation(unittest.TestCase):
+
+    def setUp(self):
+        util.SLEEP_ENABLED = False
+        self.zone_operations = FakeOperations(['RUNNING', 'DONE'])
+        self.global_operations = FakeOperations(['DONE'])
+        self.gcp_svc = GCPService4()
+        self.gcp_svc.project = 'testproject'
+        self.gcp_svc.operations = {}
+        self.gcp_svc.compute = FakeCompute(
+            self.zone_operations, self.global_operations)
+
+    def test_operation_key(self):
+        self.assertEqual(
+            'zones/us-central1-a/disks/my-disk',
+            gcp_service._operation_key(
+                'https://www.googleapis.com/compute/v1/projects/p/zones/'
+                'us-central1-a/disks/my-disk')
+        )
+        self.assertEqual(
+            'global/images/my-image',
+            gcp_service._operation_key(
+                'https://www.googleapis.com/compute/v1/projects/p/global/'
+                'images/my-image')
+        )
+
+    def test_zone_operation(self):
+        operation = {
+            'name': 'op-1',
+            'status': 'PENDING',
+            'zone': 'https://www.googleapis.com/compute/v1/projects/p/zones/'
+                    'us-central1-a'
+        }
+        result = self.gcp_svc.wait_operation(operation)
+        self.assertEqual('DONE', result['status'])
+        self.assertEqual(2, len(self.zone_operations.wait_calls))
+        self.assertEqual(
+            'us-central1-a', self.zone_operations.wait_calls[0]['zone'])
+        self.assertEqual(0, len(self.global_operations.wait_calls))
+
+    def test_global_operation(self):
+        self.gcp_svc.wait_operation({'name': 'op-1', 'status': 'RUNNING'})
+        self.assertEqual(1, len(self.global_operations.wait_calls))
+        self.assertEqual(0, len(self.zone_operations.wait_calls))
+
+    def test_done_operation(self):
+        """ Test that we don't call the API for an operation that has
+        already finished.
+        """
+        self.gcp_svc.wait_operation({'name': 'op-1', 'status': 'DONE'})
+        self.assertEqual(0, len(self.global_operations.wait_calls))
+
+    def test_operation_error(self):
+        self.global_operations.error = 'QUOTA_EXCEEDED'
+        with self.assertRaises(gcp_service.OperationError):
+            self.gcp_svc.wait_operation({'name': 'op-1', 'status': 'RUNNING'})
+
+    def test_tracked_operation(self):
+        """ Test that waiting for a resource waits for the operation that
+        created it.
+        """
+        operation = {
+            'name': 'op-1',
+            'status': 'RUNNING',
+            'targetLink': 'https://www.googleapis.com/compute/v1/projects/'
+                          'testproject/global/images/my-image'
+        }
+        self.gcp_svc._track_operation(operation)
+        self.gcp_svc._wait_for_tracked_operations(['global/images/my-image'])
+        self.assertEqual(1, len(self.global_operations.wait_calls))
+        self.assertEqual({}, self.gcp_svc.operations)
+
+
+def _http_error(status):
+    return errors.HttpError(FakeResponse(status), '{}')
+
+
+class TestExecuteBatch(unittest.TestCase):
+
+    def setUp(self):
+        util.SLEEP_ENABLED = False
+        self.gcp_svc = GCPService4()
+        self.gcp_svc.log = logging.getLogger(__name__)
+        self.gcp_svc.compute = FakeCompute()
+
+    def test_responses_in_order(self):
+        requests = [FakeRequest(n) for n in range(5)]
+        self.assertEqual(range(5), self.gcp_svc.execute_batch(requests))
+        self.assertEqual([5], self.gcp_svc.compute.batches)
+
+    def test_max_batch_size(self):
+        requests = [FakeRequest(n) for n in range(
+            gcp_service.MAX_BATCH_SIZE + 1)]
+        self.gcp_svc.execute_batch(requests)
+        self.assertEqual(
+            [gcp_service.MAX_BATCH_SIZE, 1], self.gcp_svc.compute.batches)
+
+    def test_not_found(self):
+        requests = [FakeRequest(1), FakeRequest(_http_error(404))]
+        self.assertEqual(
+            [1, None],
+            self.gcp_svc.execute_batch(requests, not_found_ok=True)
+        )
+        with self.assertRaises(errors.HttpError):
+            self.gcp_svc.execute_batch(requests)
+
+    def test_error(self):
+        requests = [FakeRequest(_http_error(403)), FakeRequest(1)]
+        with self.assertRaises(errors.HttpError):
+            self.gcp_svc.execute_batch(requests, not_found_ok=True)
+
+    def test_retry_failed_requests(self):
+        """ Test that only the requests without a result are sent again
+        when a batch request fails.
+        """
+        self.gcp_svc.compute.fail_after = 2
+        requests = [FakeRequest(n) for n in range(5)]
+        self.assertEqual(range(5), self.gcp_svc.execute_batch(requests))
+        self.assertEqual([5, 3], self.gcp_svc.compute.batches)
+
+    def test_retry_keeps_errors(self):
+        """ Test that an error reported before the batch request failed
+        is raised after the retry.
+        """
+        self.gcp_svc.compute.fail_after = 1
+        requests = [FakeRequest(_http_error(403)), FakeRequest(1)]
+        with self.assertRaises(errors.HttpError):
+            self.gcp_svc.execute_batch(requests)
+        self.assertEqual([2, 1], self.gcp_svc.compute.batches)
+
+
+class TestCreateDisks(unittest.TestCase):
+
+    def setUp(self):
+        util.SLEEP_ENABLED = False
+        self.fake_disks = FakeDisks({'existing': {'name': 'existing'}})
+        self.gcp_svc = GCPService4()
+        self.gcp_svc.project = 'testproject'
+        self.gcp_svc.log = logging.getLogger(__name__)
+        self.gcp_svc.disks = []
+        self.gcp_svc.compute = FakeCompute(disks=self.fake_disks)
+        self.gcp_svc._disk_body = lambda zone, name, size: {'name': name}
+
+    def test_skip_existing(self):
+        """ Test that disks that already exist are not created again. """
+        operations = self.gcp_svc.create_disks('us-central1-a', [
+            {'name': 'existing', 'size': 10},
+            {'name': 'new', 'size': 10}
+        ])
+        self.assertEqual(['new'], self.fake_disks.inserted)
+        self.assertEqual(['new'], self.gcp_svc.disks)
+        self.assertEqual(1, len(operations))
+
+    def test_all_existing(self):
+        operations = self.gcp_svc.create_disks(
+            'us-central1-a', [{'name': 'existing', 'size': 10}])
+        self.assertEqual([], operations)
+        self.assertEqual([], self.fake_disks.inserted)
+
+
+def _encryptor_image(name, last_used):
+    return {
+        'name': name,
+        'status': 'READY',
+        'labels': {
+            gcp_service.LABEL_ENCRYPTOR_IMAGE: 'true',
+            gcp_service.LABEL_LAST_USED: str(int(last_used))
+        }
+    }
+
+
+class TestEncryptorImageRegistry(unittest.TestCase):
+
+    def setUp(self):
+        util.SLEEP_ENABLED = False
+        self.images = FakeImages()
+        self.gcp_svc = GCPService4()
+        self.gcp_svc.project = 'testproject'
+        self.gcp_svc.log = logging.getLogger(__name__)
+        self.gcp_svc.operations = {}
+        self.gcp_svc.compute = FakeCompute(images=self.images)
+        self.gcp_svc.storage = FakeStorage(md5='\x01\x02')
+
+    def test_label_value(self):
+        self.assertEqual(
+            'latest-image-tar-gz',
+            gcp_service._label_value('Latest.image.tar.gz'))
+        self.assertEqual(63, len(gcp_service._label_value('a' * 100)))
+
+    def test_create(self):
+        """ Test that the encryptor image is named after the MD5 hash of
+        the Metavisor image file, and labeled with its source.
+        """
+        name = self.gcp_svc.get_cached_encryptor_image(
+            'my-bucket', image_file='latest.image.tar.gz')
+        self.assertEqual('encryptor-0102', name)
+        self.assertEqual(['encryptor-0102'], self.images.inserted)
+        labels = self.images.images[name]['labels']
+        self.assertEqual('true', labels[gcp_service.LABEL_ENCRYPTOR_IMAGE])
+        self.assertEqual('my-bucket', labels[gcp_service.LABEL_SOURCE_BUCKET])
+        self.assertEqual(
+            'latest-image-tar-gz', labels[gcp_service.LABEL_SOURCE_NAME])
+        self.assertEqual('1234', labels[gcp_service.LABEL_SOURCE_GENERATION])
+
+    def test_composite_object(self):
+        """ Test that we fall back to the generation when the file
+        doesn't have an MD5 hash.
+        """
+        self.gcp_svc.storage = FakeStorage(md5=None)
+        name = self.gcp_svc.get_cached_encryptor_image(
+            'my-bucket', image_file='latest.image.tar.gz')
+        self.assertEqual('encryptor-g1234', name)
+
+    def test_reuse(self):
+        """ Test that an existing encryptor image is reused, and that its
+        last used time is updated.
+        """
+        self.images.images['encryptor-0102'] = _encryptor_image(
+            'encryptor-0102', 0)
+        name = self.gcp_svc.get_cached_encryptor_image(
+            'my-bucket', image_file='latest.image.tar.gz')
+        self.assertEqual('encryptor-0102', name)
+        self.assertEqual([], self.images.inserted)
+        last_used = self.images.images[name]['labels'][
+            gcp_service.LABEL_LAST_USED]
+        self.assertNotEqual('0', last_used)
+
+    def test_replace_failed(self):
+        """ Test that a failed encryptor image is deleted and created
+        again.
+        """
+        image = _encryptor_image('encryptor-0102', 0)
+        image['status'] = 'FAILED'
+        self.images.images['encryptor-0102'] = image
+        self.gcp_svc.get_cached_encryptor_image(
+            'my-bucket', image_file='latest.image.tar.gz')
+        self.assertEqual(['encryptor-0102'], self.images.deleted)
+        self.assertEqual(['encryptor-0102'], self.images.inserted)
+
+    def test_gc(self):
+        """ Test that the least recently used images are deleted, but
+        the most recently used images are kept.
+        """
+        now = time.time()
+        day = 24 * 60 * 60
+        for name, last_used in [
+                ('encryptor-1', now - 10 * day),
+                ('encryptor-2', now - 9 * day),
+                ('encryptor-3', now - 8 * day),
+                ('encryptor-4', now - 7 * day),
+                ('encryptor-5', now - 6 * day),
+                ('encryptor-6', now - 60)]:
+            self.images.images[name] = _encryptor_image(name, last_used)
+        # Images that aren't in the registry are never deleted.
+        self.images.images['guest'] = {'name': 'guest', 'status': 'READY'}
+
+        deleted = self.gcp_svc.gc_encryptor_images(
+            keep=2, exclude=['encryptor-1'])
+        self.assertEqual(
+            ['encryptor-4', 'encryptor-3', 'encryptor-2'], deleted)
+        self.assertEqual(
+            ['encryptor-1', 'encryptor-5', 'encryptor-6', 'guest'],
+            sorted(self.images.images.keys())
+        )
+
+    def test_gc_after_create(self):
+        """ Test that old encryptor images are garbage collected after a
+        new one is created.
+        """
+        old = time.time() - 10 * 24 * 60 * 60
+        for n in range(gcp_service.ENCRYPTOR_IMAGE_CACHE_SIZE + 1):
+            name = 'encryptor-old-%d' % n
+            self.images.images[name] = _encryptor_image(name, old + n)
+        self.gcp_svc.get_cached_encryptor_image(
+            'my-bucket', image_file='latest.image.tar.gz')
+        self.assertEqual(
+            ['encryptor-old-0', 'encryptor-old-1'], sorted(self.images.deleted))
+
+
+class TestRunInstances(unittest.TestCase):
+
+    def setUp(self):
+        util.SLEEP_ENABLED = False
+        self.instances = FakeInstances()
+        self.gcp_svc = GCPService4()
+        self.gcp_svc.project = 'testproject'
+        self.gcp_svc.log = logging.getLogger(__name__)
+        self.gcp_svc.operations = {}
+        self.gcp_svc.instances = []
+        self.gcp_svc.disks = []
+        self.gcp_svc.gcp_res_uri = 'https://www.googleapis.com/compute/v1/'
+        self.gcp_svc.credentials = FakeCredentials()
+        self.gcp_svc.compute = FakeCompute(instances=self.instances)
+
+    def test_run_instances(self):
+        """ Test that all instances are inserted, and that we get them
+        with a single batch request.
+        """
+        instances = [
+            {'name': 'instance-%d' % n, 'image': 'my-image',
+             'tags': ['web']}
+            for n in range(5)
+        ]
+        result = self.gcp_svc.run_instances(
+            'us-central1-a', instances, max_parallel=2)
+        self.assertEqual(
+            ['instance-%d' % n for n in range(5)],
+            [i['name'] for i in result]
+        )
+        self.assertEqual(
+            ['instance-%d' % n for n in range(5)],
+            sorted(body['name'] for body in self.instances.inserted)
+        )
+        for body in self.instances.inserted:
+            self.assertEqual({'items': ['web']}, body['tags'])
+        self.assertEqual(5, len(self.gcp_svc.instances))
+        self.assertEqual([5], self.gcp_svc.compute.batches)
+        self.assertEqual({}, self.gcp_svc.operations)
+
+    def test_insert_fails(self):
+        """ Test that the instances that were inserted before another
+        insert failed are tracked, so that cleanup() deletes them.
+        """
+        self.instances.fail.add('instance-2')
+        instances = [
+            {'name': 'instance-%d' % n, 'image': 'my-image'}
+            for n in range(4)
+        ]
+        with self.assertRaises(ValueError):
+            self.gcp_svc.run_instances(
+                'us-central1-a', instances, max_parallel=2)
+        self.assertEqual(
+            ['instance-0', 'instance-1', 'instance-3'],
+            sorted(self.gcp_svc.instances)
+        )
+        self.assertEqual(3, len(self.gcp_svc.operations))
+
+
+class TestLaunch(unittest.TestCase):
+
+    def setUp(self):
+        util.SLEEP_ENABLED = False
+
+    def test_launch(self):
+        gcp_svc = DummyGCPService()
+        name = launch_gcp_image.launch(
+            log, gcp_svc, 'encrypted-image', 'my-instance', 'us-central1-a',
+            True, 'n1-standard-1', 'default', None, ssd_disks=2)
+        self.assertEqual('my-instance', name)
+        self.assertEqual(['my-instance'], gcp_svc.instances)
+        self.assertEqual(3, len(gcp_svc.launched[0]['disks']))
+
+    def test_launch_fleet(self):
+        gcp_svc = DummyGCPService()
+        names = launch_gcp_image.launch_instances(
+            log, gcp_svc, 'encrypted-image', 'web', 'us-central1-a', True,
+            'n1-standard-1', 'default', None, gcp_tags=['web'], count=3)
+        self.assertEqual(['web-1', 'web-2', 'web-3'], names)
+        self.assertEqual(names, gcp_svc.instances)
+        self.assertEqual(
+            ['web-1-snap', 'web-2-snap', 'web-3-snap'], gcp_svc.disks)
+        for instance in gcp_svc.launched:
+            self.assertEqual(['web'], instance['tags'])
+
+    def test_launch_fleet_fails(self):
+        """ Test that the instances and guest root disks are cleaned up
+        when one of the instances fails to start.
+        """
+        gcp_svc = DummyGCPService()
+
+        def _run_instances(zone, instances, max_parallel=None):
+            gcp_svc.run_instance(zone, **instances[0])
+            raise ValueError('Quota exceeded')
+        gcp_svc.run_instances = _run_instances
+        with self.assertRaises(ValueError):
+            launch_gcp_image.launch_instances(
+                log, gcp_svc, 'encrypted-image', 'web', 'us-central1-a',
+                True, 'n1-standard-1', 'default', None, count=3)
+        self.assertEqual([], gcp_svc.instances)
+        self.assertEqual([], gcp_svc.disks)
+
+    def test_launch_fleet_generated_names(self):
+        gcp_svc = DummyGCPService()
+        names = launch_gcp_image.launch_instances(
+            log, gcp_svc, 'encrypted-image', None, 'us-central1-a', True,
+            'n1-standard-1', 'default', None, count=3)
+        self.assertEqual(3, len(set(names)))
+
+
+class FakeHttp(object):
+    """ Stands in for httplib2.Http when downloading discovery
+    documents.
+    """
+    def __init__(self, status=200, content='{"name": "compute"}',
+                 error=None):
+        self.status = status
+        self.content = content
+        self.error = error
+        self.requests = []
+
+    def request(self, uri):
+        self.requests.append(uri)
+        if self.error:
+            raise self.error
+        return FakeResponse(self.status), self.content
+
+
+class TestDiscoveryCache(unittest.TestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.static_dir = tempfile.mkdtemp()
+        self.cache_path = os.path.join(self.cache_dir, 'compute.v1.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+        shutil.rmtree(self.static_dir)
+
+    def _get(self, http, ttl=60):
+        return gcp_discovery.get_discovery_document(
+            'compute', 'v1', http=http, cache_dir=self.cache_dir,
+            static_dir=self.static_dir, ttl=ttl)
+
+    def _write(self, path, content, age=0):
+        with open(path, 'w') as f:
+            f.write(content)
+        mtime = time.time() - age
+        os.utime(path, (mtime, mtime))
+
+    def test_download(self):
+        """ Test that a downloaded document is cached, and that the cached
+        copy is used until it expires.
+        """
+        http = FakeHttp()
+        self.assertEqual('{"name": "compute"}', self._get(http))
+        self.assertEqual(
+            ['https://www.googleapis.com/discovery/v1/apis/compute/v1/rest'],
+            http.requests
+        )
+        self.assertTrue(os.path.exists(self.cache_path))
+        self.assertEqual('{"name": "compute"}', self._get(http))
+        self.assertEqual(1, len(http.requests))
+
+    def test_expired(self):
+        self._write(self.cache_path, '{"old": true}', age=120)
+        http = FakeHttp()
+        self.assertEqual('{"name": "compute"}', self._get(http))
+        self.assertEqual(1, len(http.requests))
+
+    def test_stale_copy(self):
+        """ Test that the expired copy is used when the discovery service
+        can't be reached, and that we don't try again until the TTL
+        expires.
+        """
+        self._write(self.cache_path, '{"old": true}', age=120)
+        http = FakeHttp(error=socket.error('unreachable'))
+        self.assertEqual('{"old": true}', self._get(http))
+        self.assertEqual('{"old": true}', self._get(http))
+        self.assertEqual(1, len(http.requests))
+
+    def test_static_copy(self):
+        self._write(
+            os.path.join(self.static_dir, 'compute.v1.json'),
+            '{"static": true}'
+        )
+        http = FakeHttp(status=503)
+        self.assertEqual('{"static": true}', self._get(http))
+
+    def test_shipped_documents(self):
+        """ Test that brkt-cli ships the documents for the APIs that it
+        uses.
+        """
+        for api in ('compute', 'storage'):
+            content = gcp_discovery.get_discovery_document(
+                api, 'v1', http=FakeHttp(error=socket.error()),
+                cache_dir=self.cache_dir)
+            self.assertEqual(api, json.loads(content)['name'])
+
+    def test_invalid_document(self):
+        """ Test that an invalid document is not cached. """
+        self._write(self.cache_path, 'not json')
+        http = FakeHttp(content='also not json')
+        with self.assertRaises(ValueError):
+            self._get(http)
+        with open(self.cache_path) as f:
+            self.assertEqual('not json', f.read())
+
+    def test_unreachable(self):
+        http = FakeHttp(error=socket.error('unreachable'))
+        with self.assertRaises(socket.error):
+            self._get(http)
 
 
 class TestShareLogs(unittest.TestCase):
@@ -502,3 +1451,30 @@ class TestWrappedGuest(unittest.TestCase):
         )
         self.assertEqual(len(gcp_svc.disks), 0)
         self.assertEqual(len(gcp_svc.instances), 1)
+
+    def test_run_wrap_image(self):
+        """ Test that the wrap-guest-image subcommand runs with the
+        arguments that its parser defines.
+        """
+        config = CLIConfig()
+        config.register_option('token', 'The launch token')
+        subcommand = brkt_cli.gcp.GCPSubcommand()
+        subcommand.setup_config(config)
+        parser = argparse.ArgumentParser()
+        subcommand.register(parser.add_subparsers(), config)
+        values = parser.parse_args([
+            'gcp', 'wrap-guest-image', '--token', TOKEN,
+            '--zone', 'us-central1-a', '--project', 'project',
+            '--encryptor-image', 'encryptor-image', IGNORE_IMAGE
+        ])
+        # Set by the top-level parser in main().
+        values.verbose = False
+
+        gcp_svc = DummyGCPService()
+        real_gcp_service = gcp_service.GCPService
+        gcp_service.GCPService = lambda *args: gcp_svc
+        try:
+            self.assertEqual(0, subcommand.run(values))
+        finally:
+            gcp_service.GCPService = real_gcp_service
+        self.assertEqual(1, len(gcp_svc.instances))
@@ -0,0 +1,113 @@
+# Copyright 2017 Bracket Computing, Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License").
+# You may not use this file except in compliance with the License.
+# A copy of the License is located at
+#
+# https://github.com/brkt/brkt-cli/blob/master/LICENSE
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and
+# limitations under the License.
+import unittest
+
+from brkt_cli import encryptor_service, util
+from brkt_cli.encryptor_service import (
+    ENCRYPT_FAILED,
+    ENCRYPT_INITIALIZING,
+    ENCRYPT_SUCCESSFUL,
+    EncryptionError,
+    EncryptorService
+)
+from metavisor_server import (
+    DROP,
+    FakeMetavisor,
+    Phase,
+    Script,
+    ease_out,
+    encryption_script,
+    load_test
+)
+
+
+class TestFakeMetavisor(unittest.TestCase):
+
+    def setUp(self):
+        util.SLEEP_ENABLED = False
+
+    def test_encryptor_up(self):
+        """ Test that wait_for_encryptor_up() keeps trying while the
+        server drops connections.
+        """
+        script = Script([
+            Phase(action=DROP, requests=3),
+            Phase(ENCRYPT_INITIALIZING)
+        ])
+        with FakeMetavisor(script) as server:
+            enc_svc = EncryptorService(['127.0.0.1'], port=server.port)
+            encryptor_service.wait_for_encryptor_up(
+                enc_svc, util.Deadline(10))
+        self.assertEqual(4, server.stats['requests'])
+        self.assertEqual(3, server.stats['dropped'])
+
+    def test_progress(self):
+        """ Test that the progress curve is reported as percent_complete.
+        """
+        script = encryption_script(requests=4, curve=ease_out)
+        with FakeMetavisor(script) as server:
+            enc_svc = EncryptorService(['127.0.0.1'], port=server.port)
+            percents = [
+                enc_svc.get_status()['percent_complete'] for _ in range(6)
+            ]
+        self.assertEqual([0, 0, 43, 75, 93, 100], percents)
+        # All requests went over one connection.
+        self.assertEqual(1, server.stats['connections'])
+
+    def test_connection_drop(self):
+        """ Test that encryption finishes when the connection is dropped
+        while encrypting.
+        """
+        script = Script([
+            Phase(requests=2, progress=(0.0, 0.5)),
+            Phase(action=DROP, requests=2),
+            Phase(requests=2, progress=(0.5, 1.0)),
+            Phase(ENCRYPT_SUCCESSFUL, progress=(1.0, 1.0)),
+        ])
+        with FakeMetavisor(script) as server:
+            enc_svc = EncryptorService(['127.0.0.1'], port=server.port)
+            encryptor_service.wait_for_encryption(enc_svc)
+        self.assertEqual(2, server.stats['dropped'])
+
+    def test_failure_code(self):
+        script = Script([
+            Phase(requests=2, progress=(0.0, 0.1)),
+            Phase(ENCRYPT_FAILED, failure_code=(
+                encryptor_service.FAILURE_CODE_INVALID_SSH_KEY))
+        ])
+        with FakeMetavisor(script) as server:
+            enc_svc = EncryptorService(['127.0.0.1'], port=server.port)
+            with self.assertRaisesRegexp(EncryptionError, 'SSH key'):
+                encryptor_service.wait_for_encryption(enc_svc)
+
+    def test_stall(self):
+        """ Test that wait_for_encryption() detects stalled progress. """
+        script = Script([
+            Phase(requests=2, progress=(0.0, 0.3)),
+            Phase(progress=(0.3, 0.3))
+        ])
+        with FakeMetavisor(script) as server:
+            enc_svc = EncryptorService(['127.0.0.1'], port=server.port)
+            with self.assertRaisesRegexp(EncryptionError, 'progress'):
+                encryptor_service.wait_for_encryption(
+                    enc_svc, progress_timeout=0.2)
+
+    def test_load(self):
+        """ Test that hundreds of clients can poll at the same time, each
+        over its own persistent connection.
+        """
+        result = load_test(clients=200, polls=5)
+        self.assertEqual(1000, result.requests)
+        self.assertEqual(0, result.errors)
+        self.assertEqual(200, result.connections)
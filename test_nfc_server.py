@@ -0,0 +1,135 @@
+# Copyright 2017 Bracket Computing, Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License").
+# You may not use this file except in compliance with the License.
+# A copy of the License is located at
+#
+# https://github.com/brkt/brkt-cli/blob/master/LICENSE
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and
+# limitations under the License.
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+import requests
+
+from brkt_cli.esx import esx_service
+from nfc_server import (
+    BENCHMARKS,
+    MB,
+    FakeServiceInstance,
+    FakeVM,
+    NfcServer,
+    _wait_for_result,
+    disk_sha1,
+    make_vcenter_service,
+    run_benchmarks,
+    write_ova,
+    write_ovf
+)
+
+
+class TestNfcServer(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.server = NfcServer()
+        self.server.start()
+
+    def tearDown(self):
+        self.server.stop()
+        shutil.rmtree(self.directory)
+
+    def test_export(self):
+        """ Test that export_to_ovf() downloads each disk and writes the
+        OVF descriptor.
+        """
+        disks = [('disk0.vmdk', 3 * MB + 17), ('disk1.vmdk', 1000)]
+        si = FakeServiceInstance(self.server.url)
+        vm = FakeVM('vm', self.server.url, disks)
+        si.add_vm(vm)
+        ovf_path = make_vcenter_service(si).export_to_ovf(
+            vm, self.directory, 'exported')
+        self.assertTrue(os.path.exists(ovf_path))
+        for name, size in disks:
+            path = os.path.join(self.directory, name)
+            self.assertEqual(
+                disk_sha1(size), esx_service.compute_sha1_of_file(path))
+
+    def test_import_ovf(self):
+        """ Test that upload_ovf_to_vcenter() validates the manifest and
+        uploads each disk.
+        """
+        disks = [('disk0.vmdk', 2 * MB + 5), ('disk1.vmdk', 100)]
+        ovf_name = write_ovf(self.directory, disks)
+        si = FakeServiceInstance(self.server.url)
+        si.disk_names = [name for name, _ in disks]
+        vm = make_vcenter_service(si).upload_ovf_to_vcenter(
+            self.directory, ovf_name, vm_name='imported')
+        self.assertEqual('imported', vm.name)
+        imports = self.server.imports()
+        for name, size in disks:
+            self.assertEqual(
+                {'bytes': size, 'sha1': disk_sha1(size)}, imports[name])
+
+    def test_import_ova(self):
+        disks = [('disk0.vmdk', MB + 1)]
+        ova_path = write_ova(self.directory, disks)
+        si = FakeServiceInstance(self.server.url)
+        si.disk_names = ['disk0.vmdk']
+        make_vcenter_service(si).upload_ova_to_vcenter(
+            ova_path, vm_name='imported', validate_mf=True)
+        self.assertEqual(
+            disk_sha1(MB + 1), self.server.imports()['disk0.vmdk']['sha1'])
+
+    def test_import_empty_disk(self):
+        """ Test that a zero-length disk is posted with an empty body. """
+        ova_path = write_ova(self.directory, [('disk0.vmdk', 0)])
+        si = FakeServiceInstance(self.server.url)
+        si.disk_names = ['disk0.vmdk']
+        make_vcenter_service(si).upload_ova_to_vcenter(
+            ova_path, vm_name='imported', validate_mf=True)
+        self.assertEqual(
+            {'bytes': 0, 'sha1': disk_sha1(0)},
+            self.server.imports()['disk0.vmdk'])
+
+    def test_bandwidth(self):
+        """ Test that transfers are limited to the configured bandwidth.
+        """
+        with NfcServer(bandwidth=4 * MB, latency=0.1) as server:
+            start = time.time()
+            r = requests.get(server.url + '/export/%d/disk' % MB)
+            self.assertEqual(MB, len(r.content))
+            self.assertGreaterEqual(time.time() - start, 0.3)
+
+    def test_benchmark_crash(self):
+        """ Test that a benchmark process that exits without a result is
+        reported as an error.
+        """
+        p = multiprocessing.Process(target=os._exit, args=(3,))
+        p.start()
+        result = _wait_for_result(multiprocessing.Queue(), p, 30)
+        self.assertEqual('exited with code 3', result['error'])
+
+    def test_benchmark_timeout(self):
+        p = multiprocessing.Process(target=time.sleep, args=(30,))
+        p.start()
+        result = _wait_for_result(multiprocessing.Queue(), p, 0)
+        self.assertEqual('timed out after 0 seconds', result['error'])
+        self.assertFalse(p.is_alive())
+
+    def test_run_benchmarks(self):
+        results = run_benchmarks(size=MB)
+        self.assertEqual(
+            [name for name, _ in BENCHMARKS], [r['name'] for r in results])
+        for r in results:
+            self.assertIsNone(r['error'], r['name'])
+            self.assertGreater(r['mb_per_sec'], 0)
+            self.assertGreater(r['peak_rss_mb'], 0)